@@ -1,8 +1,23 @@
 """
 Advanced Load Test - 200 Users with Real HTTP Requests
 Uses requests library to simulate actual HTTP traffic
+
+Comparing DB connection modes (p50 / p99):
+    DB_CONNECTION_MODE=per_request python manage.py runserver
+    python advanced_load_test.py --no-prompt --save per_request.json
+    DB_CONNECTION_MODE=persistent python manage.py runserver
+    python advanced_load_test.py --no-prompt --save persistent.json
+    python advanced_load_test.py --compare per_request.json persistent.json
+
+Locust runs can be compared the same way:
+    locust -f locustfile.py --headless -u 200 -r 20 -t 2m --csv=persistent
+    python advanced_load_test.py --compare per_request_stats.csv persistent_stats.csv
 """
 
+import csv
+import json
+import os
+import sys
 import requests
 import threading
 import time
@@ -10,8 +25,8 @@ import random
 from datetime import datetime
 
 # Configuration
-BASE_URL = "http://127.0.0.1:8000"
-NUM_USERS = 200
+BASE_URL = os.getenv("LOAD_TEST_URL", "http://127.0.0.1:8000")
+NUM_USERS = int(os.getenv("LOAD_TEST_USERS", "200"))
 
 # Test credentials (create a test user first)
 TEST_USERNAME = "testuser"
@@ -137,10 +152,69 @@ def run_load_test():
     # Print results
     print_results()
 
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of response times"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summary():
+    """Headline numbers of the finished run"""
+    duration = stats['end_time'] - stats['start_time']
+    times = stats['response_times']
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'base_url': BASE_URL,
+        'users': NUM_USERS,
+        'total': stats['total'],
+        'failed': stats['failed'],
+        'duration': duration,
+        'rps': stats['total'] / duration if duration else 0,
+        'avg': sum(times) / len(times) if times else 0,
+        'p50': percentile(times, 50),
+        'p95': percentile(times, 95),
+        'p99': percentile(times, 99),
+    }
+
+def load_summary(path):
+    """Summary from a saved JSON run or a locust --csv *_stats.csv file (times in seconds)"""
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('Name') == 'Aggregated':
+                    return {
+                        'total': int(row['Request Count']),
+                        'failed': int(row['Failure Count']),
+                        'rps': float(row['Requests/s']),
+                        'avg': float(row['Average Response Time']) / 1000,
+                        'p50': float(row['50%']) / 1000,
+                        'p95': float(row['95%']) / 1000,
+                        'p99': float(row['99%']) / 1000,
+                    }
+        raise ValueError(f"No Aggregated row in {path}")
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline_path, candidate_path):
+    """Print baseline vs candidate latency side by side"""
+    baseline = load_summary(baseline_path)
+    candidate = load_summary(candidate_path)
+    
+    print(f"\n{'Metric':<12}{'Baseline':>14}{'Candidate':>14}{'Change':>10}")
+    for key in ('p50', 'p95', 'p99', 'avg', 'rps'):
+        before, after = baseline[key], candidate[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+        unit = '' if key == 'rps' else ' s'
+        print(f"{key:<12}{before:>12.3f}{unit:<2}{after:>12.3f}{unit:<2}{change:>10}")
+    print(f"{'failed':<12}{baseline['failed']:>14}{candidate['failed']:>14}")
+
 def print_results():
     """Print detailed results"""
     duration = stats['end_time'] - stats['start_time']
     avg_response = sum(stats['response_times']) / len(stats['response_times']) if stats['response_times'] else 0
+    result = summary()
     
     print(f"\n{'='*70}")
     print(f"Load Test Results")
@@ -151,8 +225,15 @@ def print_results():
     print(f"Duration:              {duration:.2f} seconds")
     print(f"Requests/Second:       {stats['total']/duration:.2f}")
     print(f"Avg Response Time:     {avg_response:.3f} seconds")
+    print(f"p50 / p95 / p99:       {result['p50']:.3f} / {result['p95']:.3f} / {result['p99']:.3f} seconds")
     print(f"{'='*70}\n")
     
+    if '--save' in sys.argv:
+        path = sys.argv[sys.argv.index('--save') + 1]
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"[SAVED] Results written to {path}")
+    
     if stats['failed'] == 0:
         print("[SUCCESS] Perfect! All requests successful!")
     elif stats['failed'] < stats['total'] * 0.05:
@@ -161,12 +242,18 @@ def print_results():
         print("[ERROR] High failure rate - Check server logs")
 
 if __name__ == '__main__':
+    if '--compare' in sys.argv:
+        index = sys.argv.index('--compare')
+        compare(sys.argv[index + 1], sys.argv[index + 2])
+        sys.exit(0)
+    
     print("\n[INFO] Prerequisites:")
     print("   1. Django server must be running: python manage.py runserver")
     print("   2. Create test user: python manage.py createsuperuser")
     print("   3. Install requests: pip install requests\n")
     
-    input("Press Enter to start the load test...")
+    if '--no-prompt' not in sys.argv:
+        input("Press Enter to start the load test...")
     
     try:
         run_load_test()
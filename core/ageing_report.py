@@ -0,0 +1,178 @@
+"""
+Ageing Report Engine
+Receivables (customers) and payables (suppliers) bucketed by days overdue.
+
+All parties come out of ONE grouped query over the invoice table: each
+bucket is a conditional Sum(balance, filter=Q(due_date in range)), so the
+cost does not grow with the number of invoices per party the way the
+ledger-per-party approach does.
+
+    due date     = invoice date + credit days (customers; suppliers have none)
+    days overdue = as-of date - due date
+
+Without an as-of date the maintained open-item balance columns are used
+(see core/open_items.py). With an as-of date the balance is rebuilt from the
+invoice total and the payments dated on or before it.
+"""
+import csv
+from datetime import date, timedelta
+
+from django.db.models import (
+    F, Q, Sum, Count, Value, Subquery, OuterRef, ExpressionWrapper, DateField, DurationField, FloatField
+)
+from django.db.models.functions import Coalesce
+
+from .models import InvoiceMaster, SalesInvoiceMaster, InvoicePaid, SalesInvoicePaid
+from .open_items import OPEN_BALANCE_THRESHOLD, _sales_items_total
+
+
+# (key, label, min days overdue, max days overdue) - None means open ended
+AGEING_BUCKETS = [
+    ('not_due', 'Not Due', None, -1),
+    ('days_0_30', '0-30 Days', 0, 30),
+    ('days_31_60', '31-60 Days', 31, 60),
+    ('days_61_90', '61-90 Days', 61, 90),
+    ('days_90_plus', '90+ Days', 91, None),
+]
+
+PARTY_TYPES = {
+    'customer': {
+        'model': SalesInvoiceMaster,
+        'party': 'customerid',
+        'name': 'customerid__customer_name',
+        'mobile': 'customerid__customer_mobile',
+        'credit_days': 'customerid__customer_credit_days',
+        'date': 'sales_invoice_date',
+        'balance': 'sales_invoice_balance',
+    },
+    'supplier': {
+        'model': InvoiceMaster,
+        'party': 'supplierid',
+        'name': 'supplierid__supplier_name',
+        'mobile': 'supplierid__supplier_mobile',
+        'credit_days': None,
+        'date': 'invoice_date',
+        'balance': 'invoice_balance',
+    },
+}
+
+
+def _paid_as_of(party_type, as_of):
+    """Payments on the invoice dated on or before as_of"""
+    if party_type == 'customer':
+        payments = SalesInvoicePaid.objects.filter(
+            sales_ip_invoice_no=OuterRef('pk'), sales_payment_date__lte=as_of
+        ).order_by().values('sales_ip_invoice_no').annotate(total=Sum('sales_payment_amount'))
+    else:
+        payments = InvoicePaid.objects.filter(
+            ip_invoiceid=OuterRef('pk'), payment_date__lte=as_of
+        ).order_by().values('ip_invoiceid').annotate(total=Sum('payment_amount'))
+    return Coalesce(Subquery(payments.values('total')), Value(0.0))
+
+
+def _open_invoices(party_type, as_of=None, search=None):
+    """Open invoices annotated with open_balance and due_date"""
+    source = PARTY_TYPES[party_type]
+    queryset = source['model'].objects.all()
+
+    if as_of is None:
+        queryset = queryset.filter(**{f"{source['balance']}__gt": OPEN_BALANCE_THRESHOLD})
+        queryset = queryset.annotate(open_balance=F(source['balance']))
+    else:
+        invoice_total = _sales_items_total() if party_type == 'customer' else F('invoice_total')
+        queryset = queryset.filter(**{f"{source['date']}__lte": as_of}).annotate(
+            open_balance=ExpressionWrapper(
+                invoice_total - _paid_as_of(party_type, as_of), output_field=FloatField()
+            )
+        ).filter(open_balance__gt=OPEN_BALANCE_THRESHOLD)
+
+    if source['credit_days']:
+        due_date = ExpressionWrapper(
+            F(source['date']) + ExpressionWrapper(
+                F(source['credit_days']) * Value(timedelta(days=1)), output_field=DurationField()
+            ),
+            output_field=DateField()
+        )
+    else:
+        due_date = F(source['date'])
+    queryset = queryset.annotate(due_date=due_date)
+
+    if search:
+        queryset = queryset.filter(
+            Q(**{f"{source['name']}__icontains": search}) |
+            Q(**{f"{source['mobile']}__icontains": search})
+        )
+    return queryset
+
+
+def _bucket_aggregates(as_of):
+    """Conditional sums of open_balance per bucket, plus the total"""
+    aggregates = {}
+    for key, _, min_days, max_days in AGEING_BUCKETS:
+        condition = Q()
+        if min_days is not None:
+            condition &= Q(due_date__lte=as_of - timedelta(days=min_days))
+        if max_days is not None:
+            condition &= Q(due_date__gte=as_of - timedelta(days=max_days))
+        aggregates[key] = Coalesce(Sum('open_balance', filter=condition), Value(0.0))
+    aggregates['total'] = Coalesce(Sum('open_balance'), Value(0.0))
+    aggregates['invoice_count'] = Count('pk')
+    return aggregates
+
+
+def get_ageing_queryset(party_type='customer', as_of=None, search=None):
+    """
+    One row per party with an open balance, largest outstanding first.
+
+    Args:
+        party_type: 'customer' (receivables) or 'supplier' (payables)
+        as_of: date the ageing is measured at; None = today from stored balances
+        search: party name / mobile filter
+
+    Returns:
+        values() queryset of dicts with party_id, party_name, credit_days,
+        one key per AGEING_BUCKETS entry, total and invoice_count
+    """
+    source = PARTY_TYPES[party_type]
+    measured_at = as_of or date.today()
+    credit_days = F(source['credit_days']) if source['credit_days'] else Value(0)
+
+    return _open_invoices(party_type, as_of, search).order_by().values(
+        party_id=F(source['party']),
+        party_name=F(source['name']),
+        party_mobile=F(source['mobile']),
+        credit_days=credit_days,
+    ).annotate(
+        **_bucket_aggregates(measured_at)
+    ).order_by('-total', 'party_name')
+
+
+def get_ageing_totals(party_type='customer', as_of=None, search=None):
+    """Grand total per bucket across all parties (one aggregate query)"""
+    measured_at = as_of or date.today()
+    return _open_invoices(party_type, as_of, search).aggregate(**_bucket_aggregates(measured_at))
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer"""
+    def write(self, value):
+        return value
+
+
+def stream_ageing_csv(party_type='customer', as_of=None, search=None):
+    """Generator of CSV lines for StreamingHttpResponse"""
+    writer = csv.writer(Echo())
+    measured_at = as_of or date.today()
+
+    yield '\ufeff'
+    yield writer.writerow([f"{party_type.title()} Ageing as of {measured_at.strftime('%d-%m-%Y')}"])
+    yield writer.writerow(
+        ['Party', 'Mobile', 'Credit Days'] + [label for _, label, _, _ in AGEING_BUCKETS] +
+        ['Total Outstanding', 'Open Invoices']
+    )
+    for row in get_ageing_queryset(party_type, as_of, search).iterator(chunk_size=2000):
+        yield writer.writerow(
+            [row['party_name'], row['party_mobile'], row['credit_days']] +
+            [f"{row[key]:.2f}" for key, _, _, _ in AGEING_BUCKETS] +
+            [f"{row['total']:.2f}", row['invoice_count']]
+        )
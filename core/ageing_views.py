@@ -0,0 +1,74 @@
+"""
+Ageing Views - receivables / payables ageing for all parties on one page,
+with a streaming CSV export for month-end collections.
+"""
+from datetime import datetime, date
+
+from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+
+from .ageing_report import (
+    AGEING_BUCKETS, get_ageing_queryset, get_ageing_totals, stream_ageing_csv
+)
+
+
+def _ageing_filters(request):
+    """(party_type, as_of, search) from the query string"""
+    party_type = request.GET.get('party', 'customer')
+    if party_type not in ('customer', 'supplier'):
+        party_type = 'customer'
+
+    as_of = None
+    as_of_str = request.GET.get('as_of', '').strip()
+    if as_of_str:
+        try:
+            as_of = datetime.strptime(as_of_str, '%Y-%m-%d').date()
+        except ValueError:
+            as_of = None
+
+    return party_type, as_of, request.GET.get('search', '').strip()
+
+
+@login_required
+def ageing_report(request):
+    """Paginated ageing by party with bucket totals"""
+    party_type, as_of, search_query = _ageing_filters(request)
+
+    paginator = Paginator(get_ageing_queryset(party_type, as_of, search_query), 50)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    totals = get_ageing_totals(party_type, as_of, search_query)
+
+    return render(request, 'reports/ageing_report.html', {
+        'page_obj': page_obj,
+        'rows': [
+            dict(row, buckets=[row[key] for key, _, _, _ in AGEING_BUCKETS])
+            for row in page_obj
+        ],
+        'bucket_labels': [label for _, label, _, _ in AGEING_BUCKETS],
+        'bucket_summary': [
+            {'label': label, 'amount': totals[key]} for key, label, _, _ in AGEING_BUCKETS
+        ],
+        'totals': totals,
+        'party_type': party_type,
+        'as_of': as_of.strftime('%Y-%m-%d') if as_of else '',
+        'measured_at': as_of or date.today(),
+        'search_query': search_query,
+        'title': 'Receivables Ageing' if party_type == 'customer' else 'Payables Ageing'
+    })
+
+
+@login_required
+def export_ageing_report(request):
+    """Stream the full ageing as CSV without building it in memory"""
+    party_type, as_of, search_query = _ageing_filters(request)
+
+    response = StreamingHttpResponse(
+        stream_ageing_csv(party_type, as_of, search_query),
+        content_type='text/csv; charset=utf-8'
+    )
+    stamp = (as_of or date.today()).strftime('%Y%m%d')
+    response['Content-Disposition'] = f'attachment; filename="{party_type}_ageing_{stamp}.csv"'
+    return response
@@ -7,3 +7,7 @@ class CoreConfig(AppConfig):
     
     def ready(self):
         import core.signals
+        import core.change_log
+        core.change_log.connect_receivers()
+        import core.year_close
+        core.year_close.connect_receivers()
@@ -0,0 +1,301 @@
+"""
+Archival of closed financial years
+`manage.py archive_years --through 2018` moves every document dated up to
+31 March 2019 - purchase and sales invoices, returns, challans and stock
+issues, with their lines and payments - into gzipped JSON Lines files under
+<ARCHIVE_DIR>/fy<year>/<model>.jsonl.gz (one folder per financial year) and
+deletes them from the database. Years not closed yet are closed first
+(core/year_close.py), so what the archived rows contributed is already in the
+OpeningStock / OpeningBalance snapshot and stock, the inventory cache and the
+ledgers show the same figures as before.
+
+Only fully settled years are archived: no unpaid purchase / sales invoice, no
+challan still to be invoiced, and no payment against an archived document
+dated after the archived range. Like every closed year, archived years are
+read-only; the archived-year report reads their rows back from the files.
+"""
+import gzip
+import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .change_log import change_log_suspended, record_changes
+from .models import (
+    InvoiceMaster, InvoicePaid, PurchaseMaster,
+    SalesInvoiceMaster, SalesInvoicePaid, SalesMaster,
+    ReturnInvoiceMaster, ReturnPurchaseMaster, PurchaseReturnInvoicePaid,
+    ReturnSalesInvoiceMaster, ReturnSalesMaster, ReturnSalesInvoicePaid,
+    Challan1, SupplierChallanMaster, SupplierChallanMaster2,
+    CustomerChallan, CustomerChallanMaster, CustomerChallanMaster2,
+    StockIssueMaster, StockIssueDetail, FinancialYearArchive,
+)
+from . import year_close
+from .opening_balances import clear_year_state, opening_year
+from .year_filter_utils import get_current_financial_year, get_financial_year_dates
+
+
+# name -> (header model, header date, [(line / payment model, foreign key to the header)])
+# Sales returns come before sales invoices: they may point at an archived sale line.
+DOCUMENTS = {
+    'purchase_invoices': (InvoiceMaster, 'invoice_date', [
+        (PurchaseMaster, 'product_invoiceid'), (InvoicePaid, 'ip_invoiceid')]),
+    'sales_returns': (ReturnSalesInvoiceMaster, 'return_sales_invoice_date', [
+        (ReturnSalesMaster, 'return_sales_invoice_no'), (ReturnSalesInvoicePaid, 'return_sales_ip_invoice_no')]),
+    'sales_invoices': (SalesInvoiceMaster, 'sales_invoice_date', [
+        (SalesMaster, 'sales_invoice_no'), (SalesInvoicePaid, 'sales_ip_invoice_no')]),
+    'purchase_returns': (ReturnInvoiceMaster, 'returninvoice_date', [
+        (ReturnPurchaseMaster, 'returninvoiceid'), (PurchaseReturnInvoicePaid, 'pr_ip_returninvoiceid')]),
+    'supplier_challans': (Challan1, 'challan_date', [
+        (SupplierChallanMaster, 'product_challan_id'), (SupplierChallanMaster2, 'product_challan_id')]),
+    'customer_challans': (CustomerChallan, 'customer_challan_date', [
+        (CustomerChallanMaster, 'customer_challan_id'), (CustomerChallanMaster2, 'customer_challan_id')]),
+    'stock_issues': (StockIssueMaster, 'issue_date', [
+        (StockIssueDetail, 'issue')]),
+}
+
+# payment model -> payment date
+PAYMENT_DATES = {
+    InvoicePaid: 'payment_date',
+    SalesInvoicePaid: 'sales_payment_date',
+    PurchaseReturnInvoicePaid: 'pr_payment_date',
+    ReturnSalesInvoicePaid: 'return_sales_payment_date',
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_dir():
+    path = getattr(settings, 'ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+    os.makedirs(path, exist_ok=True)
+    return str(path)
+
+
+def year_folder(fy_year):
+    return os.path.join(archive_dir(), f'fy{fy_year}')
+
+
+def archived_years():
+    return list(FinancialYearArchive.objects.values_list('fy_year', flat=True))
+
+
+def archived_through():
+    """Last archived financial year, or None"""
+    return FinancialYearArchive.objects.aggregate(last=Max('fy_year'))['last']
+
+
+# ---------------------------------------------------------------------------
+# Planning
+# ---------------------------------------------------------------------------
+
+def blocking_items(cutoff):
+    """Reasons the documents dated before `cutoff` cannot be archived yet"""
+    problems = year_close.blocking_items(cutoff)
+    unpaid = InvoiceMaster.objects.filter(invoice_date__lt=cutoff, invoice_balance__gt=0.01).count()
+    if unpaid:
+        problems.append(f'{unpaid} purchase invoice(s) not fully paid')
+    unpaid = SalesInvoiceMaster.objects.filter(sales_invoice_date__lt=cutoff, sales_invoice_balance__gt=0.01).count()
+    if unpaid:
+        problems.append(f'{unpaid} sales invoice(s) not fully received')
+    for header, date_field, children in DOCUMENTS.values():
+        for child, fk in children:
+            if child not in PAYMENT_DATES:
+                continue
+            late = child.objects.filter(**{
+                f'{fk}__{date_field}__lt': cutoff, f'{PAYMENT_DATES[child]}__gte': cutoff,
+            }).count()
+            if late:
+                problems.append(f'{late} {child._meta.verbose_name} row(s) dated after the archived years')
+    return problems
+
+
+def first_data_year():
+    dates = [
+        header.objects.aggregate(first=Min(date_field))['first']
+        for header, date_field, _ in DOCUMENTS.values()
+    ]
+    dates = [value for value in dates if value]
+    if not dates:
+        return None
+    first = min(dates)
+    return first.year if first.month >= 4 else first.year - 1
+
+
+def plan_archive(through_year):
+    """
+    What archiving up to `through_year` would do: {years, cutoff, documents,
+    blocking, close}. Raises ArchiveError when the request itself is invalid.
+    """
+    if through_year >= get_current_financial_year():
+        raise ArchiveError(f'FY {year_close.year_label(through_year)} has not ended yet')
+    last = archived_through()
+    if last is not None and through_year <= last:
+        raise ArchiveError(f'Financial years up to {year_close.year_label(last)} are already archived')
+    first = last + 1 if last is not None else min(first_data_year() or through_year, through_year)
+    cutoff = year_close.year_cutoff(through_year)
+    current = opening_year()
+    documents = {
+        name: header.objects.filter(**{f'{date_field}__lt': cutoff}).count()
+        for name, (header, date_field, _) in DOCUMENTS.items()
+    }
+    return {
+        'years': list(range(first, through_year + 1)),
+        'cutoff': cutoff,
+        'documents': documents,
+        'blocking': blocking_items(cutoff),
+        'close': current is None or current <= through_year,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Archiving
+# ---------------------------------------------------------------------------
+
+def _dump(folder, model, queryset, counts):
+    total = queryset.count()
+    if not total:
+        return
+    label = model._meta.label_lower
+    with gzip.open(os.path.join(folder, f'{label}.jsonl.gz'), 'wt', encoding='utf-8',
+                   compresslevel=getattr(settings, 'BACKUP_COMPRESSION', 6)) as stream:
+        serializers.serialize('jsonl', queryset.order_by('pk').iterator(chunk_size=2000), stream=stream)
+    counts[label] = counts.get(label, 0) + total
+
+
+def _write_year(fy_year):
+    """Write one financial year's documents to <ARCHIVE_DIR>/fy<year>/; returns {model: rows}"""
+    folder = year_folder(fy_year)
+    if os.path.exists(folder):
+        raise ArchiveError(f'{folder} already exists - move it away first')
+    partial = f'{folder}.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    start_date, end_date = get_financial_year_dates(fy_year)
+    counts = {}
+    for name, (header, date_field, children) in DOCUMENTS.items():
+        headers = header.objects.filter(**{f'{date_field}__range': (start_date, end_date)})
+        _dump(partial, header, headers, counts)
+        for child, fk in children:
+            _dump(partial, child, child.objects.filter(**{f'{fk}__in': headers.values('pk')}), counts)
+    with open(os.path.join(partial, 'manifest.json'), 'w') as handle:
+        json.dump({'fy_year': fy_year, 'archived_at': datetime.now().isoformat(timespec='seconds'),
+                   'rows': counts}, handle, indent=2)
+    os.replace(partial, folder)
+    return counts
+
+
+def _delete_archived(cutoff):
+    """Delete every document dated before cutoff with its lines and payments"""
+    # Later sales returns stay; only their link to an archived sale line goes
+    linked = ReturnSalesInvoiceMaster.objects.filter(
+        return_sales_invoice_date__gte=cutoff, sales_invoice_no__sales_invoice_no__sales_invoice_date__lt=cutoff
+    )
+    pks = list(linked.values_list('pk', flat=True))
+    linked.update(sales_invoice_no=None)
+    record_changes(ReturnSalesInvoiceMaster, pks)
+
+    for header, date_field, children in DOCUMENTS.values():
+        headers = header.objects.filter(**{f'{date_field}__lt': cutoff})
+        for child, fk in children:
+            rows = child.objects.filter(**{f'{fk}__in': headers.values('pk')})
+            record_changes(child, list(rows.values_list('pk', flat=True)), 'delete')
+            rows.delete()
+        record_changes(header, list(headers.values_list('pk', flat=True)), 'delete')
+        headers.delete()
+
+
+def archive_years(through_year, progress=None):
+    """
+    Archive every financial year up to through_year. Returns the plan with
+    the rows written per year. Raises ArchiveError if a year is not closed.
+    """
+    from .inventory_cache import rebuild_cache_setwise
+    from .signals import signals_disabled
+
+    progress = progress or (lambda message: None)
+    plan = plan_archive(through_year)
+    if plan['blocking']:
+        raise ArchiveError('Not fully closed: ' + '; '.join(plan['blocking']))
+
+    written = {}
+    try:
+        for fy_year in plan['years']:
+            written[fy_year] = _write_year(fy_year)
+            progress(f'FY {year_close.year_label(fy_year)}: {sum(written[fy_year].values())} rows written')
+
+        with transaction.atomic(), signals_disabled(), change_log_suspended(), year_close.closed_years_unlocked():
+            # Years not closed yet are closed first, while their rows are still here
+            if plan['close']:
+                year_close.write_snapshot(through_year)
+            _delete_archived(plan['cutoff'])
+            archives = FinancialYearArchive.objects.bulk_create([
+                FinancialYearArchive(fy_year=fy_year, archived_at=timezone.now(), path=year_folder(fy_year),
+                                     row_counts=written[fy_year])
+                for fy_year in plan['years']
+            ])
+            record_changes(FinancialYearArchive, [archive.pk for archive in archives])
+            clear_year_state()
+    except BaseException:
+        # The database is unchanged: drop the files written so far
+        for fy_year in written:
+            shutil.rmtree(year_folder(fy_year), ignore_errors=True)
+        raise
+
+    progress('Rebuilding the inventory cache...')
+    rebuild_cache_setwise()
+    plan['written'] = written
+    return plan
+
+
+# ---------------------------------------------------------------------------
+# Reading archived years
+# ---------------------------------------------------------------------------
+
+def read_archive(fy_year, model):
+    """Archived rows of one model as dicts (the serialized fields plus pk), streamed from the file"""
+    path = os.path.join(year_folder(fy_year), f'{model._meta.label_lower}.jsonl.gz')
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as stream:
+        for line in stream:
+            entry = json.loads(line)
+            yield dict(entry['fields'], pk=entry['pk'])
+
+
+@lru_cache(maxsize=32)
+def _archived_documents(fy_year, name, line_amount, mtime):
+    header, date_field, children = DOCUMENTS[name]
+    lines_model, fk = children[0]
+    line_counts, line_totals = defaultdict(int), defaultdict(float)
+    for row in read_archive(fy_year, lines_model):
+        line_counts[row[fk]] += 1
+        if line_amount:
+            line_totals[row[fk]] += row.get(line_amount) or 0
+    documents = []
+    for row in read_archive(fy_year, header):
+        row['line_count'] = line_counts.get(row['pk'], 0)
+        row['line_total'] = line_totals.get(row['pk'], 0)
+        documents.append(row)
+    documents.sort(key=lambda row: (row[date_field], str(row['pk'])))
+    return documents
+
+
+def archived_documents(fy_year, name, line_amount=None):
+    """
+    Headers of one document type of an archived year, oldest first, each
+    with line_count and (summing line_amount over its lines) line_total.
+    Cached per archive folder.
+    """
+    folder = year_folder(fy_year)
+    mtime = os.path.getmtime(folder) if os.path.exists(folder) else 0
+    return _archived_documents(fy_year, name, line_amount, mtime)
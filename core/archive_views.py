@@ -0,0 +1,58 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render, redirect
+
+from .archive_service import DOCUMENTS, archived_documents
+from .models import FinancialYearArchive, SupplierMaster, CustomerMaster
+
+
+# name -> (title, number field, party field, party model, total field or None, line amount to sum)
+REPORT_SECTIONS = [
+    ('purchase_invoices', 'Purchase Invoices', 'invoice_no', 'supplierid', SupplierMaster, 'invoice_total', None),
+    ('sales_invoices', 'Sales Invoices', 'pk', 'customerid', CustomerMaster, None, 'sale_total_amount'),
+    ('purchase_returns', 'Purchase Returns', 'pk', 'returnsupplierid', SupplierMaster, 'returninvoice_total', None),
+    ('sales_returns', 'Sales Returns', 'pk', 'return_sales_customerid', CustomerMaster, 'return_sales_invoice_total', None),
+    ('supplier_challans', 'Supplier Challans', 'challan_no', 'supplier', SupplierMaster, 'challan_total', None),
+    ('customer_challans', 'Customer Challans', 'customer_challan_no', 'customer_name', CustomerMaster, 'challan_total', None),
+    ('stock_issues', 'Stock Issues', 'issue_no', None, None, 'total_value', None),
+]
+
+
+@login_required
+def archived_year_report(request, fy_year):
+    """Documents of an archived financial year, read back from its archive files"""
+    archive = FinancialYearArchive.objects.filter(fy_year=fy_year).first()
+    if archive is None:
+        messages.error(request, f"FY {fy_year}-{str(fy_year + 1)[-2:]} is not archived.")
+        return redirect('dashboard')
+
+    supplier_names = dict(SupplierMaster.objects.values_list('supplierid', 'supplier_name'))
+    customer_names = dict(CustomerMaster.objects.values_list('customerid', 'customer_name'))
+    sections = []
+    for name, title, number_field, party_field, party_model, total_field, line_amount in REPORT_SECTIONS:
+        date_field = DOCUMENTS[name][1]
+        names = supplier_names if party_model is SupplierMaster else customer_names
+        rows = [
+            {
+                'number': document[number_field],
+                'date': document[date_field],
+                'party': names.get(document[party_field], f'#{document[party_field]}') if party_field
+                         else document.get('issue_type', '').title(),
+                'lines': document['line_count'],
+                'total': document[total_field] if total_field else document['line_total'],
+            }
+            for document in archived_documents(fy_year, name, line_amount)
+        ]
+        sections.append({
+            'title': title,
+            'rows': rows,
+            'total': sum(row['total'] or 0 for row in rows),
+        })
+
+    context = {
+        'archive': archive,
+        'fy_year': fy_year,
+        'sections': sections,
+        'title': f'Archived FY {fy_year}-{str(fy_year + 1)[-2:]}',
+    }
+    return render(request, 'reports/archived_year.html', context)
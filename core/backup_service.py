@@ -0,0 +1,566 @@
+"""
+Database backup / restore
+PostgreSQL: pg_dump in custom (-Fc, one compressed file) or directory
+(-Fd, one compressed file per table, dumped with -j parallel jobs) format,
+restored with pg_restore -j. Other databases (SQLite in development): every
+model streamed as JSON Lines through gzip, restored with loaddata.
+
+Between full backups, `create_backup --incremental` writes the rows changed
+since the last full or incremental backup (core/change_log.py) as a gzipped
+JSON Lines segment under <BACKUP_DIR>/incremental/<full backup>/;
+`restore_backup --incremental` restores the full backup and replays its
+segments in order.
+
+Backups and restores run as `manage.py create_backup` / `restore_backup`
+processes. Started from the web UI they get a job id and report progress to
+<BACKUP_DIR>/.jobs/<job id>.json, which the backup page polls.
+"""
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import FileResponse, StreamingHttpResponse
+
+from .change_log import current_watermark
+from .models import ChangeLog
+from .opening_balances import clear_year_state
+
+
+BACKUP_PREFIXES = ('backup_', 'pre_restore_')
+FORMATS = {
+    'custom': '.dump',
+    'directory': '.dir',
+    'django': '.jsonl.gz',
+    'plain': '.sql',   # older backups taken with pg_dump --column-inserts
+}
+# Rebuilt by migrate / meaningless in another database
+SKIP_MODELS = {'contenttypes.contenttype', 'auth.permission', 'sessions.session', 'core.changelog'}
+STREAM_CHUNK = 1024 * 1024
+STALE_JOB_MINUTES = 10
+
+
+class BackupError(Exception):
+    pass
+
+
+def backup_dir():
+    path = getattr(settings, 'BACKUP_DIR', os.path.join(settings.BASE_DIR, 'backups'))
+    os.makedirs(path, exist_ok=True)
+    return str(path)
+
+
+def _is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def backup_format(filename):
+    for name, extension in FORMATS.items():
+        if filename.endswith(extension):
+            return name
+    return None
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+
+def list_backups():
+    """Backups in BACKUP_DIR, newest first"""
+    folder = backup_dir()
+    backups = []
+    for filename in os.listdir(folder):
+        fmt = backup_format(filename)
+        if not fmt or not filename.startswith(BACKUP_PREFIXES):
+            continue
+        path = os.path.join(folder, filename)
+        modified = datetime.fromtimestamp(os.path.getmtime(path))
+        backups.append({
+            'filename': filename,
+            'format': fmt,
+            'size': f'{_size(path) / (1024 * 1024):.2f} MB',
+            'date': modified.strftime('%Y-%m-%d %H:%M:%S'),
+            'modified': modified,
+            'incrementals': len(list_segments(filename)),
+        })
+    backups.sort(key=lambda x: x['modified'], reverse=True)
+    return backups
+
+
+def resolve_backup(filename):
+    """Full path of a listed backup, or None (also rejects path tricks)"""
+    if not filename or filename != os.path.basename(filename) or not backup_format(filename):
+        return None
+    path = os.path.join(backup_dir(), filename)
+    return path if os.path.exists(path) else None
+
+
+def delete_backup_file(filename):
+    path = resolve_backup(filename)
+    if path is None:
+        return False
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+    shutil.rmtree(os.path.join(_incremental_dir(), filename), ignore_errors=True)
+    if (_chain_state() or {}).get('base') == filename:
+        clear_chain()
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Jobs
+# ---------------------------------------------------------------------------
+
+def _job_path(job_id):
+    folder = os.path.join(backup_dir(), '.jobs')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f'{job_id}.json')
+
+
+def read_job(job_id):
+    if not job_id or not job_id.isalnum():
+        return None
+    try:
+        with open(_job_path(job_id)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def update_job(job_id, **fields):
+    job = read_job(job_id) or {'id': job_id}
+    job.update(fields, updated=datetime.now().isoformat(timespec='seconds'))
+    temp = _job_path(job_id) + '.tmp'
+    with open(temp, 'w') as handle:
+        json.dump(job, handle)
+    os.replace(temp, _job_path(job_id))
+    return job
+
+
+def running_job():
+    """A job that is still reporting progress, if any"""
+    folder = os.path.dirname(_job_path('x'))
+    cutoff = datetime.now() - timedelta(minutes=STALE_JOB_MINUTES)
+    for filename in os.listdir(folder):
+        if not filename.endswith('.json'):
+            continue
+        job = read_job(filename[:-5])
+        if job and job.get('state') in ('queued', 'running') and datetime.fromisoformat(job['updated']) > cutoff:
+            return job
+    return None
+
+
+def start_job(command, *args):
+    """Run a backup management command in its own process; returns the job id"""
+    job_id = uuid.uuid4().hex
+    update_job(job_id, kind=command, state='queued', progress=0, message='Starting...',
+               started=datetime.now().isoformat(timespec='seconds'))
+    subprocess.Popen(
+        [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), command, *args, '--job', job_id],
+        cwd=settings.BASE_DIR,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    return job_id
+
+
+def job_progress(job_id, stdout=None):
+    """progress(percent, message) callback for run_backup / run_restore"""
+    def progress(percent, message):
+        if job_id:
+            update_job(job_id, state='running', progress=percent, message=message)
+        elif stdout is not None:
+            stdout.write(f'[{percent:3d}%] {message}')
+    return progress
+
+
+# ---------------------------------------------------------------------------
+# Backup
+# ---------------------------------------------------------------------------
+
+def _pg_binary(name):
+    return os.path.join(getattr(settings, 'PG_BIN_DIR', '') or '', name)
+
+
+def _pg_command(binary, *args):
+    db = settings.DATABASES['default']
+    cmd = [_pg_binary(binary), '-h', db['HOST'], '-p', str(db['PORT']), '-U', db['USER']]
+    env = os.environ.copy()
+    env['PGPASSWORD'] = db['PASSWORD']
+    return cmd + list(args), env
+
+
+def _run_pg(cmd, env, total, markers, progress, start, end):
+    """Run pg_dump / pg_restore --verbose, turning each finished table into progress"""
+    done = 0
+    tail = []
+    process = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    for line in process.stderr:
+        line = line.strip()
+        tail = (tail + [line])[-20:]
+        if any(marker in line for marker in markers):
+            done += 1
+            progress(start + (end - start) * min(done, total) // max(total, 1), line.split(': ', 1)[-1][:120])
+    if process.wait() != 0:
+        raise BackupError('\n'.join(line for line in tail if 'error' in line.lower()) or '\n'.join(tail))
+
+
+def _table_count():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_tables WHERE schemaname = current_schema()")
+        return cursor.fetchone()[0]
+
+
+def _pg_backup(path, fmt, jobs, progress):
+    args = [
+        '-d', settings.DATABASES['default']['NAME'],
+        '--verbose', '--no-owner', '-Z', str(getattr(settings, 'BACKUP_COMPRESSION', 6)),
+        '-f', path,
+    ]
+    if fmt == 'directory':
+        args += ['-Fd', '-j', str(jobs)]
+    else:
+        args += ['-Fc']
+    cmd, env = _pg_command('pg_dump', *args)
+    _run_pg(cmd, env, _table_count(), ('dumping contents of table', 'finished item'), progress, 5, 99)
+
+
+def _backup_models():
+    return [
+        model for model in apps.get_models()
+        if model._meta.managed and not model._meta.proxy and model._meta.label_lower not in SKIP_MODELS
+    ]
+
+
+def _django_backup(path, progress):
+    """Every model as JSON Lines through gzip, one queryset iterator at a time"""
+    models = _backup_models()
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=getattr(settings, 'BACKUP_COMPRESSION', 6)) as stream:
+        for index, model in enumerate(models, start=1):
+            serializers.serialize(
+                'jsonl', model._default_manager.order_by('pk').iterator(chunk_size=2000),
+                stream=stream, use_natural_foreign_keys=True,
+            )
+            progress(5 + 94 * index // len(models), f'Dumped {model._meta.label}')
+
+
+def run_backup(fmt=None, jobs=None, progress=None, prefix='backup'):
+    """
+    Create a backup; returns its filename.
+    fmt: custom / directory on PostgreSQL (default BACKUP_FORMAT); always django elsewhere.
+    """
+    progress = progress or (lambda percent, message: None)
+    if _is_postgres():
+        fmt = fmt or getattr(settings, 'BACKUP_FORMAT', 'custom')
+        if fmt not in ('custom', 'directory'):
+            raise BackupError(f'Unknown backup format {fmt!r} - use custom or directory')
+    else:
+        fmt = 'django'
+    jobs = jobs or getattr(settings, 'BACKUP_JOBS', 4)
+
+    # Changes logged up to here are in this backup (replaying one twice is harmless)
+    watermark = current_watermark()
+    filename = f'{prefix}_{datetime.now():%Y%m%d_%H%M%S}{FORMATS[fmt]}'
+    path = os.path.join(backup_dir(), filename)
+    # Write under a temporary name so a half-written backup is never listed
+    partial = os.path.join(backup_dir(), f'.partial_{filename}')
+    progress(1, f'Creating {filename}')
+    try:
+        if fmt == 'django':
+            _django_backup(partial, progress)
+        else:
+            _pg_backup(partial, fmt, jobs, progress)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.isdir(partial):
+            shutil.rmtree(partial, ignore_errors=True)
+        elif os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if prefix == 'backup':
+        start_chain(filename, watermark)
+    progress(100, f'Backup created: {filename} ({_size(path) / (1024 * 1024):.2f} MB)')
+    return filename
+
+
+def prune_backups(keep_last=None, keep_days=None):
+    """
+    Retention: the newest keep_last backups are always kept, older ones are
+    deleted once they are more than keep_days old. Returns deleted filenames.
+    """
+    keep_last = getattr(settings, 'BACKUP_KEEP_LAST', 10) if keep_last is None else keep_last
+    keep_days = getattr(settings, 'BACKUP_KEEP_DAYS', 30) if keep_days is None else keep_days
+    cutoff = datetime.now() - timedelta(days=keep_days)
+    deleted = []
+    for backup in list_backups()[keep_last:]:
+        if backup['modified'] < cutoff and delete_backup_file(backup['filename']):
+            deleted.append(backup['filename'])
+    return deleted
+
+
+# ---------------------------------------------------------------------------
+# Incremental
+# ---------------------------------------------------------------------------
+
+def _incremental_dir():
+    path = os.path.join(backup_dir(), 'incremental')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _chain_state():
+    """{'base': full backup filename, 'watermark': last ChangeLog id backed up, 'segments': n}"""
+    try:
+        with open(os.path.join(_incremental_dir(), 'chain.json')) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_chain(state):
+    path = os.path.join(_incremental_dir(), 'chain.json')
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(state, handle)
+    os.replace(path + '.tmp', path)
+
+
+def clear_chain():
+    try:
+        os.remove(os.path.join(_incremental_dir(), 'chain.json'))
+    except FileNotFoundError:
+        pass
+
+
+def start_chain(base, watermark):
+    """Make a new full backup the base for the following incremental ones"""
+    _write_chain({'base': base, 'watermark': watermark, 'segments': 0})
+    # One DELETE statement: ChangeLog has no receivers or relations to collect
+    queryset = ChangeLog.objects.filter(id__lte=watermark)
+    queryset._raw_delete(queryset.db)
+
+
+def list_segments(base):
+    folder = os.path.join(backup_dir(), 'incremental', base)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if name.endswith('.jsonl.gz'))
+
+
+def run_incremental_backup(progress=None):
+    """
+    Write the rows changed since the last backup as the next segment of the
+    current full backup. Returns the segment name, or None without changes.
+    """
+    progress = progress or (lambda percent, message: None)
+    state = _chain_state()
+    if not state or resolve_backup(state['base']) is None:
+        raise BackupError('No full backup to build on - run create_backup first')
+
+    high = current_watermark()
+    if high <= state['watermark']:
+        progress(100, 'No changes since the last backup')
+        return None
+
+    # Last action per row wins
+    latest = {}
+    for model, pk, action in ChangeLog.objects.filter(
+        id__gt=state['watermark'], id__lte=high
+    ).order_by('id').values_list('model', 'object_pk', 'action').iterator(chunk_size=5000):
+        latest[(model, pk)] = action
+    saved = defaultdict(list)
+    deleted = []
+    for (model, pk), action in latest.items():
+        if action == 'delete':
+            deleted.append((model, pk))
+        else:
+            saved[model].append(pk)
+
+    sequence = state['segments'] + 1
+    filename = f'{sequence:05d}_{datetime.now():%Y%m%d_%H%M%S}.jsonl.gz'
+    folder = os.path.join(_incremental_dir(), state['base'])
+    os.makedirs(folder, exist_ok=True)
+    partial = os.path.join(folder, f'.partial_{filename}')
+    progress(5, f'Writing {len(latest)} changed rows to {filename}')
+    try:
+        with gzip.open(partial, 'wt', encoding='utf-8') as stream:
+            for index, (label, pks) in enumerate(saved.items(), start=1):
+                model = apps.get_model(label)
+                for start in range(0, len(pks), 1000):
+                    serializers.serialize(
+                        'jsonl', model._default_manager.filter(pk__in=pks[start:start + 1000]).order_by('pk'),
+                        stream=stream, use_natural_foreign_keys=True,
+                    )
+                progress(5 + 90 * index // len(saved), f'Wrote {label}')
+            for label, pk in deleted:
+                stream.write(json.dumps({'model': label, 'pk': pk, 'deleted': True}) + '\n')
+        os.replace(partial, os.path.join(folder, filename))
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    _write_chain(dict(state, watermark=high, segments=sequence))
+    progress(100, f'Incremental backup created: {filename} ({len(latest)} rows)')
+    return filename
+
+
+def _replay_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as stream, transaction.atomic():
+        for line in stream:
+            entry = json.loads(line)
+            if entry.get('deleted'):
+                apps.get_model(entry['model'])._default_manager.filter(pk=entry['pk']).delete()
+            else:
+                for obj in serializers.deserialize('jsonl', line):
+                    obj.save()
+
+
+def replay_segments(base, until=None, progress=None):
+    """Apply the segments of a full backup in order (up to segment number `until`)"""
+    from .inventory_cache import rebuild_cache_setwise
+    from .open_items import refresh_purchase_invoice_balances, refresh_sales_invoice_balances
+    from .signals import signals_disabled
+
+    progress = progress or (lambda percent, message: None)
+    segments = [name for name in list_segments(base) if until is None or int(name[:5]) <= until]
+    folder = os.path.join(_incremental_dir(), base)
+    with signals_disabled():
+        for index, name in enumerate(segments, start=1):
+            _replay_segment(os.path.join(folder, name))
+            progress(60 + 30 * index // max(len(segments), 1), f'Replayed {name}')
+    progress(92, 'Rebuilding balances and inventory cache...')
+    refresh_purchase_invoice_balances()
+    refresh_sales_invoice_balances()
+    rebuild_cache_setwise()
+    return len(segments)
+
+
+# ---------------------------------------------------------------------------
+# Restore
+# ---------------------------------------------------------------------------
+
+def _pg_restore(path, fmt, jobs, progress):
+    db_name = settings.DATABASES['default']['NAME']
+    if fmt == 'plain':
+        # Old --column-inserts backups: only psql can replay them, serially
+        cmd, env = _pg_command('psql', '-d', db_name, '-v', 'ON_ERROR_STOP=1', '-q', '-f', path)
+        progress(10, 'Replaying SQL backup (single connection)...')
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise BackupError(result.stderr[-2000:])
+        return
+    if fmt == 'django':
+        raise BackupError('This backup was taken from a non-PostgreSQL database')
+
+    listing = subprocess.run([_pg_binary('pg_restore'), '-l', path], capture_output=True, text=True)
+    total = listing.stdout.count(' TABLE DATA ') if listing.returncode == 0 else 0
+
+    cmd, env = _pg_command(
+        'pg_restore', '-d', db_name, '-j', str(jobs), '--verbose',
+        '--clean', '--if-exists', '--no-owner', '--no-privileges', path
+    )
+    _run_pg(cmd, env, total, ('processing data for table', 'finished item'), progress, 10, 99)
+
+
+def _django_restore(path, progress):
+    from .inventory_cache import rebuild_cache_setwise
+    from .signals import signals_disabled
+
+    progress(10, 'Clearing current data...')
+    call_command('flush', interactive=False, verbosity=0)
+    progress(30, 'Loading backup...')
+    with signals_disabled():
+        call_command('loaddata', path, verbosity=0)
+    progress(90, 'Rebuilding inventory cache...')
+    rebuild_cache_setwise()
+
+
+def run_restore(filename, jobs=None, progress=None, safety_backup=True, incremental=False, until=None):
+    """
+    Replace the database with a backup, taking a pre_restore_ backup first.
+    incremental: also replay the backup's incremental segments (up to `until`).
+    """
+    progress = progress or (lambda percent, message: None)
+    path = resolve_backup(filename)
+    if path is None:
+        raise BackupError('Backup file not found')
+    fmt = backup_format(filename)
+    if _is_postgres() == (fmt == 'django'):
+        raise BackupError(f'A {fmt} backup cannot be restored into {connection.vendor}')
+
+    if safety_backup:
+        progress(1, 'Creating safety backup...')
+        run_backup(prefix='pre_restore', jobs=jobs)
+
+    connection.close()
+    if fmt == 'django':
+        _django_restore(path, progress)
+    else:
+        _pg_restore(path, fmt, jobs or getattr(settings, 'BACKUP_JOBS', 4), progress)
+    segments = replay_segments(filename, until, progress) if incremental else 0
+    # The change log now describes another history - the next incremental
+    # backup needs a new full backup to build on
+    clear_chain()
+    clear_year_state()
+    progress(100, f'Restored {filename}' + (f' + {segments} incremental backups' if segments else ''))
+
+
+# ---------------------------------------------------------------------------
+# Download
+# ---------------------------------------------------------------------------
+
+def _file_chunks(path):
+    with open(path, 'rb') as handle:
+        while True:
+            chunk = handle.read(STREAM_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _tar_stream(folder):
+    """Uncompressed tar of a pg_dump directory, produced block by block (the members are already compressed)"""
+    root = os.path.basename(folder)
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if not entry.is_file():
+            continue
+        info = tarfile.TarInfo(f'{root}/{entry.name}')
+        info.size = entry.stat().st_size
+        info.mtime = int(entry.stat().st_mtime)
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        yield from _file_chunks(entry.path)
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def backup_response(filename):
+    """Streaming download response for a backup, or None if it does not exist"""
+    path = resolve_backup(filename)
+    if path is None:
+        return None
+    fmt = backup_format(filename)
+    if fmt == 'directory':
+        response = StreamingHttpResponse(_tar_stream(path), content_type='application/x-tar')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.tar"'
+        return response
+    content_type = {'django': 'application/gzip', 'plain': 'application/sql'}.get(fmt, 'application/octet-stream')
+    response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
+    response.block_size = STREAM_CHUNK
+    return response
@@ -1,12 +1,11 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, FileResponse
-from django.core.management import call_command
-from django.conf import settings
-import os
-import subprocess
-from datetime import datetime
+from django.http import JsonResponse
+from .backup_service import (
+    list_backups, resolve_backup, delete_backup_file, backup_response,
+    start_job, read_job, running_job, run_backup
+)
 
 @login_required
 def backup_list(request):
@@ -14,25 +13,10 @@ def backup_list(request):
         messages.error(request, "Only admins can access backup management.")
         return redirect('dashboard')
     
-    backup_dir = 'backups'
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    backups = []
-    for filename in os.listdir(backup_dir):
-        if filename.endswith('.sql') or filename.endswith('.dump'):
-            filepath = os.path.join(backup_dir, filename)
-            size = os.path.getsize(filepath) / (1024 * 1024)
-            modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-            backups.append({
-                'filename': filename,
-                'size': f'{size:.2f} MB',
-                'date': modified.strftime('%Y-%m-%d %H:%M:%S')
-            })
-    
-    backups.sort(key=lambda x: x['date'], reverse=True)
-    
+    job = running_job()
     context = {
-        'backups': backups,
+        'backups': list_backups(),
+        'running_job': job['id'] if job else '',
         'title': 'Database Backups'
     }
     return render(request, 'system/backup_list.html', context)
@@ -42,43 +26,15 @@ def create_backup(request):
     if request.user.user_type != 'admin':
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid method'})
+    
+    if running_job():
+        return JsonResponse({'success': False, 'error': 'Another backup or restore is still running'})
+    
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_dir = 'backups'
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        db_config = settings.DATABASES['default']
-        filename = f'backup_{timestamp}.sql'
-        destination = os.path.join(backup_dir, filename)
-        
-        # PostgreSQL complete backup (schema + data with column-inserts)
-        cmd = [
-            'pg_dump',
-            '-h', db_config['HOST'],
-            '-p', str(db_config['PORT']),
-            '-U', db_config['USER'],
-            '-d', db_config['NAME'],
-            '--clean',
-            '--if-exists',
-            '--column-inserts',
-            '-f', destination
-        ]
-        
-        env = os.environ.copy()
-        env['PGPASSWORD'] = db_config['PASSWORD']
-        
-        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return JsonResponse({'success': False, 'error': f'Backup failed: {result.stderr}'})
-        
-        backup_size = os.path.getsize(destination)
-        
-        return JsonResponse({
-            'success': True,
-            'message': f'Backup created successfully! Size: {backup_size / (1024*1024):.2f} MB',
-            'filename': filename
-        })
+        job_id = start_job('create_backup')
+        return JsonResponse({'success': True, 'job_id': job_id, 'message': 'Backup started'})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -90,72 +46,33 @@ def restore_backup(request):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Invalid method'})
     
+    filename = request.POST.get('filename')
+    if resolve_backup(filename) is None:
+        return JsonResponse({'success': False, 'error': 'Backup file not found'})
+    
+    if running_job():
+        return JsonResponse({'success': False, 'error': 'Another backup or restore is still running'})
+    
     try:
-        from django.db import connection
-        
-        filename = request.POST.get('filename')
-        backup_path = os.path.join('backups', filename)
-        
-        if not os.path.exists(backup_path):
-            return JsonResponse({'success': False, 'error': 'Backup file not found'})
-        
-        connection.close()
-        
-        db_config = settings.DATABASES['default']
-        
-        # PostgreSQL restore using psql (for plain SQL)
-        cmd = [
-            'psql',
-            '-h', db_config['HOST'],
-            '-p', str(db_config['PORT']),
-            '-U', db_config['USER'],
-            '-d', db_config['NAME'],
-            '-f', backup_path
-        ]
-        
-        env = os.environ.copy()
-        env['PGPASSWORD'] = db_config['PASSWORD']
-        
-        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return JsonResponse({'success': False, 'error': f'Restore failed: {result.stderr}'})
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Database restored successfully! Please restart the server.'
-        })
+        job_id = start_job('restore_backup', filename)
+        return JsonResponse({'success': True, 'job_id': job_id, 'message': 'Restore started'})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
+@login_required
+def backup_job_status(request, job_id):
+    """Progress of a backup / restore started from the backup page"""
+    if request.user.user_type != 'admin':
+        return JsonResponse({'success': False, 'error': 'Permission denied'})
+    
+    job = read_job(job_id)
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'Unknown job'})
+    return JsonResponse({'success': True, **job})
+
 def create_backup_file():
     """Create backup file and return filename"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_dir = 'backups'
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    db_config = settings.DATABASES['default']
-    filename = f'backup_{timestamp}.sql'
-    destination = os.path.join(backup_dir, filename)
-    
-    cmd = [
-        'pg_dump',
-        '-h', db_config['HOST'],
-        '-p', str(db_config['PORT']),
-        '-U', db_config['USER'],
-        '-d', db_config['NAME'],
-        '--clean',
-        '--if-exists',
-        '--column-inserts',
-        '-f', destination
-    ]
-    
-    env = os.environ.copy()
-    env['PGPASSWORD'] = db_config['PASSWORD']
-    
-    subprocess.run(cmd, env=env, check=True)
-    
-    return filename
+    return run_backup()
 
 @login_required
 def download_backup(request, filename):
@@ -163,16 +80,11 @@ def download_backup(request, filename):
         messages.error(request, "Permission denied")
         return redirect('backup_list')
     
-    filepath = os.path.join('backups', filename)
-    if os.path.exists(filepath):
-        response = FileResponse(open(filepath, 'rb'), as_attachment=True)
-        response['Content-Type'] = 'application/sql'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = os.path.getsize(filepath)
-        return response
-    else:
+    response = backup_response(filename)
+    if response is None:
         messages.error(request, "Backup file not found")
         return redirect('backup_list')
+    return response
 
 @login_required
 def delete_backup(request):
@@ -183,11 +95,7 @@ def delete_backup(request):
         return JsonResponse({'success': False, 'error': 'Invalid method'})
     
     try:
-        filename = request.POST.get('filename')
-        filepath = os.path.join('backups', filename)
-        
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        if delete_backup_file(request.POST.get('filename')):
             return JsonResponse({'success': True, 'message': 'Backup deleted successfully'})
         else:
             return JsonResponse({'success': False, 'error': 'Backup file not found'})
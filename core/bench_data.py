@@ -0,0 +1,567 @@
+"""
+Benchmark / Test Dataset
+Deterministic pharmacy data for the `bench` and `generate_bulk_data`
+management commands.
+
+The same seed always produces the same rows: suppliers, customers, products
+with several batches each, purchase and sales invoices with their line items,
+partial payments / receipts, supplier and customer challans and sales /
+purchase returns. Rows are written with bulk_create in chunks (or COPY on
+PostgreSQL for the line tables), no per-row signals fire, and the stored
+balances and the inventory cache are rebuilt set-wise once at the end.
+"""
+import csv
+import io
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.utils import timezone
+
+from .models import (
+    SupplierMaster, CustomerMaster, ProductMaster,
+    InvoiceMaster, PurchaseMaster, InvoicePaid,
+    SalesInvoiceMaster, SalesMaster, SalesInvoicePaid, SaleRateMaster,
+    Challan1, SupplierChallanMaster, CustomerChallan, CustomerChallanMaster,
+    ReturnInvoiceMaster, ReturnPurchaseMaster, ReturnSalesInvoiceMaster, ReturnSalesMaster,
+)
+from .inventory_cache import rebuild_cache_setwise
+from .open_items import refresh_purchase_invoice_balances, refresh_sales_invoice_balances
+
+
+# Named sizes for --size; `lines` is purchase + sales line items together
+DATASET_SIZES = {
+    'small': {'products': 200, 'lines': 6000},
+    'medium': {'products': 2000, 'lines': 60000},
+    'large': {'products': 10000, 'lines': 600000},
+}
+
+# Shape of the generated data; generate_bulk_data overrides these per run
+DEFAULT_PROFILE = {
+    'lines_per_invoice': (1, 8),
+    'batches_per_product': (1, 4),
+    'paid': 0.4,          # share of invoices fully paid
+    'partial': 0.3,       # share part paid (the rest are unpaid)
+    'returns': 0.02,      # sales return lines per sales line
+    'days': 400,          # days of history ending at end_date
+}
+CHUNK_SIZE = 500
+
+CATEGORIES = ['tablet', 'capsule', 'syrup', 'injection', 'ointment', 'drops']
+COMPANIES = ['Cipla', 'Sun Pharma', 'Lupin', 'Mankind', 'Alkem', 'Zydus', 'Torrent', 'Abbott']
+SALTS = ['Paracetamol', 'Amoxicillin', 'Cetirizine', 'Metformin', 'Azithromycin', 'Pantoprazole']
+
+
+def _split_lines(lines):
+    """(purchase lines, sales lines) - one third of the volume is purchases"""
+    purchase_lines = max(lines // 3, 1)
+    return purchase_lines, max(lines - purchase_lines, 1)
+
+
+def _timestamp(day):
+    value = datetime.combine(day, time(10, 0))
+    return timezone.make_aware(value) if settings.USE_TZ else value
+
+
+def _chunks(total, size=CHUNK_SIZE):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def _copy_insert(model, objs):
+    """
+    Insert rows with PostgreSQL COPY - several times faster than multi-row
+    INSERT for the big line tables. Primary keys are not returned.
+    """
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, AutoField)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        row = []
+        for field in fields:
+            value = field.get_db_prep_save(field.pre_save(obj, True), connection=connection)
+            row.append('\\N' if value is None else value)
+        writer.writerow(row)
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    with connection.cursor() as cursor:
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+class DatasetBuilder:
+    """
+    Writes a generated dataset step by step; parent rows created by one step
+    (parties, products, batches) are reused by the next.
+
+    Args:
+        seed: random seed - same seed and steps, same rows
+        end_date: last day of the generated history (default today)
+        prefix: prefix for document numbers, so generated rows can be found and removed
+        profile: overrides for DEFAULT_PROFILE
+        use_copy: load line tables with COPY when the database is PostgreSQL
+        log: optional callable for progress messages
+    """
+    def __init__(self, seed=42, end_date=None, prefix='B', profile=None, use_copy=False, log=None):
+        self.rng = random.Random(seed)
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=self.profile['days'])
+        self.prefix = prefix
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.log = log or (lambda message: None)
+        self.counts = {}
+        self.sales_sample = []
+
+    def random_day(self):
+        return self.start_date + timedelta(days=self.rng.randint(0, self.profile['days']))
+
+    def invoice_sizes(self, total_lines):
+        """Line counts per invoice that add up to total_lines"""
+        sizes = []
+        remaining = total_lines
+        while remaining > 0:
+            size = min(self.rng.randint(*self.profile['lines_per_invoice']), remaining)
+            sizes.append(size)
+            remaining -= size
+        return sizes
+
+    def invoice_count_sizes(self, invoices):
+        """Line counts for a fixed number of invoices"""
+        return [self.rng.randint(*self.profile['lines_per_invoice']) for _ in range(invoices)]
+
+    def insert_lines(self, model, objs):
+        if self.use_copy:
+            _copy_insert(model, objs)
+        else:
+            model.objects.bulk_create(objs, batch_size=CHUNK_SIZE)
+
+    def count(self, key, value):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    # -- masters -----------------------------------------------------------
+
+    def use_existing_masters(self):
+        """Generate against the suppliers, customers and products already in the database"""
+        self.suppliers = list(SupplierMaster.objects.all())
+        self.customers = list(CustomerMaster.objects.all())
+        self.products = list(ProductMaster.objects.all())
+
+    def create_parties(self, suppliers, customers):
+        suppliers = [
+            SupplierMaster(
+                supplier_name=f'{self.prefix} Supplier {i:05d}',
+                supplier_mobile=f'90000{i:05d}',
+                supplier_type='Distributor'
+            )
+            for i in range(suppliers)
+        ]
+        self.suppliers = SupplierMaster.objects.bulk_create(suppliers, batch_size=CHUNK_SIZE)
+
+        customers = [
+            CustomerMaster(
+                customer_name=f'{self.prefix} Customer {i:05d}',
+                customer_mobile=f'80000{i:05d}',
+                customer_credit_days=self.rng.choice([0, 7, 15, 30, 45])
+            )
+            for i in range(customers)
+        ]
+        self.customers = CustomerMaster.objects.bulk_create(customers, batch_size=CHUNK_SIZE)
+        self.counts['suppliers'] = len(self.suppliers)
+        self.counts['customers'] = len(self.customers)
+
+    def create_products(self, count):
+        products = [
+            ProductMaster(
+                product_name=f'{self.rng.choice(SALTS)} {self.prefix}-{i:05d}',
+                product_company=self.rng.choice(COMPANIES),
+                product_packing=self.rng.choice(['10', '15', '100ML', '1']),
+                product_salt=self.rng.choice(SALTS),
+                product_category=self.rng.choice(CATEGORIES),
+                product_hsn='3004',
+                product_hsn_percent='12',
+                product_reorder_level=self.rng.choice([5, 10, 20])
+            )
+            for i in range(count)
+        ]
+        self.products = ProductMaster.objects.bulk_create(products, batch_size=CHUNK_SIZE)
+        self.counts['products'] = len(self.products)
+
+    def create_batches(self):
+        """Batches per product: (product, batch_no, expiry, mrp, rate), with batch sale rates"""
+        self.batches = []
+        rates = []
+        for product in self.products:
+            for k in range(self.rng.randint(*self.profile['batches_per_product'])):
+                mrp = round(self.rng.uniform(20, 800), 2)
+                batch = (
+                    product,
+                    f'{self.prefix}{product.productid}-{k}',
+                    f'{self.rng.randint(1, 12):02d}-{self.end_date.year + self.rng.randint(-1, 3)}',
+                    mrp,
+                    round(mrp * 0.6, 2),
+                )
+                self.batches.append(batch)
+                rates.append(SaleRateMaster(
+                    productid=product, product_batch_no=batch[1],
+                    rate_A=round(mrp * 0.9, 2), rate_B=round(mrp * 0.85, 2), rate_C=round(mrp * 0.8, 2)
+                ))
+        SaleRateMaster.objects.bulk_create(rates, batch_size=CHUNK_SIZE)
+        self.counts['batches'] = len(self.batches)
+
+    # -- purchases ---------------------------------------------------------
+
+    def create_purchases(self, sizes):
+        """One purchase invoice per entry of sizes (its line count), with payments"""
+        invoice_no = self.counts.get('purchase_invoices', 0)
+        for start, count in _chunks(len(sizes)):
+            invoices, lines = [], []
+            for size in sizes[start:start + count]:
+                invoice_no += 1
+                supplier = self.rng.choice(self.suppliers)
+                day = self.random_day()
+                items = []
+                for _ in range(size):
+                    product, batch_no, expiry, mrp, rate = self.rng.choice(self.batches)
+                    quantity = self.rng.randint(50, 500)
+                    items.append(PurchaseMaster(
+                        product_supplierid=supplier,
+                        product_invoice_no=f'{self.prefix}P{invoice_no:07d}',
+                        productid=product,
+                        product_name=product.product_name,
+                        product_company=product.product_company,
+                        product_packing=product.product_packing,
+                        product_batch_no=batch_no,
+                        product_expiry=expiry,
+                        product_MRP=mrp,
+                        product_purchase_rate=rate,
+                        product_quantity=quantity,
+                        product_discount_got=0,
+                        product_transportation_charges=0,
+                        actual_rate_per_qty=rate,
+                        product_actual_rate=rate,
+                        total_amount=round(rate * quantity, 2),
+                        purchase_entry_date=_timestamp(day),
+                        CGST=6, SGST=6
+                    ))
+                total = round(sum(item.total_amount for item in items), 2)
+                paid = self.payment_amount(total)
+                invoices.append(InvoiceMaster(
+                    invoice_no=f'{self.prefix}P{invoice_no:07d}',
+                    invoice_date=day,
+                    supplierid=supplier,
+                    transport_charges=0,
+                    invoice_total=total,
+                    invoice_paid=paid,
+                    invoice_balance=round(total - paid, 2),
+                    payment_status='paid' if paid >= total else ('partial' if paid > 0 else 'pending')
+                ))
+                lines.append(items)
+
+            with transaction.atomic():
+                invoices = InvoiceMaster.objects.bulk_create(invoices)
+                for invoice, items in zip(invoices, lines):
+                    for item in items:
+                        item.product_invoiceid = invoice
+                self.insert_lines(PurchaseMaster, [item for items in lines for item in items])
+                InvoicePaid.objects.bulk_create([
+                    InvoicePaid(
+                        ip_invoiceid=invoice,
+                        payment_date=invoice.invoice_date + timedelta(days=self.rng.randint(0, 30)),
+                        payment_amount=invoice.invoice_paid,
+                        payment_mode=self.rng.choice(['cash', 'cheque', 'online']),
+                        payment_ref_no=f'{self.prefix}PP{invoice.invoiceid}'
+                    )
+                    for invoice in invoices if invoice.invoice_paid > 0
+                ])
+            self.log(f'  purchase invoices: {invoice_no}')
+        self.count('purchase_invoices', len(sizes))
+        self.count('purchase_lines', sum(sizes))
+
+    def payment_amount(self, total):
+        """Fully paid, part paid or unpaid in the profile's proportions"""
+        roll = self.rng.random()
+        if roll < self.profile['paid']:
+            return total
+        if roll < self.profile['paid'] + self.profile['partial']:
+            return round(total * self.rng.uniform(0.1, 0.9), 2)
+        return 0.0
+
+    # -- sales -------------------------------------------------------------
+
+    def create_sales(self, sizes):
+        """One sales invoice per entry of sizes, with receipts; samples lines for returns"""
+        invoice_no = self.counts.get('sales_invoices', 0)
+        for start, count in _chunks(len(sizes)):
+            invoices, lines = [], []
+            for size in sizes[start:start + count]:
+                invoice_no += 1
+                customer = self.rng.choice(self.customers)
+                day = self.random_day()
+                invoice = SalesInvoiceMaster(
+                    sales_invoice_no=f'{self.prefix}S{invoice_no:07d}',
+                    sales_invoice_date=day,
+                    customerid=customer
+                )
+                items = []
+                for _ in range(size):
+                    product, batch_no, expiry, mrp, rate = self.rng.choice(self.batches)
+                    quantity = self.rng.randint(1, 10)
+                    sale_rate = round(mrp * 0.9, 2)
+                    items.append(SalesMaster(
+                        sales_invoice_no=invoice,
+                        customerid=customer,
+                        productid=product,
+                        product_name=product.product_name,
+                        product_company=product.product_company,
+                        product_packing=product.product_packing,
+                        product_batch_no=batch_no,
+                        product_expiry=expiry,
+                        product_MRP=mrp,
+                        sale_rate=sale_rate,
+                        sale_quantity=quantity,
+                        sale_total_amount=round(sale_rate * quantity, 2),
+                        sale_entry_date=_timestamp(day),
+                        rate_applied='A'
+                    ))
+                invoice.sales_invoice_paid = self.payment_amount(
+                    round(sum(item.sale_total_amount for item in items), 2)
+                )
+                invoices.append(invoice)
+                lines.append(items)
+
+            with transaction.atomic():
+                SalesInvoiceMaster.objects.bulk_create(invoices)
+                sales = [item for items in lines for item in items]
+                self.insert_lines(SalesMaster, sales)
+                SalesInvoicePaid.objects.bulk_create([
+                    SalesInvoicePaid(
+                        sales_ip_invoice_no=invoice,
+                        sales_payment_date=invoice.sales_invoice_date + timedelta(days=self.rng.randint(0, 30)),
+                        sales_payment_amount=invoice.sales_invoice_paid,
+                        sales_payment_mode=self.rng.choice(['cash', 'upi', 'cheque'])
+                    )
+                    for invoice in invoices if invoice.sales_invoice_paid > 0
+                ])
+            # Returns are drawn from these
+            self.sales_sample.extend(self.rng.sample(sales, min(round(len(sales) * self.profile['returns']), len(sales))))
+            self.log(f'  sales invoices: {invoice_no}')
+        self.count('sales_invoices', len(sizes))
+        self.count('sales_lines', sum(sizes))
+
+    # -- challans ----------------------------------------------------------
+
+    def create_challans(self, supplier_sizes, customer_sizes):
+        """Supplier and customer challans, one per entry of the size lists"""
+        challans, items = [], []
+        for number, size in enumerate(supplier_sizes, self.counts.get('supplier_challans', 0) + 1):
+            supplier = self.rng.choice(self.suppliers)
+            day = self.random_day()
+            challan = Challan1(challan_no=f'{self.prefix}SC{number:07d}', challan_date=day, supplier=supplier)
+            for _ in range(size):
+                product, batch_no, expiry, mrp, rate = self.rng.choice(self.batches)
+                quantity = self.rng.randint(10, 100)
+                items.append(SupplierChallanMaster(
+                    product_suppliername=supplier,
+                    product_challan_id=challan,
+                    product_challan_no=challan.challan_no,
+                    product_id=product,
+                    product_name=product.product_name,
+                    product_company=product.product_company,
+                    product_packing=product.product_packing,
+                    product_batch_no=batch_no,
+                    product_expiry=expiry,
+                    product_mrp=mrp,
+                    product_purchase_rate=rate,
+                    product_quantity=quantity,
+                    actual_rate_per_qty=rate,
+                    product_actual_rate=rate,
+                    total_amount=round(rate * quantity, 2),
+                    challan_entry_date=_timestamp(day)
+                ))
+            challan.challan_total = round(sum(item.total_amount for item in items[-size:]), 2)
+            challans.append(challan)
+
+        customer_challans, customer_items = [], []
+        for number, size in enumerate(customer_sizes, self.counts.get('customer_challans', 0) + 1):
+            customer = self.rng.choice(self.customers)
+            day = self.random_day()
+            challan = CustomerChallan(customer_challan_no=f'{self.prefix}CC{number:07d}', customer_challan_date=day, customer_name=customer)
+            for _ in range(size):
+                product, batch_no, expiry, mrp, rate = self.rng.choice(self.batches)
+                quantity = self.rng.randint(1, 10)
+                sale_rate = round(mrp * 0.9, 2)
+                customer_items.append(CustomerChallanMaster(
+                    customer_challan_id=challan,
+                    customer_challan_no=challan.customer_challan_no,
+                    customer_name=customer,
+                    product_id=product,
+                    product_name=product.product_name,
+                    product_company=product.product_company,
+                    product_packing=product.product_packing,
+                    product_batch_no=batch_no,
+                    product_expiry=expiry,
+                    product_mrp=mrp,
+                    sale_rate=sale_rate,
+                    sale_quantity=quantity,
+                    sale_total_amount=round(sale_rate * quantity, 2),
+                    sales_entry_date=_timestamp(day)
+                ))
+            challan.challan_total = round(sum(item.sale_total_amount for item in customer_items[-size:]), 2)
+            customer_challans.append(challan)
+
+        with transaction.atomic():
+            Challan1.objects.bulk_create(challans, batch_size=CHUNK_SIZE)
+            self.insert_lines(SupplierChallanMaster, items)
+            CustomerChallan.objects.bulk_create(customer_challans, batch_size=CHUNK_SIZE)
+            self.insert_lines(CustomerChallanMaster, customer_items)
+        self.count('supplier_challans', len(challans))
+        self.count('customer_challans', len(customer_challans))
+
+    # -- returns -----------------------------------------------------------
+
+    def create_returns(self):
+        """One sales return per sampled sale line, plus half as many supplier returns"""
+        return_invoices, return_items = [], []
+        for number, sale in enumerate(self.sales_sample, self.counts.get('sales_returns', 0) + 1):
+            quantity = min(sale.sale_quantity, self.rng.randint(1, 3))
+            total = round(sale.sale_rate * quantity, 2)
+            day = min(sale.sales_invoice_no.sales_invoice_date + timedelta(days=self.rng.randint(1, 20)), self.end_date)
+            invoice = ReturnSalesInvoiceMaster(
+                return_sales_invoice_no=f'{self.prefix}SR{number:07d}',
+                return_sales_invoice_date=day,
+                return_sales_customerid=sale.customerid,
+                return_sales_invoice_total=total
+            )
+            return_invoices.append(invoice)
+            return_items.append(ReturnSalesMaster(
+                return_sales_invoice_no=invoice,
+                return_customerid=sale.customerid,
+                return_productid=sale.productid,
+                return_product_name=sale.product_name,
+                return_product_company=sale.product_company,
+                return_product_packing=sale.product_packing,
+                return_product_batch_no=sale.product_batch_no,
+                return_product_expiry=sale.product_expiry,
+                return_product_MRP=sale.product_MRP,
+                return_sale_rate=sale.sale_rate,
+                return_sale_quantity=quantity,
+                return_sale_total_amount=total,
+                return_reason='damaged',
+                return_sale_entry_date=_timestamp(day)
+            ))
+
+        purchase_returns, purchase_return_items = [], []
+        first = self.counts.get('purchase_returns', 0) + 1
+        for number in range(first, first + len(self.sales_sample) // 2):
+            product, batch_no, expiry, mrp, rate = self.rng.choice(self.batches)
+            supplier = self.rng.choice(self.suppliers)
+            quantity = self.rng.randint(1, 10)
+            month, year = expiry.split('-')
+            invoice = ReturnInvoiceMaster(
+                returninvoiceid=f'{self.prefix}PR{number:07d}',
+                returninvoice_date=self.random_day(),
+                returnsupplierid=supplier,
+                returninvoice_total=round(rate * quantity, 2)
+            )
+            purchase_returns.append(invoice)
+            purchase_return_items.append(ReturnPurchaseMaster(
+                returninvoiceid=invoice,
+                returnproduct_supplierid=supplier,
+                returnproductid=product,
+                returnproduct_batch_no=batch_no,
+                returnproduct_expiry=date(int(year), int(month), 1),
+                returnproduct_MRP=mrp,
+                returnproduct_purchase_rate=rate,
+                returnproduct_quantity=quantity,
+                returntotal_amount=invoice.returninvoice_total,
+                return_reason='expired',
+                returnpurchase_entry_date=invoice.returninvoice_date
+            ))
+
+        with transaction.atomic():
+            ReturnSalesInvoiceMaster.objects.bulk_create(return_invoices, batch_size=CHUNK_SIZE)
+            ReturnSalesMaster.objects.bulk_create(return_items, batch_size=CHUNK_SIZE)
+            ReturnInvoiceMaster.objects.bulk_create(purchase_returns, batch_size=CHUNK_SIZE)
+            ReturnPurchaseMaster.objects.bulk_create(purchase_return_items, batch_size=CHUNK_SIZE)
+        self.count('sales_returns', len(return_invoices))
+        self.count('purchase_returns', len(purchase_returns))
+        self.sales_sample = []
+
+
+    def finish(self):
+        """Rebuild the stored balances and the inventory cache, set-wise"""
+        self.log('Rebuilding balances and inventory cache...')
+        refresh_purchase_invoice_balances()
+        refresh_sales_invoice_balances()
+        self.counts['cache'] = rebuild_cache_setwise()
+        return self.counts
+
+
+def delete_generated(prefix):
+    """
+    Remove the rows a DatasetBuilder wrote with this prefix (documents first,
+    then batch rates and masters). Run inside signals_disabled() and rebuild
+    the caches afterwards.
+
+    Returns:
+        number of rows deleted, cascades included
+    """
+    querysets = [
+        InvoiceMaster.objects.filter(invoice_no__startswith=f'{prefix}P'),
+        SalesInvoiceMaster.objects.filter(sales_invoice_no__startswith=f'{prefix}S'),
+        Challan1.objects.filter(challan_no__startswith=f'{prefix}SC'),
+        CustomerChallan.objects.filter(customer_challan_no__startswith=f'{prefix}CC'),
+        ReturnSalesInvoiceMaster.objects.filter(return_sales_invoice_no__startswith=f'{prefix}SR'),
+        ReturnInvoiceMaster.objects.filter(returninvoiceid__startswith=f'{prefix}PR'),
+        SaleRateMaster.objects.filter(product_batch_no__startswith=prefix),
+        ProductMaster.objects.filter(product_name__contains=f' {prefix}-'),
+        SupplierMaster.objects.filter(supplier_name__startswith=f'{prefix} Supplier '),
+        CustomerMaster.objects.filter(customer_name__startswith=f'{prefix} Customer '),
+    ]
+    deleted = 0
+    with transaction.atomic():
+        for queryset in querysets:
+            deleted += queryset.delete()[0]
+    return deleted
+
+
+def seed_dataset(products=200, lines=6000, seed=42, end_date=None, log=None):
+    """
+    Write the benchmark dataset into the current database.
+
+    Args:
+        products: number of products (1-4 batches each)
+        lines: purchase + sales line items (one third purchases)
+        seed: random seed - same seed, same rows
+        end_date: last day of the generated history (default today)
+        log: optional callable for progress messages
+
+    Returns:
+        dict of row counts per entity
+    """
+    builder = DatasetBuilder(seed=seed, end_date=end_date, log=log)
+    purchase_lines, sales_lines = _split_lines(lines)
+    challan_lines = max(lines // 20, 2)
+
+    builder.log('Creating suppliers, customers and products...')
+    builder.create_parties(max(products // 40, 5), max(products // 10, 10))
+    builder.create_products(products)
+    builder.create_batches()
+    builder.log(f'Creating {purchase_lines} purchase lines...')
+    builder.create_purchases(builder.invoice_sizes(purchase_lines))
+    builder.log(f'Creating {sales_lines} sales lines...')
+    builder.create_sales(builder.invoice_sizes(sales_lines))
+    builder.log('Creating challans and returns...')
+    builder.create_challans(
+        builder.invoice_sizes(challan_lines // 2), builder.invoice_sizes(challan_lines - challan_lines // 2)
+    )
+    builder.create_returns()
+    return builder.finish()
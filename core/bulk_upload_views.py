@@ -1,17 +1,25 @@
 import csv
 import io
+import math
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, HttpResponseRedirect
 from .models import ProductMaster
-from django.core.paginator import Paginator
+from .change_log import record_changes
 try:
     from openpyxl import Workbook, load_workbook
     EXCEL_SUPPORT = True
 except ImportError:
     EXCEL_SUPPORT = False
 
+PRODUCT_COLUMNS = ['product_name', 'product_company', 'product_packing', 'product_category', 'product_barcode']
+MAX_LENGTHS = {'product_name': 200, 'product_company': 200, 'product_packing': 20,
+               'product_category': 30, 'product_barcode': 50}
+UPSERT_FIELDS = ['product_name', 'product_company', 'product_packing', 'product_category']
+CHUNK_SIZE = 2000
+PRODUCTS_PER_PAGE = 50
+
 @login_required
 def bulk_upload_products(request):
     if request.method == 'POST':
@@ -23,47 +31,27 @@ def bulk_upload_products(request):
         
         try:
             if file.name.endswith('.csv'):
-                products = process_csv_file(file)
+                rows = process_csv_file(file)
             elif file.name.endswith(('.xlsx', '.xls')):
-                products = process_excel_file(file)
+                rows = process_excel_file(file)
             else:
                 messages.error(request, 'Invalid file format. Please upload CSV or Excel file')
                 return redirect('bulk_upload_products')
             
-            success_count = 0
-            error_count = 0
-            errors = []
+            result = import_products(rows)
             
-            for idx, product_data in enumerate(products, start=2):
-                try:
-                    ProductMaster.objects.create(
-                        product_name=product_data['product_name'],
-                        product_company=product_data['product_company'],
-                        product_packing=product_data['product_packing'],
-                        product_category=product_data['product_category'],
-                        product_salt='N/A',
-                        product_hsn='N/A',
-                        product_hsn_percent='0',
-                        product_barcode=product_data.get('product_barcode', '') or None
-                    )
-                    success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    errors.append(f"Row {idx}: {str(e)[:100]}")
+            if result['created'] or result['updated']:
+                messages.success(request, f"Successfully uploaded {result['created']} new products, updated {result['updated']} existing products")
             
-            if success_count > 0:
-                messages.success(request, f'Successfully uploaded {success_count} products')
+            if result['duplicates']:
+                messages.info(request, f"{result['duplicates']} duplicate rows in the file were skipped")
             
-            if error_count > 0:
-                error_msg = f'{error_count} products failed. ' + '; '.join(errors[:5])
+            if result['errors']:
+                error_msg = f"{len(result['errors'])} products failed. " + '; '.join(result['errors'][:5])
                 messages.warning(request, error_msg)
             
             # Redirect to last page with ID sorting to show newly added products
-            all_products = ProductMaster.objects.all().order_by('productid')
-            paginator = Paginator(all_products, 50)
-            last_page = paginator.num_pages
-            
-            from django.http import HttpResponseRedirect
+            last_page = max(1, math.ceil(ProductMaster.objects.count() / PRODUCTS_PER_PAGE))
             return HttpResponseRedirect(f'/products/?sort=productid&page={last_page}')
             
         except Exception as e:
@@ -72,44 +60,157 @@ def bulk_upload_products(request):
     
     return render(request, 'products/bulk_upload_products.html')
 
+def _clean_row(values):
+    """Row dict with stripped strings for every product column"""
+    return {
+        column: '' if values.get(column) is None else str(values.get(column)).strip()
+        for column in PRODUCT_COLUMNS
+    }
+
 def process_csv_file(file):
-    decoded_file = file.read().decode('utf-8').splitlines()
-    reader = csv.DictReader(decoded_file)
-    products = []
-    
-    for row in reader:
-        if row.get('product_name') and row.get('product_name').strip():  # Skip empty rows
-            products.append({
-                'product_name': row['product_name'].strip(),
-                'product_company': row['product_company'].strip(),
-                'product_packing': row['product_packing'].strip(),
-                'product_category': row['product_category'].strip(),
-                'product_barcode': row.get('product_barcode', '').strip()
-            })
+    """Yield (row number, product dict) from a CSV upload without loading it into memory"""
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [(name or '').strip().lower() for name in reader.fieldnames or []]
     
-    return products
+    for idx, row in enumerate(reader, start=2):
+        row = _clean_row(row)
+        if row['product_name']:  # Skip empty rows
+            yield idx, row
 
 def process_excel_file(file):
+    """Yield (row number, product dict) from the first sheet, read-only so rows stream from the file"""
     if not EXCEL_SUPPORT:
         raise Exception('Excel support not available. Please install openpyxl: pip install openpyxl')
     
-    wb = load_workbook(file)
-    ws = wb.active
-    products = []
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        headers = [str(cell or '').strip().lower() for cell in next(rows, ())]
+        if 'product_name' not in headers:
+            headers = PRODUCT_COLUMNS  # no header row names - use the template's column order
+        
+        for idx, row in enumerate(rows, start=2):
+            row = _clean_row(dict(zip(headers, row)))
+            if row['product_name']:  # Skip empty rows
+                yield idx, row
+    finally:
+        wb.close()
+
+def _name_key(row):
+    return (row['product_name'].lower(), row['product_company'].lower())
+
+def import_products(rows, chunk_size=CHUNK_SIZE):
+    """
+    Upsert products from (row number, product dict) pairs.
+    A row matches an existing product by barcode, or by name + company when it
+    has no barcode (or the barcode is new and the matched product has none);
+    matches are updated, everything else is inserted. Rows earlier in the file
+    count as existing products: a repeated barcode, or a repeated name +
+    company without a barcode, is skipped (the first one wins), and a barcode
+    for a name + company the file inserted without one is given to that row.
+    Returns {'created', 'updated', 'duplicates', 'errors'}.
+    """
+    by_barcode = {}
+    by_name = {}
+    for productid, name, company, barcode in ProductMaster.objects.values_list(
+        'productid', 'product_name', 'product_company', 'product_barcode'
+    ).iterator(chunk_size=chunk_size):
+        if barcode:
+            by_barcode[barcode] = productid
+        by_name.setdefault((name.strip().lower(), company.strip().lower()), (productid, barcode))
+    
+    seen = set()
+    new_products = {}  # name + company -> product the file inserted without a barcode
+    result = {'created': 0, 'updated': 0, 'duplicates': 0, 'errors': []}
+    upserts, inserts, updates = [], [], []
     
-    headers = [cell.value for cell in ws[1]]
+    def flush():
+        if upserts:
+            ProductMaster.objects.bulk_create(
+                upserts, update_conflicts=True,
+                unique_fields=['product_barcode'], update_fields=UPSERT_FIELDS
+            )
+            # Upserts do not return primary keys - look them up by barcode
+            record_changes(ProductMaster, ProductMaster.objects.filter(
+                product_barcode__in=[product.product_barcode for product in upserts]
+            ).values_list('productid', flat=True))
+        if inserts:
+            ProductMaster.objects.bulk_create(inserts)
+            record_changes(ProductMaster, [product.pk for product in inserts])
+        if updates:
+            # Upsert on the primary key: one INSERT .. ON CONFLICT instead of a CASE per field
+            ProductMaster.objects.bulk_create(
+                updates, update_conflicts=True,
+                unique_fields=['productid'], update_fields=UPSERT_FIELDS + ['product_barcode']
+            )
+            record_changes(ProductMaster, [product.pk for product in updates])
+        upserts.clear()
+        inserts.clear()
+        updates.clear()
     
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row[0]:  # Skip empty rows
-            products.append({
-                'product_name': str(row[0]).strip(),
-                'product_company': str(row[1]).strip(),
-                'product_packing': str(row[2]).strip(),
-                'product_category': str(row[3]).strip(),
-                'product_barcode': str(row[4] if len(row) > 4 and row[4] else '').strip()
-            })
+    for idx, row in rows:
+        too_long = [column for column, limit in MAX_LENGTHS.items() if len(row[column]) > limit]
+        if too_long:
+            result['errors'].append(f"Row {idx}: {', '.join(too_long)} too long")
+            continue
+        if not row['product_company'] or not row['product_packing']:
+            result['errors'].append(f"Row {idx}: product_company and product_packing are required")
+            continue
+        
+        barcode = row['product_barcode'] or None
+        name_key = _name_key(row)
+        file_key = barcode or name_key
+        if file_key in seen:
+            result['duplicates'] += 1
+            continue
+        seen.update((file_key, name_key))
+        
+        product = ProductMaster(
+            product_name=row['product_name'],
+            product_company=row['product_company'],
+            product_packing=row['product_packing'],
+            product_category=row['product_category'],
+            product_salt='N/A',
+            product_hsn='N/A',
+            product_hsn_percent='0',
+            product_barcode=barcode
+        )
+        existing_id, existing_barcode = by_name.get(name_key, (None, None))
+        
+        if barcode and barcode in by_barcode:
+            upserts.append(product)
+            result['updated'] += 1
+        elif name_key in new_products:
+            # Inserted earlier in this file without a barcode: it takes this one
+            product = new_products.pop(name_key)
+            product.product_barcode = barcode
+            if product.pk is not None:
+                updates.append(product)  # already written by flush()
+            by_barcode[barcode] = product.pk
+            result['updated'] += 1
+        elif existing_id and not (barcode and existing_barcode):
+            # Same name + company: update it, giving it the barcode if it had none
+            product.productid = existing_id
+            product.product_barcode = barcode or existing_barcode
+            updates.append(product)
+            by_name[name_key] = (existing_id, product.product_barcode)
+            result['updated'] += 1
+        elif barcode:
+            upserts.append(product)
+            by_barcode[barcode] = None
+            result['created'] += 1
+        else:
+            inserts.append(product)
+            new_products[name_key] = product
+            result['created'] += 1
+        
+        if len(upserts) + len(inserts) + len(updates) >= chunk_size:
+            flush()
     
-    return products
+    flush()
+    return result
 
 @login_required
 def download_product_template(request):
@@ -7,6 +7,9 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.db.models import Q
 from core.year_filter_utils import apply_year_filter
+import logging
+
+logger = logging.getLogger(__name__)
 
 @login_required
 def supplier_challan_list(request):
@@ -113,7 +116,7 @@ def add_supplier_challan(request):
                     
                     # REMOVED: Inventory tracking - no longer needed
                     # Inventory is now tracked through PurchaseMaster and SalesMaster tables
-                    print(f"✅ SUPPLIER CHALLAN: Added {qty} units of {product.product_name} (Batch: {batch_no}) to challan {challan_no}")
+                    logger.debug('Supplier challan %s: added %s units of %s (batch %s)', challan_no, qty, product.product_name, batch_no)
                     
                     # Update sale rates if provided
                     rate_A = product_data.get('rate_A')
@@ -135,9 +138,7 @@ def add_supplier_challan(request):
                 return redirect('supplier_challan_list')
                 
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"ERROR in challan creation: {error_details}")
+            logger.exception('Supplier challan creation failed')
             messages.error(request, f'Error: {str(e)}')
             return redirect('add_supplier_challan')
     
@@ -239,9 +240,7 @@ def view_supplier_challan(request, challan_id):
                 return JsonResponse({'success': True, 'message': 'Challan updated successfully'})
                 
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"ERROR updating supplier challan: {error_details}")
+            logger.exception('Supplier challan update failed')
             return JsonResponse({'success': False, 'error': str(e)})
     
     # GET request - show details
@@ -495,15 +494,13 @@ def add_customer_challan(request):
                     
                     # REMOVED: Inventory tracking - no longer needed
                     # Stock is now tracked through SalesMaster table
-                    print(f"✅ CUSTOMER CHALLAN: Added {qty} units of {product.product_name} (Batch: {batch_no}) to challan {challan_no}")
+                    logger.debug('Customer challan %s: added %s units of %s (batch %s)', challan_no, qty, product.product_name, batch_no)
                 
                 messages.success(request, f'Customer Challan {challan_no} created successfully! Inventory updated.')
                 return redirect('view_customer_challan', challan_id=challan.customer_challan_id)
                 
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"ERROR in customer challan creation: {error_details}")
+            logger.exception('Customer challan creation failed')
             messages.error(request, f'Error: {str(e)}')
             return redirect('add_customer_challan')
     
@@ -604,9 +601,7 @@ def view_customer_challan(request, challan_id):
                 return JsonResponse({'success': True, 'message': 'Challan updated successfully'})
                 
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"ERROR updating customer challan: {error_details}")
+            logger.exception('Customer challan update failed')
             return JsonResponse({'success': False, 'error': str(e)})
     
     # GET request - show details
@@ -881,6 +876,8 @@ def create_customer_invoice_from_challans(request):
                     )
             
             # Mark selected challans as invoiced
+            from .change_log import record_changes
+            record_changes(CustomerChallan, list(challans.values_list('pk', flat=True)))
             challans.update(is_invoiced=True)
             
             return JsonResponse({
@@ -0,0 +1,94 @@
+"""
+Change log for incremental backups
+Every save / delete of a core model writes one ChangeLog row (post_save /
+post_delete, connected per model by connect_receivers() from CoreConfig.ready()).
+Code that writes with bulk_create or queryset.update(),
+which send no signals, calls record_changes() itself.
+
+Cache tables and stored balances are left out - they are rebuilt from the
+transaction tables after an incremental restore (see backup_service).
+"""
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from .models import ChangeLog
+
+
+# Rebuilt after a restore, never backed up incrementally
+DERIVED_MODELS = {
+    'core.changelog', 'core.productinventorycache', 'core.batchinventorycache', 'core.reordersuggestion',
+}
+
+
+def is_tracked(model):
+    meta = model._meta
+    return (
+        getattr(settings, 'CHANGE_LOG_ENABLED', True)
+        and meta.app_label == 'core'
+        and meta.managed and not meta.proxy
+        and meta.label_lower not in DERIVED_MODELS
+    )
+
+
+def record_changes(model, pks, action='save'):
+    """Log rows written without signals (bulk_create / queryset.update)"""
+    if not is_tracked(model):
+        return 0
+    label = model._meta.label_lower
+    rows = [ChangeLog(model=label, object_pk=str(pk), action=action) for pk in pks if pk is not None]
+    ChangeLog.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def current_watermark():
+    """Id of the newest change log row (0 when empty)"""
+    last = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+    return last or 0
+
+
+def log_save(sender, instance, raw=False, **kwargs):
+    # raw: loaddata / backup replay - not a change made in this database
+    if raw:
+        return
+    ChangeLog.objects.create(model=sender._meta.label_lower, object_pk=str(instance.pk), action='save')
+
+
+def log_delete(sender, instance, **kwargs):
+    ChangeLog.objects.create(model=sender._meta.label_lower, object_pk=str(instance.pk), action='delete')
+
+
+def tracked_models():
+    return [model for model in apps.get_app_config('core').get_models() if is_tracked(model)]
+
+
+def connect_receivers():
+    """
+    Connect the receivers to each tracked model. With a sender they skip the
+    migration state models (whose tables may not exist yet), and untracked
+    models keep Django's fast queryset delete.
+    """
+    for model in tracked_models():
+        post_save.connect(log_save, sender=model, dispatch_uid=f'change_log_save_{model._meta.label_lower}')
+        post_delete.connect(log_delete, sender=model, dispatch_uid=f'change_log_delete_{model._meta.label_lower}')
+
+
+def disconnect_receivers():
+    for model in tracked_models():
+        post_save.disconnect(sender=model, dispatch_uid=f'change_log_save_{model._meta.label_lower}')
+        post_delete.disconnect(sender=model, dispatch_uid=f'change_log_delete_{model._meta.label_lower}')
+
+
+@contextmanager
+def change_log_suspended():
+    """
+    Stop the per-row receivers during a bulk delete (archive_service); the
+    caller records what it changed with record_changes() instead.
+    """
+    disconnect_receivers()
+    try:
+        yield
+    finally:
+        connect_receivers()
@@ -4,39 +4,27 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db import transaction
-from django.db.models import Sum, Q
-from .models import ProductMaster, SupplierMaster, PurchaseMaster, SaleRateMaster, InvoiceMaster, SalesMaster, Challan1, SupplierChallanMaster, SupplierChallanMaster2
+from django.db.models import Q
+from .models import ProductMaster, SupplierMaster, PurchaseMaster, SaleRateMaster, InvoiceMaster, Challan1, SupplierChallanMaster, SupplierChallanMaster2
 from .forms import InvoiceForm
-from .stock_manager import StockManager
 import logging
 from datetime import datetime, timedelta
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Simple file logging for debugging
-import os
-log_file = os.path.join(os.path.dirname(__file__), 'invoice_debug.log')
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
 @login_required
 def add_invoice_with_products(request):
     if request.method == 'POST':
         try:
             # Debug: Log the POST data
-            logger.info(f"POST data received: {request.POST}")
+            logger.debug('POST data received: %s', request.POST)
             
             # Handle form submission
             invoice_form = InvoiceForm(request.POST)
             
             # Debug: Check form validation
             if not invoice_form.is_valid():
-                logger.error(f"Invoice form validation errors: {invoice_form.errors}")
+                logger.error('Invoice form validation errors: %s', invoice_form.errors)
                 messages.error(request, f"Invoice form validation failed: {invoice_form.errors}")
                 # Return to form with errors
                 suppliers = SupplierMaster.objects.all().order_by('supplier_name')
@@ -54,18 +42,18 @@ def add_invoice_with_products(request):
             challan_flag = request.POST.get('is_from_challan', 'false').lower()
             is_from_challan = challan_flag == 'true'
             is_mixed_mode = challan_flag == 'mixed'
-            logger.info(f"Products data received: {products_data}")
-            logger.info(f"Challan flag: {challan_flag}")
+            logger.debug('Products data received: %s', products_data)
+            logger.debug('Challan flag: %s', challan_flag)
             
             # Allow invoice creation without products - just log it
             if not products_data or products_data.strip() == '' or products_data.strip() == '[]':
-                logger.info("Invoice being created without products - header only")
+                logger.debug("Invoice being created without products - header only")
                 products_data = '[]'  # Set empty array for processing
             
             try:
                 products = json.loads(products_data)
             except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
+                logger.error('JSON decode error: %s', e)
                 messages.error(request, "Invalid products data format. Please try again.")
                 suppliers = SupplierMaster.objects.all().order_by('supplier_name')
                 products_list = ProductMaster.objects.all().order_by('product_name')
@@ -89,12 +77,12 @@ def add_invoice_with_products(request):
                     if product_id and batch_no and quantity > 0:
                         valid_products.append(product)
                 except (ValueError, TypeError) as e:
-                    logger.warning(f"Error validating product: {e}")
+                    logger.warning('Error validating product: %s', e)
                     continue
             
             # Log if no valid products but continue with invoice creation
             if not valid_products:
-                logger.info("Creating invoice without valid products - header only invoice")
+                logger.debug("Creating invoice without valid products - header only invoice")
                 valid_products = []  # Empty list for processing
             
             # Use valid products for processing
@@ -106,7 +94,7 @@ def add_invoice_with_products(request):
                 invoice = invoice_form.save(commit=False)
                 invoice.invoice_paid = 0
                 invoice.save()
-                logger.info(f"Invoice created with ID: {invoice.invoiceid}")
+                logger.debug('Invoice created with ID: %s', invoice.invoiceid)
                 
                 total_amount = 0
                 products_added = 0
@@ -229,11 +217,11 @@ def add_invoice_with_products(request):
                             challan_no = product_data.get('challan_no', '')
                             challan_date_str = product_data.get('challan_date', '')
                             
-                            logger.info(f"Challan data received: challan_no={challan_no}, challan_date={challan_date_str}")
+                            logger.debug('Challan data received: challan_no=%s, challan_date=%s', challan_no, challan_date_str)
                             
                             if challan_no and str(challan_no).strip():
                                 purchase.source_challan_no = str(challan_no).strip()
-                                logger.info(f"Set source_challan_no: {purchase.source_challan_no}")
+                                logger.debug('Set source_challan_no: %s', purchase.source_challan_no)
                             else:
                                 purchase.source_challan_no = None
                             
@@ -245,12 +233,12 @@ def add_invoice_with_products(request):
                                     for fmt in ['%d-%m-%Y', '%Y-%m-%d', '%d/%m/%Y']:
                                         try:
                                             purchase.source_challan_date = datetime.strptime(date_str, fmt).date()
-                                            logger.info(f"Set source_challan_date: {purchase.source_challan_date}")
+                                            logger.debug('Set source_challan_date: %s', purchase.source_challan_date)
                                             break
                                         except ValueError:
                                             continue
                                 except Exception as e:
-                                    logger.warning(f"Error parsing challan date '{challan_date_str}': {e}")
+                                    logger.warning('Error parsing challan date %r: %s', challan_date_str, e)
                                     purchase.source_challan_date = None
                             else:
                                 purchase.source_challan_date = None
@@ -265,9 +253,9 @@ def add_invoice_with_products(request):
                                 purchase.rate_b = float(str(rate_b_val)) if rate_b_val else 0.0
                                 purchase.rate_c = float(str(rate_c_val)) if rate_c_val else 0.0
                                 
-                                logger.info(f"Setting rates for {product.product_name}: A={purchase.rate_a}, B={purchase.rate_b}, C={purchase.rate_c}")
+                                logger.debug('Setting rates for %s: A=%s, B=%s, C=%s', product.product_name, purchase.rate_a, purchase.rate_b, purchase.rate_c)
                             except (ValueError, TypeError) as e:
-                                logger.warning(f"Error converting rates for {product.product_name}: {e}")
+                                logger.warning('Error converting rates for %s: %s', product.product_name, e)
                                 purchase.rate_a = 0.0
                                 purchase.rate_b = 0.0
                                 purchase.rate_c = 0.0
@@ -299,12 +287,12 @@ def add_invoice_with_products(request):
                             purchase.product_transportation_charges = 0  # Will be calculated later
                             
                             total_amount += purchase.total_amount
-                            logger.info(f"Product {product.product_name}: Base={base_amount}, CGST={cgst_amount}, SGST={sgst_amount}, Total={purchase.total_amount}")
+                            logger.debug('Product %s: Base=%s, CGST=%s, SGST=%s, Total=%s', product.product_name, base_amount, cgst_amount, sgst_amount, purchase.total_amount)
                             purchase.save()
                             products_added += 1
-                            logger.info(f"Product {product.product_name} added to invoice")
+                            logger.debug('Product %s added to invoice', product.product_name)
                             
-                            logger.info(f"PURCHASE CREATED: {product.product_name}, Batch: {batch_no}, Qty: {quantity}")
+                            logger.debug('PURCHASE CREATED: %s, Batch: %s, Qty: %s', product.product_name, batch_no, quantity)
                             
                             # Save sale rates if provided
                             rate_A = product_data.get('rate_a') or product_data.get('rate_A')
@@ -323,22 +311,19 @@ def add_invoice_with_products(request):
                                         }
                                     )
                                 except (ValueError, TypeError):
-                                    logger.warning(f"Invalid sale rates for {product.product_name}, skipping rate setup")
+                                    logger.warning('Invalid sale rates for %s, skipping rate setup', product.product_name)
                             
                         except ProductMaster.DoesNotExist:
                             errors.append(f"Row {i+1}: Product with ID {product_data['productid']} not found")
                             continue
                         except Exception as e:
-                            import traceback
-                            error_trace = traceback.format_exc()
                             errors.append(f"Row {i+1}: Error processing product: {str(e)}")
-                            logger.error(f"Error processing product {i+1}: {e}")
-                            logger.error(f"Full traceback: {error_trace}")
+                            logger.exception('Error processing product %s', i + 1)
                             continue
                 
                 # Allow invoice creation even without products
                 if products_added == 0:
-                    logger.info(f"Invoice {invoice.invoice_no} created without products - header only")
+                    logger.debug('Invoice %s created without products - header only', invoice.invoice_no)
                     if errors:
                         # Show errors as warnings but don't prevent invoice creation
                         for error in errors[:3]:  # Show first 3 errors
@@ -351,7 +336,7 @@ def add_invoice_with_products(request):
                 # Invoice total = products total + transport charges
                 invoice.invoice_total = total_amount + transport_charges_val
                 invoice.save()
-                logger.info(f"Products total: {total_amount}, Transport: {transport_charges_val}, Invoice total: {invoice.invoice_total}")
+                logger.debug('Products total: %s, Transport: %s, Invoice total: %s', total_amount, transport_charges_val, invoice.invoice_total)
                 
                 # Move challan entries to SupplierChallanMaster2 if pulled from challan
                 if is_from_challan or is_mixed_mode:
@@ -399,12 +384,12 @@ def add_invoice_with_products(request):
                                     # Delete from SupplierChallanMaster
                                     entry.delete()
                                     moved_count += 1
-                                    logger.info(f"Moved challan entry to SupplierChallanMaster2: {entry.product_name} - {entry.product_batch_no}")
+                                    logger.debug('Moved challan entry to SupplierChallanMaster2: %s - %s', entry.product_name, entry.product_batch_no)
                             except Exception as e:
-                                logger.error(f"Error moving challan entry: {e}")
+                                logger.error('Error moving challan entry: %s', e)
                     
                     if moved_count > 0:
-                        logger.info(f"Total {moved_count} challan entries moved to SupplierChallanMaster2")
+                        logger.debug('Total %s challan entries moved to SupplierChallanMaster2', moved_count)
                 
                 # Show any non-critical errors as warnings
                 if errors:
@@ -418,19 +403,12 @@ def add_invoice_with_products(request):
                     success_msg = f"Purchase Invoice #{invoice.invoice_no} created successfully (header only)!"
                 
                 messages.success(request, success_msg)
-                logger.info(f"Invoice {invoice.invoice_no} created successfully with {products_added} products")
+                logger.info('Invoice %s created successfully with %s products', invoice.invoice_no, products_added)
                 return redirect('invoice_detail', pk=invoice.invoiceid)
                 
         except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            logger.error(f"Unexpected error creating invoice: {e}")
-            logger.error(f"Full error traceback: {error_trace}")
+            logger.exception('Unexpected error creating invoice')
             messages.error(request, f"Error creating invoice: {str(e)}")
-            print(f"\n\n=== INVOICE CREATION ERROR ===")
-            print(f"Error: {e}")
-            print(f"Traceback:\n{error_trace}")
-            print(f"=== END ERROR ===")
             # Return to form
             suppliers = SupplierMaster.objects.all().order_by('supplier_name')
             products = ProductMaster.objects.all().order_by('product_name')
@@ -467,9 +445,11 @@ def get_existing_batches(request):
         if not product_id:
             return JsonResponse({'success': False, 'error': 'Product ID required'})
         
-        from .stock_manager import StockManager
-        from .models import ReturnPurchaseMaster, ReturnSalesMaster, SupplierChallanMaster
+        from .models import SupplierChallanMaster
+        from .stock_service import balances_for
         
+        # Stock of every batch of the product (core/stock_service.py)
+        stock = {batch_no: quantity for (_, batch_no), quantity in balances_for([product_id], level='batch').items()}
         batches_dict = {}
         
         # 1. Get batches from PurchaseMaster
@@ -479,23 +459,7 @@ def get_existing_batches(request):
         
         for batch in purchase_batches:
             batch_no = batch['product_batch_no']
-            try:
-                batch_stock_info = StockManager._get_batch_stock(product_id, batch_no)
-                current_stock = batch_stock_info['batch_stock']
-            except Exception:
-                total_purchased = PurchaseMaster.objects.filter(
-                    productid=product_id, product_batch_no=batch_no
-                ).aggregate(total=Sum('product_quantity'))['total'] or 0
-                total_sold = SalesMaster.objects.filter(
-                    productid=product_id, product_batch_no=batch_no
-                ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-                purchase_returns = ReturnPurchaseMaster.objects.filter(
-                    returnproductid=product_id, returnproduct_batch_no=batch_no
-                ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-                sales_returns = ReturnSalesMaster.objects.filter(
-                    return_productid=product_id, return_product_batch_no=batch_no
-                ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-                current_stock = total_purchased - total_sold - purchase_returns + sales_returns
+            current_stock = stock.get(batch_no, 0)
             
             if current_stock >= 0:
                 latest_purchase = PurchaseMaster.objects.filter(
@@ -537,20 +501,7 @@ def get_existing_batches(request):
             if batch_no in batches_dict:
                 continue
             
-            try:
-                batch_stock_info = StockManager._get_batch_stock(product_id, batch_no)
-                current_stock = batch_stock_info['batch_stock']
-            except Exception:
-                total_challan = SupplierChallanMaster.objects.filter(
-                    product_id=product_id, product_batch_no=batch_no
-                ).aggregate(total=Sum('product_quantity'))['total'] or 0
-                total_sold = SalesMaster.objects.filter(
-                    productid=product_id, product_batch_no=batch_no
-                ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-                sales_returns = ReturnSalesMaster.objects.filter(
-                    return_productid=product_id, return_product_batch_no=batch_no
-                ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-                current_stock = total_challan - total_sold + sales_returns
+            current_stock = stock.get(batch_no, 0)
             
             if current_stock >= 0:
                 latest_challan = SupplierChallanMaster.objects.filter(
@@ -763,7 +714,7 @@ def get_supplier_challans(request):
         })
         
     except Exception as e:
-        logger.error(f"Error fetching supplier challans: {e}")
+        logger.error('Error fetching supplier challans: %s', e)
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -842,7 +793,7 @@ def get_challan_products(request):
         })
         
     except Exception as e:
-        logger.error(f"Error fetching challan products: {e}")
+        logger.error('Error fetching challan products: %s', e)
         return JsonResponse({
             'success': False,
             'error': str(e)
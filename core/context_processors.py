@@ -1,13 +1,20 @@
-from core.year_filter_utils import get_current_financial_year
+from core.opening_balances import year_state
+from core.year_filter_utils import get_current_financial_year, get_selected_year
 
 def year_context(request):
     """Add financial year context to all templates"""
     current_fy = get_current_financial_year()
     year_range = range(2012, current_fy + 1)
-    selected_year = request.session.get('selected_year', current_fy)
+    selected_year = get_selected_year(request)
+    state = year_state(request)
+    archived_years = state['archived_years']
+    first_open_year = state['opening_year']
     
     return {
         'year_range': reversed(year_range),
         'selected_year': selected_year,
-        'current_financial_year': current_fy
+        'current_financial_year': current_fy,
+        'archived_years': archived_years,
+        'selected_year_archived': selected_year in archived_years,
+        'selected_year_closed': first_open_year is not None and selected_year < first_open_year,
     }
@@ -1,7 +1,8 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
-from django.db.models import Sum, Q
+from django.db.models import Sum, Q, Value, Prefetch
+from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator
 from django.template.loader import render_to_string
 from .models import SalesMaster, CustomerMaster, SalesInvoiceMaster, CustomerChallanMaster
@@ -14,6 +15,98 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.units import inch
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _customer_sales_invoices(customer, from_date, to_date, with_items=False):
+    """
+    Sales invoices of a customer in a date range with per-invoice totals
+    aggregated in the database. With with_items=True the invoice lines are
+    loaded with one Prefetch query into invoice.items.
+    """
+    invoices = SalesInvoiceMaster.objects.filter(
+        customerid=customer,
+        sales_invoice_date__range=[from_date, to_date]
+    ).annotate(
+        invoice_total=Coalesce(Sum('salesmaster__sale_total_amount'), Value(0.0)),
+        invoice_qty=Coalesce(Sum('salesmaster__sale_quantity'), Value(0.0)),
+    ).order_by('-sales_invoice_date', '-sales_invoice_no')
+    
+    if with_items:
+        invoices = invoices.prefetch_related(Prefetch(
+            'salesmaster_set',
+            queryset=SalesMaster.objects.only(
+                'id', 'sales_invoice_no', 'product_name', 'product_batch_no',
+                'sale_quantity', 'sale_rate', 'sale_total_amount'
+            ).order_by('id'),
+            to_attr='items'
+        ))
+    return invoices
+
+
+def _customer_sales_challans(customer, from_date, to_date):
+    """Customer challan lines of a customer in a date range"""
+    return CustomerChallanMaster.objects.filter(
+        customer_name=customer,
+        sales_entry_date__date__range=[from_date, to_date]
+    ).only(
+        'customer_challan_master_id', 'customer_challan_no', 'sales_entry_date',
+        'product_name', 'product_batch_no', 'sale_quantity', 'sale_rate', 'sale_total_amount'
+    ).order_by('-sales_entry_date')
+
+
+def _customer_sales_summary(customer, from_date, to_date):
+    """Report totals computed with DB aggregation (no per-invoice loops)"""
+    invoice_totals = SalesMaster.objects.filter(
+        sales_invoice_no__customerid=customer,
+        sales_invoice_no__sales_invoice_date__range=[from_date, to_date]
+    ).aggregate(
+        total_amount=Sum('sale_total_amount'),
+        total_quantity=Sum('sale_quantity')
+    )
+    total_invoices = SalesInvoiceMaster.objects.filter(
+        customerid=customer,
+        sales_invoice_date__range=[from_date, to_date]
+    ).count()
+    challan_totals = _customer_sales_challans(customer, from_date, to_date).aggregate(
+        total_amount=Sum('sale_total_amount'),
+        total_quantity=Sum('sale_quantity')
+    )
+    
+    total_amount = invoice_totals['total_amount'] or 0
+    total_quantity = invoice_totals['total_quantity'] or 0
+    challan_amount = challan_totals['total_amount'] or 0
+    challan_quantity = challan_totals['total_quantity'] or 0
+    
+    return {
+        'total_invoices': total_invoices,
+        'total_amount': total_amount,
+        'total_quantity': total_quantity,
+        'challan_amount': challan_amount,
+        'challan_quantity': challan_quantity,
+        'grand_total': total_amount + challan_amount,
+        'grand_quantity': total_quantity + challan_quantity
+    }
+
+
+def _invoice_row(invoice):
+    """Row dict used by the report template and the export functions"""
+    return {
+        'invoice': invoice,
+        'items': getattr(invoice, 'items', []),
+        'invoice_total': invoice.invoice_total,
+        'invoice_qty': invoice.invoice_qty,
+        'balance_due': invoice.invoice_total - invoice.sales_invoice_paid
+    }
+
+
+def _iter_customer_sales(customer, from_date, to_date):
+    """Stream invoices with their lines in chunks for the exports"""
+    invoices = _customer_sales_invoices(customer, from_date, to_date, with_items=True)
+    for invoice in invoices.iterator(chunk_size=500):
+        yield _invoice_row(invoice)
+
 
 @login_required
 def customer_wise_sales_report(request):
@@ -44,27 +137,10 @@ def customer_wise_sales_report(request):
                 from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
                 to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
                 
-                # Get sales data for export
-                sales_invoices = SalesInvoiceMaster.objects.filter(
-                    customerid=customer,
-                    sales_invoice_date__range=[from_date_obj, to_date_obj]
-                ).order_by('-sales_invoice_date')
-                
-                sales_data = []
-                for invoice in sales_invoices:
-                    invoice_items = SalesMaster.objects.filter(sales_invoice_no=invoice).select_related('productid')
-                    invoice_total = sum(item.sale_total_amount for item in invoice_items)
-                    sales_data.append({
-                        'invoice': invoice,
-                        'items': invoice_items,
-                        'invoice_total': invoice_total
-                    })
-                
-                # Get customer challans
-                customer_challans = list(CustomerChallanMaster.objects.filter(
-                    customer_name=customer,
-                    sales_entry_date__date__range=[from_date_obj, to_date_obj]
-                ).select_related('product_id'))
+                # Invoices and lines come from one annotated query plus one prefetch
+                sales_data = _iter_customer_sales(customer, from_date_obj, to_date_obj)
+                customer_challans = _customer_sales_challans(customer, from_date_obj, to_date_obj).iterator(chunk_size=2000)
+                summary = _customer_sales_summary(customer, from_date_obj, to_date_obj)
                 
                 if export_type == 'pdf':
                     return export_customer_sales_pdf(customer, sales_data, customer_challans, from_date_obj, to_date_obj)
@@ -75,22 +151,20 @@ def customer_wise_sales_report(request):
                     context = {
                         'pharmacy': pharmacy,
                         'customer': customer,
-                        'sales_data': sales_data,
-                        'customer_challans': customer_challans,
+                        'sales_data': list(sales_data),
+                        'customer_challans': list(customer_challans),
                         'from_date': from_date_obj,
                         'to_date': to_date_obj,
                         'summary': {
-                            'total_amount': sum(s['invoice_total'] for s in sales_data) + sum(c.sale_total_amount for c in customer_challans),
-                            'total_qty': sum(sum(i.sale_quantity for i in s['items']) for s in sales_data) + sum(c.sale_quantity for c in customer_challans)
+                            'total_amount': summary['grand_total'],
+                            'total_qty': summary['grand_quantity']
                         }
                     }
                     return render(request, 'reports/customer_sales_print.html', context)
                 elif export_type == 'excel':
                     return export_customer_sales_excel(customer, sales_data, customer_challans, from_date_obj, to_date_obj)
             except Exception as e:
-                import traceback
-                print(f"Export error: {str(e)}")
-                print(traceback.format_exc())
+                logger.exception('Customer sales export failed')
                 return JsonResponse({'success': False, 'error': f'Export failed: {str(e)}'})
     
     # If filters applied, get sales data
@@ -102,59 +176,21 @@ def customer_wise_sales_report(request):
             from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
             to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
             
-            # Get sales invoices
-            sales_invoices = SalesInvoiceMaster.objects.filter(
-                customerid=customer,
-                sales_invoice_date__range=[from_date_obj, to_date_obj]
-            ).order_by('-sales_invoice_date')
-            
-            # Get sales data
-            sales_data = []
-            total_amount = 0
-            total_quantity = 0
+            # Server-side pagination - only the visible page of invoices is loaded
+            invoice_paginator = Paginator(_customer_sales_invoices(customer, from_date_obj, to_date_obj), 15)
+            page_obj = invoice_paginator.get_page(request.GET.get('page'))
+            sales_data = [_invoice_row(invoice) for invoice in page_obj]
             
-            for invoice in sales_invoices:
-                # Get invoice items
-                invoice_items = SalesMaster.objects.filter(
-                    sales_invoice_no=invoice
-                ).select_related('productid')
-                
-                invoice_total = sum(item.sale_total_amount for item in invoice_items)
-                invoice_qty = sum(item.sale_quantity for item in invoice_items)
-                
-                sales_data.append({
-                    'invoice': invoice,
-                    'items': invoice_items,
-                    'invoice_total': invoice_total,
-                    'invoice_qty': invoice_qty,
-                    'balance_due': invoice.balance_due
-                })
-                
-                total_amount += invoice_total
-                total_quantity += invoice_qty
-            
-            # Get customer challan sales
-            customer_challans = CustomerChallanMaster.objects.filter(
-                customer_name=customer,
-                sales_entry_date__date__range=[from_date_obj, to_date_obj]
-            ).select_related('product_id')
-            
-            challan_total = sum(item.sale_total_amount for item in customer_challans)
-            challan_qty = sum(item.sale_quantity for item in customer_challans)
+            challan_paginator = Paginator(_customer_sales_challans(customer, from_date_obj, to_date_obj), 25)
+            challan_page_obj = challan_paginator.get_page(request.GET.get('challan_page'))
             
             context.update({
                 'selected_customer': customer,
                 'sales_data': sales_data,
-                'customer_challans': customer_challans,
-                'summary': {
-                    'total_invoices': len(sales_data),
-                    'total_amount': total_amount,
-                    'total_quantity': total_quantity,
-                    'challan_amount': challan_total,
-                    'challan_quantity': challan_qty,
-                    'grand_total': total_amount + challan_total,
-                    'grand_quantity': total_quantity + challan_qty
-                }
+                'page_obj': page_obj,
+                'customer_challans': challan_page_obj,
+                'challan_page_obj': challan_page_obj,
+                'summary': _customer_sales_summary(customer, from_date_obj, to_date_obj)
             })
             
         except CustomerMaster.DoesNotExist:
@@ -229,12 +265,15 @@ def customer_sales_summary(request, customer_id):
             total_quantity=Sum('sale_quantity')
         )
         
-        # Outstanding balance
-        outstanding_invoices = SalesInvoiceMaster.objects.filter(
+        # Outstanding balance (billed - received) aggregated in the database
+        total_billed = SalesMaster.objects.filter(
+            sales_invoice_no__customerid=customer
+        ).aggregate(total=Sum('sale_total_amount'))['total'] or 0
+        total_received = SalesInvoiceMaster.objects.filter(
             customerid=customer
-        )
+        ).aggregate(total=Sum('sales_invoice_paid'))['total'] or 0
         
-        total_outstanding = sum(invoice.balance_due for invoice in outstanding_invoices)
+        total_outstanding = total_billed - total_received
         
         return JsonResponse({
             'success': True,
@@ -342,51 +381,53 @@ def export_customer_sales_pdf(customer, sales_data, customer_challans, from_date
     elements.append(info_table)
     elements.append(Spacer(1, 8*mm))
     
-    # Sales Data Table
-    if sales_data or customer_challans:
-        # Table Headers
-        data = [['S.No.', 'Type', 'Invoice/Challan', 'Date', 'Product', 'Batch', 'Qty', 'Rate', 'Amount']]
-        
-        total_amount = 0
-        total_qty = 0
-        sr_no = 1
-        
-        # Add invoice sales
-        for sale_info in sales_data:
-            invoice = sale_info['invoice']
-            for item in sale_info['items']:
-                data.append([
-                    str(sr_no),
-                    'Invoice',
-                    str(invoice.sales_invoice_no),
-                    invoice.sales_invoice_date.strftime('%d/%m/%Y'),
-                    item.product_name[:20] + '...' if len(item.product_name) > 20 else item.product_name,
-                    item.product_batch_no[:8] if item.product_batch_no else 'N/A',
-                    f"{item.sale_quantity:.0f}",
-                    f"{item.sale_rate:.2f}",
-                    f"{item.sale_total_amount:.2f}"
-                ])
-                total_amount += item.sale_total_amount
-                total_qty += item.sale_quantity
-                sr_no += 1
-        
-        # Add challan sales
-        for challan in customer_challans:
+    # Table Headers
+    data = [['S.No.', 'Type', 'Invoice/Challan', 'Date', 'Product', 'Batch', 'Qty', 'Rate', 'Amount']]
+    
+    total_amount = 0
+    total_qty = 0
+    total_invoices = 0
+    sr_no = 1
+    
+    # Add invoice sales (sales_data may be a streaming iterator)
+    for sale_info in sales_data:
+        total_invoices += 1
+        invoice = sale_info['invoice']
+        for item in sale_info['items']:
             data.append([
                 str(sr_no),
-                'Challan',
-                str(challan.customer_challan_no),
-                challan.sales_entry_date.strftime('%d/%m/%Y'),
-                challan.product_name[:20] + '...' if len(challan.product_name) > 20 else challan.product_name,
-                challan.product_batch_no[:8] if challan.product_batch_no else 'N/A',
-                f"{challan.sale_quantity:.0f}",
-                f"{challan.sale_rate:.2f}",
-                f"{challan.sale_total_amount:.2f}"
+                'Invoice',
+                str(invoice.sales_invoice_no),
+                invoice.sales_invoice_date.strftime('%d/%m/%Y'),
+                item.product_name[:20] + '...' if len(item.product_name) > 20 else item.product_name,
+                item.product_batch_no[:8] if item.product_batch_no else 'N/A',
+                f"{item.sale_quantity:.0f}",
+                f"{item.sale_rate:.2f}",
+                f"{item.sale_total_amount:.2f}"
             ])
-            total_amount += challan.sale_total_amount
-            total_qty += challan.sale_quantity
+            total_amount += item.sale_total_amount
+            total_qty += item.sale_quantity
             sr_no += 1
-        
+    
+    # Add challan sales
+    for challan in customer_challans:
+        data.append([
+            str(sr_no),
+            'Challan',
+            str(challan.customer_challan_no),
+            challan.sales_entry_date.strftime('%d/%m/%Y'),
+            challan.product_name[:20] + '...' if len(challan.product_name) > 20 else challan.product_name,
+            challan.product_batch_no[:8] if challan.product_batch_no else 'N/A',
+            f"{challan.sale_quantity:.0f}",
+            f"{challan.sale_rate:.2f}",
+            f"{challan.sale_total_amount:.2f}"
+        ])
+        total_amount += challan.sale_total_amount
+        total_qty += challan.sale_quantity
+        sr_no += 1
+    
+    # Sales Data Table
+    if sr_no > 1:
         # Summary Row
         data.append(['', '', '', '', 'TOTAL', '', f"{total_qty:.0f}", '', f"{total_amount:.2f}"])
         
@@ -440,7 +481,7 @@ def export_customer_sales_pdf(customer, sales_data, customer_challans, from_date
         elements.append(Spacer(1, 8*mm))
         
         summary_data = [
-            ['Total Invoices:', str(len(sales_data))],
+            ['Total Invoices:', str(total_invoices)],
             ['Total Items:', str(sr_no - 1)],
             ['Total Quantity:', f"{total_qty:.0f}"],
             ['Total Amount:', f"₹ {total_amount:,.2f}"]
@@ -537,8 +578,8 @@ def export_customer_sales_excel(customer, sales_data, customer_challans, from_da
             
             # Empty row for spacing
             row += 1
-    except Exception as e:
-        print(f"Error fetching pharmacy details: {e}")
+    except Exception:
+        logger.exception('Could not add the pharmacy details to the customer sales export')
     
     # Report Title
     cell = worksheet.cell(row=row, column=1, value='CUSTOMER WISE SALES REPORT')
@@ -568,34 +609,33 @@ def export_customer_sales_excel(customer, sales_data, customer_challans, from_da
         cell.alignment = Alignment(horizontal='center', vertical='center')
     row += 1
     
-    # Data
+    # Data - rows are written as they stream in; column widths are tracked
+    # on the way instead of re-scanning the whole sheet afterwards
     total_amount = 0
+    max_lengths = [len(header) for header in headers]
+    
+    def write_row(values):
+        for col, value in enumerate(values, 1):
+            worksheet.cell(row=row, column=col, value=value)
+            if value is not None:
+                max_lengths[col - 1] = max(max_lengths[col - 1], len(str(value)))
     
     # Invoice sales
     for sale_info in sales_data:
         invoice = sale_info['invoice']
+        invoice_no = str(invoice.sales_invoice_no)
+        invoice_date = invoice.sales_invoice_date.strftime('%d/%m/%Y')
         for item in sale_info['items']:
-            worksheet.cell(row=row, column=1, value='Invoice')
-            worksheet.cell(row=row, column=2, value=str(invoice.sales_invoice_no))
-            worksheet.cell(row=row, column=3, value=invoice.sales_invoice_date.strftime('%d/%m/%Y'))
-            worksheet.cell(row=row, column=4, value=item.product_name)
-            worksheet.cell(row=row, column=5, value=item.product_batch_no)
-            worksheet.cell(row=row, column=6, value=item.sale_quantity)
-            worksheet.cell(row=row, column=7, value=item.sale_rate)
-            worksheet.cell(row=row, column=8, value=item.sale_total_amount)
+            write_row(['Invoice', invoice_no, invoice_date, item.product_name, item.product_batch_no,
+                       item.sale_quantity, item.sale_rate, item.sale_total_amount])
             total_amount += item.sale_total_amount
             row += 1
     
     # Challan sales
     for challan in customer_challans:
-        worksheet.cell(row=row, column=1, value='Challan')
-        worksheet.cell(row=row, column=2, value=str(challan.customer_challan_no))
-        worksheet.cell(row=row, column=3, value=challan.sales_entry_date.strftime('%d/%m/%Y'))
-        worksheet.cell(row=row, column=4, value=challan.product_name)
-        worksheet.cell(row=row, column=5, value=challan.product_batch_no)
-        worksheet.cell(row=row, column=6, value=challan.sale_quantity)
-        worksheet.cell(row=row, column=7, value=challan.sale_rate)
-        worksheet.cell(row=row, column=8, value=challan.sale_total_amount)
+        write_row(['Challan', str(challan.customer_challan_no), challan.sales_entry_date.strftime('%d/%m/%Y'),
+                   challan.product_name, challan.product_batch_no,
+                   challan.sale_quantity, challan.sale_rate, challan.sale_total_amount])
         total_amount += challan.sale_total_amount
         row += 1
     
@@ -606,17 +646,7 @@ def export_customer_sales_excel(customer, sales_data, customer_challans, from_da
     # Auto-adjust columns
     from openpyxl.utils import get_column_letter
     for col_idx in range(1, 9):  # Columns A to H (1 to 8)
-        max_length = 0
-        column_letter = get_column_letter(col_idx)
-        for row_cells in worksheet.iter_rows(min_col=col_idx, max_col=col_idx):
-            for cell in row_cells:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-        adjusted_width = min(max_length + 2, 50)
-        worksheet.column_dimensions[column_letter].width = adjusted_width
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = min(max_lengths[col_idx - 1] + 2, 50)
     
     # Save to BytesIO buffer
     excel_buffer = BytesIO()
@@ -0,0 +1,206 @@
+"""
+Expiry Report Service
+Near-expiry and expired stock read from BatchInventoryCache.
+
+Every bucket is a date range on the indexed expiry_month_end column, so the
+report never loads purchase rows or parses expiry strings in Python. Stock
+value is current_stock × purchase_rate, computed in SQL.
+"""
+from datetime import date, timedelta
+from itertools import groupby
+
+from django.db.models import (
+    Case, When, Value, F, Q, Sum, Count, Subquery, OuterRef, CharField, FloatField
+)
+from django.db.models.functions import Coalesce
+
+from .models import BatchInventoryCache, PurchaseMaster, SupplierChallanMaster
+
+
+# (key, label, from day, to day) - days counted from today to the end of the expiry month
+EXPIRY_BUCKETS = [
+    ('expired', 'Expired', None, -1),
+    ('under_30', 'Expiring in 30 days', 0, 30),
+    ('under_60', 'Expiring in 31-60 days', 31, 60),
+    ('under_90', 'Expiring in 61-90 days', 61, 90),
+    ('later', 'Later', 91, None),
+]
+BUCKET_LABELS = {key: label for key, label, _, _ in EXPIRY_BUCKETS}
+
+# Expiry years further out than this are treated as data-entry mistakes
+MAX_EXPIRY_YEARS = 10
+
+
+def _bucket_q(key, today):
+    """Q on expiry_month_end for one bucket"""
+    for bucket_key, _, start, end in EXPIRY_BUCKETS:
+        if bucket_key == key:
+            q = Q()
+            if start is not None:
+                q &= Q(expiry_month_end__gte=today + timedelta(days=start))
+            if end is not None:
+                q &= Q(expiry_month_end__lte=today + timedelta(days=end))
+            return q
+    raise ValueError(f"Unknown expiry bucket: {key}")
+
+
+def _bucket_case(today):
+    return Case(
+        *[When(_bucket_q(key, today), then=Value(key)) for key, _, _, _ in EXPIRY_BUCKETS],
+        output_field=CharField()
+    )
+
+
+def _batch_supplier(field):
+    """Correlated lookup of the supplier a batch was bought from (purchase first, then challan)"""
+    purchase = PurchaseMaster.objects.filter(
+        productid=OuterRef('product_id'),
+        product_batch_no=OuterRef('batch_no'),
+        product_expiry=OuterRef('expiry_date'),
+    ).order_by('-purchase_entry_date').values(f'product_supplierid__{field}')[:1]
+    challan = SupplierChallanMaster.objects.filter(
+        product_id=OuterRef('product_id'),
+        product_batch_no=OuterRef('batch_no'),
+        product_expiry=OuterRef('expiry_date'),
+    ).order_by('-challan_entry_date').values(f'product_suppliername__{field}')[:1]
+    return Coalesce(Subquery(purchase), Subquery(challan))
+
+
+def get_expiry_queryset(bucket=None, search=None, with_supplier=False, today=None):
+    """
+    In-stock batches with a parseable expiry, ordered by expiry month.
+
+    Args:
+        bucket: one of the EXPIRY_BUCKETS keys, or None for every batch
+        search: product name / company filter
+        with_supplier: annotate supplier_id / supplier_name of the batch
+        today: reference date (defaults to today)
+    """
+    today = today or date.today()
+
+    queryset = BatchInventoryCache.objects.filter(
+        current_stock__gt=0,
+        expiry_month_end__isnull=False,
+        expiry_month_end__lte=today.replace(year=today.year + MAX_EXPIRY_YEARS, day=28),
+    ).select_related('product')
+
+    if bucket:
+        queryset = queryset.filter(_bucket_q(bucket, today))
+
+    if search:
+        queryset = queryset.filter(
+            Q(product__product_name__icontains=search) |
+            Q(product__product_company__icontains=search)
+        )
+
+    queryset = queryset.annotate(
+        stock_value=F('current_stock') * F('purchase_rate'),
+        expiry_bucket=_bucket_case(today),
+    )
+
+    if with_supplier:
+        queryset = queryset.annotate(
+            supplier_id=_batch_supplier('supplierid'),
+            supplier_name=_batch_supplier('supplier_name'),
+        )
+
+    return queryset.order_by('expiry_month_end', 'product__product_name', 'batch_no')
+
+
+def get_bucket_summary(search=None, today=None):
+    """
+    Batch count, units and value per bucket in a single aggregate query.
+
+    Returns:
+        list of {'key', 'label', 'batches', 'quantity', 'value'} in bucket order
+    """
+    today = today or date.today()
+    queryset = get_expiry_queryset(search=search, today=today)
+
+    aggregates = {}
+    for key, _, _, _ in EXPIRY_BUCKETS:
+        bucket_filter = _bucket_q(key, today)
+        aggregates[f'{key}_batches'] = Count('id', filter=bucket_filter)
+        aggregates[f'{key}_quantity'] = Sum('current_stock', filter=bucket_filter)
+        aggregates[f'{key}_value'] = Sum(F('current_stock') * F('purchase_rate'), filter=bucket_filter,
+                                         output_field=FloatField())
+
+    totals = queryset.order_by().aggregate(**aggregates)
+
+    return [{
+        'key': key,
+        'label': label,
+        'batches': totals[f'{key}_batches'] or 0,
+        'quantity': totals[f'{key}_quantity'] or 0,
+        'value': totals[f'{key}_value'] or 0,
+    } for key, label, _, _ in EXPIRY_BUCKETS]
+
+
+def _row(batch, today):
+    return {
+        'product_name': batch.product.product_name,
+        'product_company': batch.product.product_company,
+        'product_packing': batch.product.product_packing,
+        'batch_no': batch.batch_no,
+        'quantity': batch.current_stock,
+        'purchase_rate': batch.purchase_rate,
+        'mrp': batch.mrp,
+        'value': batch.stock_value,
+        'days_to_expiry': (batch.expiry_month_end - today).days,
+        'expiry_display': batch.expiry_date,
+        'bucket': batch.expiry_bucket,
+    }
+
+
+def get_dateexpiry_inventory_data(search_query='', bucket=None, today=None):
+    """
+    Expiry report grouped by expiry month.
+
+    Returns:
+        (list of {'expiry_display', 'expiry_date', 'days_to_expiry', 'products', 'total_value'},
+         grand total value)
+    """
+    today = today or date.today()
+    queryset = get_expiry_queryset(bucket=bucket, search=search_query, today=today)
+
+    result = []
+    for expiry_month_end, batches in groupby(queryset.iterator(chunk_size=1000), key=lambda b: b.expiry_month_end):
+        items = [_row(batch, today) for batch in batches]
+        result.append({
+            'expiry_display': items[0]['expiry_display'],
+            'expiry_date': items[0]['expiry_display'],
+            'days_to_expiry': (expiry_month_end - today).days,
+            'products': items,
+            'total_value': sum(item['value'] for item in items),
+        })
+
+    return result, sum(group['total_value'] for group in result)
+
+
+def get_supplier_return_list(bucket='expired', search=None, today=None):
+    """
+    Batches of one bucket grouped by the supplier they were bought from,
+    for return-to-vendor. Batches with no known supplier come last.
+
+    Returns:
+        list of {'supplier_id', 'supplier_name', 'items', 'total_quantity', 'total_value'}
+    """
+    today = today or date.today()
+    batches = sorted(
+        get_expiry_queryset(bucket=bucket, search=search, with_supplier=True, today=today),
+        key=lambda b: (b.supplier_name is None, b.supplier_name or '', b.supplier_id or 0)
+    )
+
+    groups = []
+    for supplier_id, rows in groupby(batches, key=lambda b: b.supplier_id):
+        rows = list(rows)
+        items = [_row(batch, today) for batch in rows]
+        groups.append({
+            'supplier_id': supplier_id,
+            'supplier_name': rows[0].supplier_name,
+            'items': items,
+            'total_quantity': sum(item['quantity'] for item in items),
+            'total_value': sum(item['value'] for item in items),
+        })
+
+    return groups
@@ -0,0 +1,29 @@
+"""
+Expiry Report Views - return-to-vendor list of expiring / expired batches
+grouped by the supplier each batch was bought from.
+"""
+from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+
+from .expiry_report import get_supplier_return_list, get_bucket_summary, BUCKET_LABELS
+
+
+@login_required
+def expiry_return_list(request):
+    """Batches of one expiry bucket grouped by supplier"""
+    search_query = request.GET.get('search', '').strip()
+    bucket = request.GET.get('bucket', 'expired')
+    if bucket not in BUCKET_LABELS:
+        bucket = 'expired'
+    
+    groups = get_supplier_return_list(bucket=bucket, search=search_query)
+    
+    return render(request, 'reports/expiry_return_list.html', {
+        'groups': groups,
+        'bucket': bucket,
+        'bucket_label': BUCKET_LABELS[bucket],
+        'bucket_summary': [b for b in get_bucket_summary(search=search_query) if b['key'] != 'later'],
+        'search_query': search_query,
+        'total_value': sum(group['total_value'] for group in groups),
+        'title': 'Expiry Return to Vendor'
+    })
@@ -1,6 +1,7 @@
-from django.db.models import Sum, Q
+from django.db.models import Q
 from collections import defaultdict
-from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster, SupplierChallanMaster, ProductMaster, CustomerChallanMaster, StockIssueDetail
+from .models import PurchaseMaster, SupplierChallanMaster, ProductMaster
+from .stock_service import balances_for
 
 class FastInventory:
     @staticmethod
@@ -15,53 +16,31 @@ class FastInventory:
         product_ids = list(products_query.values_list('productid', flat=True))
         products_dict = {p.productid: p for p in products_query}
         
-        # Bulk fetch all transactions with expiry
-        purchases = defaultdict(lambda: {'qty': 0, 'mrp': 0, 'expiry': None})
-        for p in PurchaseMaster.objects.filter(productid__in=product_ids).values('productid', 'product_batch_no', 'product_quantity', 'product_MRP', 'product_expiry'):
+        # Stock per batch, one grouped query per source (core/stock_service.py)
+        balances = balances_for(product_ids, level='batch')
+        
+        # MRP and expiry of each batch from its purchases, else its challans
+        details = defaultdict(lambda: {'mrp': 0, 'expiry': None})
+        for p in PurchaseMaster.objects.filter(productid__in=product_ids).values('productid', 'product_batch_no', 'product_MRP', 'product_expiry'):
             key = (p['productid'], p['product_batch_no'])
-            purchases[key]['qty'] += p['product_quantity']
-            if not purchases[key]['mrp']:
-                purchases[key]['mrp'] = p['product_MRP'] or 0
-            if not purchases[key]['expiry']:
-                purchases[key]['expiry'] = p['product_expiry']
+            if not details[key]['mrp']:
+                details[key]['mrp'] = p['product_MRP'] or 0
+            if not details[key]['expiry']:
+                details[key]['expiry'] = p['product_expiry']
         
-        for c in SupplierChallanMaster.objects.filter(product_id__in=product_ids).values('product_id', 'product_batch_no', 'product_quantity', 'product_mrp', 'product_expiry'):
+        for c in SupplierChallanMaster.objects.filter(product_id__in=product_ids).values('product_id', 'product_batch_no', 'product_mrp', 'product_expiry'):
             key = (c['product_id'], c['product_batch_no'])
-            purchases[key]['qty'] += c['product_quantity']
-            if not purchases[key]['mrp']:
-                purchases[key]['mrp'] = c['product_mrp'] or 0
-            if not purchases[key]['expiry']:
-                purchases[key]['expiry'] = c['product_expiry']
-        
-        sales = defaultdict(int)
-        for s in SalesMaster.objects.filter(productid__in=product_ids).values('productid', 'product_batch_no').annotate(total=Sum('sale_quantity')):
-            sales[(s['productid'], s['product_batch_no'])] = s['total']
-        
-        # Add customer challan sales
-        for cc in CustomerChallanMaster.objects.filter(product_id__in=product_ids).values('product_id', 'product_batch_no').annotate(total=Sum('sale_quantity')):
-            key = (cc['product_id'], cc['product_batch_no'])
-            sales[key] += cc['total']
-        
-        pr = defaultdict(int)
-        for r in ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid', 'returnproduct_batch_no').annotate(total=Sum('returnproduct_quantity')):
-            pr[(r['returnproductid'], r['returnproduct_batch_no'])] = r['total']
-        
-        sr = defaultdict(int)
-        for r in ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid', 'return_product_batch_no').annotate(total=Sum('return_sale_quantity')):
-            sr[(r['return_productid'], r['return_product_batch_no'])] = r['total']
+            if not details[key]['mrp']:
+                details[key]['mrp'] = c['product_mrp'] or 0
+            if not details[key]['expiry']:
+                details[key]['expiry'] = c['product_expiry']
         
-        # CRITICAL FIX: Add stock issues to calculation
-        stock_issues = defaultdict(int)
-        for si in StockIssueDetail.objects.filter(product__in=product_ids).values('product', 'batch_no').annotate(total=Sum('quantity_issued')):
-            stock_issues[(si['product'], si['batch_no'])] = si['total']
-        
-        # Calculate inventory - FIXED to include stock issues
         inventory = []
-        for key, data in purchases.items():
+        for key, stock in balances.items():
             pid, batch = key
-            stock = data['qty'] - sales.get(key, 0) - pr.get(key, 0) + sr.get(key, 0) - stock_issues.get(key, 0)
             if stock > 0 and pid in products_dict:
                 p = products_dict[pid]
+                data = details[key]
                 inventory.append({
                     'product_id': pid,
                     'product_name': p.product_name,
@@ -77,126 +56,7 @@ class FastInventory:
         return inventory
     
     @staticmethod
-    def get_dateexpiry_inventory_data(search_query=''):
-        """Optimized date/expiry inventory"""
-        products_query = ProductMaster.objects.all()
-        if search_query:
-            products_query = products_query.filter(
-                Q(product_name__icontains=search_query) | Q(product_company__icontains=search_query)
-            )
-        
-        product_ids = list(products_query.values_list('productid', flat=True))
-        products_dict = {p.productid: p for p in products_query}
-        
-        # Bulk fetch with expiry
-        purchases = defaultdict(lambda: {'qty': 0, 'rate': 0, 'mrp': 0, 'expiry': None})
-        for p in PurchaseMaster.objects.filter(productid__in=product_ids).values('productid', 'product_batch_no', 'product_quantity', 'product_actual_rate', 'product_MRP', 'product_expiry'):
-            key = (p['productid'], p['product_batch_no'])
-            purchases[key]['qty'] += p['product_quantity']
-            if not purchases[key]['rate']:
-                purchases[key]['rate'] = p['product_actual_rate'] or 0
-                purchases[key]['mrp'] = p['product_MRP'] or 0
-                purchases[key]['expiry'] = p['product_expiry']
-        
-        for c in SupplierChallanMaster.objects.filter(product_id__in=product_ids).values('product_id', 'product_batch_no', 'product_quantity', 'product_purchase_rate', 'product_mrp', 'product_expiry'):
-            key = (c['product_id'], c['product_batch_no'])
-            purchases[key]['qty'] += c['product_quantity']
-            if not purchases[key]['rate']:
-                purchases[key]['rate'] = c['product_purchase_rate'] or 0
-                purchases[key]['mrp'] = c['product_mrp'] or 0
-                purchases[key]['expiry'] = c['product_expiry']
-        
-        sales = defaultdict(int)
-        for s in SalesMaster.objects.filter(productid__in=product_ids).values('productid', 'product_batch_no').annotate(total=Sum('sale_quantity')):
-            sales[(s['productid'], s['product_batch_no'])] = s['total']
-        
-        # Add customer challan sales
-        for cc in CustomerChallanMaster.objects.filter(product_id__in=product_ids).values('product_id', 'product_batch_no').annotate(total=Sum('sale_quantity')):
-            key = (cc['product_id'], cc['product_batch_no'])
-            sales[key] += cc['total']
-        
-        pr = defaultdict(int)
-        for r in ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid', 'returnproduct_batch_no').annotate(total=Sum('returnproduct_quantity')):
-            pr[(r['returnproductid'], r['returnproduct_batch_no'])] = r['total']
-        
-        sr = defaultdict(int)
-        for r in ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid', 'return_product_batch_no').annotate(total=Sum('return_sale_quantity')):
-            sr[(r['return_productid'], r['return_product_batch_no'])] = r['total']
-        
-        # CRITICAL FIX: Add stock issues to dateexpiry calculation
-        stock_issues = defaultdict(int)
-        for si in StockIssueDetail.objects.filter(product__in=product_ids).values('product', 'batch_no').annotate(total=Sum('quantity_issued')):
-            stock_issues[(si['product'], si['batch_no'])] = si['total']
-        
-        # Group by expiry
-        from datetime import datetime
-        import calendar
-        grouped = defaultdict(list)
-        today = datetime.now().date()
-        
-        for key, data in purchases.items():
-            pid, batch = key
-            stock = data['qty'] - sales.get(key, 0) - pr.get(key, 0) + sr.get(key, 0) - stock_issues.get(key, 0)
-            if stock > 0 and pid in products_dict:
-                p = products_dict[pid]
-                expiry = data['expiry']
-                
-                # Skip products without expiry date
-                if not expiry:
-                    continue
-                
-                # Parse expiry
-                expiry_key = None
-                days = 999999
-                try:
-                    if isinstance(expiry, str):
-                        exp_date = datetime.strptime(expiry, '%m-%Y')
-                        # Skip unrealistic dates (more than 10 years in future)
-                        if exp_date.year > today.year + 10:
-                            continue
-                        expiry_key = expiry
-                        last_day = calendar.monthrange(exp_date.year, exp_date.month)[1]
-                        month_end = datetime(exp_date.year, exp_date.month, last_day).date()
-                        days = (month_end - today).days
-                    elif hasattr(expiry, 'strftime'):
-                        # Skip unrealistic dates (more than 10 years in future)
-                        if expiry.year > today.year + 10:
-                            continue
-                        expiry_key = expiry.strftime('%m-%Y')
-                        last_day = calendar.monthrange(expiry.year, expiry.month)[1]
-                        month_end = datetime(expiry.year, expiry.month, last_day).date()
-                        days = (month_end - today).days
-                except:
-                    continue
-                
-                if not expiry_key:
-                    continue
-                
-                grouped[expiry_key].append({
-                    'product_name': p.product_name,
-                    'product_company': p.product_company,
-                    'product_packing': p.product_packing,
-                    'batch_no': batch,
-                    'quantity': stock,
-                    'purchase_rate': data['rate'],
-                    'mrp': data['mrp'],
-                    'value': stock * data['rate'],
-                    'days_to_expiry': days,
-                    'expiry_display': expiry_key
-                })
-        
-        # Format output
-        result = []
-        for exp_key, items in grouped.items():
-            total = sum(i['value'] for i in items)
-            days = items[0]['days_to_expiry'] if items else 999999
-            result.append({
-                'expiry_display': exp_key,
-                'expiry_date': exp_key,
-                'days_to_expiry': days,
-                'products': items,
-                'total_value': total
-            })
-        
-        result.sort(key=lambda x: x['days_to_expiry'])
-        return result, sum(g['total_value'] for g in result)
+    def get_dateexpiry_inventory_data(search_query='', bucket=None):
+        """Date/expiry inventory - served from BatchInventoryCache by expiry month"""
+        from .expiry_report import get_dateexpiry_inventory_data
+        return get_dateexpiry_inventory_data(search_query, bucket=bucket)
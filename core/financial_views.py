@@ -28,16 +28,16 @@ def financial_report(request):
     # Apply date filters
     if start_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__gte=start_date)
-            purchase_query = purchase_query.filter(purchase_entry_date__date__gte=start_date)
+            sales_query = sales_query.in_date_range(start=start_date)
+            purchase_query = purchase_query.in_date_range(start=start_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__gte=start_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__gte=start_date)
         except:
             pass
     if end_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__lte=end_date)
-            purchase_query = purchase_query.filter(purchase_entry_date__date__lte=end_date)
+            sales_query = sales_query.in_date_range(end=end_date)
+            purchase_query = purchase_query.in_date_range(end=end_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__lte=end_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__lte=end_date)
         except:
@@ -305,14 +305,14 @@ def export_financial_pdf(request):
     
     if start_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__gte=start_date)
+            sales_query = sales_query.in_date_range(start=start_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__gte=start_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__gte=start_date)
         except:
             pass
     if end_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__lte=end_date)
+            sales_query = sales_query.in_date_range(end=end_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__lte=end_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__lte=end_date)
         except:
@@ -444,14 +444,14 @@ def export_financial_excel(request):
     
     if start_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__gte=start_date)
+            sales_query = sales_query.in_date_range(start=start_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__gte=start_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__gte=start_date)
         except:
             pass
     if end_date:
         try:
-            sales_query = sales_query.filter(sale_entry_date__date__lte=end_date)
+            sales_query = sales_query.in_date_range(end=end_date)
             supplier_challan_query = supplier_challan_query.filter(challan_entry_date__date__lte=end_date)
             customer_challan_query = customer_challan_query.filter(sales_entry_date__date__lte=end_date)
         except:
@@ -100,6 +100,14 @@ class ProductForm(forms.ModelForm):
     product_hsn_percent = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control'}))
     product_barcode = forms.CharField(required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Scan or enter product barcode'}))
     product_image = forms.ImageField(required=False, widget=forms.FileInput(attrs={'class': 'form-control'}))
+    product_reorder_level = forms.FloatField(required=False, min_value=0, initial=10, widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}))
+    
+    def clean_product_reorder_level(self):
+        reorder_level = self.cleaned_data.get('product_reorder_level')
+        # Blank means the default threshold
+        if reorder_level is None:
+            return 10
+        return reorder_level
     
     def clean_product_barcode(self):
         barcode = self.cleaned_data.get('product_barcode')
@@ -117,7 +125,8 @@ class ProductForm(forms.ModelForm):
     class Meta:
         model = ProductMaster
         fields = ['product_name', 'product_company', 'product_packing', 'product_salt', 
-                  'product_category', 'product_hsn', 'product_hsn_percent', 'product_barcode', 'product_image']
+                  'product_category', 'product_hsn', 'product_hsn_percent', 'product_barcode', 'product_image',
+                  'product_reorder_level']
 
 class SupplierForm(forms.ModelForm):
     supplier_name = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control'}))
@@ -134,6 +143,14 @@ class SupplierForm(forms.ModelForm):
     supplier_bankaccountno = forms.CharField(required=False, widget=forms.TextInput(attrs={'class': 'form-control'}))
     supplier_bankifsc = forms.CharField(required=False, widget=forms.TextInput(attrs={'class': 'form-control'}))
     supplier_upi = forms.CharField(required=False, widget=forms.TextInput(attrs={'class': 'form-control'}))
+    supplier_lead_time_days = forms.IntegerField(required=False, min_value=0, initial=7, widget=forms.NumberInput(attrs={'class': 'form-control'}))
+    
+    def clean_supplier_lead_time_days(self):
+        lead_time = self.cleaned_data.get('supplier_lead_time_days')
+        # Blank means the default lead time
+        if lead_time is None:
+            return 7
+        return lead_time
     
     class Meta:
         model = SupplierMaster
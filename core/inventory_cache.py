@@ -2,91 +2,93 @@
 Inventory Cache Management
 Handles updating ProductInventoryCache and BatchInventoryCache tables
 """
-from django.db.models import Sum, Avg, Count, Q
+import calendar
+import logging
+from django.db import transaction
+from django.db.models import Sum, Avg, Count, Min, Q, Exists, OuterRef, Subquery
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 from .models import (
     ProductMaster, ProductInventoryCache, BatchInventoryCache,
     PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
     SupplierChallanMaster, CustomerChallanMaster,
     SaleRateMaster
 )
+from .low_stock_service import classify_stock, DEFAULT_REORDER_LEVEL
+from .opening_balances import OPENING_DETAILS, live_rows, opening_details, opening_stock_rows
+from .stock_service import balance, balances_for
+
+logger = logging.getLogger(__name__)
+
+EXPIRING_SOON_DAYS = 90
 
 
 def calculate_batch_stock(product_id, batch_no, expiry_date):
-    """Calculate current stock for a specific batch - OPTIMIZED with all transactions"""
-    # ⬆️ INCREASE: Purchase + Supplier Challan + Sales Return
-    purchased = PurchaseMaster.objects.filter(
-        productid=product_id,
-        product_batch_no=batch_no,
-        product_expiry=expiry_date
-    ).aggregate(total=Sum('product_quantity'))['total'] or 0
-    
-    supplier_challan = SupplierChallanMaster.objects.filter(
-        product_id=product_id,
-        product_batch_no=batch_no,
-        product_expiry=expiry_date
-    ).aggregate(total=Sum('product_quantity'))['total'] or 0
-    
-    sales_returns = ReturnSalesMaster.objects.filter(
-        return_productid=product_id,
-        return_product_batch_no=batch_no,
-        return_product_expiry=expiry_date
-    ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-    
-    # ⬇️ DECREASE: Sales + Customer Challan + Purchase Return
-    sold = SalesMaster.objects.filter(
-        productid=product_id,
-        product_batch_no=batch_no,
-        product_expiry=expiry_date
-    ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-    
-    customer_challan = CustomerChallanMaster.objects.filter(
-        product_id=product_id,
-        product_batch_no=batch_no,
-        product_expiry=expiry_date
-    ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-    
-    purchase_returns = ReturnPurchaseMaster.objects.filter(
-        returnproductid=product_id,
-        returnproduct_batch_no=batch_no
-    ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-    
-    # Calculate: INCREASE - DECREASE
-    current_stock = (purchased + supplier_challan + sales_returns) - (sold + customer_challan + purchase_returns)
+    """Cached stock of a batch + expiry: its stock_service balance, never below zero"""
+    return max(0, balance(product_id, batch_no, expiry_date))
+
+
+def parse_expiry_month_end(expiry_str):
+    """Last day of an MM-YYYY expiry month, or None if it can't be parsed"""
+    if not expiry_str:
+        return None
     
-    return max(0, current_stock)
+    try:
+        month, year = map(int, expiry_str.split('-'))
+        return date(year, month, calendar.monthrange(year, month)[1])
+    except (AttributeError, ValueError):
+        return None
 
 
 def check_expiry_status(expiry_str):
     """Check if batch is expired or expiring soon"""
-    if not expiry_str:
+    expiry_date = parse_expiry_month_end(expiry_str)
+    if not expiry_date:
         return 'valid', False
     
-    try:
-        # Parse MM-YYYY format
-        month, year = map(int, expiry_str.split('-'))
-        expiry_date = datetime(year, month, 1)
-        
-        # Get last day of month
-        if month == 12:
-            expiry_date = datetime(year + 1, 1, 1) - timedelta(days=1)
-        else:
-            expiry_date = datetime(year, month + 1, 1) - timedelta(days=1)
-        
-        current_date = datetime.now()
-        days_to_expiry = (expiry_date - current_date).days
-        
-        if days_to_expiry < 0:
-            return 'expired', True
-        elif days_to_expiry <= 90:  # 3 months
-            return 'expiring_soon', False
-        else:
-            return 'valid', False
-    except:
+    days_to_expiry = (expiry_date - date.today()).days
+    
+    if days_to_expiry < 0:
+        return 'expired', True
+    elif days_to_expiry <= EXPIRING_SOON_DAYS:  # 3 months
+        return 'expiring_soon', False
+    else:
         return 'valid', False
 
 
+def refresh_expiry_status(today=None):
+    """
+    Re-flag every batch as expired / expiring_soon / valid for today's date.
+    Set-wise: three UPDATEs on the indexed expiry_month_end plus one for the
+    product-level has_expired_batches flag, each writing only the rows whose
+    stored flag is out of date. Run nightly - the flags are only written when
+    a batch changes, so they go stale as time passes.
+    
+    Returns:
+        dict with the number of batches moved into each status
+    """
+    today = today or date.today()
+    soon = today + timedelta(days=EXPIRING_SOON_DAYS)
+    batches = BatchInventoryCache.objects.all()
+    
+    with transaction.atomic():
+        counts = {
+            'expired': batches.filter(expiry_month_end__lt=today).exclude(expiry_status='expired').update(
+                is_expired=True, expiry_status='expired'),
+            'expiring_soon': batches.filter(expiry_month_end__gte=today, expiry_month_end__lte=soon).exclude(
+                expiry_status='expiring_soon').update(is_expired=False, expiry_status='expiring_soon'),
+            'valid': batches.filter(Q(expiry_month_end__gt=soon) | Q(expiry_month_end__isnull=True)).exclude(
+                expiry_status='valid').update(is_expired=False, expiry_status='valid'),
+        }
+        
+        has_expired = Exists(
+            BatchInventoryCache.objects.filter(product_id=OuterRef('product_id'), is_expired=True)
+        )
+        ProductInventoryCache.objects.exclude(has_expired_batches=has_expired).update(has_expired_batches=has_expired)
+    
+    return counts
+
+
 def update_batch_cache(product_id, batch_no, expiry_date):
     """Update cache for a specific batch"""
     try:
@@ -95,19 +97,25 @@ def update_batch_cache(product_id, batch_no, expiry_date):
         
         # If no stock and no source records exist, delete the cache entry
         if current_stock <= 0:
-            purchase_exists = PurchaseMaster.objects.filter(
+            purchase_exists = live_rows(PurchaseMaster).filter(
                 productid=product_id,
                 product_batch_no=batch_no,
                 product_expiry=expiry_date
             ).exists()
             
-            challan_exists = SupplierChallanMaster.objects.filter(
+            challan_exists = live_rows(SupplierChallanMaster).filter(
                 product_id=product_id,
                 product_batch_no=batch_no,
                 product_expiry=expiry_date
             ).exists()
             
-            if not purchase_exists and not challan_exists:
+            opening_exists = opening_stock_rows().filter(
+                product_id=product_id,
+                batch_no=batch_no,
+                expiry_date=expiry_date
+            ).exists()
+            
+            if not purchase_exists and not challan_exists and not opening_exists:
                 # No source records, delete cache
                 BatchInventoryCache.objects.filter(
                     product_id=product_id,
@@ -116,16 +124,24 @@ def update_batch_cache(product_id, batch_no, expiry_date):
                 ).delete()
                 return None
         
-        # Get batch details from first purchase
-        purchase = PurchaseMaster.objects.filter(
+        # Get batch details from first purchase - closed years first, then live
+        opening = opening_stock_rows().filter(
+            product_id=product_id,
+            batch_no=batch_no,
+            expiry_date=expiry_date,
+            mrp__isnull=False
+        ).values_list(*OPENING_DETAILS).first()
+        purchase = None if opening else live_rows(PurchaseMaster).filter(
             productid=product_id,
             product_batch_no=batch_no,
             product_expiry=expiry_date
         ).first()
         
-        if not purchase:
+        if opening:
+            mrp, purchase_rate, rate_a, rate_b, rate_c = opening
+        elif not purchase:
             # Try challan
-            challan = SupplierChallanMaster.objects.filter(
+            challan = live_rows(SupplierChallanMaster).filter(
                 product_id=product_id,
                 product_batch_no=batch_no,
                 product_expiry=expiry_date
@@ -181,12 +197,13 @@ def update_batch_cache(product_id, batch_no, expiry_date):
                 'rate_c': rate_c,
                 'is_expired': is_expired,
                 'expiry_status': expiry_status,
+                'expiry_month_end': parse_expiry_month_end(expiry_date),
             }
         )
         
         return batch_cache
-    except Exception as e:
-        print(f"[ERROR] update_batch_cache: {e}")
+    except Exception:
+        logger.exception('update_batch_cache failed for product %s batch %s', product_id, batch_no)
         return None
 
 
@@ -218,21 +235,24 @@ def update_product_cache(product_id):
         # Calculate stock value (optimized with list comprehension)
         total_stock_value = sum(b.current_stock * b.mrp for b in active_batches)
         
-        # ✅ AUTO-DELETE: If all values are zero, delete the product cache row
+        # ✅ AUTO-DELETE: If all values are zero and the product has no batch history,
+        # delete the product cache row. Sold-out products keep an 'out_of_stock' row
+        # so the low-stock list can find them through the cache.
         if (total_stock == 0 and total_batches == 0 and 
-            avg_mrp == 0 and avg_purchase_rate == 0 and total_stock_value == 0):
+            avg_mrp == 0 and avg_purchase_rate == 0 and total_stock_value == 0 and
+            not BatchInventoryCache.objects.filter(product_id=product_id).exists()):
             deleted_count = ProductInventoryCache.objects.filter(product_id=product_id).delete()[0]
             if deleted_count > 0:
-                print(f"🗑️ Auto-deleted ProductInventoryCache for product {product_id} (all values zero)")
+                logger.debug('Deleted ProductInventoryCache for product %s (all values zero)', product_id)
             return None
         
-        # Determine stock status (OPTIMIZED logic)
-        if total_stock <= 0:
-            stock_status = 'out_of_stock'
-        elif total_stock <= 10:
-            stock_status = 'low_stock'
-        else:
-            stock_status = 'in_stock'
+        # Determine stock status against the product's own reorder level
+        reorder_level = ProductMaster.objects.filter(productid=product_id).values_list(
+            'product_reorder_level', flat=True
+        ).first()
+        stock_status = classify_stock(
+            total_stock, DEFAULT_REORDER_LEVEL if reorder_level is None else reorder_level
+        )
         
         # Check for expired batches (single query)
         has_expired_batches = BatchInventoryCache.objects.filter(
@@ -255,8 +275,8 @@ def update_product_cache(product_id):
         )
         
         return product_cache
-    except Exception as e:
-        print(f"[ERROR] update_product_cache for product {product_id}: {e}")
+    except Exception:
+        logger.exception('update_product_cache failed for product %s', product_id)
         return None
 
 
@@ -277,14 +297,18 @@ def update_all_batches_for_product(product_id):
             filter_key = 'productid' if model in [PurchaseMaster, SalesMaster] else 'returnproductid' if model == ReturnPurchaseMaster else 'return_productid' if model == ReturnSalesMaster else 'product_id'
             
             if expiry_field:
-                batches = model.objects.filter(**{filter_key: product_id}).values(batch_field, expiry_field).distinct()
+                batches = live_rows(model).filter(**{filter_key: product_id}).values(batch_field, expiry_field).distinct()
                 for b in batches:
                     all_batches.add((b[batch_field], b[expiry_field]))
             else:
-                batches = model.objects.filter(**{filter_key: product_id}).values(batch_field).distinct()
+                batches = live_rows(model).filter(**{filter_key: product_id}).values(batch_field).distinct()
                 for b in batches:
                     all_batches.add((b[batch_field], None))
         
+        all_batches.update(
+            opening_stock_rows().filter(product_id=product_id).values_list('batch_no', 'expiry_date')
+        )
+        
         # Update each batch
         for batch_no, expiry_date in all_batches:
             if batch_no:
@@ -294,8 +318,8 @@ def update_all_batches_for_product(product_id):
         update_product_cache(product_id)
         
         return True
-    except Exception as e:
-        print(f"[ERROR] update_all_batches_for_product: {e}")
+    except Exception:
+        logger.exception('update_all_batches_for_product failed for product %s', product_id)
         return False
 
 
@@ -312,16 +336,16 @@ def update_cache_after_sales_return(return_sales_master):
         # Update product summary
         update_product_cache(product_id)
         
-        print(f"✅ Cache updated after sales return: Product {product_id}, Batch {batch_no}")
+        logger.debug('Cache updated after sales return: product %s batch %s', product_id, batch_no)
         return True
-    except Exception as e:
-        print(f"❌ Error updating cache after sales return: {e}")
+    except Exception:
+        logger.exception('Error updating cache after sales return')
         return False
 
 
 def rebuild_all_cache():
     """Rebuild entire cache for all products - OPTIMIZED"""
-    print("[INFO] Starting cache rebuild...")
+    logger.info('Starting cache rebuild')
     
     # OLD: Load all products at once (MEMORY INTENSIVE)
     # NEW: Use iterator() to process in chunks (MEMORY EFFICIENT)
@@ -338,11 +362,128 @@ def rebuild_all_cache():
             
             # Progress update every 50 products (less console spam)
             if idx % 50 == 0:
-                print(f"[INFO] Progress: {idx}/{total} products ({(idx/total)*100:.1f}%) - Success: {success_count}, Errors: {error_count}")
-        except Exception as e:
+                logger.info('Cache rebuild progress: %s/%s products, success %s, errors %s',
+                            idx, total, success_count, error_count)
+        except Exception:
             error_count += 1
-            print(f"[ERROR] Failed for product {product.productid}: {e}")
+            logger.exception('Cache rebuild failed for product %s', product.productid)
     
-    print(f"[OK] Cache rebuild completed!")
-    print(f"    Total: {total} | Success: {success_count} | Errors: {error_count}")
+    logger.info('Cache rebuild completed: total %s, success %s, errors %s', total, success_count, error_count)
     return True
+
+
+def _first_rows(model, product_field, batch_field, expiry_field, pk_field, columns):
+    """Details of the first (lowest pk) row of every batch - what update_batch_cache reads"""
+    first_ids = live_rows(model).order_by().values(product_field, batch_field, expiry_field).annotate(
+        first_id=Min(pk_field)
+    ).values_list('first_id', flat=True)
+    details = {}
+    for row in model.objects.filter(**{f'{pk_field}__in': Subquery(first_ids)}).values_list(
+        product_field, batch_field, expiry_field, *columns
+    ).iterator(chunk_size=2000):
+        details[(row[0], row[1], row[2])] = row[3:]
+    return details
+
+
+def rebuild_cache_setwise():
+    """
+    Rebuild both cache tables from grouped aggregates - the same numbers as
+    rebuild_all_cache() without the per-product / per-batch queries, for
+    bulk loads (generate_bulk_data, bench) and large imports.
+
+    Batch stock is the stock_service balance at the expiry level,
+    floored at zero like calculate_batch_stock
+
+    Returns:
+        dict with the number of batch and product cache rows written
+    """
+    today = date.today()
+    balances = balances_for(level='expiry')
+
+    # Batch details come from the first purchase, else the first supplier challan;
+    # the closed years' ones first
+    details = _first_rows(
+        SupplierChallanMaster, 'product_id', 'product_batch_no', 'product_expiry', 'challan_id',
+        ['product_mrp', 'product_purchase_rate', 'rate_a', 'rate_b', 'rate_c']
+    )
+    details.update(_first_rows(
+        PurchaseMaster, 'productid', 'product_batch_no', 'product_expiry', 'purchaseid',
+        ['product_MRP', 'product_purchase_rate', 'rate_a', 'rate_b', 'rate_c']
+    ))
+    details.update(opening_details())
+    sale_rates = {
+        (row[0], row[1]): row[2:]
+        for row in SaleRateMaster.objects.order_by('id').values_list(
+            'productid', 'product_batch_no', 'rate_A', 'rate_B', 'rate_C'
+        ).iterator(chunk_size=2000)
+    }
+
+    batch_rows = []
+    for key, (mrp, purchase_rate, rate_a, rate_b, rate_c) in details.items():
+        product_id, batch_no, expiry = key
+        if not batch_no:
+            continue
+        stock = balances.get(key, 0)
+        rate_a, rate_b, rate_c = sale_rates.get((product_id, batch_no), (rate_a, rate_b, rate_c))
+        expiry_month_end = parse_expiry_month_end(expiry)
+        if expiry_month_end is None or expiry_month_end > today + timedelta(days=EXPIRING_SOON_DAYS):
+            expiry_status = 'valid'
+        elif expiry_month_end < today:
+            expiry_status = 'expired'
+        else:
+            expiry_status = 'expiring_soon'
+        batch_rows.append(BatchInventoryCache(
+            product_id=product_id,
+            batch_no=batch_no,
+            expiry_date=expiry,
+            expiry_month_end=expiry_month_end,
+            current_stock=max(0, stock),
+            mrp=mrp,
+            purchase_rate=purchase_rate,
+            rate_a=rate_a,
+            rate_b=rate_b,
+            rate_c=rate_c,
+            is_expired=expiry_status == 'expired',
+            expiry_status=expiry_status,
+        ))
+
+    # Product summary over the batches with stock, as update_product_cache does
+    summaries = {}
+    for batch in batch_rows:
+        summary = summaries.setdefault(batch.product_id, {
+            'stock': 0, 'batches': 0, 'mrp': 0, 'rate': 0, 'value': 0, 'expired': False
+        })
+        summary['expired'] = summary['expired'] or batch.is_expired
+        if batch.current_stock > 0:
+            summary['stock'] += batch.current_stock
+            summary['batches'] += 1
+            summary['mrp'] += batch.mrp
+            summary['rate'] += batch.purchase_rate
+            summary['value'] += batch.current_stock * batch.mrp
+
+    reorder_levels = dict(ProductMaster.objects.filter(
+        productid__in=list(summaries)
+    ).values_list('productid', 'product_reorder_level'))
+    product_rows = [
+        ProductInventoryCache(
+            product_id=product_id,
+            total_stock=summary['stock'],
+            total_batches=summary['batches'],
+            avg_mrp=summary['mrp'] / summary['batches'] if summary['batches'] else 0,
+            avg_purchase_rate=summary['rate'] / summary['batches'] if summary['batches'] else 0,
+            total_stock_value=summary['value'],
+            stock_status=classify_stock(summary['stock'], reorder_levels.get(product_id, DEFAULT_REORDER_LEVEL)),
+            has_expired_batches=summary['expired'],
+        )
+        for product_id, summary in summaries.items()
+        if product_id in reorder_levels
+    ]
+
+    with transaction.atomic():
+        BatchInventoryCache.objects.all().delete()
+        BatchInventoryCache.objects.bulk_create(batch_rows, batch_size=1000)
+        ProductInventoryCache.objects.all().delete()
+        ProductInventoryCache.objects.bulk_create(product_rows, batch_size=1000)
+
+    logger.info('Set-wise cache rebuild: %s batches, %s products', len(batch_rows), len(product_rows))
+    return {'batches': len(batch_rows), 'products': len(product_rows)}
@@ -37,8 +37,11 @@ def get_batch_inventory_data(search_query=''):
             inventory.append({'product_id': p.productid, 'product_name': p.product_name, 'product_company': p.product_company, 'product_packing': p.product_packing, 'batch_no': '', 'expiry': '', 'mrp': 0, 'stock': stock_info['current_stock'], 'value': 0})
     return inventory
 
-def get_dateexpiry_inventory_data(search_query=''):
-    return [], 0
+def get_dateexpiry_inventory_data(search_query='', bucket=None):
+    from .expiry_report import get_dateexpiry_inventory_data as expiry_report_data, BUCKET_LABELS
+    if bucket not in BUCKET_LABELS:
+        bucket = None
+    return expiry_report_data(search_query, bucket=bucket)
 
 
 @login_required
@@ -441,7 +444,7 @@ def export_dateexpiry_inventory_pdf(request):
         expiry_to = request.GET.get('expiry_to', '')
         
         # Get inventory data
-        expiry_data, total_value = get_dateexpiry_inventory_data(search_query)
+        expiry_data, total_value = get_dateexpiry_inventory_data(search_query, bucket=request.GET.get('bucket') or None)
         
         # Create PDF buffer
         buffer = io.BytesIO()
@@ -618,7 +621,7 @@ def export_dateexpiry_inventory_excel(request):
         expiry_to = request.GET.get('expiry_to', '')
         
         # Get inventory data
-        expiry_data, total_value = get_dateexpiry_inventory_data(search_query)
+        expiry_data, total_value = get_dateexpiry_inventory_data(search_query, bucket=request.GET.get('bucket') or None)
         
         # Create workbook
         wb = Workbook()
@@ -0,0 +1,256 @@
+"""
+Purchase Invoice Import
+CSV / Excel purchase invoices -> InvoiceMaster + PurchaseMaster, in three passes:
+
+    prepare   normalise the columns and compute every line total with
+              vectorised pandas operations
+    validate  resolve suppliers and products from one name -> id dictionary
+              each, check every row and collect a row-level error report;
+              an invoice with any bad row is rejected as a whole
+    write     bulk_create the valid invoices and their lines in chunks with
+              signals off, then refresh the inventory cache once per
+              affected batch
+"""
+from datetime import datetime, time
+
+import pandas as pd
+
+from django.db import transaction
+
+from .change_log import record_changes
+from .inventory_cache import update_batch_cache, update_product_cache
+from .models import InvoiceMaster, PurchaseMaster, SupplierMaster, ProductMaster
+from .signals import signals_disabled
+from .year_close import block_closed_years_bulk, is_closed_date
+
+
+REQUIRED_COLUMNS = ['Invoice No', 'Invoice Date', 'Supplier Name', 'Product Name',
+                    'Batch No', 'Expiry', 'MRP', 'Purchase Rate', 'Quantity']
+NUMERIC_COLUMNS = {'MRP': None, 'Purchase Rate': None, 'Quantity': None,
+                   'Discount': 0, 'GST%': 0, 'Rate A': 0, 'Rate B': 0, 'Rate C': 0}
+CHUNK_SIZE = 1000
+
+
+def read_invoice_file(file):
+    """DataFrame from an uploaded .csv / .xlsx / .xls file (ValueError for other types)"""
+    extension = file.name.rsplit('.', 1)[-1].lower()
+    if extension in ('xlsx', 'xls'):
+        return pd.read_excel(file, dtype=str)
+    if extension == 'csv':
+        return pd.read_csv(file, dtype=str, keep_default_na=False)
+    raise ValueError('Unsupported file format. Please upload Excel or CSV file.')
+
+
+def _error(report, rows, column, message):
+    for _, row in rows.iterrows():
+        report.append({
+            'row': int(row['_row']),
+            'invoice_no': row['Invoice No'],
+            'column': column,
+            'message': message,
+        })
+
+
+def prepare_invoice_frame(df):
+    """
+    Normalise an import sheet. Adds:
+        _row            spreadsheet row number (header is row 1)
+        _supplier_key / _product_key   lower-cased names for the lookups
+        _date, _expiry  parsed invoice date and MM-YYYY expiry
+        _net, _total    line amount before / after GST
+    """
+    df = df.copy()
+    df.columns = [str(column).strip() for column in df.columns]
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f'Missing columns: {", ".join(missing)}')
+
+    df['_row'] = df.index + 2
+    for column in ('Invoice No', 'Supplier Name', 'Product Name', 'Batch No', 'Expiry'):
+        df[column] = df[column].fillna('').astype(str).str.strip()
+    df['_supplier_key'] = df['Supplier Name'].str.lower()
+    df['_product_key'] = df['Product Name'].str.lower()
+
+    for column, default in NUMERIC_COLUMNS.items():
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column].replace('', None), errors='coerce')
+            if default is not None:
+                df[column] = df[column].fillna(default)
+        else:
+            df[column] = default
+
+    df['_date'] = pd.to_datetime(df['Invoice Date'], errors='coerce').dt.date
+
+    # Expiry as MM-YYYY: accept MM-YYYY, MM/YYYY and full dates
+    expiry = df['Expiry'].str.replace('/', '-', regex=False)
+    parts = expiry.str.extract(r'^(\d{1,2})-(\d{4})$')
+    as_date = pd.to_datetime(expiry.where(parts[0].isna()), errors='coerce')
+    month = pd.to_numeric(parts[0], errors='coerce').fillna(as_date.dt.month)
+    year = pd.to_numeric(parts[1], errors='coerce').fillna(as_date.dt.year)
+    valid = month.between(1, 12) & year.notna()
+    df['_expiry'] = None
+    df.loc[valid, '_expiry'] = (
+        month[valid].astype(int).astype(str).str.zfill(2) + '-' + year[valid].astype(int).astype(str)
+    )
+
+    df['_net'] = df['Purchase Rate'] * df['Quantity'] - df['Discount']
+    df['_total'] = (df['_net'] * (1 + df['GST%'] / 100)).round(2)
+    return df
+
+
+def validate_invoice_frame(df):
+    """
+    Check every row and resolve suppliers / products.
+
+    Returns:
+        (DataFrame of rows from fully valid invoices with supplier_id / product_id,
+         list of {row, invoice_no, column, message})
+    """
+    report = []
+    suppliers = {}
+    for supplier_id, name in SupplierMaster.objects.order_by('-supplierid').values_list('supplierid', 'supplier_name'):
+        suppliers[name.strip().lower()] = supplier_id
+    products = {}
+    for product_id, name in ProductMaster.objects.order_by('-productid').values_list('productid', 'product_name'):
+        products[name.strip().lower()] = product_id
+    df['supplier_id'] = df['_supplier_key'].map(suppliers)
+    df['product_id'] = df['_product_key'].map(products)
+
+    checks = [
+        (df['Invoice No'] == '', 'Invoice No', 'Invoice number is required'),
+        (df['_date'].isna(), 'Invoice Date', 'Invalid date (use YYYY-MM-DD)'),
+        (df['supplier_id'].isna(), 'Supplier Name', 'Supplier not found'),
+        (df['product_id'].isna(), 'Product Name', 'Product not found'),
+        (df['Batch No'] == '', 'Batch No', 'Batch number is required'),
+        (df['Batch No'].str.len() > 20, 'Batch No', 'Batch number longer than 20 characters'),
+        (df['_expiry'].isna(), 'Expiry', 'Invalid expiry (use MM-YYYY)'),
+        (df['MRP'].isna() | (df['MRP'] < 0), 'MRP', 'MRP must be a number of 0 or more'),
+        (df['Purchase Rate'].isna() | (df['Purchase Rate'] < 0), 'Purchase Rate', 'Purchase rate must be a number of 0 or more'),
+        (df['Quantity'].isna() | (df['Quantity'] <= 0), 'Quantity', 'Quantity must be greater than 0'),
+        (df['_net'] < 0, 'Discount', 'Discount is larger than the line amount'),
+    ]
+    closed_dates = {value for value in df['_date'].dropna().unique() if is_closed_date(value)}
+    checks.append((df['_date'].isin(closed_dates), 'Invoice Date', 'Date falls in a closed financial year'))
+    for column in ('Discount', 'GST%', 'Rate A', 'Rate B', 'Rate C'):
+        checks.append((df[column].isna(), column, f'{column} must be a number'))
+    for mask, column, message in checks:
+        _error(report, df[mask.fillna(False)], column, message)
+
+    # One supplier and one date per invoice
+    per_invoice = df.groupby('Invoice No').agg(suppliers=('_supplier_key', 'nunique'), dates=('_date', 'nunique'))
+    for column, key, message in [
+        ('Supplier Name', 'suppliers', 'Rows of one invoice name different suppliers'),
+        ('Invoice Date', 'dates', 'Rows of one invoice have different dates'),
+    ]:
+        mixed = per_invoice.index[per_invoice[key] > 1]
+        _error(report, df[df['Invoice No'].isin(mixed) & (df['Invoice No'] != '')], column, message)
+
+    # Already imported: same supplier + invoice number
+    candidates = df.dropna(subset=['supplier_id'])
+    existing = set(InvoiceMaster.objects.filter(
+        supplierid__in=candidates['supplier_id'].astype(int).unique().tolist(),
+        invoice_no__in=candidates['Invoice No'].unique().tolist()
+    ).values_list('supplierid', 'invoice_no'))
+    if existing:
+        duplicate = candidates.apply(lambda row: (int(row['supplier_id']), row['Invoice No']) in existing, axis=1)
+        _error(report, candidates[duplicate], 'Invoice No', 'Invoice already exists for this supplier')
+
+    rejected = {entry['invoice_no'] for entry in report}
+    valid = df[~df['Invoice No'].isin(rejected)].copy()
+    valid['supplier_id'] = valid['supplier_id'].astype(int)
+    valid['product_id'] = valid['product_id'].astype(int)
+    report.sort(key=lambda entry: entry['row'])
+    return valid, report
+
+
+def write_invoices(df, chunk_size=CHUNK_SIZE):
+    """
+    Insert validated rows. Returns (invoices created, lines created).
+    """
+    if df.empty:
+        return 0, 0
+
+    totals = df.groupby('Invoice No', sort=False).agg(
+        supplier_id=('supplier_id', 'first'), invoice_date=('_date', 'first'), total=('_total', 'sum')
+    )
+    invoice_numbers = list(totals.index)
+    lines_by_invoice = {
+        invoice_no: rows.to_dict('records') for invoice_no, rows in df.groupby('Invoice No', sort=False)
+    }
+    products = {
+        product_id: details for product_id, *details in ProductMaster.objects.filter(
+            productid__in=df['product_id'].unique().tolist()
+        ).values_list('productid', 'product_name', 'product_company', 'product_packing')
+    }
+    lines_created = 0
+
+    with signals_disabled(), transaction.atomic():
+        for start in range(0, len(invoice_numbers), chunk_size):
+            chunk = totals.loc[invoice_numbers[start:start + chunk_size]]
+            invoices = [
+                InvoiceMaster(
+                    invoice_no=invoice_no,
+                    invoice_date=row.invoice_date,
+                    supplierid_id=int(row.supplier_id),
+                    transport_charges=0,
+                    invoice_total=round(row.total, 2),
+                    invoice_paid=0,
+                    invoice_balance=round(row.total, 2),
+                    payment_status='pending'
+                )
+                for invoice_no, row in chunk.iterrows()
+            ]
+            # bulk_create sends no pre_save: the whole import rolls back on a closed-year date
+            block_closed_years_bulk(InvoiceMaster, invoices)
+            invoices = InvoiceMaster.objects.bulk_create(invoices)
+            purchases = [
+                _purchase_line(invoice, line, products[line['product_id']])
+                for invoice in invoices
+                for line in lines_by_invoice[invoice.invoice_no]
+            ]
+            PurchaseMaster.objects.bulk_create(purchases, batch_size=chunk_size)
+            record_changes(InvoiceMaster, [invoice.pk for invoice in invoices])
+            record_changes(PurchaseMaster, [purchase.pk for purchase in purchases])
+            lines_created += len(purchases)
+
+    # Cache: once per affected batch, then once per product
+    batches = df[['product_id', 'Batch No', '_expiry']].drop_duplicates()
+    for product_id, batch_no, expiry in batches.itertuples(index=False):
+        update_batch_cache(int(product_id), batch_no, expiry)
+    for product_id in batches['product_id'].unique():
+        update_product_cache(int(product_id))
+
+    return len(invoice_numbers), lines_created
+
+
+def _purchase_line(invoice, line, product):
+    """PurchaseMaster for one validated row; product = (name, company, packing)"""
+    quantity = line['Quantity']
+    net = line['_net']
+    gst = line['GST%']
+    return PurchaseMaster(
+        product_supplierid_id=invoice.supplierid_id,
+        product_invoiceid=invoice,
+        product_invoice_no=invoice.invoice_no,
+        productid_id=line['product_id'],
+        product_name=product[0],
+        product_company=product[1],
+        product_packing=product[2],
+        product_batch_no=line['Batch No'],
+        product_expiry=line['_expiry'],
+        product_MRP=line['MRP'],
+        product_purchase_rate=line['Purchase Rate'],
+        product_quantity=quantity,
+        product_discount_got=line['Discount'],
+        product_transportation_charges=0,
+        actual_rate_per_qty=round(net / quantity, 4),
+        product_actual_rate=round(net / quantity, 4),
+        total_amount=line['_total'],
+        purchase_entry_date=datetime.combine(invoice.invoice_date, time()),
+        CGST=gst / 2,
+        SGST=gst / 2,
+        purchase_calculation_mode='flat',
+        rate_a=line['Rate A'],
+        rate_b=line['Rate B'],
+        rate_c=line['Rate C'],
+    )
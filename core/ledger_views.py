@@ -2,64 +2,71 @@ from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.db.models import Sum
 from django.utils import timezone
+from datetime import date, datetime
 from .models import (
-    CustomerMaster, SupplierMaster, SalesInvoiceMaster, SalesMaster,
+    CustomerMaster, SupplierMaster, SalesInvoiceMaster,
     SalesInvoicePaid, ReturnSalesInvoiceMaster, InvoiceMaster, InvoicePaid,
     ReturnInvoiceMaster, Pharmacy_Details
 )
+from .opening_balances import live_rows, opening_balance
 
-@login_required
-def ledger_selection(request):
-    """Unified ledger selection page with both customers and suppliers"""
-    customers = CustomerMaster.objects.all().order_by('customer_name')
-    suppliers = SupplierMaster.objects.all().order_by('supplier_name')
-    
-    context = {
-        'title': 'Ledger Selection',
-        'customers': customers,
-        'suppliers': suppliers
-    }
-    return render(request, 'ledger/ledger_selection.html', context)
 
-@login_required
-def customer_ledger(request, customer_id=None):
-    customers = CustomerMaster.objects.all().order_by('customer_name')
-    
-    if not customer_id:
-        context = {'customers': customers, 'title': 'Select Customer'}
-        return render(request, 'ledger/customer_select.html', context)
-    
-    customer = get_object_or_404(CustomerMaster, customerid=customer_id)
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    transactions = []
-    
-    # Sales Invoices (Debit)
-    sales = SalesInvoiceMaster.objects.filter(customerid=customer).order_by('sales_invoice_date')
+def _in_range(queryset, date_field, start_date, end_date):
+    if start_date and end_date:
+        queryset = queryset.filter(**{f'{date_field}__range': [start_date, end_date]})
+    return queryset
+
+
+def _opening_row(opening, start_date, end_date):
+    """Totals carried forward from closed years, shown when the range starts before them"""
+    if opening is None:
+        return []
+    opening_date = date(opening.fy_year, 4, 1)
     if start_date and end_date:
-        sales = sales.filter(sales_invoice_date__range=[start_date, end_date])
+        try:
+            if datetime.strptime(start_date, '%Y-%m-%d').date() > opening_date:
+                return []
+        except ValueError:
+            pass
+    return [{
+        'date': opening_date,
+        'type': 'Opening Balance',
+        'reference': f'Up to FY {opening.fy_year - 1}-{str(opening.fy_year)[-2:]}',
+        'debit': opening.debit,
+        'credit': opening.credit
+    }]
+
+
+def _running_balance(transactions, sign):
+    """Sort by date and add the running balance; returns the closing balance"""
+    transactions.sort(key=lambda x: x['date'].date() if isinstance(x['date'], datetime) else x['date'])
+    balance = 0
+    for trans in transactions:
+        balance += sign * (trans['debit'] - trans['credit'])
+        trans['balance'] = balance
+    return balance
+
+
+def _customer_transactions(customer, start_date=None, end_date=None):
+    """Customer ledger rows: sales (debit), receipts and sales returns (credit); balance = debit - credit"""
+    transactions = _opening_row(opening_balance(customer=customer), start_date, end_date)
     
-    for sale in sales:
-        total = SalesMaster.objects.filter(sales_invoice_no=sale.sales_invoice_no).aggregate(
-            Sum('sale_total_amount'))['sale_total_amount__sum'] or 0
+    # Sales Invoices (Debit)
+    sales = _in_range(live_rows(SalesInvoiceMaster).filter(customerid=customer), 'sales_invoice_date', start_date, end_date)
+    for sale in sales.annotate(total=Sum('salesmaster__sale_total_amount')).order_by('sales_invoice_date'):
         transactions.append({
             'date': sale.sales_invoice_date,
             'type': 'Sales Invoice',
             'reference': sale.sales_invoice_no,
-            'debit': total,
+            'debit': sale.total or 0,
             'credit': 0,
             'invoice_obj': sale
         })
     
     # Payments (Credit)
-    payments = SalesInvoicePaid.objects.filter(
-        sales_ip_invoice_no__customerid=customer
-    ).order_by('sales_payment_date')
-    if start_date and end_date:
-        payments = payments.filter(sales_payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
+    payments = _in_range(live_rows(SalesInvoicePaid).filter(sales_ip_invoice_no__customerid=customer),
+                         'sales_payment_date', start_date, end_date)
+    for payment in payments.select_related('sales_ip_invoice_no').order_by('sales_payment_date'):
         transactions.append({
             'date': payment.sales_payment_date,
             'type': 'Payment',
@@ -70,13 +77,9 @@ def customer_ledger(request, customer_id=None):
         })
     
     # Sales Returns (Credit)
-    returns = ReturnSalesInvoiceMaster.objects.filter(
-        return_sales_customerid=customer
-    ).order_by('return_sales_invoice_date')
-    if start_date and end_date:
-        returns = returns.filter(return_sales_invoice_date__range=[start_date, end_date])
-    
-    for ret in returns:
+    returns = _in_range(live_rows(ReturnSalesInvoiceMaster).filter(return_sales_customerid=customer),
+                        'return_sales_invoice_date', start_date, end_date)
+    for ret in returns.order_by('return_sales_invoice_date'):
         transactions.append({
             'date': ret.return_sales_invoice_date,
             'type': 'Sales Return',
@@ -86,12 +89,78 @@ def customer_ledger(request, customer_id=None):
             'return_obj': ret
         })
     
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['debit'] - trans['credit']
-        trans['balance'] = balance
+    return transactions, _running_balance(transactions, 1)
+
+
+def _supplier_transactions(supplier, start_date=None, end_date=None):
+    """Supplier ledger rows: purchases (credit), payments and purchase returns (debit); balance = credit - debit"""
+    transactions = _opening_row(opening_balance(supplier=supplier), start_date, end_date)
+    
+    # Purchase Invoices (Credit)
+    purchases = _in_range(live_rows(InvoiceMaster).filter(supplierid=supplier), 'invoice_date', start_date, end_date)
+    for purchase in purchases.order_by('invoice_date'):
+        transactions.append({
+            'date': purchase.invoice_date,
+            'type': 'Purchase Invoice',
+            'reference': purchase.invoice_no,
+            'debit': 0,
+            'credit': purchase.invoice_total,
+            'invoice_obj': purchase
+        })
+    
+    # Payments (Debit)
+    payments = _in_range(live_rows(InvoicePaid).filter(ip_invoiceid__supplierid=supplier), 'payment_date', start_date, end_date)
+    for payment in payments.select_related('ip_invoiceid').order_by('payment_date'):
+        transactions.append({
+            'date': payment.payment_date,
+            'type': 'Payment',
+            'reference': payment.ip_invoiceid.invoice_no,
+            'debit': payment.payment_amount,
+            'credit': 0,
+            'invoice_obj': payment.ip_invoiceid
+        })
+    
+    # Purchase Returns (Debit)
+    returns = _in_range(live_rows(ReturnInvoiceMaster).filter(returnsupplierid=supplier),
+                        'returninvoice_date', start_date, end_date)
+    for ret in returns.order_by('returninvoice_date'):
+        transactions.append({
+            'date': ret.returninvoice_date,
+            'type': 'Purchase Return',
+            'reference': ret.returninvoiceid,
+            'debit': ret.returninvoice_total,
+            'credit': 0,
+            'return_obj': ret
+        })
+    
+    return transactions, _running_balance(transactions, -1)
+
+@login_required
+def ledger_selection(request):
+    """Unified ledger selection page with both customers and suppliers"""
+    customers = CustomerMaster.objects.all().order_by('customer_name')
+    suppliers = SupplierMaster.objects.all().order_by('supplier_name')
+    
+    context = {
+        'title': 'Ledger Selection',
+        'customers': customers,
+        'suppliers': suppliers
+    }
+    return render(request, 'ledger/ledger_selection.html', context)
+
+@login_required
+def customer_ledger(request, customer_id=None):
+    customers = CustomerMaster.objects.all().order_by('customer_name')
+    
+    if not customer_id:
+        context = {'customers': customers, 'title': 'Select Customer'}
+        return render(request, 'ledger/customer_select.html', context)
+    
+    customer = get_object_or_404(CustomerMaster, customerid=customer_id)
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    
+    transactions, balance = _customer_transactions(customer, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -130,63 +199,7 @@ def supplier_ledger(request, supplier_id=None):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    transactions = []
-    
-    # Purchase Invoices (Credit)
-    purchases = InvoiceMaster.objects.filter(supplierid=supplier).order_by('invoice_date')
-    if start_date and end_date:
-        purchases = purchases.filter(invoice_date__range=[start_date, end_date])
-    
-    for purchase in purchases:
-        transactions.append({
-            'date': purchase.invoice_date,
-            'type': 'Purchase Invoice',
-            'reference': purchase.invoice_no,
-            'debit': 0,
-            'credit': purchase.invoice_total,
-            'invoice_obj': purchase
-        })
-    
-    # Payments (Debit)
-    payments = InvoicePaid.objects.filter(
-        ip_invoiceid__supplierid=supplier
-    ).order_by('payment_date')
-    if start_date and end_date:
-        payments = payments.filter(payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'type': 'Payment',
-            'reference': payment.ip_invoiceid.invoice_no,
-            'debit': payment.payment_amount,
-            'credit': 0,
-            'invoice_obj': payment.ip_invoiceid
-        })
-    
-    # Purchase Returns (Debit)
-    returns = ReturnInvoiceMaster.objects.filter(
-        returnsupplierid=supplier
-    ).order_by('returninvoice_date')
-    if start_date and end_date:
-        returns = returns.filter(returninvoice_date__range=[start_date, end_date])
-    
-    for ret in returns:
-        transactions.append({
-            'date': ret.returninvoice_date,
-            'type': 'Purchase Return',
-            'reference': ret.returninvoiceid,
-            'debit': ret.returninvoice_total,
-            'credit': 0,
-            'return_obj': ret
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['credit'] - trans['debit']
-        trans['balance'] = balance
+    transactions, balance = _supplier_transactions(supplier, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -219,58 +232,7 @@ def customer_ledger_print(request, customer_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    transactions = []
-    
-    # Sales Invoices
-    sales = SalesInvoiceMaster.objects.filter(customerid=customer).order_by('sales_invoice_date')
-    if start_date and end_date:
-        sales = sales.filter(sales_invoice_date__range=[start_date, end_date])
-    
-    for sale in sales:
-        total = SalesMaster.objects.filter(sales_invoice_no=sale.sales_invoice_no).aggregate(
-            Sum('sale_total_amount'))['sale_total_amount__sum'] or 0
-        transactions.append({
-            'date': sale.sales_invoice_date,
-            'type': 'Sales Invoice',
-            'reference': sale.sales_invoice_no,
-            'debit': total,
-            'credit': 0
-        })
-    
-    # Payments
-    payments = SalesInvoicePaid.objects.filter(sales_ip_invoice_no__customerid=customer).order_by('sales_payment_date')
-    if start_date and end_date:
-        payments = payments.filter(sales_payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.sales_payment_date,
-            'type': 'Payment',
-            'reference': payment.sales_ip_invoice_no.sales_invoice_no,
-            'debit': 0,
-            'credit': payment.sales_payment_amount
-        })
-    
-    # Sales Returns
-    returns = ReturnSalesInvoiceMaster.objects.filter(return_sales_customerid=customer).order_by('return_sales_invoice_date')
-    if start_date and end_date:
-        returns = returns.filter(return_sales_invoice_date__range=[start_date, end_date])
-    
-    for ret in returns:
-        transactions.append({
-            'date': ret.return_sales_invoice_date,
-            'type': 'Sales Return',
-            'reference': ret.return_sales_invoice_no,
-            'debit': 0,
-            'credit': ret.return_sales_invoice_total
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['debit'] - trans['credit']
-        trans['balance'] = balance
+    transactions, balance = _customer_transactions(customer, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -297,56 +259,7 @@ def supplier_ledger_print(request, supplier_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    transactions = []
-    
-    # Purchase Invoices
-    purchases = InvoiceMaster.objects.filter(supplierid=supplier).order_by('invoice_date')
-    if start_date and end_date:
-        purchases = purchases.filter(invoice_date__range=[start_date, end_date])
-    
-    for purchase in purchases:
-        transactions.append({
-            'date': purchase.invoice_date,
-            'type': 'Purchase Invoice',
-            'reference': purchase.invoice_no,
-            'debit': 0,
-            'credit': purchase.invoice_total
-        })
-    
-    # Payments
-    payments = InvoicePaid.objects.filter(ip_invoiceid__supplierid=supplier).order_by('payment_date')
-    if start_date and end_date:
-        payments = payments.filter(payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'type': 'Payment',
-            'reference': payment.ip_invoiceid.invoice_no,
-            'debit': payment.payment_amount,
-            'credit': 0
-        })
-    
-    # Purchase Returns
-    returns = ReturnInvoiceMaster.objects.filter(returnsupplierid=supplier).order_by('returninvoice_date')
-    if start_date and end_date:
-        returns = returns.filter(returninvoice_date__range=[start_date, end_date])
-    
-    for ret in returns:
-        transactions.append({
-            'date': ret.returninvoice_date,
-            'type': 'Purchase Return',
-            'reference': ret.returninvoiceid,
-            'debit': ret.returninvoice_total,
-            'credit': 0
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['credit'] - trans['debit']
-        trans['balance'] = balance
+    transactions, balance = _supplier_transactions(supplier, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -382,43 +295,7 @@ def export_supplier_ledger_pdf(request, supplier_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    # Get transactions (same logic as supplier_ledger view)
-    transactions = []
-    
-    # Purchase Invoices
-    purchases = InvoiceMaster.objects.filter(supplierid=supplier).order_by('invoice_date')
-    if start_date and end_date:
-        purchases = purchases.filter(invoice_date__range=[start_date, end_date])
-    
-    for purchase in purchases:
-        transactions.append({
-            'date': purchase.invoice_date,
-            'type': 'Purchase Invoice',
-            'reference': purchase.invoice_no,
-            'debit': 0,
-            'credit': purchase.invoice_total
-        })
-    
-    # Payments
-    payments = InvoicePaid.objects.filter(ip_invoiceid__supplierid=supplier).order_by('payment_date')
-    if start_date and end_date:
-        payments = payments.filter(payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'type': 'Payment',
-            'reference': payment.ip_invoiceid.invoice_no,
-            'debit': payment.payment_amount,
-            'credit': 0
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['credit'] - trans['debit']
-        trans['balance'] = balance
+    transactions, balance = _supplier_transactions(supplier, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -510,43 +387,7 @@ def export_supplier_ledger_excel(request, supplier_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    # Get transactions (same logic as supplier_ledger view)
-    transactions = []
-    
-    # Purchase Invoices
-    purchases = InvoiceMaster.objects.filter(supplierid=supplier).order_by('invoice_date')
-    if start_date and end_date:
-        purchases = purchases.filter(invoice_date__range=[start_date, end_date])
-    
-    for purchase in purchases:
-        transactions.append({
-            'date': purchase.invoice_date,
-            'type': 'Purchase Invoice',
-            'reference': purchase.invoice_no,
-            'debit': 0,
-            'credit': purchase.invoice_total
-        })
-    
-    # Payments
-    payments = InvoicePaid.objects.filter(ip_invoiceid__supplierid=supplier).order_by('payment_date')
-    if start_date and end_date:
-        payments = payments.filter(payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'type': 'Payment',
-            'reference': payment.ip_invoiceid.invoice_no,
-            'debit': payment.payment_amount,
-            'credit': 0
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['credit'] - trans['debit']
-        trans['balance'] = balance
+    transactions, balance = _supplier_transactions(supplier, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -657,44 +498,7 @@ def export_customer_ledger_pdf(request, customer_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    transactions = []
-    
-    # Sales Invoices
-    sales = SalesInvoiceMaster.objects.filter(customerid=customer).order_by('sales_invoice_date')
-    if start_date and end_date:
-        sales = sales.filter(sales_invoice_date__range=[start_date, end_date])
-    
-    for sale in sales:
-        total = SalesMaster.objects.filter(sales_invoice_no=sale.sales_invoice_no).aggregate(
-            Sum('sale_total_amount'))['sale_total_amount__sum'] or 0
-        transactions.append({
-            'date': sale.sales_invoice_date,
-            'type': 'Sales Invoice',
-            'reference': sale.sales_invoice_no,
-            'debit': total,
-            'credit': 0
-        })
-    
-    # Payments
-    payments = SalesInvoicePaid.objects.filter(sales_ip_invoice_no__customerid=customer).order_by('sales_payment_date')
-    if start_date and end_date:
-        payments = payments.filter(sales_payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.sales_payment_date,
-            'type': 'Payment',
-            'reference': payment.sales_ip_invoice_no.sales_invoice_no,
-            'debit': 0,
-            'credit': payment.sales_payment_amount
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['debit'] - trans['credit']
-        trans['balance'] = balance
+    transactions, balance = _customer_transactions(customer, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -786,44 +590,7 @@ def export_customer_ledger_excel(request, customer_id):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     
-    transactions = []
-    
-    # Sales Invoices
-    sales = SalesInvoiceMaster.objects.filter(customerid=customer).order_by('sales_invoice_date')
-    if start_date and end_date:
-        sales = sales.filter(sales_invoice_date__range=[start_date, end_date])
-    
-    for sale in sales:
-        total = SalesMaster.objects.filter(sales_invoice_no=sale.sales_invoice_no).aggregate(
-            Sum('sale_total_amount'))['sale_total_amount__sum'] or 0
-        transactions.append({
-            'date': sale.sales_invoice_date,
-            'type': 'Sales Invoice',
-            'reference': sale.sales_invoice_no,
-            'debit': total,
-            'credit': 0
-        })
-    
-    # Payments
-    payments = SalesInvoicePaid.objects.filter(sales_ip_invoice_no__customerid=customer).order_by('sales_payment_date')
-    if start_date and end_date:
-        payments = payments.filter(sales_payment_date__range=[start_date, end_date])
-    
-    for payment in payments:
-        transactions.append({
-            'date': payment.sales_payment_date,
-            'type': 'Payment',
-            'reference': payment.sales_ip_invoice_no.sales_invoice_no,
-            'debit': 0,
-            'credit': payment.sales_payment_amount
-        })
-    
-    # Sort and calculate balance
-    transactions.sort(key=lambda x: x['date'])
-    balance = 0
-    for trans in transactions:
-        balance += trans['debit'] - trans['credit']
-        trans['balance'] = balance
+    transactions, balance = _customer_transactions(customer, start_date, end_date)
     
     total_debit = sum(t['debit'] for t in transactions)
     total_credit = sum(t['credit'] for t in transactions)
@@ -0,0 +1,73 @@
+"""
+Logging Handlers
+Used by settings.LOGGING: a JSON formatter that writes one object per line,
+and a queue handler that hands records to a background QueueListener so the
+request thread never waits on the console or the log file.
+"""
+import atexit
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+
+# LogRecord attributes that are not extra= fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger and message plus the
+    record's extra= fields. A dict passed as the message is merged in as is.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry['message'] = record.getMessage()
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Queues records for a QueueListener thread that passes them on to handlers.
+
+    Configured with the '()' key and a list of 'cfg://handlers.<name>'
+    references; dictConfig retries the handler once those are built.
+    """
+
+    def __init__(self, handlers):
+        targets = [handlers[index] for index in range(len(handlers))]
+        for target in targets:
+            if not isinstance(target, logging.Handler):
+                raise ValueError('target handler not configured yet')
+        super().__init__(Queue(-1))
+        self.listener = QueueListener(self.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # Instead of QueueHandler.prepare, which folds the traceback into the
+        # message and turns a dict message into a string
+        record = copy.copy(record)
+        if not isinstance(record.msg, dict):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
@@ -0,0 +1,124 @@
+"""
+Low Stock Service
+Low / out-of-stock products read straight from ProductInventoryCache.
+
+The cache already carries stock_status, which is classified against each
+product's own reorder level, so the low-stock list is a single indexed scan on
+(stock_status, total_stock). Recent sales velocity, the suggested reorder
+quantity and the latest purchase batch are added as SQL annotations - no
+per-product loop.
+"""
+from datetime import timedelta
+
+from django.core.paginator import Paginator
+from django.db.models import (
+    Case, When, Value, F, Q, Sum, Subquery, OuterRef, FloatField, CharField
+)
+from django.db.models.functions import Coalesce, Greatest, Ceil
+from django.utils import timezone
+
+from .models import (
+    ProductMaster, ProductInventoryCache, PurchaseMaster, SalesMaster, CustomerChallanMaster
+)
+
+
+DEFAULT_REORDER_LEVEL = 10
+VELOCITY_DAYS = 30      # sales window used to measure demand
+COVER_DAYS = 30         # stock to hold after reordering, in days of demand
+LOW_STOCK_STATUSES = ['low_stock', 'out_of_stock']
+
+
+def classify_stock(total_stock, reorder_level=DEFAULT_REORDER_LEVEL):
+    """stock_status for one product"""
+    if total_stock <= 0:
+        return 'out_of_stock'
+    if total_stock <= reorder_level:
+        return 'low_stock'
+    return 'in_stock'
+
+
+def refresh_stock_status(product_ids=None):
+    """
+    Re-classify cached products against their current reorder level with one
+    UPDATE (used when reorder levels change). Returns the number of rows touched.
+    """
+    reorder_level = ProductMaster.objects.filter(
+        productid=OuterRef('product_id')
+    ).values('product_reorder_level')[:1]
+
+    queryset = ProductInventoryCache.objects.all()
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+
+    return queryset.update(stock_status=Case(
+        When(total_stock__lte=0, then=Value('out_of_stock')),
+        When(total_stock__lte=Subquery(reorder_level), then=Value('low_stock')),
+        default=Value('in_stock'),
+        output_field=CharField(),
+    ))
+
+
+def _sold_since(model, product_field, qty_field, date_field, since):
+    """Correlated SUM of quantity sold per product since a date"""
+    return Subquery(
+        model.objects.filter(**{
+            product_field: OuterRef('product_id'),
+            f'{date_field}__gte': since,
+        }).order_by().values(product_field).annotate(
+            total=Sum(qty_field)
+        ).values('total')[:1],
+        output_field=FloatField()
+    )
+
+
+def get_low_stock_queryset(search=None, velocity_days=VELOCITY_DAYS, cover_days=COVER_DAYS):
+    """
+    ProductInventoryCache rows at or below their reorder level, annotated with:
+        sold_recent   - units sold (invoices + customer challans) in the window
+        daily_demand  - sold_recent / velocity_days
+        suggested_qty - units to order to hold cover_days of demand
+                        (never below the reorder level), rounded up
+        batch_no, expiry, mrp - from the latest purchase of the product
+    """
+    since = timezone.now() - timedelta(days=velocity_days)
+
+    latest_purchase = PurchaseMaster.objects.filter(
+        productid=OuterRef('product_id')
+    ).order_by('-purchase_entry_date', '-purchaseid')
+
+    queryset = ProductInventoryCache.objects.filter(
+        stock_status__in=LOW_STOCK_STATUSES
+    ).select_related('product')
+
+    if search:
+        queryset = queryset.filter(
+            Q(product__product_name__icontains=search) |
+            Q(product__product_company__icontains=search)
+        )
+
+    queryset = queryset.annotate(
+        sold_recent=(
+            Coalesce(_sold_since(SalesMaster, 'productid', 'sale_quantity', 'sale_entry_date', since), Value(0.0)) +
+            Coalesce(_sold_since(CustomerChallanMaster, 'product_id', 'sale_quantity', 'sales_entry_date', since), Value(0.0))
+        ),
+    ).annotate(
+        daily_demand=F('sold_recent') / Value(float(velocity_days)),
+    ).annotate(
+        suggested_qty=Ceil(Greatest(
+            Greatest(F('daily_demand') * Value(float(cover_days)), F('product__product_reorder_level')) - F('total_stock'),
+            Value(0.0),
+        )),
+        batch_no=Subquery(latest_purchase.values('product_batch_no')[:1]),
+        expiry=Subquery(latest_purchase.values('product_expiry')[:1]),
+        mrp=Subquery(latest_purchase.values('product_MRP')[:1]),
+    )
+
+    return queryset.order_by('total_stock', 'product__product_name')
+
+
+def get_low_stock_page(page_number, per_page=50, search=None,
+                       velocity_days=VELOCITY_DAYS, cover_days=COVER_DAYS):
+    """One page of the low-stock list"""
+    queryset = get_low_stock_queryset(search, velocity_days, cover_days)
+    paginator = Paginator(queryset, per_page)
+    return paginator.get_page(page_number)
@@ -2,46 +2,24 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.db import transaction
-from django.db.models import Sum
 from datetime import datetime
 import json
 
-from .models import ProductMaster, SupplierMaster, InvoiceMaster, PurchaseMaster, SalesMaster
+from .models import ProductMaster, SupplierMaster, InvoiceMaster, PurchaseMaster
+from .low_stock_service import get_low_stock_page
 
 @login_required
 def low_stock_update(request):
-    # Get low stock items
-    low_stock_items = []
-    products = ProductMaster.objects.all()
-    
-    for product in products:
-        purchases = PurchaseMaster.objects.filter(productid=product)
-        
-        # Skip products with no purchase history
-        if not purchases.exists():
-            continue
-            
-        sales = SalesMaster.objects.filter(productid=product)
-        
-        total_purchased = purchases.aggregate(total=Sum('product_quantity'))['total'] or 0
-        total_sold = sales.aggregate(total=Sum('sale_quantity'))['total'] or 0
-        current_stock = total_purchased - total_sold
-        
-        if current_stock <= 10:
-            # Get latest batch info
-            latest_purchase = purchases.order_by('-purchase_entry_date').first()
-            low_stock_items.append({
-                'product': product,
-                'current_stock': current_stock,
-                'batch_no': latest_purchase.product_batch_no if latest_purchase else '',
-                'expiry': latest_purchase.product_expiry if latest_purchase and latest_purchase.product_expiry else '',
-                'mrp': latest_purchase.product_MRP if latest_purchase else 0
-            })
+    # Low stock items come from ProductInventoryCache (one indexed query per page)
+    search_query = request.GET.get('search', '').strip()
+    page_obj = get_low_stock_page(request.GET.get('page'), per_page=50, search=search_query)
     
     suppliers = SupplierMaster.objects.all().order_by('supplier_name')
     
     return render(request, 'inventory/low_stock_update.html', {
-        'low_stock_items': low_stock_items,
+        'low_stock_items': page_obj,
+        'page_obj': page_obj,
+        'search_query': search_query,
         'suppliers': suppliers
     })
 
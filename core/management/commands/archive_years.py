@@ -0,0 +1,62 @@
+"""
+Management command to archive closed financial years (see core/archive_service.py)
+Usage:
+    python manage.py archive_years                        # archived years
+    python manage.py archive_years --through 2018 --check # what would be archived, and what blocks it
+    python manage.py archive_years --through 2018         # archive every year up to FY 2018-19
+
+Take a backup first, and copy ARCHIVE_DIR along with the database backups:
+the archived documents exist only in those files.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive_service import ArchiveError, archive_years, plan_archive
+from core.models import FinancialYearArchive
+
+
+class Command(BaseCommand):
+    help = 'Move closed financial years out of the database into compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--through', type=int, metavar='YEAR',
+                            help='Archive every financial year up to and including YEAR (e.g. 2018 for 2018-19)')
+        parser.add_argument('--check', action='store_true', help='With --through: report only, change nothing')
+
+    def handle(self, *args, **options):
+        if options['through'] is None:
+            self.print_status()
+            return
+
+        try:
+            plan = plan_archive(options['through'])
+        except ArchiveError as e:
+            raise CommandError(str(e))
+
+        years = ', '.join(f'{year}-{str(year + 1)[-2:]}' for year in plan['years'])
+        self.stdout.write(f"FY {years} (documents dated before {plan['cutoff']:%d-%m-%Y}):")
+        for name, count in plan['documents'].items():
+            self.stdout.write(f"    {name.replace('_', ' '):<20}{count:>10}")
+        for problem in plan['blocking']:
+            self.stdout.write(self.style.WARNING(f'  Not closed: {problem}'))
+
+        if options['check']:
+            return
+        if plan['blocking']:
+            raise CommandError('Settle the items above before archiving')
+
+        try:
+            plan = archive_years(options['through'], progress=self.stdout.write)
+        except ArchiveError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Archived FY {years}'))
+
+    def print_status(self):
+        archives = FinancialYearArchive.objects.all()
+        if not archives:
+            self.stdout.write('No archived financial years')
+            return
+        for archive in archives:
+            self.stdout.write(
+                f"FY {archive.fy_year}-{str(archive.fy_year + 1)[-2:]}: {sum(archive.row_counts.values())} rows, "
+                f"archived {archive.archived_at:%d-%m-%Y} to {archive.path}"
+            )
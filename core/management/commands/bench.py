@@ -0,0 +1,304 @@
+"""
+Management command to benchmark the hot paths in-process
+Usage:
+    python manage.py bench                          # small dataset, all scenarios
+    python manage.py bench --size large --repeat 5
+    python manage.py bench --only dashboard,inventory_list --output before.json
+    python manage.py bench --compare before.json    # print the change per scenario
+
+Runs against a separate test database (test_<NAME>, or in-memory on SQLite)
+seeded by core/bench_data.py, so the live data is never touched. Each
+scenario goes through the Django test client, full middleware stack
+included, and records wall time and the SQL query count of every run.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core.bench_data import DATASET_SIZES, seed_dataset
+
+
+BENCH_USERNAME = 'bench-admin'
+
+
+class _QueryCounter:
+    """connection.execute_wrapper counting statements (connection.queries stops at 9000)"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _sales_post_data(ctx):
+    """A five line sales invoice, posted the way the sales entry screen does"""
+    return {
+        'sales_invoice_date': datetime.now().strftime('%Y-%m-%d'),
+        'customerid': ctx['customer_id'],
+        'sales_transport_charges': 0,
+        'products_data': json.dumps([
+            {
+                'productid': product_id,
+                'batch_no': batch_no,
+                'expiry': expiry,
+                'mrp': mrp,
+                'sale_rate': round(mrp * 0.9, 2),
+                'quantity': 1,
+                'discount': 0,
+                'cgst': 6,
+                'sgst': 6,
+                'calculation_mode': 'flat',
+            }
+            for product_id, batch_no, expiry, mrp in ctx['sale_lines']
+        ]),
+    }
+
+
+# name -> (method, url builder, POST data builder or None)
+SCENARIOS = {
+    'dashboard': ('GET', lambda ctx: reverse('dashboard'), None),
+    'inventory_list': ('GET', lambda ctx: reverse('inventory_list'), None),
+    'inventory_search': ('GET', lambda ctx: reverse('inventory_list') + f"?search={ctx['search']}", None),
+    'product_search_suggestions': (
+        'GET', lambda ctx: reverse('product_search_suggestions') + f"?q={ctx['search']}", None
+    ),
+    'product_batches': (
+        'GET', lambda ctx: reverse('get_product_batches') + f"?product_id={ctx['product_id']}", None
+    ),
+    'batch_selector': (
+        'GET', lambda ctx: reverse('api_product_batch_selector') + f"?product_id={ctx['product_id']}", None
+    ),
+    'sales_posting': (
+        'POST', lambda ctx: reverse('add_sales_invoice_with_products'), _sales_post_data
+    ),
+    'customer_ledger': ('GET', lambda ctx: reverse('customer_ledger_detail', args=[ctx['customer_id']]), None),
+    'supplier_ledger': ('GET', lambda ctx: reverse('supplier_ledger_detail', args=[ctx['supplier_id']]), None),
+    'ageing_report': ('GET', lambda ctx: reverse('ageing_report'), None),
+    'stock_statement': ('GET', lambda ctx: reverse('stock_statement_report'), None),
+    'export_inventory_csv': ('GET', lambda ctx: reverse('export_inventory_csv'), None),
+    'export_sales_excel': ('GET', lambda ctx: reverse('export_sales_excel'), None),
+    'export_ageing_csv': ('GET', lambda ctx: reverse('export_ageing_report'), None),
+}
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seed a deterministic dataset in a test database and time the hot paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(DATASET_SIZES), default='small',
+                            help='Dataset preset (small / medium / large)')
+        parser.add_argument('--products', type=int, help='Override the number of products')
+        parser.add_argument('--lines', type=int, help='Override the number of purchase + sales lines')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the dataset')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per scenario (after one warm-up)')
+        parser.add_argument('--only', help='Comma separated scenario names')
+        parser.add_argument('--output', help='JSON results file (default bench_results/<timestamp>-<revision>.json)')
+        parser.add_argument('--compare', help='Previous JSON results to compare against')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the test database and reuse an already seeded dataset')
+        parser.add_argument('--list', action='store_true', help='List the scenarios and exit')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, (method, _, _) in SCENARIOS.items():
+                self.stdout.write(f'{method:5} {name}')
+            return
+
+        scenarios = list(SCENARIOS)
+        if options['only']:
+            scenarios = [name.strip() for name in options['only'].split(',') if name.strip()]
+            unknown = [name for name in scenarios if name not in SCENARIOS]
+            if unknown:
+                raise CommandError(f"Unknown scenario(s): {', '.join(unknown)}")
+
+        dataset = dict(DATASET_SIZES[options['size']])
+        if options['products']:
+            dataset['products'] = options['products']
+        if options['lines']:
+            dataset['lines'] = options['lines']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+        )
+        try:
+            counts, seed_seconds = self.seed(dataset, options['seed'])
+            with override_settings(QUERY_BUDGET_ENABLED=False):
+                ctx = self.build_context()
+                client = Client()
+                client.force_login(ctx['user'])
+                results = {name: self.run_scenario(client, name, ctx, options['repeat']) for name in scenarios}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'revision': _git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': dict(dataset, seed=options['seed'], rows=counts, seed_seconds=seed_seconds),
+            'repeat': options['repeat'],
+            'results': results,
+        }
+
+        output = options['output'] or os.path.join(
+            'bench_results', f"{datetime.now():%Y%m%d-%H%M%S}-{report['revision'] or 'local'}.json"
+        )
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+        self.print_results(results)
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+    def seed(self, dataset, seed):
+        from core.models import ProductMaster
+        if ProductMaster.objects.exists():
+            self.stdout.write('Reusing the seeded test database')
+            return None, 0
+
+        self.stdout.write(f"Seeding {dataset['products']} products / {dataset['lines']} lines on {connection.vendor}...")
+        start = time.perf_counter()
+        counts = seed_dataset(seed=seed, log=self.stdout.write, **dataset)
+        seconds = round(time.perf_counter() - start, 2)
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {seconds}s: {counts}'))
+        return counts, seconds
+
+    def build_context(self):
+        """Ids the scenarios point at - the busiest product / parties in the dataset"""
+        from core.models import (
+            Web_User, ProductMaster, CustomerMaster, SupplierMaster, BatchInventoryCache
+        )
+
+        user = Web_User.objects.filter(username=BENCH_USERNAME).first()
+        if user is None:
+            user = Web_User.objects.create_superuser(
+                username=BENCH_USERNAME, password=BENCH_USERNAME, email='', user_type='admin', user_contact='0'
+            )
+
+        product = ProductMaster.objects.annotate(lines=Count('purchasemaster')).order_by('-lines', 'productid').first()
+        customer = CustomerMaster.objects.annotate(invoices=Count('salesinvoicemaster')).order_by('-invoices').first()
+        supplier = SupplierMaster.objects.annotate(invoices=Count('invoicemaster')).order_by('-invoices').first()
+        if not (product and customer and supplier):
+            raise CommandError('The test database has no benchmark data - run without --keepdb')
+
+        sale_lines = list(
+            BatchInventoryCache.objects.filter(current_stock__gt=10).order_by('product_id', 'batch_no').values_list(
+                'product_id', 'batch_no', 'expiry_date', 'mrp'
+            )[:5]
+        )
+
+        return {
+            'user': user,
+            'product_id': product.productid,
+            'customer_id': customer.customerid,
+            'supplier_id': supplier.supplierid,
+            'search': product.product_name.split()[0][:4],
+            'sale_lines': sale_lines,
+        }
+
+    def run_scenario(self, client, name, ctx, repeat):
+        method, url_builder, data_builder = SCENARIOS[name]
+        url = url_builder(ctx)
+        timings, query_counts, status, error = [], [], None, None
+
+        for run in range(repeat + 1):
+            counter = _QueryCounter()
+            try:
+                with connection.execute_wrapper(counter):
+                    start = time.perf_counter()
+                    if method == 'POST':
+                        response = client.post(url, data_builder(ctx))
+                    else:
+                        response = client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                break
+            status = response.status_code
+            if run == 0:
+                continue  # warm-up
+            timings.append(elapsed)
+            query_counts.append(counter.count)
+
+        result = {
+            'method': method, 'url': url, 'status': status,
+            'queries': max(query_counts) if query_counts else None,
+            # one count per timed run; they differ when a run hits a cold cache or writes
+            'query_counts': query_counts,
+        }
+        if timings:
+            result.update({
+                'runs': len(timings),
+                'median_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(_percentile(timings, 95), 2),
+                'min_ms': round(min(timings), 2),
+                'max_ms': round(max(timings), 2),
+            })
+        if error:
+            result['error'] = error
+        return result
+
+    def print_results(self, results):
+        self.stdout.write(f"\n{'Scenario':<28}{'Status':>7}{'Median ms':>12}{'p95 ms':>10}{'Queries':>9}")
+        for name, result in results.items():
+            if 'median_ms' not in result:
+                self.stdout.write(self.style.ERROR(f"{name:<28}{'-':>7}  {result.get('error', 'no runs')}"))
+                continue
+            counts = result['query_counts']
+            queries = f"{min(counts)}-{max(counts)}" if min(counts) != max(counts) else str(result['queries'])
+            line = f"{name:<28}{result['status']:>7}{result['median_ms']:>12.1f}{result['p95_ms']:>10.1f}{queries:>9}"
+            self.stdout.write(self.style.WARNING(line) if result['status'] >= 400 else line)
+
+    def print_comparison(self, path, results):
+        try:
+            with open(path) as handle:
+                baseline = json.load(handle)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        self.stdout.write(f"\nCompared with {path}")
+        self.stdout.write(f"{'Scenario':<28}{'Median ms':>20}{'Change':>9}{'Queries':>14}")
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before or 'median_ms' not in before or 'median_ms' not in result:
+                continue
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+            self.stdout.write(
+                f"{name:<28}{before['median_ms']:>9.1f} -> {result['median_ms']:<7.1f}{change:>+8.1f}%"
+                f"{before['queries']:>6} -> {result['queries']}"
+            )
@@ -0,0 +1,58 @@
+"""
+Management command to close financial years (see core/year_close.py)
+Usage:
+    python manage.py close_year                     # closed years
+    python manage.py close_year --year 2023 --check # what blocks closing FY 2023-24
+    python manage.py close_year --year 2023         # close every open year up to FY 2023-24
+
+Closed years are read-only. Take a backup first.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import FinancialYearClose
+from core.year_close import YearCloseError, blocking_items, check_closable, close_year, year_cutoff, year_label
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the closing stock and balances of a financial year as the opening of the next one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, metavar='YEAR',
+                            help='Close every financial year up to and including YEAR (e.g. 2023 for 2023-24)')
+        parser.add_argument('--check', action='store_true', help='With --year: report only, change nothing')
+
+    def handle(self, *args, **options):
+        fy_year = options['year']
+        if fy_year is None:
+            self.print_status()
+            return
+
+        try:
+            check_closable(fy_year)
+        except YearCloseError as e:
+            raise CommandError(str(e))
+
+        problems = blocking_items(year_cutoff(fy_year))
+        for problem in problems:
+            self.stdout.write(self.style.WARNING(f'  Not ready: {problem}'))
+        if options['check']:
+            if not problems:
+                self.stdout.write(f'FY {year_label(fy_year)} can be closed')
+            return
+
+        try:
+            counts = close_year(fy_year)
+        except YearCloseError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Closed FY {year_label(fy_year)}: {counts['stock_rows']} opening stock rows, "
+            f"{counts['balance_rows']} opening balances for FY {year_label(fy_year + 1)}"
+        ))
+
+    def print_status(self):
+        closes = FinancialYearClose.objects.all()
+        if not closes:
+            self.stdout.write('No closed financial years')
+            return
+        for close in closes:
+            self.stdout.write(f'FY {year_label(close.fy_year)}: closed {close.closed_at:%d-%m-%Y}')
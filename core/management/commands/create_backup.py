@@ -1,21 +1,68 @@
-from django.core.management.base import BaseCommand
-from django.core.management import call_command
-import os
-import shutil
-from datetime import datetime
+"""
+Management command to back up the database
+Usage:
+    python manage.py create_backup                         # BACKUP_FORMAT (custom by default)
+    python manage.py create_backup --format directory --jobs 8
+    python manage.py create_backup --prune-only            # apply retention, no backup
+    python manage.py create_backup --incremental           # rows changed since the last backup (hourly)
+
+PostgreSQL is dumped with pg_dump (-Fc or -Fd -j N), other databases as
+gzipped JSON Lines - see core/backup_service.py. Old backups are pruned
+afterwards (BACKUP_KEEP_LAST / BACKUP_KEEP_DAYS).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backup_service import job_progress, prune_backups, run_backup, run_incremental_backup, update_job
+
 
 class Command(BaseCommand):
     help = 'Create database backup'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['custom', 'directory'], help='pg_dump format (PostgreSQL only)')
+        parser.add_argument('--jobs', type=int, help='Parallel pg_dump jobs for --format directory')
+        parser.add_argument('--no-prune', action='store_true', help='Keep old backups')
+        parser.add_argument('--prune-only', action='store_true', help='Only delete backups past retention')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only the rows changed since the last full / incremental backup')
+        parser.add_argument('--job', help='Job id to report progress to (set by the backup page)')
+
     def handle(self, *args, **options):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_dir = 'backups'
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Backup SQLite
-        source = 'db.sqlite3'
-        destination = os.path.join(backup_dir, f'backup_{timestamp}.sqlite3')
-        shutil.copy2(source, destination)
-        
-        self.stdout.write(self.style.SUCCESS(f'✅ Backup created: {destination}'))
-        return destination
+        if options['prune_only']:
+            for filename in prune_backups():
+                self.stdout.write(f'Deleted {filename}')
+            return
+
+        job = options['job']
+        if options['incremental']:
+            return self.incremental(job)
+
+        try:
+            filename = run_backup(
+                fmt=options['format'], jobs=options['jobs'], progress=job_progress(job, self.stdout)
+            )
+            deleted = [] if options['no_prune'] else prune_backups()
+        except Exception as e:
+            if job:
+                update_job(job, state='failed', message=f'Backup failed: {e}')
+            raise CommandError(f'Backup failed: {e}')
+
+        message = f'Backup created: {filename}'
+        if deleted:
+            message += f' ({len(deleted)} old backups removed)'
+        if job:
+            update_job(job, state='done', progress=100, message=message, filename=filename)
+        self.stdout.write(self.style.SUCCESS(f'✅ {message}'))
+
+    def incremental(self, job):
+        try:
+            segment = run_incremental_backup(progress=job_progress(job, self.stdout))
+        except Exception as e:
+            if job:
+                update_job(job, state='failed', message=f'Incremental backup failed: {e}')
+            raise CommandError(f'Incremental backup failed: {e}')
+
+        message = f'Incremental backup created: {segment}' if segment else 'No changes since the last backup'
+        if job:
+            update_job(job, state='done', progress=100, message=message, filename=segment)
+        self.stdout.write(self.style.SUCCESS(f'✅ {message}'))
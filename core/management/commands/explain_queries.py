@@ -0,0 +1,184 @@
+"""
+Management command to show the query plans of the hot stock / report queries
+Usage:
+    python manage.py explain_queries --output before.json
+    python manage.py migrate
+    python manage.py explain_queries --compare before.json
+    python manage.py explain_queries --analyze --verbose --only batch_purchase
+
+Covers the per-batch stock aggregates (product, batch, expiry) on every
+movement table and the financial-year filters from apply_year_filter. Each
+plan is summarised as its scan nodes, e.g. "Index Only Scan using
+purchase_batch_idx on core_purchasemaster" vs "Seq Scan on ...".
+"""
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from core.models import (
+    PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
+    SupplierChallanMaster, CustomerChallanMaster, StockIssueDetail,
+    InvoiceMaster, SalesInvoiceMaster, ReturnInvoiceMaster, ReturnSalesInvoiceMaster,
+    Challan1, CustomerChallan, StockIssueMaster,
+)
+from core.year_filter_utils import get_current_financial_year, get_financial_year_dates
+
+
+# name -> (model, product field, batch field, expiry field, quantity field)
+BATCH_QUERIES = {
+    'batch_purchase': (PurchaseMaster, 'productid', 'product_batch_no', 'product_expiry', 'product_quantity'),
+    'batch_sales': (SalesMaster, 'productid', 'product_batch_no', 'product_expiry', 'sale_quantity'),
+    'batch_purchase_return': (ReturnPurchaseMaster, 'returnproductid', 'returnproduct_batch_no', None, 'returnproduct_quantity'),
+    'batch_sales_return': (ReturnSalesMaster, 'return_productid', 'return_product_batch_no', 'return_product_expiry', 'return_sale_quantity'),
+    'batch_supplier_challan': (SupplierChallanMaster, 'product_id', 'product_batch_no', 'product_expiry', 'product_quantity'),
+    'batch_customer_challan': (CustomerChallanMaster, 'product_id', 'product_batch_no', 'product_expiry', 'sale_quantity'),
+    'batch_stock_issue': (StockIssueDetail, 'product', 'batch_no', 'expiry_date', 'quantity_issued'),
+}
+
+# name -> (model, date field) as filtered by apply_year_filter
+YEAR_QUERIES = {
+    'fy_purchase_invoices': (InvoiceMaster, 'invoice_date'),
+    'fy_sales_invoices': (SalesInvoiceMaster, 'sales_invoice_date'),
+    'fy_purchase_returns': (ReturnInvoiceMaster, 'returninvoice_date'),
+    'fy_sales_returns': (ReturnSalesInvoiceMaster, 'return_sales_invoice_date'),
+    'fy_supplier_challans': (Challan1, 'challan_date'),
+    'fy_customer_challans': (CustomerChallan, 'customer_challan_date'),
+    'fy_stock_issues': (StockIssueMaster, 'issue_date'),
+}
+
+PG_SCAN = re.compile(r'((?:Parallel )?(?:Seq Scan|Index Only Scan|Index Scan|Bitmap Heap Scan|Bitmap Index Scan))'
+                     r'(?: Backward)?(?: using (\S+))? on (\S+)')
+SQLITE_SCAN = re.compile(r'\b(SCAN|SEARCH) (\S+)(?: USING (?:COVERING )?INDEX (\S+))?')
+PG_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+
+
+def summarise(plan):
+    """Scan nodes of a plan, in order"""
+    if connection.vendor == 'postgresql':
+        scans = []
+        for node, index, table in PG_SCAN.findall(plan):
+            if node == 'Bitmap Index Scan':
+                scans.append(f'{node} using {table}')  # "on <index>" for bitmap index nodes
+            else:
+                scans.append(f'{node} using {index} on {table}' if index else f'{node} on {table}')
+        return scans
+    return [
+        f'{kind} {table} USING INDEX {index}' if index else f'{kind} {table}'
+        for kind, table, index in SQLITE_SCAN.findall(plan)
+    ]
+
+
+def is_full_scan(scan):
+    return scan.startswith(('Seq Scan', 'Parallel Seq Scan')) or (scan.startswith('SCAN ') and 'USING' not in scan)
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the batch stock aggregates and financial-year filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (PostgreSQL; runs the queries)')
+        parser.add_argument('--verbose', action='store_true', help='Print the full plans')
+        parser.add_argument('--only', help='Comma separated query names (prefix match)')
+        parser.add_argument('--product', type=int, help='Product id for the batch queries (default: latest purchase)')
+        parser.add_argument('--batch', help='Batch number for the batch queries')
+        parser.add_argument('--expiry', help='Expiry (MM-YYYY) for the batch queries')
+        parser.add_argument('--year', type=int, help='Financial year start for the year queries (default: current)')
+        parser.add_argument('--output', help='Write the plans to this JSON file')
+        parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        sample = self.sample_batch(options)
+        start_date, end_date = get_financial_year_dates(options['year'] or get_current_financial_year())
+
+        queries = {}
+        for name, (model, product, batch, expiry, quantity) in BATCH_QUERIES.items():
+            filters = {product: sample['product'], batch: sample['batch']}
+            if expiry:
+                filters[expiry] = sample['expiry']
+            queries[name] = model.objects.filter(**filters).order_by().values(product).annotate(total=Sum(quantity))
+        for name, (model, date_field) in YEAR_QUERIES.items():
+            queries[name] = model.objects.filter(
+                **{f'{date_field}__gte': start_date, f'{date_field}__lte': end_date}
+            ).order_by(f'-{date_field}')[:50]
+
+        if options['only']:
+            prefixes = [name.strip() for name in options['only'].split(',') if name.strip()]
+            queries = {name: qs for name, qs in queries.items() if name.startswith(tuple(prefixes))}
+            if not queries:
+                raise CommandError('No query matches --only')
+
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze needs PostgreSQL')
+            explain_options = {'analyze': True, 'buffers': True}
+
+        self.stdout.write(
+            f"{connection.vendor}: batch product={sample['product']} batch={sample['batch']} "
+            f"expiry={sample['expiry']}, year {start_date} - {end_date}\n"
+        )
+        results = {}
+        for name, queryset in queries.items():
+            plan = queryset.explain(**explain_options)
+            timing = PG_TIME.search(plan)
+            results[name] = {
+                'scans': summarise(plan),
+                'ms': float(timing.group(1)) if timing else None,
+                'plan': plan,
+            }
+            self.print_result(name, results[name], options['verbose'])
+
+        full_scans = [name for name, result in results.items() if any(is_full_scan(s) for s in result['scans'])]
+        if full_scans:
+            self.stdout.write(self.style.WARNING(f"\nFull table scans: {', '.join(full_scans)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nEvery query uses an index'))
+
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump({'database': connection.vendor, 'sample': sample, 'results': results}, handle, indent=2)
+            self.stdout.write(f"Plans written to {options['output']}")
+
+    def sample_batch(self, options):
+        if options['product'] and options['batch']:
+            return {'product': options['product'], 'batch': options['batch'], 'expiry': options['expiry'] or ''}
+        latest = PurchaseMaster.objects.order_by('-purchaseid').values(
+            'productid', 'product_batch_no', 'product_expiry'
+        ).first()
+        if latest is None:
+            return {'product': 0, 'batch': '', 'expiry': ''}
+        return {'product': latest['productid'], 'batch': latest['product_batch_no'], 'expiry': latest['product_expiry']}
+
+    def print_result(self, name, result, verbose):
+        scans = '; '.join(result['scans']) or '(no table access)'
+        timing = f" [{result['ms']:.2f} ms]" if result['ms'] is not None else ''
+        line = f'{name:<24}{scans}{timing}'
+        self.stdout.write(self.style.WARNING(line) if any(is_full_scan(s) for s in result['scans']) else line)
+        if verbose:
+            for plan_line in result['plan'].splitlines():
+                self.stdout.write(f'    {plan_line}')
+
+    def print_comparison(self, path, results):
+        try:
+            with open(path) as handle:
+                baseline = json.load(handle)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        self.stdout.write(f'\nCompared with {path}')
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if before['scans'] == result['scans']:
+                self.stdout.write(f'{name:<24}unchanged')
+                continue
+            self.stdout.write(f'{name:<24}{"; ".join(before["scans"])}')
+            self.stdout.write(f'{"":<21}-> {"; ".join(result["scans"])}')
+            if before.get('ms') is not None and result.get('ms') is not None:
+                self.stdout.write(f'{"":<24}{before["ms"]:.2f} ms -> {result["ms"]:.2f} ms')
@@ -0,0 +1,125 @@
+"""
+Management command to generate production-scale test data quickly
+Usage:
+    python manage.py generate_bulk_data --products 5000 --purchase-invoices 100000 --sales-invoices 200000
+    python manage.py generate_bulk_data --purchase-invoices 20000 --copy          # existing masters, COPY on PostgreSQL
+    python manage.py generate_bulk_data --clear                                   # remove rows from earlier runs
+
+Signals are disconnected while the rows are written with bulk_create (or
+COPY for the line tables), so nothing is recalculated per row; balances and
+the inventory cache are rebuilt set-wise once at the end.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bench_data import DatasetBuilder, delete_generated
+from core.inventory_cache import rebuild_cache_setwise
+from core.models import InvoiceMaster
+from core.signals import signals_disabled
+
+
+def _range(value):
+    """'2-6' -> (2, 6); '3' -> (3, 3)"""
+    try:
+        low, _, high = value.partition('-')
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise CommandError(f'Expected a number or a range like 2-6, got {value!r}')
+    if low < 1 or high < low:
+        raise CommandError(f'Invalid range {value!r}')
+    return low, high
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate products, invoices, payments, challans and returns for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=0, help='New products to create (0 = use existing products)')
+        parser.add_argument('--suppliers', type=int, default=0, help='New suppliers to create (0 = use existing suppliers)')
+        parser.add_argument('--customers', type=int, default=0, help='New customers to create (0 = use existing customers)')
+        parser.add_argument('--purchase-invoices', type=int, default=10000)
+        parser.add_argument('--sales-invoices', type=int, default=20000)
+        parser.add_argument('--supplier-challans', type=int, default=0)
+        parser.add_argument('--customer-challans', type=int, default=0)
+        parser.add_argument('--lines-per-invoice', default='1-8', help='Line items per invoice / challan, e.g. 1-8')
+        parser.add_argument('--batches-per-product', default='2-6', help='Batches per product, e.g. 2-6')
+        parser.add_argument('--paid', type=float, default=0.4, help='Share of invoices fully paid')
+        parser.add_argument('--partial', type=float, default=0.3, help='Share of invoices part paid')
+        parser.add_argument('--returns', type=float, default=0.02, help='Sales return lines per sales line')
+        parser.add_argument('--days', type=int, default=365, help='Days of history ending today')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='GEN', help='Prefix for generated document numbers and names')
+        parser.add_argument('--copy', action='store_true', help='Load line tables with COPY (PostgreSQL only)')
+        parser.add_argument('--clear', action='store_true', help='Delete rows generated with this prefix first')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if not prefix or len(prefix) > 6:
+            raise CommandError('--prefix must be 1-6 characters')
+        if options['paid'] + options['partial'] > 1:
+            raise CommandError('--paid + --partial cannot exceed 1')
+
+        start = time.perf_counter()
+        with signals_disabled():
+            if options['clear']:
+                deleted = delete_generated(prefix)
+                self.stdout.write(f'Deleted {deleted} rows generated with prefix {prefix}')
+            elif InvoiceMaster.objects.filter(invoice_no__startswith=f'{prefix}P').exists():
+                raise CommandError(f'Data with prefix {prefix} already exists - use --clear or another --prefix')
+
+            builder = DatasetBuilder(
+                seed=options['seed'],
+                prefix=prefix,
+                use_copy=options['copy'],
+                log=self.stdout.write,
+                profile={
+                    'lines_per_invoice': _range(options['lines_per_invoice']),
+                    'batches_per_product': _range(options['batches_per_product']),
+                    'paid': options['paid'],
+                    'partial': options['partial'],
+                    'returns': options['returns'],
+                    'days': options['days'],
+                },
+            )
+            if options['copy'] and not builder.use_copy:
+                self.stdout.write(self.style.WARNING('COPY needs PostgreSQL - using bulk_create'))
+
+            if not (options['purchase_invoices'] or options['sales_invoices']
+                    or options['supplier_challans'] or options['customer_challans']):
+                if options['clear']:
+                    rebuild_cache_setwise()
+                    return
+                raise CommandError('Nothing to generate')
+
+            builder.use_existing_masters()
+            if options['suppliers'] or options['customers']:
+                existing_suppliers, existing_customers = builder.suppliers, builder.customers
+                builder.create_parties(options['suppliers'], options['customers'])
+                builder.suppliers = builder.suppliers or existing_suppliers
+                builder.customers = builder.customers or existing_customers
+            if options['products']:
+                builder.create_products(options['products'])
+            if not (builder.suppliers and builder.customers and builder.products):
+                raise CommandError('Need suppliers, customers and products - add some or pass --suppliers/--customers/--products')
+
+            self.stdout.write(f"Creating batches for {len(builder.products)} products...")
+            builder.create_batches()
+            self.stdout.write(f"Creating {options['purchase_invoices']} purchase invoices...")
+            builder.create_purchases(builder.invoice_count_sizes(options['purchase_invoices']))
+            self.stdout.write(f"Creating {options['sales_invoices']} sales invoices...")
+            builder.create_sales(builder.invoice_count_sizes(options['sales_invoices']))
+            if options['supplier_challans'] or options['customer_challans']:
+                self.stdout.write('Creating challans...')
+                builder.create_challans(
+                    builder.invoice_count_sizes(options['supplier_challans']),
+                    builder.invoice_count_sizes(options['customer_challans'])
+                )
+            self.stdout.write('Creating returns...')
+            builder.create_returns()
+            counts = builder.finish()
+
+        elapsed = time.perf_counter() - start
+        for key, value in counts.items():
+            self.stdout.write(f'  {key}: {value}')
+        self.stdout.write(self.style.SUCCESS(f'Generated in {elapsed:.1f}s'))
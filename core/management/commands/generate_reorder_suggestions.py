@@ -0,0 +1,24 @@
+"""
+Management command to regenerate reorder suggestions for the whole catalogue
+Usage: python manage.py generate_reorder_suggestions [--cover-days 30]
+Schedule it nightly (cron / Task Scheduler) after the inventory cache is current.
+"""
+from django.core.management.base import BaseCommand
+from core.reorder_engine import generate_reorder_suggestions, DEFAULT_COVER_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Recompute reorder suggestions from sales velocity, stock and supplier lead time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cover-days', type=int, default=DEFAULT_COVER_DAYS,
+                            help='Days of demand to hold after the order arrives')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Generating reorder suggestions...'))
+        
+        stored, to_order = generate_reorder_suggestions(cover_days=options['cover_days'])
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Done! {stored} products analysed, {to_order} need reordering.'
+        ))
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from core.models import InvoiceMaster, PurchaseMaster, SupplierMaster, ProductMaster
+from core.inventory_cache import rebuild_cache_setwise
+from core.signals import signals_disabled
 from datetime import datetime, timedelta
 import random
 
@@ -26,35 +28,23 @@ class Command(BaseCommand):
         total_invoices = 100000
         start_date = datetime.now() - timedelta(days=365)
         
-        for batch_num in range(0, total_invoices, batch_size):
-            invoices_to_create = []
-            purchases_to_create = []
-            
-            with transaction.atomic():
-                for i in range(batch_size):
-                    if batch_num + i >= total_invoices:
-                        break
-                    
+        with signals_disabled():
+            for batch_num in range(0, total_invoices, batch_size):
+                invoices_to_create = []
+                purchases_to_create = []
+                
+                for i in range(min(batch_size, total_invoices - batch_num)):
                     # Random invoice data
                     supplier = random.choice(suppliers)
                     invoice_date = start_date + timedelta(days=random.randint(0, 365))
                     invoice_no = f'TEST-INV-{batch_num + i + 1:06d}'
-                    
-                    # Create invoice
-                    invoice = InvoiceMaster.objects.create(
-                        supplierid=supplier,
-                        invoice_no=invoice_no,
-                        invoice_date=invoice_date,
-                        invoice_total=0,
-                        invoice_paid=0,
-                        transport_charges=random.uniform(0, 500)
-                    )
+                    transport_charges = random.uniform(0, 500)
                     
                     # Add 1-5 products per invoice
-                    num_products = random.randint(1, 5)
+                    lines = []
                     invoice_total = 0
                     
-                    for _ in range(num_products):
+                    for _ in range(random.randint(1, 5)):
                         product = random.choice(products)
                         quantity = random.randint(10, 100)
                         rate = random.uniform(10, 500)
@@ -64,9 +54,8 @@ class Command(BaseCommand):
                         total = actual_rate * quantity
                         invoice_total += total
                         
-                        PurchaseMaster.objects.create(
+                        lines.append(PurchaseMaster(
                             product_supplierid=supplier,
-                            product_invoiceid=invoice,
                             product_invoice_no=invoice_no,
                             productid=product,
                             product_name=product.product_name,
@@ -86,13 +75,32 @@ class Command(BaseCommand):
                             product_actual_rate=actual_rate,
                             total_amount=total,
                             product_transportation_charges=0
-                        )
+                        ))
                     
-                    # Update invoice total
-                    invoice.invoice_total = invoice_total + invoice.transport_charges
-                    invoice.invoice_paid = random.uniform(0, invoice_total) if random.random() > 0.3 else 0
-                    invoice.save()
-            
-            self.stdout.write(f'Created {batch_num + batch_size}/{total_invoices} invoices...')
+                    # bulk_create skips save(), so set the stored balance / status here
+                    invoice_total += transport_charges
+                    invoice_paid = random.uniform(0, invoice_total) if random.random() > 0.3 else 0
+                    invoices_to_create.append(InvoiceMaster(
+                        supplierid=supplier,
+                        invoice_no=invoice_no,
+                        invoice_date=invoice_date,
+                        invoice_total=invoice_total,
+                        invoice_paid=invoice_paid,
+                        invoice_balance=invoice_total - invoice_paid,
+                        payment_status='partial' if invoice_paid > 0 else 'pending',
+                        transport_charges=transport_charges
+                    ))
+                    purchases_to_create.append(lines)
+                
+                with transaction.atomic():
+                    invoices = InvoiceMaster.objects.bulk_create(invoices_to_create)
+                    for invoice, lines in zip(invoices, purchases_to_create):
+                        for line in lines:
+                            line.product_invoiceid = invoice
+                    PurchaseMaster.objects.bulk_create([line for lines in purchases_to_create for line in lines])
+                
+                self.stdout.write(f'Created {batch_num + len(invoices_to_create)}/{total_invoices} invoices...')
         
+        self.stdout.write('Rebuilding inventory cache...')
+        rebuild_cache_setwise()
         self.stdout.write(self.style.SUCCESS(f'Successfully created {total_invoices} test invoices!'))
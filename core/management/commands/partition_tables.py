@@ -0,0 +1,112 @@
+"""
+Management command for financial-year partitioning (PostgreSQL, see core/partitioning.py)
+Usage:
+    python manage.py partition_tables                      # status
+    python manage.py partition_tables --convert --dry-run  # print the SQL
+    python manage.py partition_tables --convert            # partition every table
+    python manage.py partition_tables --convert --tables salesmaster,purchasemaster
+    python manage.py partition_tables --add-years 1        # partitions up to next year
+    python manage.py partition_tables --detach 2014        # take 2014-15 out of the tables
+    python manage.py partition_tables --attach 2014
+
+--convert rewrites each table in one transaction holding an exclusive lock:
+take a backup (create_backup) and run it outside business hours. Foreign
+keys into invoicemaster (from invoicepaid and purchasemaster) are dropped:
+the database stops checking that their invoice exists. Foreign keys to
+sales_invoice_no now reference the lookup table that keeps sales invoice
+numbers unique across years; invoice number + supplier gets one too. The
+notes printed per table list every such change.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.partitioning import (
+    PARTITION_KEYS, check_database, is_partitioned, list_partitions, plan_conversion,
+    convert_table, add_partitions, detach_year, attach_year,
+)
+from core.year_filter_utils import get_current_financial_year
+
+
+class Command(BaseCommand):
+    help = ('Partition the transaction tables by financial year (PostgreSQL). Foreign keys into '
+            'invoicemaster are dropped; invoice numbers stay unique across years through lookup tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', help='Comma separated tables (default: all of ' + ', '.join(PARTITION_KEYS) + ')')
+        parser.add_argument('--convert', action='store_true', help='Convert the tables into partitioned tables')
+        parser.add_argument('--dry-run', action='store_true', help='With --convert: print the SQL, change nothing')
+        parser.add_argument('--first-year', type=int, help='With --convert: first yearly partition (default: oldest row)')
+        parser.add_argument('--add-years', type=int, metavar='N',
+                            help='Create missing partitions up to the current financial year + N')
+        parser.add_argument('--detach', type=int, metavar='YEAR', help='Detach the partition of financial year YEAR')
+        parser.add_argument('--attach', type=int, metavar='YEAR', help='Attach a detached partition again')
+
+    def handle(self, *args, **options):
+        try:
+            check_database()
+        except ValueError as e:
+            raise CommandError(str(e))
+        tables = self.selected_tables(options['tables'])
+
+        try:
+            if options['convert']:
+                self.convert(tables, options)
+            elif options['add_years'] is not None:
+                last_year = get_current_financial_year() + options['add_years']
+                for table in self.partitioned(tables):
+                    created = add_partitions(table, last_year)
+                    self.stdout.write(f"{table}: {', '.join(created) if created else 'nothing to add'}")
+            elif options['detach'] is not None:
+                for table in self.partitioned(tables):
+                    self.stdout.write(f"{table}: detached {detach_year(table, options['detach'])}")
+            elif options['attach'] is not None:
+                for table in self.partitioned(tables):
+                    self.stdout.write(f"{table}: attached {attach_year(table, options['attach'])}")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not options['dry_run']:
+            self.print_status(tables)
+
+    def selected_tables(self, value):
+        if not value:
+            return list(PARTITION_KEYS)
+        tables = []
+        for name in value.split(','):
+            name = name.strip().lower()
+            table = name if name in PARTITION_KEYS else f'core_{name}'
+            if table not in PARTITION_KEYS:
+                raise CommandError(f"Unknown table {name} (choose from {', '.join(PARTITION_KEYS)})")
+            tables.append(table)
+        return tables
+
+    def partitioned(self, tables):
+        missing = [table for table in tables if not is_partitioned(table)]
+        if missing:
+            raise CommandError(f"Not partitioned yet: {', '.join(missing)} (run --convert first)")
+        return tables
+
+    def convert(self, tables, options):
+        for table in tables:
+            if is_partitioned(table):
+                self.stdout.write(f'{table}: already partitioned')
+                continue
+            if options['dry_run']:
+                statements, notes = plan_conversion(table, options['first_year'])
+                self.stdout.write(f'-- {table}')
+                for statement in statements:
+                    self.stdout.write(f'{statement};')
+            else:
+                self.stdout.write(f'Converting {table}...')
+                notes = convert_table(table, options['first_year'])
+            for note in notes:
+                self.stdout.write(self.style.WARNING(f'  {note}'))
+
+    def print_status(self, tables):
+        for table in tables:
+            if not is_partitioned(table):
+                self.stdout.write(f'{table}: not partitioned')
+                continue
+            partitions = list_partitions(table)
+            self.stdout.write(f'{table}: partitioned on {PARTITION_KEYS[table]}, {len(partitions)} partitions')
+            for partition in partitions:
+                self.stdout.write(f"    {partition['name']:<40}{partition['rows']:>10}  {partition['bounds']}")
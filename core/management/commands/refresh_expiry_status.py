@@ -0,0 +1,20 @@
+"""
+Management command to refresh batch expiry flags for today's date
+Usage: python manage.py refresh_expiry_status
+Schedule it nightly (cron / Task Scheduler) so is_expired / expiry_status stay current.
+"""
+from django.core.management.base import BaseCommand
+from core.inventory_cache import refresh_expiry_status
+
+
+class Command(BaseCommand):
+    help = 'Refresh is_expired / expiry_status on the batch inventory cache'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Refreshing batch expiry status...'))
+        
+        counts = refresh_expiry_status()
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Done! Batches re-flagged - Expired: {counts['expired']} | Expiring soon: {counts['expiring_soon']} | Valid: {counts['valid']}"
+        ))
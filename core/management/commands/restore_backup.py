@@ -0,0 +1,45 @@
+"""
+Management command to restore a backup from BACKUP_DIR
+Usage:
+    python manage.py restore_backup backup_20250101_120000.dump --jobs 8
+    python manage.py restore_backup backup_20250101_120000.jsonl.gz --no-safety-backup
+    python manage.py restore_backup backup_20250101_120000.dump --incremental --until 5
+
+.dump / .dir backups go through pg_restore -j, older .sql backups through
+psql, .jsonl.gz (non-PostgreSQL) through loaddata. A pre_restore_ backup of
+the current data is taken first. --incremental then replays the backup's
+incremental segments and rebuilds balances and the inventory cache.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backup_service import job_progress, run_restore, update_job
+
+
+class Command(BaseCommand):
+    help = 'Replace the database with a backup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='Backup file name in BACKUP_DIR')
+        parser.add_argument('--jobs', type=int, help='Parallel pg_restore jobs')
+        parser.add_argument('--incremental', action='store_true', help='Replay incremental backups on top')
+        parser.add_argument('--until', type=int, help='Last incremental segment number to replay')
+        parser.add_argument('--no-safety-backup', action='store_true', help='Skip the pre_restore_ backup')
+        parser.add_argument('--job', help='Job id to report progress to (set by the backup page)')
+
+    def handle(self, *args, **options):
+        job = options['job']
+        try:
+            run_restore(
+                options['filename'], jobs=options['jobs'], progress=job_progress(job, self.stdout),
+                safety_backup=not options['no_safety_backup'],
+                incremental=options['incremental'], until=options['until'],
+            )
+        except Exception as e:
+            if job:
+                update_job(job, state='failed', message=f'Restore failed: {e}')
+            raise CommandError(f'Restore failed: {e}')
+
+        message = f"Restored {options['filename']} - restart the server to clear cached data"
+        if job:
+            update_job(job, state='done', progress=100, message=message)
+        self.stdout.write(self.style.SUCCESS(f'✅ {message}'))
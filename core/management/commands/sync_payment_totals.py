@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction, models
 from core.models import SalesInvoiceMaster, SalesInvoicePaid, InvoiceMaster, InvoicePaid
+from core.open_items import refresh_sales_invoice_balances, refresh_purchase_invoice_balances
 
 class Command(BaseCommand):
     help = 'Sync payment totals for sales and purchase invoices'
@@ -34,4 +35,8 @@ class Command(BaseCommand):
                 invoice.save()
                 purchase_fixed += 1
         
+        # Rebuild open-item balances (one UPDATE each)
+        refresh_sales_invoice_balances()
+        refresh_purchase_invoice_balances()
+        
         self.stdout.write(f"✅ Fixed {sales_fixed} sales invoices and {purchase_fixed} purchase invoices")
\ No newline at end of file
@@ -1,6 +1,10 @@
 import time
 import logging
-from django.db import connection
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
 from django.http import JsonResponse
 
 logger = logging.getLogger(__name__)
@@ -67,24 +71,129 @@ class DatabaseRetryMiddleware:
 
 class DatabaseConnectionMiddleware:
     """
-    Middleware to ensure proper database connection handling
+    Middleware to ensure proper database connection handling.
+
+    Connections are NOT closed after every request - that would throw away
+    the persistent connection kept by CONN_MAX_AGE / CONN_HEALTH_CHECKS and
+    pay a new PostgreSQL connect + auth handshake each time. Django already
+    recycles connections that are too old at the request boundaries; this
+    middleware only drops a connection that a failed request left unusable.
+    DB_CONNECTION_MODE = 'per_request' restores the old close-every-time behaviour.
     """
     def __init__(self, get_response):
         self.get_response = get_response
+        self.close_each_request = getattr(settings, 'DB_CONNECTION_MODE', 'persistent') == 'per_request'
 
     def __call__(self, request):
         try:
             response = self.get_response(request)
             return response
         finally:
-            # Ensure database connections are properly closed
-            if connection.connection:
+            if self.close_each_request and connection.connection:
                 connection.close()
 
     def process_exception(self, request, exception):
         """
-        Close database connection on exception
+        Close the database connection only if the error left it unusable
         """
-        if connection.connection:
-            connection.close()
-        return None
\ No newline at end of file
+        connection.close_if_unusable_or_obsolete()
+        return None
+
+
+query_logger = logging.getLogger('core.query_budget')
+
+
+class _QueryRecorder:
+    """connection.execute_wrapper that times every statement of one request"""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, repr(params), (time.perf_counter() - start) * 1000))
+
+    def summary(self, top_n):
+        statements = Counter((sql, params) for sql, params, _ in self.queries)
+        templates = Counter(sql for sql, _, _ in self.queries)
+        slowest = sorted(self.queries, key=lambda query: query[2], reverse=True)[:top_n]
+        return {
+            'queries': len(self.queries),
+            'db_ms': round(sum(duration for _, _, duration in self.queries), 2),
+            # identical SQL + params run more than once
+            'duplicates': sum(count - 1 for count in statements.values() if count > 1),
+            # same SQL with different params - the usual N+1 signature
+            'repeated_templates': sum(count - 1 for count in templates.values() if count > 1),
+            'slowest': [
+                {'ms': round(duration, 2), 'sql': sql[:300]} for sql, _, duration in slowest
+            ],
+        }
+
+
+class QueryBudgetMiddleware:
+    """
+    Per-request SQL instrumentation, enabled with settings.QUERY_BUDGET_ENABLED.
+
+    Records the number of queries, total DB time, duplicate / repeated
+    statements and the slowest statements of every request, adds a
+    Server-Timing header (visible in the browser dev tools) and writes one
+    structured log line to the 'core.query_budget' logger. Requests over the
+    budget of their view (settings.QUERY_BUDGETS, keyed by URL name, falling
+    back to QUERY_BUDGET_DEFAULT) are logged as warnings.
+
+    Works without DEBUG because it hooks connection.execute_wrapper instead
+    of connection.queries. Queries run while a streaming response is being
+    consumed happen after the middleware returns and are not counted.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.default_budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', {})
+        self.budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        self.top_n = getattr(settings, 'QUERY_BUDGET_TOP_N', 5)
+
+    def __call__(self, request):
+        recorder = _QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        report = recorder.summary(self.top_n)
+        view = self._view_name(request)
+        budget = {**self.default_budget, **self.budgets.get(view, {})}
+        exceeded = sorted(key for key, limit in budget.items() if report.get(key, 0) > limit)
+
+        response['Server-Timing'] = (
+            f'db;dur={report["db_ms"]:.1f};desc="{report["queries"]} queries", '
+            f'app;dur={max(total_ms - report["db_ms"], 0):.1f}, total;dur={total_ms:.1f}'
+        )
+
+        entry = {
+            'event': 'query_budget',
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            **report,
+            'budget': budget,
+            'exceeded': exceeded,
+        }
+        if exceeded:
+            query_logger.warning(entry)
+        else:
+            query_logger.info(entry)
+        return response
+
+    @staticmethod
+    def _view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return None
+        return match.view_name or match._func_path
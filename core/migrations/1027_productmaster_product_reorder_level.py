@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1026_remove_inventory_calculation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmaster',
+            name='product_reorder_level',
+            field=models.FloatField(default=10, help_text='Stock at or below this level is reported as low stock'),
+        ),
+    ]
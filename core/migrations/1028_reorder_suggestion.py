@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 23:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1027_productmaster_product_reorder_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='suppliermaster',
+            name='supplier_lead_time_days',
+            field=models.PositiveIntegerField(default=7, help_text='Days between placing an order and receiving stock'),
+        ),
+        migrations.CreateModel(
+            name='ReorderSuggestion',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reorder_suggestion', serialize=False, to='core.productmaster')),
+                ('avg_daily_7', models.FloatField(default=0, help_text='Average units sold per day, last 7 days')),
+                ('avg_daily_30', models.FloatField(default=0, help_text='Average units sold per day, last 30 days')),
+                ('avg_daily_90', models.FloatField(default=0, help_text='Average units sold per day, last 90 days')),
+                ('daily_demand', models.FloatField(default=0, help_text='Weighted daily demand used for planning')),
+                ('current_stock', models.FloatField(default=0)),
+                ('days_of_cover', models.FloatField(blank=True, help_text='Days current stock lasts at daily_demand (empty = no demand)', null=True)),
+                ('lead_time_days', models.IntegerField(default=7)),
+                ('last_purchase_rate', models.FloatField(default=0)),
+                ('last_mrp', models.FloatField(default=0)),
+                ('last_purchase_date', models.DateTimeField(blank=True, null=True)),
+                ('suggested_qty', models.FloatField(db_index=True, default=0)),
+                ('estimated_value', models.FloatField(default=0, help_text='suggested_qty × last_purchase_rate')),
+                ('generated_at', models.DateTimeField(db_index=True)),
+                ('supplier', models.ForeignKey(blank=True, help_text='Supplier of the latest purchase', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reorder_suggestions', to='core.suppliermaster')),
+            ],
+            options={
+                'db_table': 'reorder_suggestion',
+                'indexes': [models.Index(fields=['supplier', 'suggested_qty'], name='reorder_sug_supplie_df56bc_idx')],
+            },
+        ),
+    ]
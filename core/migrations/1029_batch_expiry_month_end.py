@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:00
+
+import calendar
+from datetime import date
+
+from django.db import migrations, models
+
+
+def populate_expiry_month_end(apps, schema_editor):
+    BatchInventoryCache = apps.get_model('core', 'BatchInventoryCache')
+    
+    # One UPDATE per distinct expiry month instead of one per batch
+    for expiry in BatchInventoryCache.objects.values_list('expiry_date', flat=True).distinct():
+        try:
+            month, year = map(int, expiry.split('-'))
+            month_end = date(year, month, calendar.monthrange(year, month)[1])
+        except (AttributeError, ValueError):
+            continue
+        BatchInventoryCache.objects.filter(expiry_date=expiry).update(expiry_month_end=month_end)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1028_reorder_suggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchinventorycache',
+            name='expiry_month_end',
+            field=models.DateField(blank=True, help_text='Last day of the expiry month (parsed from expiry_date)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='batchinventorycache',
+            index=models.Index(fields=['expiry_month_end', 'current_stock'], name='batch_inven_expiry__87875d_idx'),
+        ),
+        migrations.RunPython(populate_expiry_month_end, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:03
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_balances(apps, schema_editor):
+    InvoiceMaster = apps.get_model('core', 'InvoiceMaster')
+    SalesInvoiceMaster = apps.get_model('core', 'SalesInvoiceMaster')
+    SalesMaster = apps.get_model('core', 'SalesMaster')
+    
+    InvoiceMaster.objects.update(invoice_balance=F('invoice_total') - F('invoice_paid'))
+    
+    items_total = SalesMaster.objects.filter(
+        sales_invoice_no=OuterRef('pk')
+    ).order_by().values('sales_invoice_no').annotate(total=Sum('sale_total_amount')).values('total')
+    SalesInvoiceMaster.objects.update(
+        sales_invoice_balance=Coalesce(Subquery(items_total), Value(0.0)) - F('sales_invoice_paid')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1029_batch_expiry_month_end'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoicemaster',
+            name='invoice_balance',
+            field=models.FloatField(default=0, help_text='invoice_total - invoice_paid, kept in sync on save'),
+        ),
+        migrations.AddField(
+            model_name='salesinvoicemaster',
+            name='sales_invoice_balance',
+            field=models.FloatField(default=0, help_text='Sum of item totals - sales_invoice_paid, kept in sync by signals'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicemaster',
+            index=models.Index(condition=models.Q(('invoice_balance__gt', 0.01)), fields=['supplierid', 'invoice_date'], name='invoice_open_items_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesinvoicemaster',
+            index=models.Index(condition=models.Q(('sales_invoice_balance__gt', 0.01)), fields=['customerid', 'sales_invoice_date'], name='sales_invoice_open_items_idx'),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
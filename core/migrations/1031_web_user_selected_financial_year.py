@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1030_invoice_open_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='web_user',
+            name='selected_financial_year',
+            field=models.PositiveIntegerField(blank=True, help_text="FY start year, used when FY_SELECTION_STORE = 'profile'", null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1031_web_user_selected_financial_year'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(help_text='app_label.modelname', max_length=60)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('action', models.CharField(choices=[('save', 'Saved'), ('delete', 'Deleted')], default='save', max_length=6)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'change_log',
+            },
+        ),
+    ]
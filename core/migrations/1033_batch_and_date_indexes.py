@@ -0,0 +1,87 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1032_change_log'),
+    ]
+
+    operations = [
+        # Superseded by the (product, batch, expiry) indexes below, which
+        # serve every (product, batch) lookup too
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS idx_purchase_product_batch;",
+            reverse_sql="CREATE INDEX IF NOT EXISTS idx_purchase_product_batch ON core_purchasemaster(productid_id, product_batch_no);"
+        ),
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS idx_sales_product_batch;",
+            reverse_sql="CREATE INDEX IF NOT EXISTS idx_sales_product_batch ON core_salesmaster(productid_id, product_batch_no);"
+        ),
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS idx_return_purchase_product_batch;",
+            reverse_sql="CREATE INDEX IF NOT EXISTS idx_return_purchase_product_batch ON core_returnpurchasemaster(returnproductid_id, returnproduct_batch_no);"
+        ),
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS idx_return_sales_product_batch;",
+            reverse_sql="CREATE INDEX IF NOT EXISTS idx_return_sales_product_batch ON core_returnsalesmaster(return_productid_id, return_product_batch_no);"
+        ),
+        migrations.AddIndex(
+            model_name='challan1',
+            index=models.Index(fields=['challan_date'], name='supplier_challan_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerchallan',
+            index=models.Index(fields=['customer_challan_date'], name='customer_challan_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerchallanmaster',
+            index=models.Index(fields=['product_id', 'product_batch_no', 'product_expiry'], include=('sale_quantity',), name='customer_challan_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicemaster',
+            index=models.Index(fields=['invoice_date'], name='invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchasemaster',
+            index=models.Index(fields=['productid', 'product_batch_no', 'product_expiry'], include=('product_quantity',), name='purchase_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returninvoicemaster',
+            index=models.Index(fields=['returninvoice_date'], name='purchase_return_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returnpurchasemaster',
+            index=models.Index(fields=['returnproductid', 'returnproduct_batch_no', 'returnproduct_expiry'], include=('returnproduct_quantity',), name='purchase_return_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returnsalesinvoicemaster',
+            index=models.Index(fields=['return_sales_invoice_date'], name='sales_return_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returnsalesmaster',
+            index=models.Index(fields=['return_productid', 'return_product_batch_no', 'return_product_expiry'], include=('return_sale_quantity',), name='sales_return_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesinvoicemaster',
+            index=models.Index(fields=['sales_invoice_date'], name='sales_invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesmaster',
+            index=models.Index(fields=['productid', 'product_batch_no', 'product_expiry'], include=('sale_quantity',), name='sales_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockissuedetail',
+            index=models.Index(fields=['product', 'batch_no', 'expiry_date'], include=('quantity_issued',), name='stock_issue_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockissuemaster',
+            index=models.Index(fields=['issue_date'], name='stock_issue_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierchallanmaster',
+            index=models.Index(fields=['product_id', 'product_batch_no', 'product_expiry'], include=('product_quantity',), name='supplier_challan_batch_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1033_batch_and_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinancialYearArchive',
+            fields=[
+                ('fy_year', models.IntegerField(help_text='First year of the FY, e.g. 2015 for 2015-16', primary_key=True, serialize=False)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('path', models.CharField(help_text='Folder holding the archived rows', max_length=500)),
+                ('row_counts', models.JSONField(default=dict, help_text='Archived rows per model')),
+            ],
+            options={
+                'db_table': 'financial_year_archive',
+                'ordering': ['fy_year'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OpeningStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fy_year', models.IntegerField(help_text='First financial year still in the transaction tables')),
+                ('batch_no', models.CharField(max_length=20)),
+                ('expiry_date', models.CharField(help_text='Format: MM-YYYY', max_length=7)),
+                ('purchased', models.FloatField(default=0)),
+                ('supplier_challan', models.FloatField(default=0)),
+                ('sales_returns', models.FloatField(default=0)),
+                ('sold', models.FloatField(default=0)),
+                ('customer_challan', models.FloatField(default=0)),
+                ('purchase_returns', models.FloatField(default=0)),
+                ('stock_issued', models.FloatField(default=0)),
+                ('mrp', models.FloatField(blank=True, null=True)),
+                ('purchase_rate', models.FloatField(blank=True, null=True)),
+                ('rate_a', models.FloatField(blank=True, null=True)),
+                ('rate_b', models.FloatField(blank=True, null=True)),
+                ('rate_c', models.FloatField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_stock', to='core.productmaster')),
+            ],
+            options={
+                'db_table': 'opening_stock',
+                'indexes': [models.Index(fields=['product', 'batch_no'], name='opening_stock_batch_idx')],
+                'unique_together': {('fy_year', 'product', 'batch_no', 'expiry_date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='OpeningBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fy_year', models.IntegerField(help_text='First financial year still in the transaction tables')),
+                ('debit', models.FloatField(default=0)),
+                ('credit', models.FloatField(default=0)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='opening_balances', to='core.customermaster')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='opening_balances', to='core.suppliermaster')),
+            ],
+            options={
+                'db_table': 'opening_balance',
+                'indexes': [models.Index(fields=['customer', 'fy_year'], name='opening_balance_customer_idx'), models.Index(fields=['supplier', 'fy_year'], name='opening_balance_supplier_idx')],
+            },
+        ),
+    ]
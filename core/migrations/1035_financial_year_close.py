@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-20 00:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def close_archived_years(apps, schema_editor):
+    # Archived years are closed years
+    FinancialYearArchive = apps.get_model('core', 'FinancialYearArchive')
+    FinancialYearClose = apps.get_model('core', 'FinancialYearClose')
+    FinancialYearClose.objects.bulk_create([
+        FinancialYearClose(fy_year=archive.fy_year, closed_at=archive.archived_at)
+        for archive in FinancialYearArchive.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1034_archived_years_and_opening_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinancialYearClose',
+            fields=[
+                ('fy_year', models.IntegerField(help_text='First year of the FY, e.g. 2015 for 2015-16', primary_key=True, serialize=False)),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'financial_year_close',
+                'ordering': ['fy_year'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='openingbalance',
+            name='fy_year',
+            field=models.IntegerField(help_text='Financial year the figures open'),
+        ),
+        migrations.AlterField(
+            model_name='openingstock',
+            name='fy_year',
+            field=models.IntegerField(help_text='Financial year the figures open'),
+        ),
+        migrations.RunPython(close_archived_years, migrations.RunPython.noop),
+    ]
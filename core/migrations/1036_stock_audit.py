@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-20 01:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '1035_financial_year_close'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAuditEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('action', models.CharField(choices=[('purchase_return', 'Purchase Return'), ('sales_return', 'Sales Return')], max_length=20)),
+                ('document_no', models.CharField(help_text='Return invoice number', max_length=50)),
+                ('batch_no', models.CharField(max_length=20)),
+                ('expiry_date', models.CharField(blank=True, default='', max_length=10)),
+                ('quantity', models.FloatField(help_text='Stock change: negative when stock goes out')),
+                ('stock_before', models.FloatField()),
+                ('stock_after', models.FloatField()),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_audit', to='core.productmaster')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_audit', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'stock_audit',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['product', 'batch_no'], name='stock_audit_batch_idx'), models.Index(fields=['action', 'document_no'], name='stock_audit_document_idx')],
+            },
+        ),
+    ]
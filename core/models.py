@@ -7,6 +7,7 @@ from decimal import Decimal
 import csv
 from django.http import HttpResponse
 from django.db.models import Q, F 
+from .partitioning import FinancialYearQuerySet
 
 # Create your models here.
 class Web_User(AbstractUser):
@@ -22,6 +23,7 @@ class Web_User(AbstractUser):
         return self.username
     profile_picture = models.ImageField(upload_to='images/', blank=True, null=True)    
     user_isactive=models.DecimalField(max_digits=1,decimal_places=0, default=0)
+    selected_financial_year=models.PositiveIntegerField(null=True, blank=True, help_text="FY start year, used when FY_SELECTION_STORE = 'profile'")
     # add additional fields in here
   
     
@@ -46,6 +48,7 @@ class ProductMaster(models.Model):
     product_hsn=models.CharField(max_length=20, default=None)
     product_hsn_percent=models.CharField(max_length=20, default=None)
     product_barcode=models.CharField(max_length=50, blank=True, null=True, unique=True, help_text="Product barcode for scanning")
+    product_reorder_level=models.FloatField(default=10, help_text="Stock at or below this level is reported as low stock")
     
     def __str__(self):
         return f"{self.product_name} ({self.product_company})"
@@ -66,6 +69,7 @@ class SupplierMaster(models.Model):
     supplier_bankaccountno=models.CharField(max_length=30, blank=True, default='')
     supplier_bankifsc=models.CharField(max_length=20, blank=True, default='')
     supplier_upi=models.CharField(max_length=50, null=True, blank=True, default='')
+    supplier_lead_time_days=models.PositiveIntegerField(default=7, help_text="Days between placing an order and receiving stock")
     
     def __str__(self):
         return self.supplier_name
@@ -101,14 +105,32 @@ class InvoiceMaster(models.Model):
         ('paid', 'Fully Paid'),
         ('overdue', 'Overdue')
     ], default='pending')
+    invoice_balance=models.FloatField(default=0, help_text="invoice_total - invoice_paid, kept in sync on save")
+
+    # Partition-aware date filters (core/partitioning.py)
+    objects = FinancialYearQuerySet.as_manager()
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['invoice_no', 'supplierid'], name='unique_invoiceno_supplierid')
         ]
+        indexes = [
+            # Open items only: payment pickers never scan settled invoices
+            models.Index(fields=['supplierid', 'invoice_date'], name='invoice_open_items_idx',
+                         condition=models.Q(invoice_balance__gt=0.01)),
+            # Financial year filter (apply_year_filter)
+            models.Index(fields=['invoice_date'], name='invoice_date_idx'),
+        ]
     
     def __str__(self):
         return f"Invoice #{self.invoice_no} - {self.supplierid.supplier_name}"
     
+    def save(self, *args, **kwargs):
+        self.invoice_balance = (self.invoice_total or 0) - (self.invoice_paid or 0)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'invoice_total', 'invoice_paid'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'invoice_balance'}
+        super().save(*args, **kwargs)
+    
     @property
     def balance_due(self):
         return self.invoice_total - self.invoice_paid
@@ -154,6 +176,16 @@ class PurchaseMaster(models.Model):
     source_challan_no=models.CharField(max_length=50, blank=True, null=True)
     source_challan_date=models.DateField(blank=True, null=True)
     #calculation_mode indicates how discount is calculated by flat-rupees or %-percent
+
+    # Partition-aware date filters (core/partitioning.py)
+    objects = FinancialYearQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Batch stock: SUM(quantity) per (product, batch, expiry) straight from the index
+            models.Index(fields=['productid', 'product_batch_no', 'product_expiry'],
+                         include=['product_quantity'], name='purchase_batch_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product_name} - {self.product_batch_no} - {self.product_quantity}"
@@ -165,6 +197,19 @@ class SalesInvoiceMaster(models.Model):
     invoice_series=models.ForeignKey('InvoiceSeries', on_delete=models.SET_NULL, null=True, blank=True)
     sales_transport_charges=models.FloatField(default=0)
     sales_invoice_paid=models.FloatField(null=False, blank=False, default=0)
+    sales_invoice_balance=models.FloatField(default=0, help_text="Sum of item totals - sales_invoice_paid, kept in sync by signals")
+
+    # Partition-aware date filters (core/partitioning.py)
+    objects = FinancialYearQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Financial year filter (apply_year_filter)
+            models.Index(fields=['sales_invoice_date'], name='sales_invoice_date_idx'),
+            # Open items only: receipt pickers never scan settled invoices
+            models.Index(fields=['customerid', 'sales_invoice_date'], name='sales_invoice_open_items_idx',
+                         condition=models.Q(sales_invoice_balance__gt=0.01)),
+        ]
     
     def __str__(self):
         return f"Sales Invoice #{self.sales_invoice_no} - {self.customerid.customer_name}"
@@ -204,6 +249,15 @@ class SalesMaster(models.Model):
     #calculation_mode indicates how discount is calculated by flat-rupees or %-percent
     source_challan_no=models.CharField(max_length=50, blank=True, null=True, help_text='Source customer challan number if pulled from challan')
     source_challan_date=models.DateField(blank=True, null=True, help_text='Source customer challan date if pulled from challan')
+
+    # Partition-aware date filters (core/partitioning.py)
+    objects = FinancialYearQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['productid', 'product_batch_no', 'product_expiry'],
+                         include=['sale_quantity'], name='sales_batch_idx'),
+        ]
    
     def __str__(self):
         return f"{self.product_name} - {self.product_batch_no} - {self.sale_quantity}"
@@ -237,6 +291,11 @@ class ReturnInvoiceMaster(models.Model):
     returninvoice_total=models.FloatField(null=False, blank=False)
     returninvoice_paid=models.FloatField(null=False, blank=False, default=0)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['returninvoice_date'], name='purchase_return_date_idx'),
+        ]
+    
     def __str__(self):
         return f"Return Invoice #{self.returninvoiceid} - {self.returnsupplierid.supplier_name}"
     
@@ -271,6 +330,12 @@ class ReturnPurchaseMaster(models.Model):
     return_reason=models.CharField(max_length=200, blank=True, null=True)
     returnpurchase_entry_date=models.DateField(default=timezone.now)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['returnproductid', 'returnproduct_batch_no', 'returnproduct_expiry'],
+                         include=['returnproduct_quantity'], name='purchase_return_batch_idx'),
+        ]
+    
     def __str__(self):
         return f"Return: {self.returnproductid.product_name} - {self.returnproduct_batch_no} - {self.returnproduct_quantity}"
 
@@ -285,6 +350,11 @@ class ReturnSalesInvoiceMaster(models.Model):
     return_sales_invoice_paid=models.FloatField(null=False, blank=False, default=0)
     created_at=models.DateTimeField(default=timezone.now)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['return_sales_invoice_date'], name='sales_return_date_idx'),
+        ]
+    
     def __str__(self):
         return f"Sales Return Invoice #{self.return_sales_invoice_no} - {self.return_sales_customerid.customer_name}"
     
@@ -332,6 +402,12 @@ class ReturnSalesMaster(models.Model):
     return_sale_entry_date=models.DateTimeField(default=timezone.now)
     return_sale_calculation_mode=models.CharField(max_length=20, default='percentage', choices=[('percentage', 'Percentage'), ('fixed', 'Fixed Amount')])
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['return_productid', 'return_product_batch_no', 'return_product_expiry'],
+                         include=['return_sale_quantity'], name='sales_return_batch_idx'),
+        ]
+    
     def __str__(self):
         return f"Sales Return: {self.return_product_name} - {self.return_product_batch_no} - {self.return_sale_quantity}"
 
@@ -400,6 +476,9 @@ class Challan1(models.Model):
     class Meta:
         db_table = 'challan1'
         ordering = ['-challan_date', '-challan_id']
+        indexes = [
+            models.Index(fields=['challan_date'], name='supplier_challan_date_idx'),
+        ]
 
 class SupplierChallanMaster(models.Model):
     challan_id = models.BigAutoField(primary_key=True, auto_created=True)
@@ -435,6 +514,10 @@ class SupplierChallanMaster(models.Model):
     class Meta:
         db_table = 'supplier_challan_master'
         ordering = ['-challan_entry_date']
+        indexes = [
+            models.Index(fields=['product_id', 'product_batch_no', 'product_expiry'],
+                         include=['product_quantity'], name='supplier_challan_batch_idx'),
+        ]
 
 class SupplierChallanMaster2(models.Model):
     challan_id = models.BigAutoField(primary_key=True, auto_created=True)
@@ -502,6 +585,9 @@ class CustomerChallan(models.Model):
     class Meta:
         db_table = 'customer_challan'
         ordering = ['-customer_challan_date', '-customer_challan_id']
+        indexes = [
+            models.Index(fields=['customer_challan_date'], name='customer_challan_date_idx'),
+        ]
 
 class CustomerChallanMaster(models.Model):
     customer_challan_master_id = models.BigAutoField(primary_key=True, auto_created=True)
@@ -530,6 +616,10 @@ class CustomerChallanMaster(models.Model):
     class Meta:
         db_table = 'customer_challan_master'
         ordering = ['-sales_entry_date']
+        indexes = [
+            models.Index(fields=['product_id', 'product_batch_no', 'product_expiry'],
+                         include=['sale_quantity'], name='customer_challan_batch_idx'),
+        ]
 
 class CustomerChallanMaster2(models.Model):
     customer_challan_master_id = models.BigAutoField(primary_key=True, auto_created=True)
@@ -626,6 +716,9 @@ class StockIssueMaster(models.Model):
     class Meta:
         db_table = 'stock_issue_master'
         ordering = ['-issue_date', '-issue_id']
+        indexes = [
+            models.Index(fields=['issue_date'], name='stock_issue_date_idx'),
+        ]
     
     def __str__(self):
         return f"Stock Issue #{self.issue_no} - {self.get_issue_type_display()}"
@@ -656,6 +749,10 @@ class StockIssueDetail(models.Model):
     class Meta:
         db_table = 'stock_issue_detail'
         ordering = ['detail_id']
+        indexes = [
+            models.Index(fields=['product', 'batch_no', 'expiry_date'],
+                         include=['quantity_issued'], name='stock_issue_batch_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product.product_name} - Batch: {self.batch_no} - Qty: {self.quantity_issued}"
@@ -751,6 +848,7 @@ class BatchInventoryCache(models.Model):
     product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='batch_caches')
     batch_no = models.CharField(max_length=20, db_index=True)
     expiry_date = models.CharField(max_length=7, help_text="Format: MM-YYYY")
+    expiry_month_end = models.DateField(null=True, blank=True, help_text="Last day of the expiry month (parsed from expiry_date)")
     
     # Stock Details
     current_stock = models.FloatField(default=0, db_index=True)
@@ -778,6 +876,7 @@ class BatchInventoryCache(models.Model):
             models.Index(fields=['is_expired']),
             models.Index(fields=['expiry_date']),
             models.Index(fields=['batch_no']),
+            models.Index(fields=['expiry_month_end', 'current_stock']),
         ]
         ordering = ['expiry_date', 'batch_no']
     
@@ -786,3 +885,195 @@ class BatchInventoryCache(models.Model):
 # ============================================
 # INVENTORY CACHE TABLES - END
 # ============================================
+
+# ============================================
+# REORDER SUGGESTIONS - START
+# ============================================
+class ReorderSuggestion(models.Model):
+    """Stored output of the reorder engine (regenerated as a batch job)"""
+    product = models.OneToOneField(ProductMaster, on_delete=models.CASCADE, primary_key=True, related_name='reorder_suggestion')
+    supplier = models.ForeignKey(SupplierMaster, on_delete=models.SET_NULL, null=True, blank=True, related_name='reorder_suggestions',
+                                 help_text="Supplier of the latest purchase")
+    
+    # Demand
+    avg_daily_7 = models.FloatField(default=0, help_text="Average units sold per day, last 7 days")
+    avg_daily_30 = models.FloatField(default=0, help_text="Average units sold per day, last 30 days")
+    avg_daily_90 = models.FloatField(default=0, help_text="Average units sold per day, last 90 days")
+    daily_demand = models.FloatField(default=0, help_text="Weighted daily demand used for planning")
+    
+    # Stock position
+    current_stock = models.FloatField(default=0)
+    days_of_cover = models.FloatField(null=True, blank=True, help_text="Days current stock lasts at daily_demand (empty = no demand)")
+    lead_time_days = models.IntegerField(default=7)
+    
+    # Last purchase
+    last_purchase_rate = models.FloatField(default=0)
+    last_mrp = models.FloatField(default=0)
+    last_purchase_date = models.DateTimeField(null=True, blank=True)
+    
+    # Suggestion
+    suggested_qty = models.FloatField(default=0, db_index=True)
+    estimated_value = models.FloatField(default=0, help_text="suggested_qty × last_purchase_rate")
+    
+    generated_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'reorder_suggestion'
+        indexes = [
+            models.Index(fields=['supplier', 'suggested_qty']),
+        ]
+    
+    def __str__(self):
+        return f"Reorder: {self.product.product_name} - Qty: {self.suggested_qty}"
+# ============================================
+# REORDER SUGGESTIONS - END
+# ============================================
+
+# ============================================
+# CHANGE LOG (incremental backups) - START
+# ============================================
+class ChangeLog(models.Model):
+    """One row per saved / deleted record since the last full backup (see core/change_log.py)"""
+    ACTION_CHOICES = [('save', 'Saved'), ('delete', 'Deleted')]
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=60, help_text="app_label.modelname")
+    object_pk = models.CharField(max_length=64)
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES, default='save')
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'change_log'
+
+    def __str__(self):
+        return f"{self.action} {self.model} #{self.object_pk}"
+# ============================================
+# CHANGE LOG (incremental backups) - END
+# ============================================
+
+# ============================================
+# ARCHIVED YEARS / OPENING BALANCES - START
+# ============================================
+class FinancialYearArchive(models.Model):
+    """A closed financial year moved out of the transaction tables (see core/archive_service.py)"""
+    fy_year = models.IntegerField(primary_key=True, help_text="First year of the FY, e.g. 2015 for 2015-16")
+    archived_at = models.DateTimeField(default=timezone.now)
+    path = models.CharField(max_length=500, help_text="Folder holding the archived rows")
+    row_counts = models.JSONField(default=dict, help_text="Archived rows per model")
+
+    class Meta:
+        db_table = 'financial_year_archive'
+        ordering = ['fy_year']
+
+    def __str__(self):
+        return f"FY {self.fy_year}-{str(self.fy_year + 1)[-2:]} (archived)"
+
+
+class FinancialYearClose(models.Model):
+    """
+    A closed financial year: its closing stock and balances are snapshotted as
+    the OpeningStock / OpeningBalance of the next year (see core/year_close.py)
+    """
+    fy_year = models.IntegerField(primary_key=True, help_text="First year of the FY, e.g. 2015 for 2015-16")
+    closed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'financial_year_close'
+        ordering = ['fy_year']
+
+    def __str__(self):
+        return f"FY {self.fy_year}-{str(self.fy_year + 1)[-2:]} (closed)"
+
+
+class OpeningStock(models.Model):
+    """
+    Quantities carried forward per batch from closed years, kept per source
+    table so every stock calculation adds back exactly what it used to read
+    from the rows of those years (see core/opening_balances.py)
+    """
+    fy_year = models.IntegerField(help_text="Financial year the figures open")
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='opening_stock')
+    batch_no = models.CharField(max_length=20)
+    expiry_date = models.CharField(max_length=7, help_text="Format: MM-YYYY")
+
+    purchased = models.FloatField(default=0)
+    supplier_challan = models.FloatField(default=0)
+    sales_returns = models.FloatField(default=0)
+    sold = models.FloatField(default=0)
+    customer_challan = models.FloatField(default=0)
+    purchase_returns = models.FloatField(default=0)
+    stock_issued = models.FloatField(default=0)
+
+    # Details of the batch's first purchase / challan in the closed years, for the
+    # batch pickers and the cache; empty when it had none there
+    mrp = models.FloatField(null=True, blank=True)
+    purchase_rate = models.FloatField(null=True, blank=True)
+    rate_a = models.FloatField(null=True, blank=True)
+    rate_b = models.FloatField(null=True, blank=True)
+    rate_c = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'opening_stock'
+        unique_together = [['fy_year', 'product', 'batch_no', 'expiry_date']]
+        indexes = [
+            models.Index(fields=['product', 'batch_no'], name='opening_stock_batch_idx'),
+        ]
+
+    def __str__(self):
+        return f"Opening {self.fy_year}: {self.product_id} {self.batch_no} {self.expiry_date}"
+
+
+class OpeningBalance(models.Model):
+    """Ledger totals of a customer or supplier carried forward from closed years"""
+    fy_year = models.IntegerField(help_text="Financial year the figures open")
+    customer = models.ForeignKey(CustomerMaster, on_delete=models.CASCADE, null=True, blank=True, related_name='opening_balances')
+    supplier = models.ForeignKey(SupplierMaster, on_delete=models.CASCADE, null=True, blank=True, related_name='opening_balances')
+    debit = models.FloatField(default=0)
+    credit = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'opening_balance'
+        indexes = [
+            models.Index(fields=['customer', 'fy_year'], name='opening_balance_customer_idx'),
+            models.Index(fields=['supplier', 'fy_year'], name='opening_balance_supplier_idx'),
+        ]
+
+    def __str__(self):
+        party = f"customer {self.customer_id}" if self.customer_id else f"supplier {self.supplier_id}"
+        return f"Opening {self.fy_year}: {party} Dr {self.debit} Cr {self.credit}"
+# ============================================
+# ARCHIVED YEARS / OPENING BALANCES - END
+# ============================================
+
+# ============================================
+# STOCK AUDIT - START
+# ============================================
+class StockAuditEntry(models.Model):
+    """One row per batch cache row (batch + expiry) whose stock a posted return moved (see core/return_posting.py)"""
+    ACTION_CHOICES = [('purchase_return', 'Purchase Return'), ('sales_return', 'Sales Return')]
+
+    id = models.BigAutoField(primary_key=True)
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    document_no = models.CharField(max_length=50, help_text="Return invoice number")
+    product = models.ForeignKey(ProductMaster, on_delete=models.SET_NULL, null=True, related_name='stock_audit')
+    batch_no = models.CharField(max_length=20)
+    expiry_date = models.CharField(max_length=10, blank=True, default='')
+    quantity = models.FloatField(help_text="Stock change: negative when stock goes out")
+    stock_before = models.FloatField()
+    stock_after = models.FloatField()
+    user = models.ForeignKey(Web_User, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_audit')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'stock_audit'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['product', 'batch_no'], name='stock_audit_batch_idx'),
+            models.Index(fields=['action', 'document_no'], name='stock_audit_document_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_action_display()} {self.document_no}: {self.product_id} {self.batch_no} {self.quantity:+g}"
+# ============================================
+# STOCK AUDIT - END
+# ============================================
@@ -0,0 +1,101 @@
+"""
+Open Items
+Outstanding balances are stored on the invoice rows (InvoiceMaster.invoice_balance,
+SalesInvoiceMaster.sales_invoice_balance) and covered by partial indexes on
+balance > OPEN_BALANCE_THRESHOLD, so payment / receipt pickers fetch open
+invoices with one indexed query instead of aggregating every invoice.
+
+InvoiceMaster keeps its balance in save(); sales balances depend on the line
+items and are refreshed by the signals in core/signals.py.
+"""
+from django.db.models import F, Q, Sum, Value, Subquery, OuterRef
+from django.db.models.functions import Coalesce
+
+from .models import InvoiceMaster, SalesInvoiceMaster, SalesMaster
+
+
+# Matches the partial index condition - balances at or below this count as settled
+OPEN_BALANCE_THRESHOLD = 0.01
+
+
+def _sales_items_total():
+    return Coalesce(Subquery(
+        SalesMaster.objects.filter(
+            sales_invoice_no=OuterRef('pk')
+        ).order_by().values('sales_invoice_no').annotate(
+            total=Sum('sale_total_amount')
+        ).values('total')
+    ), Value(0.0))
+
+
+def refresh_sales_invoice_balances(invoice_nos=None):
+    """Recompute sales_invoice_balance with one UPDATE (all invoices when invoice_nos is None)"""
+    queryset = SalesInvoiceMaster.objects.all()
+    if invoice_nos is not None:
+        queryset = queryset.filter(sales_invoice_no__in=invoice_nos)
+    return queryset.update(sales_invoice_balance=_sales_items_total() - F('sales_invoice_paid'))
+
+
+def refresh_purchase_invoice_balances(invoice_ids=None):
+    """Recompute invoice_balance with one UPDATE (all invoices when invoice_ids is None)"""
+    queryset = InvoiceMaster.objects.all()
+    if invoice_ids is not None:
+        queryset = queryset.filter(invoiceid__in=invoice_ids)
+    return queryset.update(invoice_balance=F('invoice_total') - F('invoice_paid'))
+
+
+def open_sales_invoices(customer_id=None, search=None):
+    """Sales invoices with an outstanding balance, newest first"""
+    queryset = SalesInvoiceMaster.objects.filter(
+        sales_invoice_balance__gt=OPEN_BALANCE_THRESHOLD
+    ).select_related('customerid')
+    if customer_id:
+        queryset = queryset.filter(customerid=customer_id)
+    if search:
+        queryset = queryset.filter(
+            Q(customerid__customer_name__icontains=search) |
+            Q(customerid__customer_mobile__icontains=search)
+        )
+    return queryset.order_by('-sales_invoice_date', '-sales_invoice_no')
+
+
+def open_purchase_invoices(supplier_id=None, search=None):
+    """Purchase invoices with an outstanding balance, newest first"""
+    queryset = InvoiceMaster.objects.filter(
+        invoice_balance__gt=OPEN_BALANCE_THRESHOLD
+    ).select_related('supplierid')
+    if supplier_id:
+        queryset = queryset.filter(supplierid=supplier_id)
+    if search:
+        queryset = queryset.filter(supplierid__supplier_name__icontains=search)
+    return queryset.order_by('-invoice_date', '-invoiceid')
+
+
+def sales_invoice_item(invoice, date_format='%d-%m-%Y'):
+    """JSON row for a receipt picker"""
+    return {
+        'invoice_no': invoice.sales_invoice_no,
+        'customer_id': invoice.customerid_id,
+        'customer_name': invoice.customerid.customer_name,
+        'invoice_date': invoice.sales_invoice_date.strftime(date_format),
+        'total_amount': float(invoice.sales_invoice_balance + invoice.sales_invoice_paid),
+        'paid_amount': float(invoice.sales_invoice_paid),
+        'balance_amount': float(invoice.sales_invoice_balance)
+    }
+
+
+def purchase_invoice_item(invoice, date_format='%d-%m-%Y'):
+    """JSON row for a payment picker"""
+    balance = invoice.invoice_balance
+    return {
+        'id': invoice.invoiceid,
+        'supplier_id': invoice.supplierid_id,
+        'supplier_name': invoice.supplierid.supplier_name,
+        'invoice_no': invoice.invoice_no,
+        'invoice_date': invoice.invoice_date.strftime(date_format),
+        'total_amount': float(invoice.invoice_total),
+        'paid_amount': float(invoice.invoice_paid),
+        'balance_amount': float(balance),
+        'payment_status': 'Unpaid' if invoice.invoice_paid == 0 else 'Partial',
+        'text': f"{invoice.supplierid.supplier_name} - Invoice #{invoice.invoice_no} (₹{balance:.2f} due)"
+    }
@@ -0,0 +1,153 @@
+"""
+Carried-forward stock and party balances
+Closing a financial year (core/year_close.py) snapshots what every document
+up to its end contributed: OpeningStock per batch and source table,
+OpeningBalance per customer / supplier, both for the next year. From then on
+stock calculations and ledgers read the snapshot plus the rows dated from
+that year on (live_rows), so their cost no longer grows with the age of the
+data. Archiving (core/archive_service.py) closes the years it moves out.
+
+Each close writes a complete new set of rows for its fy_year; only the set
+of the first open year is read.
+"""
+from datetime import date
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+
+from .models import (
+    FinancialYearArchive, PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
+    SupplierChallanMaster, CustomerChallanMaster, StockIssueDetail,
+    InvoiceMaster, InvoicePaid, SalesInvoiceMaster, SalesInvoicePaid,
+    ReturnInvoiceMaster, ReturnSalesInvoiceMaster, Challan1, CustomerChallan, StockIssueMaster,
+    FinancialYearClose, OpeningStock, OpeningBalance,
+)
+
+
+# Source tables, as the OpeningStock columns that carry their closed quantities
+OPENING_SOURCES = (
+    'purchased', 'supplier_challan', 'sales_returns',
+    'sold', 'customer_challan', 'purchase_returns', 'stock_issued',
+)
+OPENING_DETAILS = ('mrp', 'purchase_rate', 'rate_a', 'rate_b', 'rate_c')
+
+# Date deciding which financial year a row belongs to: the document date,
+# or the payment date for payments
+ROW_DATES = {
+    InvoiceMaster: 'invoice_date',
+    PurchaseMaster: 'product_invoiceid__invoice_date',
+    InvoicePaid: 'payment_date',
+    SalesInvoiceMaster: 'sales_invoice_date',
+    SalesMaster: 'sales_invoice_no__sales_invoice_date',
+    SalesInvoicePaid: 'sales_payment_date',
+    ReturnInvoiceMaster: 'returninvoice_date',
+    ReturnPurchaseMaster: 'returninvoiceid__returninvoice_date',
+    ReturnSalesInvoiceMaster: 'return_sales_invoice_date',
+    ReturnSalesMaster: 'return_sales_invoice_no__return_sales_invoice_date',
+    Challan1: 'challan_date',
+    SupplierChallanMaster: 'product_challan_id__challan_date',
+    CustomerChallan: 'customer_challan_date',
+    CustomerChallanMaster: 'customer_challan_id__customer_challan_date',
+    StockIssueMaster: 'issue_date',
+    StockIssueDetail: 'issue__issue_date',
+}
+
+
+def opening_year():
+    """First financial year after the last closed one, or None when no year is closed"""
+    last = FinancialYearClose.objects.aggregate(last=Max('fy_year'))['last']
+    return last + 1 if last is not None else None
+
+
+YEAR_STATE_KEY = 'year_state'
+
+
+def year_state(request=None):
+    """
+    {'opening_year', 'archived_years'} for the navbar on every page: kept in
+    the cache until a close or an archive clears it, and on request so the
+    partials of one response read it once.
+    """
+    state = getattr(request, '_year_state', None)
+    if state is None:
+        state = cache.get(YEAR_STATE_KEY)
+    if state is None:
+        state = {
+            'opening_year': opening_year(),
+            'archived_years': set(FinancialYearArchive.objects.values_list('fy_year', flat=True)),
+        }
+        cache.set(YEAR_STATE_KEY, state, None)
+    if request is not None:
+        request._year_state = state
+    return state
+
+
+def clear_year_state():
+    """Drop the cached year_state once the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(YEAR_STATE_KEY))
+
+
+def opening_start():
+    """1 April of the first open financial year, or None"""
+    year = opening_year()
+    return date(year, 4, 1) if year is not None else None
+
+
+def archived_until():
+    """1 April after the last archived financial year (older rows are gone), or None"""
+    archived = year_state()['archived_years']
+    return date(max(archived) + 1, 4, 1) if archived else None
+
+
+def row_dated(model, lookup, value):
+    """Q on the ROW_DATES date of a transaction table - the date the snapshot splits on"""
+    return Q(**{f'{ROW_DATES[model]}__{lookup}': value})
+
+
+def live_rows(model, start=None):
+    """Rows of a transaction table dated from the first open financial year (all rows if none is closed)"""
+    start = start or opening_start()
+    queryset = model.objects.all()
+    if start is None:
+        return queryset
+    return queryset.filter(row_dated(model, 'gte', start))
+
+
+def opening_stock_rows():
+    """OpeningStock rows of the first open year"""
+    return OpeningStock.objects.filter(fy_year=opening_year())
+
+
+def opening_quantities(product_id, batch_no=None, expiry_date=None):
+    """{source: quantity} carried forward for a product, batch or batch + expiry"""
+    rows = opening_stock_rows().filter(product_id=product_id)
+    if batch_no is not None:
+        rows = rows.filter(batch_no=batch_no)
+    if expiry_date is not None:
+        rows = rows.filter(expiry_date=expiry_date)
+    totals = rows.aggregate(**{source: Sum(source) for source in OPENING_SOURCES})
+    return {source: totals[source] or 0 for source in OPENING_SOURCES}
+
+
+def opening_batches(product_id):
+    """Carried-forward batches of a product with their details, for the batch pickers"""
+    return opening_stock_rows().filter(product_id=product_id).order_by('batch_no', 'expiry_date')
+
+
+def opening_details():
+    """{(product_id, batch_no, expiry): (mrp, purchase_rate, rate_a, rate_b, rate_c)} of the batches that have them"""
+    return {
+        (row[0], row[1], row[2]): row[3:]
+        for row in opening_stock_rows().filter(mrp__isnull=False).values_list(
+            'product_id', 'batch_no', 'expiry_date', *OPENING_DETAILS
+        )
+    }
+
+
+def opening_balance(customer=None, supplier=None):
+    """The carried-forward ledger row of a party for the first open year, or None"""
+    rows = OpeningBalance.objects.filter(fy_year=opening_year())
+    if customer is not None:
+        return rows.filter(customer=customer).first()
+    return rows.filter(supplier=supplier).first()
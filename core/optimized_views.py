@@ -10,13 +10,16 @@ from django.core.paginator import Paginator
 from datetime import datetime, timedelta
 from collections import defaultdict
 import json
+import logging
 
 from .models import (
     ProductMaster, SupplierMaster, CustomerMaster, InvoiceMaster, SalesInvoiceMaster, 
-    SalesMaster, PurchaseMaster, ReturnPurchaseMaster, ReturnSalesMaster,
-    SupplierChallanMaster, CustomerChallanMaster, StockIssueDetail, Pharmacy_Details
+    SalesMaster, PurchaseMaster, Pharmacy_Details
 )
 from .utils import get_stock_status
+from .stock_service import balances_for
+
+logger = logging.getLogger(__name__)
 
 
 class OptimizedStockCalculator:
@@ -31,45 +34,9 @@ class OptimizedStockCalculator:
                 products_query = products_query[:limit]
             product_ids = list(products_query.values_list('productid', flat=True))
         
-        # Bulk fetch all stock movements
-        purchases = defaultdict(int)
-        for p in PurchaseMaster.objects.filter(productid__in=product_ids).values('productid').annotate(total=Sum('product_quantity')):
-            purchases[p['productid']] = p['total']
-        
-        # Add supplier challan stock
-        for c in SupplierChallanMaster.objects.filter(product_id__in=product_ids).values('product_id').annotate(total=Sum('product_quantity')):
-            purchases[c['product_id']] += c['total']
-        
-        # Sales
-        sales = defaultdict(int)
-        for s in SalesMaster.objects.filter(productid__in=product_ids).values('productid').annotate(total=Sum('sale_quantity')):
-            sales[s['productid']] = s['total']
-        
-        # Add customer challan sales
-        for cc in CustomerChallanMaster.objects.filter(product_id__in=product_ids).values('product_id').annotate(total=Sum('sale_quantity')):
-            sales[cc['product_id']] += cc['total']
-        
-        # Returns
-        purchase_returns = defaultdict(int)
-        for pr in ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid').annotate(total=Sum('returnproduct_quantity')):
-            purchase_returns[pr['returnproductid']] = pr['total']
-        
-        sales_returns = defaultdict(int)
-        for sr in ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid').annotate(total=Sum('return_sale_quantity')):
-            sales_returns[sr['return_productid']] = sr['total']
-        
-        # Stock issues
-        stock_issues = defaultdict(int)
-        for si in StockIssueDetail.objects.filter(product__in=product_ids).values('product').annotate(total=Sum('quantity_issued')):
-            stock_issues[si['product']] = si['total']
-        
-        # Calculate final stock
-        stock_data = {}
-        for pid in product_ids:
-            current_stock = (purchases.get(pid, 0) - sales.get(pid, 0) - 
-                           purchase_returns.get(pid, 0) + sales_returns.get(pid, 0) - 
-                           stock_issues.get(pid, 0))
-            stock_data[pid] = max(0, current_stock)
+        # One grouped query per stock source (core/stock_service.py)
+        balances = balances_for(product_ids, level='product')
+        stock_data = {pid: max(0, balances.get(pid, 0)) for pid in product_ids}
         
         return stock_data
 
@@ -126,8 +93,8 @@ def optimized_dashboard(request):
                     'product': product,
                     'current_stock': stock_data[product.productid]
                 })
-    except Exception as e:
-        print(f"Dashboard: Error in low stock calculation: {e}")
+    except Exception:
+        logger.exception('Dashboard: low stock calculation failed')
     
     # Optimized expiry calculation
     expired_products = []
@@ -169,8 +136,8 @@ def optimized_dashboard(request):
                             break
             except Exception as e:
                 continue
-    except Exception as e:
-        print(f"Dashboard: Error in expiry calculation: {e}")
+    except Exception:
+        logger.exception('Dashboard: expiry calculation failed')
     
     # Financial calculations (optimized with single queries)
     today = timezone.now().date()
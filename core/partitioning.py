@@ -0,0 +1,403 @@
+"""
+Financial-year partitioning of the transaction tables (PostgreSQL, optional)
+`manage.py partition_tables --convert` turns the tables in PARTITION_KEYS
+into declaratively range-partitioned tables with one partition per
+financial year (1 April to 1 April) plus a DEFAULT partition for anything
+outside the created years. Nothing changes on the Django side: models,
+migrations and SQLite development databases work as before.
+
+PostgreSQL only prunes partitions when the query has a plain range
+predicate on the partition key. FinancialYearQuerySet (the default manager
+of the partitioned models) builds that predicate: for_financial_year() /
+in_date_range() filter `key >= start AND key < end + 1 day`, which a
+`key__date` lookup or a join to the invoice header never gives.
+
+What PostgreSQL requires of a partitioned table, and what convert does:
+- primary keys and unique constraints must contain the partition key, so
+  the primary key becomes (pk, key) and unique constraints get the key
+  appended. The keys in GLOBAL_KEYS (invoice number + supplier, sales
+  invoice number) stay unique across years through a lookup table holding
+  every key, kept in step by a row trigger; generated ids still come from
+  one sequence;
+- a foreign key must reference a unique constraint, and (pk, key) is not
+  one the referencing tables can point at. Foreign keys INTO the converted
+  tables are re-pointed at the lookup table when it holds the referenced
+  key (sales_invoice_no) and dropped otherwise (invoiceid). Django emulates
+  on_delete itself, so deletes still cascade; only the database-level
+  check goes away.
+
+A detached year keeps its keys in the lookup table: its numbers stay taken
+until the lookup rows are deleted by hand.
+"""
+from datetime import date, datetime, timedelta
+
+from django.db import connection, models, transaction
+
+from .year_filter_utils import get_current_financial_year, get_financial_year_dates
+
+
+# db table -> partition key (the date every list / report filters on)
+PARTITION_KEYS = {
+    'core_invoicemaster': 'invoice_date',
+    'core_salesinvoicemaster': 'sales_invoice_date',
+    'core_purchasemaster': 'purchase_entry_date',
+    'core_salesmaster': 'sale_entry_date',
+}
+
+# db table -> column sets that must stay unique across financial years
+GLOBAL_KEYS = {
+    'core_invoicemaster': [('invoice_no', 'supplierid_id')],
+    'core_salesinvoicemaster': [('sales_invoice_no',)],
+}
+
+# First year offered by the year selector (context_processors.year_context)
+FIRST_FINANCIAL_YEAR = 2012
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+class FinancialYearQuerySet(models.QuerySet):
+    """Date filters on the partition key, in a form PostgreSQL can prune on"""
+
+    @property
+    def partition_field(self):
+        return PARTITION_KEYS[self.model._meta.db_table]
+
+    def in_date_range(self, start=None, end=None):
+        """Rows dated start..end inclusive (dates, datetimes or YYYY-MM-DD)"""
+        queryset = self
+        if start:
+            queryset = queryset.filter(**{f'{self.partition_field}__gte': _as_date(start)})
+        if end:
+            queryset = queryset.filter(**{f'{self.partition_field}__lt': _as_date(end) + timedelta(days=1)})
+        return queryset
+
+    def for_financial_year(self, fy_year=None):
+        """Rows of one financial year (default: the current one)"""
+        start_date, end_date = get_financial_year_dates(fy_year or get_current_financial_year())
+        return self.in_date_range(start_date, end_date)
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL DDL
+# ---------------------------------------------------------------------------
+
+def partition_name(table, fy_year):
+    return f'{table}_fy{fy_year}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def year_bounds(fy_year):
+    """[1 April fy_year, 1 April fy_year + 1) - the partition bounds"""
+    return date(fy_year, 4, 1), date(fy_year + 1, 4, 1)
+
+
+def financial_year_of(value):
+    value = _as_date(value)
+    return value.year if value.month >= 4 else value.year - 1
+
+
+def key_table_name(table, columns):
+    """Lookup table keeping `columns` unique across the partitions of `table`"""
+    return f'{table}_{"_".join(columns)}_key'
+
+
+def check_database():
+    if connection.vendor != 'postgresql':
+        raise ValueError(f'Financial-year partitioning needs PostgreSQL (this database is {connection.vendor})')
+    if connection.pg_version < 110000:
+        raise ValueError('Financial-year partitioning needs PostgreSQL 11 or newer')
+
+
+def is_partitioned(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(table):
+    """[{name, bounds, rows}] of a partitioned table, rows as estimated by ANALYZE"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+        """, [table])
+        return [{'name': name, 'bounds': bounds, 'rows': max(rows, 0)} for name, bounds, rows in cursor.fetchall()]
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _inspect(cursor, table):
+    """Primary key, constraints, plain indexes and incoming foreign keys of a table"""
+    cursor.execute("""
+        SELECT a.attname FROM pg_index x
+        JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+        WHERE x.indrelid = %s::regclass AND x.indisprimary
+    """, [table])
+    pk_columns = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT conname, contype, pg_get_constraintdef(oid),
+               ARRAY(SELECT a.attname FROM unnest(conkey) WITH ORDINALITY AS k(attnum, n)
+                     JOIN pg_attribute a ON a.attrelid = conrelid AND a.attnum = k.attnum ORDER BY k.n)
+        FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        ORDER BY conname
+    """, [table])
+    constraints = [
+        {'name': name, 'type': kind, 'definition': definition, 'columns': list(columns)}
+        for name, kind, definition, columns in cursor.fetchall()
+    ]
+
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(i.oid), x.indisunique FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid AND c.conrelid = x.indrelid)
+        ORDER BY i.relname
+    """, [table])
+    indexes = [{'name': name, 'definition': definition, 'unique': unique}
+               for name, definition, unique in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT conname, conrelid::regclass::text,
+               ARRAY(SELECT a.attname FROM unnest(conkey) WITH ORDINALITY AS k(attnum, n)
+                     JOIN pg_attribute a ON a.attrelid = conrelid AND a.attnum = k.attnum ORDER BY k.n),
+               ARRAY(SELECT a.attname FROM unnest(confkey) WITH ORDINALITY AS k(attnum, n)
+                     JOIN pg_attribute a ON a.attrelid = confrelid AND a.attnum = k.attnum ORDER BY k.n)
+        FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f' ORDER BY conname
+    """, [table])
+    incoming = [
+        {'name': name, 'table': source, 'columns': list(columns), 'references': list(references)}
+        for name, source, columns, references in cursor.fetchall()
+    ]
+
+    sequence = None
+    if len(pk_columns) == 1:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk_columns[0]])
+        sequence = cursor.fetchone()[0]
+    return pk_columns, constraints, indexes, incoming, sequence
+
+
+def plan_conversion(table, first_year=None, last_year=None):
+    """
+    SQL that turns `table` into a partitioned table, and the notes to show
+    the user. Nothing is executed. Years default to the data's first year
+    through next financial year.
+    """
+    key = PARTITION_KEYS[table]
+    old = f'{table}_unpartitioned'
+    notes = []
+    with connection.cursor() as cursor:
+        pk_columns, constraints, indexes, incoming, sequence = _inspect(cursor, table)
+        cursor.execute(f'SELECT min({_quote(key)}), max({_quote(key)}) FROM {_quote(table)}')
+        oldest, newest = cursor.fetchone()
+
+    if first_year is None:
+        first_year = max(FIRST_FINANCIAL_YEAR, financial_year_of(oldest)) if oldest else get_current_financial_year()
+    if last_year is None:
+        last_year = max(get_current_financial_year() + 1, financial_year_of(newest) if newest else 0)
+
+    statements = [
+        f'LOCK TABLE {_quote(table)} IN ACCESS EXCLUSIVE MODE',
+        f'ALTER TABLE {_quote(table)} RENAME TO {_quote(old)}',
+        f'CREATE TABLE {_quote(table)} (LIKE {_quote(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+        f'INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE ({_quote(key)})',
+    ]
+    for fy_year in range(first_year, last_year + 1):
+        start, end = year_bounds(fy_year)
+        statements.append(
+            f"CREATE TABLE {_quote(partition_name(table, fy_year))} PARTITION OF {_quote(table)} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    statements.append(f'CREATE TABLE {_quote(default_partition_name(table))} PARTITION OF {_quote(table)} DEFAULT')
+    statements.append(f'INSERT INTO {_quote(table)} SELECT * FROM {_quote(old)}')
+
+    if sequence:
+        # The old serial / identity sequence goes with the old table
+        pk = pk_columns[0]
+        new_sequence = f'{table}_{pk}_part_seq'
+        statements += [
+            f'CREATE SEQUENCE {_quote(new_sequence)} OWNED BY {_quote(table)}.{_quote(pk)}',
+            f"ALTER TABLE {_quote(table)} ALTER COLUMN {_quote(pk)} SET DEFAULT nextval('{new_sequence}')",
+            f"SELECT setval('{new_sequence}', COALESCE((SELECT max({_quote(pk)}) FROM {_quote(table)}), 0) + 1, false)",
+        ]
+
+    global_keys = GLOBAL_KEYS.get(table, [])
+    for columns in global_keys:
+        statements += _key_table_statements(table, old, columns)
+
+    repointed = []
+    for fk in incoming:
+        if tuple(fk['references']) in global_keys:
+            repointed.append(fk)
+            notes.append(f'foreign key {fk["name"]} on {fk["table"]} now references '
+                         f'{key_table_name(table, fk["references"])}')
+        else:
+            notes.append(f'foreign key {fk["name"]} on {fk["table"]} is dropped: the database no longer '
+                         f'checks {", ".join(fk["columns"])} against {table} (Django still cascades deletes)')
+    statements.append(f'DROP TABLE {_quote(old)} CASCADE')
+    for fk in repointed:
+        statements.append(
+            f'ALTER TABLE {_quote(fk["table"])} ADD CONSTRAINT {_quote(fk["name"])} '
+            f'FOREIGN KEY ({", ".join(_quote(column) for column in fk["columns"])}) '
+            f'REFERENCES {_quote(key_table_name(table, fk["references"]))} '
+            f'({", ".join(_quote(column) for column in fk["references"])}) DEFERRABLE INITIALLY DEFERRED'
+        )
+
+    for constraint in constraints:
+        if constraint['type'] == 'f':
+            statements.append(
+                f'ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(constraint["name"])} {constraint["definition"]}'
+            )
+            continue
+        columns = constraint['columns']
+        if key not in columns:
+            if tuple(columns) in global_keys:
+                notes.append(f'{constraint["name"]} stays unique across years through '
+                             f'{key_table_name(table, columns)}')
+            elif constraint['type'] == 'u':
+                notes.append(f'unique constraint {constraint["name"]} becomes unique per financial year')
+            columns = columns + [key]
+        kind = 'PRIMARY KEY' if constraint['type'] == 'p' else 'UNIQUE'
+        statements.append(
+            f'ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(constraint["name"])} '
+            f'{kind} ({", ".join(_quote(column) for column in columns)})'
+        )
+
+    for index in indexes:
+        definition = index['definition']
+        if index['unique']:
+            definition = definition.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1)
+            notes.append(f'unique index {index["name"]} is recreated as a plain index')
+        statements.append(definition)
+
+    statements.append(f'ANALYZE {_quote(table)}')
+    return statements, notes
+
+
+def _key_table_statements(table, old, columns):
+    """
+    Lookup table with `columns` as its primary key, filled from the rows
+    being converted, and the trigger that adds, changes and removes a key
+    with its row - a duplicate in any partition fails on the primary key.
+    """
+    name = key_table_name(table, columns)
+    function = f'{name}_sync'
+    column_list = ', '.join(_quote(column) for column in columns)
+    old_match = ' AND '.join(f'{_quote(column)} = OLD.{_quote(column)}' for column in columns)
+    new_values = ', '.join(f'NEW.{_quote(column)}' for column in columns)
+    changed = ' OR '.join(f'OLD.{_quote(column)} IS DISTINCT FROM NEW.{_quote(column)}' for column in columns)
+    return [
+        f'CREATE TABLE {_quote(name)} AS SELECT {column_list} FROM {_quote(old)}',
+        f'ALTER TABLE {_quote(name)} ADD PRIMARY KEY ({column_list})',
+        f"""CREATE FUNCTION {_quote(function)}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {_quote(name)} WHERE {old_match};
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        INSERT INTO {_quote(name)} ({column_list}) VALUES ({new_values});
+    END IF;
+    RETURN NULL;
+END $$""",
+        f'CREATE TRIGGER {_quote(function)} AFTER INSERT OR DELETE ON {_quote(table)} '
+        f'FOR EACH ROW EXECUTE FUNCTION {_quote(function)}()',
+        f'CREATE TRIGGER {_quote(function + "_update")} AFTER UPDATE OF {column_list} ON {_quote(table)} '
+        f'FOR EACH ROW WHEN ({changed}) EXECUTE FUNCTION {_quote(function)}()',
+    ]
+
+
+def convert_table(table, first_year=None, last_year=None):
+    """Partition `table` in one transaction. Returns the notes of plan_conversion"""
+    check_database()
+    if is_partitioned(table):
+        raise ValueError(f'{table} is already partitioned')
+    statements, notes = plan_conversion(table, first_year, last_year)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    return notes
+
+
+def add_partitions(table, last_year):
+    """
+    Create the missing yearly partitions up to last_year. Rows already in
+    the DEFAULT partition for a new year are moved into it.
+    """
+    check_database()
+    existing = {partition['name'] for partition in list_partitions(table)}
+    default = default_partition_name(table)
+    key = _quote(PARTITION_KEYS[table])
+    first_year = min(
+        [int(name.rsplit('_fy', 1)[1]) for name in existing if name.rsplit('_fy', 1)[-1].isdigit()]
+        or [get_current_financial_year()]
+    )
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for fy_year in range(first_year, last_year + 1):
+            name = partition_name(table, fy_year)
+            if name in existing:
+                continue
+            start, end = year_bounds(fy_year)
+            if default in existing:
+                cursor.execute(f'ALTER TABLE {_quote(table)} DETACH PARTITION {_quote(default)}')
+            cursor.execute(
+                f"CREATE TABLE {_quote(name)} PARTITION OF {_quote(table)} FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+            if default in existing:
+                # The detached DEFAULT has no trigger: free the keys of the moved rows
+                # so inserting them through the parent can take them again
+                for columns in GLOBAL_KEYS.get(table, []):
+                    match = ' AND '.join(f'k.{_quote(column)} = d.{_quote(column)}' for column in columns)
+                    cursor.execute(
+                        f'DELETE FROM {_quote(key_table_name(table, columns))} k USING {_quote(default)} d '
+                        f'WHERE {match} AND d.{key} >= %s AND d.{key} < %s', [start, end]
+                    )
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {_quote(default)} WHERE {key} >= %s AND {key} < %s RETURNING *) '
+                    f'INSERT INTO {_quote(table)} SELECT * FROM moved', [start, end]
+                )
+                cursor.execute(f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(default)} DEFAULT')
+            created.append(name)
+    return created
+
+
+def detach_year(table, fy_year):
+    """
+    Detach one year's partition: its rows leave the application (every
+    report and stock total) but stay in a standalone table of the same name,
+    which can be dumped and dropped, or attached again with attach_year().
+    Its invoice numbers stay taken in the GLOBAL_KEYS lookup tables.
+    """
+    check_database()
+    name = partition_name(table, fy_year)
+    if name not in {partition['name'] for partition in list_partitions(table)}:
+        raise ValueError(f'{table} has no partition for {fy_year}-{fy_year + 1}')
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {_quote(table)} DETACH PARTITION {_quote(name)}')
+    return name
+
+
+def attach_year(table, fy_year):
+    check_database()
+    name = partition_name(table, fy_year)
+    start, end = year_bounds(fy_year)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(name)} FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    return name
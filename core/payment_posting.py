@@ -0,0 +1,327 @@
+"""
+Payment Posting
+Applies supplier payments and customer receipts to their invoices with
+single UPDATE statements.
+
+    apply_*      add (or with a negative amount, reverse) a payment on the
+                 invoice with F() arithmetic: paid, open balance and the
+                 purchase payment_status change in the same UPDATE
+    post_*       one cheque / transfer split across many invoices: the payment
+                 rows are bulk inserted and all invoices are updated by one
+                 set-wise UPDATE, in one transaction
+    settle_*     lump-sum settlement for a party: locks the party's open
+                 invoices and allocates FIFO (oldest first) or by an explicit
+                 split, then posts through post_*
+    reverse_*    delete a payment row and take its amount off the invoice
+    resync_*     recompute paid from the payment rows (one UPDATE with a
+                 subquery) - used by the signals for ad-hoc edits
+
+Rows written through post_* / reverse_* are flagged with _posted so the
+signals in core/signals.py do not apply them a second time.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum, Value, Case, When, CharField, FloatField, Subquery, OuterRef
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+
+from .change_log import record_changes
+from .models import InvoiceMaster, InvoicePaid, SalesInvoiceMaster, SalesInvoicePaid
+from .open_items import OPEN_BALANCE_THRESHOLD
+from .year_close import block_closed_years_bulk
+
+
+def _purchase_status(paid):
+    """payment_status for the paid amount `paid` (an expression over the row)"""
+    return Case(
+        When(LessThanOrEqual(F('invoice_total') - paid, OPEN_BALANCE_THRESHOLD), then=Value('paid')),
+        When(GreaterThan(paid, 0), then=Value('partial')),
+        default=Value('pending'),
+        output_field=CharField()
+    )
+
+
+def _allocation_totals(allocations):
+    """{invoice key: summed amount} - an invoice may appear more than once"""
+    totals = defaultdict(float)
+    for invoice_key, amount in allocations:
+        totals[invoice_key] += float(amount)
+    return totals
+
+
+def _amount_by_key(key_field, totals):
+    """CASE key WHEN ... THEN amount - per-row amounts for a set-wise UPDATE"""
+    return Case(
+        *[When(**{key_field: key}, then=Value(amount)) for key, amount in totals.items()],
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+
+
+def allocate_fifo(open_items, amount):
+    """
+    Spread amount over open items oldest first.
+
+    Args:
+        open_items: iterable of (invoice key, open balance) in settlement order
+        amount: lump sum to allocate
+
+    Returns:
+        (list of (invoice key, allocated amount), unallocated remainder)
+    """
+    remaining = round(float(amount), 2)
+    allocations = []
+    for invoice_key, balance in open_items:
+        if remaining <= 0:
+            break
+        allocated = round(min(remaining, balance), 2)
+        allocations.append((invoice_key, allocated))
+        remaining = round(remaining - allocated, 2)
+    return allocations, remaining
+
+
+def _split_allocations(open_balances, splits, amount):
+    """Validate an explicit {invoice key: amount} split against the locked balances"""
+    allocations = []
+    for invoice_key, allocated in splits.items():
+        allocated = round(float(allocated), 2)
+        if allocated <= 0:
+            continue
+        if invoice_key not in open_balances:
+            raise ValueError(f'Invoice {invoice_key} has no outstanding balance')
+        if allocated > open_balances[invoice_key] + OPEN_BALANCE_THRESHOLD:
+            raise ValueError(f'Allocation for invoice {invoice_key} exceeds its balance of {open_balances[invoice_key]:.2f}')
+        allocations.append((invoice_key, allocated))
+
+    remaining = round(float(amount) - sum(allocated for _, allocated in allocations), 2)
+    if remaining < -OPEN_BALANCE_THRESHOLD:
+        raise ValueError('Allocations exceed the amount received')
+    return allocations, max(remaining, 0)
+
+
+# ---------------------------------------------------------------------------
+# Supplier payments (InvoiceMaster / InvoicePaid)
+# ---------------------------------------------------------------------------
+
+def apply_purchase_payment(invoice_id, amount):
+    """Add amount (negative = reverse) to one purchase invoice in a single UPDATE"""
+    amount = float(amount)
+    paid = F('invoice_paid') + amount
+    record_changes(InvoiceMaster, [invoice_id])
+    return InvoiceMaster.objects.filter(invoiceid=invoice_id).update(
+        invoice_paid=paid,
+        invoice_balance=F('invoice_total') - paid,
+        payment_status=_purchase_status(paid)
+    )
+
+
+def resync_purchase_payments(invoice_ids):
+    """Set invoice_paid / balance / status from the InvoicePaid rows"""
+    paid = Coalesce(Subquery(
+        InvoicePaid.objects.filter(
+            ip_invoiceid=OuterRef('pk')
+        ).order_by().values('ip_invoiceid').annotate(total=Sum('payment_amount')).values('total')
+    ), Value(0.0))
+    record_changes(InvoiceMaster, invoice_ids)
+    return InvoiceMaster.objects.filter(invoiceid__in=invoice_ids).update(
+        invoice_paid=paid,
+        invoice_balance=F('invoice_total') - paid,
+        payment_status=_purchase_status(paid)
+    )
+
+
+def apply_purchase_allocations(totals):
+    """Apply {invoice_id: amount} to every invoice with one UPDATE"""
+    amount = _amount_by_key('invoiceid', totals)
+    paid = F('invoice_paid') + amount
+    record_changes(InvoiceMaster, totals)
+    return InvoiceMaster.objects.filter(invoiceid__in=list(totals)).update(
+        invoice_paid=paid,
+        invoice_balance=F('invoice_total') - paid,
+        payment_status=_purchase_status(paid)
+    )
+
+
+def post_purchase_payments(allocations, payment_date, payment_mode=None, payment_ref_no=None):
+    """
+    Record one supplier payment split across invoices.
+
+    Args:
+        allocations: iterable of (invoice_id, amount)
+        payment_date, payment_mode, payment_ref_no: copied to every InvoicePaid row
+
+    Returns:
+        list of created InvoicePaid rows
+    """
+    allocations = [(invoice_id, float(amount)) for invoice_id, amount in allocations if float(amount) > 0]
+    payments = [
+        InvoicePaid(
+            ip_invoiceid_id=invoice_id,
+            payment_date=payment_date,
+            payment_amount=amount,
+            payment_mode=payment_mode,
+            payment_ref_no=payment_ref_no
+        )
+        for invoice_id, amount in allocations
+    ]
+
+    # bulk_create sends no pre_save: run the closed-year guard here
+    block_closed_years_bulk(InvoicePaid, payments)
+    with transaction.atomic():
+        payments = InvoicePaid.objects.bulk_create(payments)
+        record_changes(InvoicePaid, [payment.pk for payment in payments])
+        if allocations:
+            apply_purchase_allocations(_allocation_totals(allocations))
+
+    return payments
+
+
+def reverse_purchase_payment(payment):
+    """Delete an InvoicePaid row and take its amount off the invoice"""
+    with transaction.atomic():
+        payment._posted = True
+        payment.delete()
+        apply_purchase_payment(payment.ip_invoiceid_id, -payment.payment_amount)
+
+
+# ---------------------------------------------------------------------------
+# Customer receipts (SalesInvoiceMaster / SalesInvoicePaid)
+# ---------------------------------------------------------------------------
+
+def apply_sales_receipt(invoice_no, amount):
+    """Add amount (negative = reverse) to one sales invoice in a single UPDATE"""
+    amount = float(amount)
+    record_changes(SalesInvoiceMaster, [invoice_no])
+    return SalesInvoiceMaster.objects.filter(sales_invoice_no=invoice_no).update(
+        sales_invoice_paid=F('sales_invoice_paid') + amount,
+        sales_invoice_balance=F('sales_invoice_balance') - amount
+    )
+
+
+def resync_sales_receipts(invoice_nos):
+    """Set sales_invoice_paid / balance from the SalesInvoicePaid rows"""
+    paid = Coalesce(Subquery(
+        SalesInvoicePaid.objects.filter(
+            sales_ip_invoice_no=OuterRef('pk')
+        ).order_by().values('sales_ip_invoice_no').annotate(total=Sum('sales_payment_amount')).values('total')
+    ), Value(0.0))
+    record_changes(SalesInvoiceMaster, invoice_nos)
+    return SalesInvoiceMaster.objects.filter(sales_invoice_no__in=invoice_nos).update(
+        sales_invoice_balance=F('sales_invoice_balance') + F('sales_invoice_paid') - paid,
+        sales_invoice_paid=paid
+    )
+
+
+def apply_sales_allocations(totals):
+    """Apply {sales_invoice_no: amount} to every invoice with one UPDATE"""
+    amount = _amount_by_key('sales_invoice_no', totals)
+    record_changes(SalesInvoiceMaster, totals)
+    return SalesInvoiceMaster.objects.filter(sales_invoice_no__in=list(totals)).update(
+        sales_invoice_paid=F('sales_invoice_paid') + amount,
+        sales_invoice_balance=F('sales_invoice_balance') - amount
+    )
+
+
+def post_sales_receipts(allocations, payment_date, payment_mode='NA', payment_ref_no='NA'):
+    """
+    Record one customer receipt split across invoices.
+
+    Args:
+        allocations: iterable of (sales_invoice_no, amount)
+        payment_date, payment_mode, payment_ref_no: copied to every SalesInvoicePaid row
+
+    Returns:
+        list of created SalesInvoicePaid rows
+    """
+    allocations = [(invoice_no, float(amount)) for invoice_no, amount in allocations if float(amount) > 0]
+    receipts = [
+        SalesInvoicePaid(
+            sales_ip_invoice_no_id=invoice_no,
+            sales_payment_date=payment_date,
+            sales_payment_amount=amount,
+            sales_payment_mode=payment_mode,
+            sales_payment_ref_no=payment_ref_no
+        )
+        for invoice_no, amount in allocations
+    ]
+
+    # bulk_create sends no pre_save: run the closed-year guard here
+    block_closed_years_bulk(SalesInvoicePaid, receipts)
+    with transaction.atomic():
+        receipts = SalesInvoicePaid.objects.bulk_create(receipts)
+        record_changes(SalesInvoicePaid, [receipt.pk for receipt in receipts])
+        if allocations:
+            apply_sales_allocations(_allocation_totals(allocations))
+
+    return receipts
+
+
+def reverse_sales_receipt(receipt):
+    """Delete a SalesInvoicePaid row and take its amount off the invoice"""
+    with transaction.atomic():
+        receipt._posted = True
+        receipt.delete()
+        apply_sales_receipt(receipt.sales_ip_invoice_no_id, -receipt.sales_payment_amount)
+
+
+# ---------------------------------------------------------------------------
+# Lump-sum settlement
+# ---------------------------------------------------------------------------
+
+def settle_supplier_payment(supplier_id, amount, payment_date, payment_mode=None,
+                            payment_ref_no=None, splits=None):
+    """
+    Pay a supplier a lump sum across their open invoices.
+
+    The open invoices are locked (SELECT ... FOR UPDATE) in invoice date
+    order, so concurrent postings for the same supplier queue up instead of
+    over-allocating.
+
+    Args:
+        splits: optional {invoice_id: amount}; FIFO allocation when omitted
+
+    Returns:
+        (list of (invoice_id, amount) allocations, unallocated remainder)
+    """
+    with transaction.atomic():
+        open_items = list(
+            InvoiceMaster.objects.select_for_update().filter(
+                supplierid=supplier_id, invoice_balance__gt=OPEN_BALANCE_THRESHOLD
+            ).order_by('invoice_date', 'invoiceid').values_list('invoiceid', 'invoice_balance')
+        )
+        if splits:
+            allocations, unallocated = _split_allocations(dict(open_items), splits, amount)
+        else:
+            allocations, unallocated = allocate_fifo(open_items, amount)
+
+        post_purchase_payments(allocations, payment_date, payment_mode, payment_ref_no)
+
+    return allocations, unallocated
+
+
+def settle_customer_receipt(customer_id, amount, payment_date, payment_mode='NA',
+                            payment_ref_no='NA', splits=None):
+    """
+    Receive a lump sum from a customer across their open invoices.
+
+    Args:
+        splits: optional {sales_invoice_no: amount}; FIFO allocation when omitted
+
+    Returns:
+        (list of (sales_invoice_no, amount) allocations, unallocated remainder)
+    """
+    with transaction.atomic():
+        open_items = list(
+            SalesInvoiceMaster.objects.select_for_update().filter(
+                customerid=customer_id, sales_invoice_balance__gt=OPEN_BALANCE_THRESHOLD
+            ).order_by('sales_invoice_date', 'sales_invoice_no').values_list('sales_invoice_no', 'sales_invoice_balance')
+        )
+        if splits:
+            allocations, unallocated = _split_allocations(dict(open_items), splits, amount)
+        else:
+            allocations, unallocated = allocate_fifo(open_items, amount)
+
+        post_sales_receipts(allocations, payment_date, payment_mode, payment_ref_no)
+
+    return allocations, unallocated
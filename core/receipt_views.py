@@ -8,6 +8,8 @@ from datetime import datetime
 import json
 
 from .models import SalesInvoiceMaster, SalesInvoicePaid, CustomerMaster
+from .open_items import open_sales_invoices, sales_invoice_item
+from .payment_posting import post_sales_receipts
 
 @login_required
 def add_receipt(request):
@@ -57,7 +59,7 @@ def add_receipt(request):
                     })
                 
                 # Check if amount exceeds balance
-                balance = invoice.sales_invoice_total - invoice.sales_invoice_paid
+                balance = invoice.sales_invoice_balance
                 if receipt_amount > balance + 0.01:  # Small tolerance for floating point
                     return JsonResponse({
                         'success': False,
@@ -78,19 +80,14 @@ def add_receipt(request):
                 if payment_mode == 'bank_transfer' and bank_name:
                     final_payment_mode = f'Bank Transfer - {bank_name}'
                 
-                # Create receipt record using SalesInvoicePaid
-                receipt = SalesInvoicePaid.objects.create(
-                    sales_ip_invoice_no=invoice,
-                    sales_payment_date=parsed_date,
-                    sales_payment_amount=receipt_amount,
-                    sales_payment_mode=final_payment_mode,
-                    sales_payment_ref_no=reference_no
+                # Create the receipt and apply it to the invoice in one transaction
+                receipt, = post_sales_receipts(
+                    [(invoice.sales_invoice_no, receipt_amount)],
+                    payment_date=parsed_date,
+                    payment_mode=final_payment_mode,
+                    payment_ref_no=reference_no
                 )
                 
-                # Update invoice paid amount
-                invoice.sales_invoice_paid += receipt_amount
-                invoice.save()
-                
                 return JsonResponse({
                     'success': True,
                     'message': f'Receipt of ₹{receipt_amount:.2f} added successfully!',
@@ -121,22 +118,11 @@ def get_customer_invoices_api(request):
         return JsonResponse({'success': False, 'error': 'Customer ID is required'})
     
     try:
-        # Get unpaid or partially paid invoices for the customer
-        invoices = SalesInvoiceMaster.objects.filter(
-            customerid=customer_id
-        ).order_by('-sales_invoice_date')
-        
-        invoice_list = []
-        for invoice in invoices:
-            balance = invoice.sales_invoice_total - invoice.sales_invoice_paid
-            if balance > 0.01:  # Only show invoices with outstanding balance
-                invoice_list.append({
-                    'invoice_no': invoice.sales_invoice_no,
-                    'invoice_date': invoice.sales_invoice_date.strftime('%Y-%m-%d'),
-                    'total_amount': float(invoice.sales_invoice_total),
-                    'paid_amount': float(invoice.sales_invoice_paid),
-                    'balance_amount': float(balance)
-                })
+        # Open invoices only - one query on the open-items index
+        invoice_list = [
+            sales_invoice_item(invoice, date_format='%Y-%m-%d')
+            for invoice in open_sales_invoices(customer_id=customer_id)
+        ]
         
         return JsonResponse({
             'success': True,
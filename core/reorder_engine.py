@@ -0,0 +1,180 @@
+"""
+Reorder Engine
+Purchase planning for the whole catalogue in one batch run.
+
+Demand is read with one grouped query per sales source (invoices + customer
+challans) using conditional sums for every rolling window, stock comes from
+ProductInventoryCache, and the last supplier / rate comes from a single
+annotated ProductMaster query. The results are written to ReorderSuggestion
+so the draft purchase list is a plain table read.
+
+Policy (per product):
+    daily_demand  = weighted blend of the 7 / 30 / 90 day averages
+    reorder point = daily_demand × supplier lead time + product reorder level
+    order up to   = daily_demand × (lead time + cover days) + product reorder level
+A product is suggested when its stock is at or below the reorder point.
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Sum, Q, F, Subquery, OuterRef
+from django.utils import timezone
+
+from .models import (
+    ProductMaster, SupplierMaster, ProductInventoryCache, PurchaseMaster,
+    SalesMaster, CustomerChallanMaster, ReorderSuggestion
+)
+
+
+# Rolling windows in days and their weight in the planning demand
+WINDOW_WEIGHTS = {7: 0.5, 30: 0.3, 90: 0.2}
+DEFAULT_COVER_DAYS = 30
+DEFAULT_LEAD_TIME_DAYS = 7
+
+# (model, product field, quantity field, date field)
+DEMAND_SOURCES = [
+    (SalesMaster, 'productid', 'sale_quantity', 'sale_entry_date'),
+    (CustomerChallanMaster, 'product_id', 'sale_quantity', 'sales_entry_date'),
+]
+
+
+def _window_sales(now):
+    """{product_id: {days: units sold in the last `days` days}}"""
+    longest = max(WINDOW_WEIGHTS)
+    sold = defaultdict(lambda: dict.fromkeys(WINDOW_WEIGHTS, 0))
+
+    for model, product_field, qty_field, date_field in DEMAND_SOURCES:
+        aggregates = {
+            f'w{days}': Sum(qty_field, filter=Q(**{f'{date_field}__gte': now - timedelta(days=days)}))
+            for days in WINDOW_WEIGHTS
+        }
+        rows = model.objects.filter(
+            **{f'{date_field}__gte': now - timedelta(days=longest)}
+        ).order_by().values(product_field).annotate(**aggregates)
+
+        for row in rows:
+            entry = sold[row[product_field]]
+            for days in WINDOW_WEIGHTS:
+                entry[days] += row[f'w{days}'] or 0
+
+    return sold
+
+
+def _products_with_last_purchase():
+    """Every product with its latest purchase supplier / rate / MRP / date"""
+    latest = PurchaseMaster.objects.filter(
+        productid=OuterRef('productid')
+    ).order_by('-purchase_entry_date', '-purchaseid')
+
+    return ProductMaster.objects.annotate(
+        last_supplier_id=Subquery(latest.values('product_supplierid')[:1]),
+        last_rate=Subquery(latest.values('product_purchase_rate')[:1]),
+        last_mrp=Subquery(latest.values('product_MRP')[:1]),
+        last_date=Subquery(latest.values('purchase_entry_date')[:1]),
+    ).values(
+        'productid', 'product_reorder_level',
+        'last_supplier_id', 'last_rate', 'last_mrp', 'last_date'
+    ).order_by()
+
+
+def build_reorder_suggestions(cover_days=DEFAULT_COVER_DAYS, now=None):
+    """
+    Compute suggestions for the whole catalogue (nothing is saved).
+    Products with neither purchase history nor recent demand are skipped.
+
+    Returns:
+        list of unsaved ReorderSuggestion objects
+    """
+    now = now or timezone.now()
+
+    sold = _window_sales(now)
+    stock = dict(ProductInventoryCache.objects.values_list('product_id', 'total_stock'))
+    lead_times = dict(SupplierMaster.objects.values_list('supplierid', 'supplier_lead_time_days'))
+
+    suggestions = []
+    for product in _products_with_last_purchase().iterator(chunk_size=2000):
+        product_id = product['productid']
+        windows = sold.get(product_id)
+        if product['last_supplier_id'] is None and windows is None:
+            continue
+
+        averages = {days: (windows[days] if windows else 0) / days for days in WINDOW_WEIGHTS}
+        daily_demand = sum(averages[days] * weight for days, weight in WINDOW_WEIGHTS.items())
+
+        current_stock = stock.get(product_id, 0)
+        on_hand = max(current_stock, 0)
+        lead_time = lead_times.get(product['last_supplier_id'], DEFAULT_LEAD_TIME_DAYS)
+        reorder_level = product['product_reorder_level']
+
+        reorder_point = daily_demand * lead_time + reorder_level
+        order_up_to = daily_demand * (lead_time + cover_days) + reorder_level
+        suggested_qty = math.ceil(order_up_to - on_hand) if on_hand <= reorder_point else 0
+
+        last_rate = product['last_rate'] or 0
+        suggestions.append(ReorderSuggestion(
+            product_id=product_id,
+            supplier_id=product['last_supplier_id'],
+            avg_daily_7=averages[7],
+            avg_daily_30=averages[30],
+            avg_daily_90=averages[90],
+            daily_demand=daily_demand,
+            current_stock=current_stock,
+            days_of_cover=on_hand / daily_demand if daily_demand > 0 else None,
+            lead_time_days=lead_time,
+            last_purchase_rate=last_rate,
+            last_mrp=product['last_mrp'] or 0,
+            last_purchase_date=product['last_date'],
+            suggested_qty=suggested_qty,
+            estimated_value=suggested_qty * last_rate,
+            generated_at=now,
+        ))
+
+    return suggestions
+
+
+def generate_reorder_suggestions(cover_days=DEFAULT_COVER_DAYS):
+    """
+    Batch job: recompute and replace the stored suggestions.
+
+    Returns:
+        (rows stored, rows with a suggested quantity)
+    """
+    suggestions = build_reorder_suggestions(cover_days=cover_days)
+
+    with transaction.atomic():
+        ReorderSuggestion.objects.all().delete()
+        ReorderSuggestion.objects.bulk_create(suggestions, batch_size=1000)
+
+    return len(suggestions), sum(1 for s in suggestions if s.suggested_qty > 0)
+
+
+def get_draft_purchase_list():
+    """
+    Stored suggestions grouped by supplier for the draft purchase list.
+
+    Returns:
+        list of {'supplier', 'items', 'total_qty', 'total_value'}; products
+        never purchased come last with supplier None
+    """
+    rows = ReorderSuggestion.objects.filter(
+        suggested_qty__gt=0
+    ).select_related('product', 'supplier').order_by(
+        'supplier__supplier_name', 'supplier_id',
+        F('days_of_cover').asc(nulls_last=True), 'product__product_name'
+    )
+
+    groups = []
+    for _, items in groupby(rows, key=lambda row: row.supplier_id):
+        items = list(items)
+        groups.append({
+            'supplier': items[0].supplier,
+            'items': items,
+            'total_qty': sum(item.suggested_qty for item in items),
+            'total_value': sum(item.estimated_value for item in items),
+        })
+
+    groups.sort(key=lambda group: group['supplier'] is None)
+    return groups
@@ -0,0 +1,29 @@
+"""
+Reorder Suggestion Views - draft purchase list grouped by supplier
+Reads the stored ReorderSuggestion table; recomputing is a batch job.
+"""
+from django.shortcuts import render, redirect
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db.models import Max
+
+from .models import ReorderSuggestion
+from .reorder_engine import generate_reorder_suggestions, get_draft_purchase_list
+
+
+@login_required
+def reorder_suggestions(request):
+    """Draft purchase list from the last reorder engine run"""
+    if request.method == 'POST':
+        stored, to_order = generate_reorder_suggestions()
+        messages.success(request, f'Reorder suggestions regenerated: {to_order} of {stored} products need reordering.')
+        return redirect('reorder_suggestions')
+    
+    groups = get_draft_purchase_list()
+    
+    return render(request, 'inventory/reorder_suggestions.html', {
+        'groups': groups,
+        'total_items': sum(len(group['items']) for group in groups),
+        'grand_total_value': sum(group['total_value'] for group in groups),
+        'generated_at': ReorderSuggestion.objects.aggregate(last=Max('generated_at'))['last'],
+    })
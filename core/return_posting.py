@@ -0,0 +1,233 @@
+"""
+Return Posting
+Validates and saves all lines of a purchase / sales return in one go.
+
+The stock check reads the BatchInventoryCache rows of the batches on the
+return, locked with SELECT ... FOR UPDATE so two returns against the same
+batch queue up instead of both passing the check. A return is compared with
+the lines it replaces (none for a new return) and only the difference is
+applied to the cache rows with F() arithmetic - a batch is recalculated from
+the transaction tables only when it has no cache row yet. A purchase return
+comes off every expiry row of its batch, so it must fit in each of them: the
+row with the least stock decides, and a return it cannot cover fails rather
+than leaving a row clamped at zero. Every cache row moved gets a
+StockAuditEntry row.
+
+Lines written here are flagged with _posted so the cache signals in
+core/signals.py do not refresh their batches a second time.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from .change_log import record_changes
+from .inventory_cache import update_all_batches_for_product, update_batch_cache, update_product_cache
+from .models import BatchInventoryCache, ReturnPurchaseMaster, ReturnSalesMaster, StockAuditEntry
+from .year_close import block_closed_years_bulk
+
+
+# Line fields of the two return types. Purchase returns take stock out of the
+# whole batch (their expiry is a date, see core/stock_service.py); sales
+# returns put it back into one batch + expiry.
+PURCHASE_RETURN = {
+    'action': 'purchase_return', 'model': ReturnPurchaseMaster, 'header': 'returninvoiceid',
+    'product': 'returnproductid', 'batch': 'returnproduct_batch_no', 'expiry': None,
+    'quantity': 'returnproduct_quantity', 'sign': -1,
+}
+SALES_RETURN = {
+    'action': 'sales_return', 'model': ReturnSalesMaster, 'header': 'return_sales_invoice_no',
+    'product': 'return_productid', 'batch': 'return_product_batch_no', 'expiry': 'return_product_expiry',
+    'quantity': 'return_sale_quantity', 'sign': 1,
+}
+
+QUANTITY_TOLERANCE = 1e-6
+
+
+class ReturnStockError(Exception):
+    """A return failed validation; problems holds one dict per failing line"""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problem['message'] for problem in problems))
+        self.problems = problems
+
+
+def _lock_batches(keys):
+    """{(product_id, batch_no): [cache rows]} for the batches in keys, locked in pk order"""
+    rows = defaultdict(list)
+    if not keys:
+        return rows
+    condition = Q()
+    for product_id, batch_no in keys:
+        condition |= Q(product_id=product_id, batch_no=batch_no)
+    for row in BatchInventoryCache.objects.select_for_update().filter(condition).order_by('pk'):
+        rows[(row.product_id, row.batch_no)].append(row)
+    return rows
+
+
+def _locked_batches(keys):
+    """_lock_batches, building the cache rows first for batches that have none"""
+    rows = _lock_batches(keys)
+    missing = [key for key in keys if key not in rows]
+    for product_id in {product_id for product_id, _ in missing}:
+        update_all_batches_for_product(product_id)
+    rows.update(_lock_batches(missing))
+    return rows
+
+
+def _line_key(spec, product_id, batch_no, expiry):
+    return (product_id, batch_no, expiry) if spec['expiry'] else (product_id, batch_no)
+
+
+def _key_rows(spec, key, batches):
+    """Cache rows a change of key moves: every expiry of the batch, or the one expiry of a sales return"""
+    rows = batches.get(key[:2], [])
+    if spec['expiry']:
+        rows = [row for row in rows if row.expiry_date == key[2]]
+    return rows
+
+
+def _replace_lines(spec, header, lines):
+    """Delete the header's current lines and bulk insert the new ones"""
+    model = spec['model']
+    for line in model.objects.filter(**{spec['header']: header}):
+        line._posted = True
+        line.delete()
+    for line in lines:
+        setattr(line, spec['header'], header)
+    # bulk_create sends no pre_save: run the closed-year guard here
+    block_closed_years_bulk(model, lines)
+    lines = model.objects.bulk_create(lines)
+    record_changes(model, [line.pk for line in lines])
+    return lines
+
+
+def _validate(spec, lines, changes, batches):
+    """Problems of the return: quantities not positive, batches unknown or short of stock"""
+    problems = []
+    requested = defaultdict(float)
+    names = {}
+    for line in lines:
+        product = getattr(line, spec['product'])
+        batch_no = getattr(line, spec['batch'])
+        quantity = getattr(line, spec['quantity'])
+        key = _line_key(spec, product.productid, batch_no, getattr(line, spec['expiry']) if spec['expiry'] else None)
+        requested[key] += quantity
+        names[key] = product.product_name
+        if quantity <= 0:
+            problems.append({
+                'error_type': 'invalid_quantity', 'product_name': product.product_name, 'batch_no': batch_no,
+                'message': f"Invalid return quantity for {product.product_name} (Batch: {batch_no}): {quantity}. "
+                           f"Quantity must be positive.",
+            })
+
+    for key, name in names.items():
+        if not batches.get(key[:2]):
+            problems.append({
+                'error_type': 'batch_not_found', 'product_name': name, 'batch_no': key[1],
+                'message': f"Batch {key[1]} not found for product {name}. Cannot process return.",
+            })
+
+    # Stock going out (a purchase return, or a sales return cut down) moves every
+    # cache row of the key by the whole change: the row with the least stock decides
+    for key, change in changes.items():
+        if change >= 0 or (key in names and not batches.get(key[:2])):
+            continue
+        rows = _key_rows(spec, key, batches)
+        available = min((row.current_stock for row in rows), default=0)
+        if available + change < -QUANTITY_TOLERANCE:
+            # A key only the replaced lines had is named from its cache row
+            name = names[key] if key in names else (rows[0].product.product_name if rows else key[0])
+            problems.append({
+                'error_type': 'insufficient_stock', 'product_name': name, 'batch_no': key[1],
+                'available_stock': available + requested[key] + change, 'requested_quantity': requested[key],
+                'message': f"Insufficient stock for return. Product: {name}, Batch: {key[1]}. "
+                           f"Available: {available + requested[key] + change}, Requested: {requested[key]}",
+            })
+    return problems
+
+
+def _apply_changes(spec, header_no, changes, batches, user):
+    """Move the cache rows by the changes (validated to stay non-negative) and write one audit row per cache row"""
+    entries = []
+    for key, change in changes.items():
+        if abs(change) < QUANTITY_TOLERANCE:
+            continue
+        rows = _key_rows(spec, key, batches)
+        if rows:
+            BatchInventoryCache.objects.filter(pk__in=[row.pk for row in rows]).update(
+                current_stock=F('current_stock') + change
+            )
+            moved = [(row.expiry_date, row.current_stock, row.current_stock + change) for row in rows]
+        else:
+            # A sales return into an expiry the batch has no cache row for yet
+            cache = update_batch_cache(*key)
+            moved = [(key[2], 0, cache.current_stock if cache else 0)]
+        entries += [
+            StockAuditEntry(
+                action=spec['action'], document_no=header_no, product_id=key[0], batch_no=key[1],
+                expiry_date=expiry, quantity=change, stock_before=before, stock_after=after, user=user,
+            )
+            for expiry, before, after in moved
+        ]
+    entries = StockAuditEntry.objects.bulk_create(entries)
+    record_changes(StockAuditEntry, [entry.pk for entry in entries])
+    for product_id in {key[0] for key in changes}:
+        update_product_cache(product_id)
+    return entries
+
+
+def _post_return(spec, header, lines, user=None):
+    """Validate lines against the locked batch stock, then save them in place of the header's lines"""
+    lines = list(lines)
+    with transaction.atomic():
+        fields = [spec['product'], spec['batch']] + ([spec['expiry']] if spec['expiry'] else [])
+        changes = defaultdict(float)
+        for row in spec['model'].objects.filter(**{spec['header']: header}).order_by().values_list(
+            *fields
+        ).annotate(total=Sum(spec['quantity'])):
+            changes[tuple(row[:-1])] -= spec['sign'] * (row[-1] or 0)
+        for line in lines:
+            key = _line_key(spec, getattr(line, spec['product']).productid, getattr(line, spec['batch']),
+                            getattr(line, spec['expiry']) if spec['expiry'] else None)
+            changes[key] += spec['sign'] * getattr(line, spec['quantity'])
+
+        batches = _locked_batches(list({key[:2] for key in changes}))
+        problems = _validate(spec, lines, changes, batches)
+        if problems:
+            raise ReturnStockError(problems)
+
+        lines = _replace_lines(spec, header, lines)
+        user = user if getattr(user, 'is_authenticated', False) else None
+        entries = _apply_changes(spec, header.pk, changes, batches, user)
+    return lines, entries
+
+
+def post_purchase_return(return_invoice, lines, user=None):
+    """
+    Save lines (unsaved ReturnPurchaseMaster rows) as the lines of return_invoice,
+    replacing the ones it has.
+
+    Raises:
+        ReturnStockError, with nothing saved, when a quantity is not positive
+        or a batch has less stock than the return takes out
+
+    Returns:
+        (created lines, StockAuditEntry rows)
+    """
+    return _post_return(PURCHASE_RETURN, return_invoice, lines, user)
+
+
+def post_sales_return(return_invoice, lines, user=None):
+    """
+    Save lines (unsaved ReturnSalesMaster rows) as the lines of return_invoice,
+    replacing the ones it has.
+
+    Raises:
+        ReturnStockError, with nothing saved, when a quantity is not positive
+        or a batch is unknown
+
+    Returns:
+        (created lines, StockAuditEntry rows)
+    """
+    return _post_return(SALES_RETURN, return_invoice, lines, user)
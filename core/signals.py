@@ -1,88 +1,47 @@
+import logging
+from contextlib import contextmanager
+
+from django.apps import apps
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db import models
 from .models import (
-    InvoicePaid, InvoiceMaster, SalesInvoicePaid, SalesInvoiceMaster,
+    InvoicePaid, SalesInvoicePaid, SalesInvoiceMaster,
     SupplierChallanMaster, PurchaseMaster, SalesMaster
 )
+from .open_items import refresh_sales_invoice_balances
+from .payment_posting import resync_purchase_payments, resync_sales_receipts
 # REMOVED: InventoryMaster, InventoryTransaction - no longer needed
 
-@receiver(post_save, sender=InvoicePaid)
-def update_invoice_payment_status_on_save(sender, instance, **kwargs):
-    """Update invoice payment status when a payment is added or modified"""
-    invoice = instance.ip_invoiceid
-    
-    # Recalculate total paid amount from all payments
-    total_paid = InvoicePaid.objects.filter(ip_invoiceid=invoice).aggregate(
-        total=models.Sum('payment_amount')
-    )['total'] or 0
-    
-    # Update invoice paid amount
-    invoice.invoice_paid = total_paid
-    
-    # Update payment status based on balance
-    balance = invoice.invoice_total - invoice.invoice_paid
-    if balance <= 0.01:
-        invoice.payment_status = 'paid'
-    elif invoice.invoice_paid > 0:
-        invoice.payment_status = 'partial'
-    else:
-        invoice.payment_status = 'pending'
-    
-    invoice.save()
+logger = logging.getLogger(__name__)
 
-@receiver(post_delete, sender=InvoicePaid)
-def update_invoice_payment_status_on_delete(sender, instance, **kwargs):
-    """Update invoice payment status when a payment is deleted"""
-    invoice = instance.ip_invoiceid
-    
-    # Recalculate total paid amount from remaining payments
-    total_paid = InvoicePaid.objects.filter(ip_invoiceid=invoice).aggregate(
-        total=models.Sum('payment_amount')
-    )['total'] or 0
-    
-    # Update invoice paid amount
-    invoice.invoice_paid = total_paid
-    
-    # Update payment status based on balance
-    balance = invoice.invoice_total - invoice.invoice_paid
-    if balance <= 0.01:
-        invoice.payment_status = 'paid'
-    elif invoice.invoice_paid > 0:
-        invoice.payment_status = 'partial'
-    else:
-        invoice.payment_status = 'pending'
-    
-    invoice.save()
+# Payment signals: one UPDATE per change, keyed on the FK id (no invoice fetch).
+# Rows written by core/payment_posting are flagged _posted and already applied.
+@receiver([post_save, post_delete], sender=InvoicePaid)
+def update_invoice_payment_status(sender, instance, **kwargs):
+    """Resync invoice_paid / payment_status when a payment is added, edited or deleted"""
+    if getattr(instance, '_posted', False):
+        return
+    resync_purchase_payments([instance.ip_invoiceid_id])
 
 # Sales Invoice Payment Signals
-@receiver(post_save, sender=SalesInvoicePaid)
-def update_sales_invoice_payment_on_save(sender, instance, **kwargs):
-    """Update sales invoice payment total when a payment is added or modified"""
-    invoice = instance.sales_ip_invoice_no
-    
-    # Recalculate total paid amount from all payments
-    total_paid = SalesInvoicePaid.objects.filter(sales_ip_invoice_no=invoice).aggregate(
-        total=models.Sum('sales_payment_amount')
-    )['total'] or 0
-    
-    # Update invoice paid amount
-    invoice.sales_invoice_paid = total_paid
-    invoice.save()
+@receiver([post_save, post_delete], sender=SalesInvoicePaid)
+def update_sales_invoice_payment(sender, instance, **kwargs):
+    """Resync sales_invoice_paid when a receipt is added, edited or deleted"""
+    if getattr(instance, '_posted', False):
+        return
+    resync_sales_receipts([instance.sales_ip_invoice_no_id])
+
+# Open-items balance: sales balances depend on the line items, so any change to the
+# invoice or its items recomputes the stored balance with one UPDATE
+@receiver(post_save, sender=SalesInvoiceMaster)
+def update_sales_invoice_balance_on_save(sender, instance, **kwargs):
+    """Keep sales_invoice_balance in step with sales_invoice_paid"""
+    refresh_sales_invoice_balances([instance.sales_invoice_no])
 
-@receiver(post_delete, sender=SalesInvoicePaid)
-def update_sales_invoice_payment_on_delete(sender, instance, **kwargs):
-    """Update sales invoice payment total when a payment is deleted"""
-    invoice = instance.sales_ip_invoice_no
-    
-    # Recalculate total paid amount from remaining payments
-    total_paid = SalesInvoicePaid.objects.filter(sales_ip_invoice_no=invoice).aggregate(
-        total=models.Sum('sales_payment_amount')
-    )['total'] or 0
-    
-    # Update invoice paid amount
-    invoice.sales_invoice_paid = total_paid
-    invoice.save()
+@receiver([post_save, post_delete], sender=SalesMaster)
+def update_sales_invoice_balance_on_item_change(sender, instance, **kwargs):
+    """Keep sales_invoice_balance in step with the invoice items"""
+    refresh_sales_invoice_balances([instance.sales_invoice_no_id])
 
 # REMOVED: Inventory Management Signals - no longer needed
 # Inventory is now tracked through PurchaseMaster and SalesMaster tables directly
@@ -92,9 +51,10 @@ def update_sales_invoice_payment_on_delete(sender, instance, **kwargs):
 # ============================================
 from .models import (
     ReturnPurchaseMaster, ReturnSalesMaster, StockIssueDetail,
-    CustomerChallanMaster
+    CustomerChallanMaster, ProductMaster
 )
 from .inventory_cache import update_batch_cache, update_product_cache, update_all_batches_for_product
+from .low_stock_service import refresh_stock_status
 
 @receiver(post_save, sender=PurchaseMaster)
 def update_cache_on_purchase_save(sender, instance, **kwargs):
@@ -106,8 +66,8 @@ def update_cache_on_purchase_save(sender, instance, **kwargs):
             instance.product_expiry
         )
         update_product_cache(instance.productid.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_purchase_save: {e}")
+    except Exception:
+        logger.exception('update_cache_on_purchase_save failed')
 
 @receiver(post_delete, sender=PurchaseMaster)
 def update_cache_on_purchase_delete(sender, instance, **kwargs):
@@ -135,8 +95,8 @@ def update_cache_on_purchase_delete(sender, instance, **kwargs):
         
         # Update product summary
         update_product_cache(product_id)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_purchase_delete: {e}")
+    except Exception:
+        logger.exception('update_cache_on_purchase_delete failed')
 
 @receiver(post_save, sender=SalesMaster)
 def update_cache_on_sale_save(sender, instance, **kwargs):
@@ -148,8 +108,8 @@ def update_cache_on_sale_save(sender, instance, **kwargs):
             instance.product_expiry
         )
         update_product_cache(instance.productid.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_sale_save: {e}")
+    except Exception:
+        logger.exception('update_cache_on_sale_save failed')
 
 @receiver(post_delete, sender=SalesMaster)
 def update_cache_on_sale_delete(sender, instance, **kwargs):
@@ -162,8 +122,8 @@ def update_cache_on_sale_delete(sender, instance, **kwargs):
         # Recalculate and update batch cache
         update_batch_cache(product_id, batch_no, expiry_date)
         update_product_cache(product_id)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_sale_delete: {e}")
+    except Exception:
+        logger.exception('update_cache_on_sale_delete failed')
 
 @receiver(post_save, sender=SupplierChallanMaster)
 def update_cache_on_supplier_challan_save(sender, instance, **kwargs):
@@ -175,8 +135,8 @@ def update_cache_on_supplier_challan_save(sender, instance, **kwargs):
             instance.product_expiry
         )
         update_product_cache(instance.product_id.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_supplier_challan_save: {e}")
+    except Exception:
+        logger.exception('update_cache_on_supplier_challan_save failed')
 
 @receiver(post_delete, sender=SupplierChallanMaster)
 def update_cache_on_supplier_challan_delete(sender, instance, **kwargs):
@@ -204,8 +164,8 @@ def update_cache_on_supplier_challan_delete(sender, instance, **kwargs):
         
         # Update product summary
         update_product_cache(product_id)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_supplier_challan_delete: {e}")
+    except Exception:
+        logger.exception('update_cache_on_supplier_challan_delete failed')
 
 @receiver(post_save, sender=CustomerChallanMaster)
 def update_cache_on_customer_challan_save(sender, instance, **kwargs):
@@ -217,8 +177,8 @@ def update_cache_on_customer_challan_save(sender, instance, **kwargs):
             instance.product_expiry
         )
         update_product_cache(instance.product_id.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_customer_challan_save: {e}")
+    except Exception:
+        logger.exception('update_cache_on_customer_challan_save failed')
 
 @receiver(post_delete, sender=CustomerChallanMaster)
 def update_cache_on_customer_challan_delete(sender, instance, **kwargs):
@@ -231,20 +191,25 @@ def update_cache_on_customer_challan_delete(sender, instance, **kwargs):
         # Recalculate and update batch cache
         update_batch_cache(product_id, batch_no, expiry_date)
         update_product_cache(product_id)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_customer_challan_delete: {e}")
+    except Exception:
+        logger.exception('update_cache_on_customer_challan_delete failed')
 
 @receiver([post_save, post_delete], sender=ReturnPurchaseMaster)
 def update_cache_on_purchase_return(sender, instance, **kwargs):
     """Update cache when purchase return is added/modified/deleted"""
+    # Lines written by core/return_posting are flagged _posted and already applied
+    if getattr(instance, '_posted', False):
+        return
     try:
         update_all_batches_for_product(instance.returnproductid.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_purchase_return: {e}")
+    except Exception:
+        logger.exception('update_cache_on_purchase_return failed')
 
 @receiver([post_save, post_delete], sender=ReturnSalesMaster)
 def update_cache_on_sales_return(sender, instance, **kwargs):
     """Update cache when sales return is added/modified/deleted"""
+    if getattr(instance, '_posted', False):
+        return
     try:
         update_batch_cache(
             instance.return_productid.productid,
@@ -252,8 +217,8 @@ def update_cache_on_sales_return(sender, instance, **kwargs):
             instance.return_product_expiry
         )
         update_product_cache(instance.return_productid.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_sales_return: {e}")
+    except Exception:
+        logger.exception('update_cache_on_sales_return failed')
 
 @receiver([post_save, post_delete], sender=StockIssueDetail)
 def update_cache_on_stock_issue(sender, instance, **kwargs):
@@ -265,8 +230,42 @@ def update_cache_on_stock_issue(sender, instance, **kwargs):
             instance.expiry_date
         )
         update_product_cache(instance.product.productid)
-    except Exception as e:
-        print(f"[ERROR] update_cache_on_stock_issue: {e}")
+    except Exception:
+        logger.exception('update_cache_on_stock_issue failed')
+
+@receiver(post_save, sender=ProductMaster)
+def update_stock_status_on_product_save(sender, instance, update_fields=None, **kwargs):
+    """Re-classify cached stock status when the product's reorder level may have changed"""
+    if update_fields is not None and 'product_reorder_level' not in update_fields:
+        return
+    try:
+        refresh_stock_status([instance.productid])
+    except Exception:
+        logger.exception('update_stock_status_on_product_save failed')
 # ============================================
 # INVENTORY CACHE UPDATE SIGNALS - END
 # ============================================
+
+
+@contextmanager
+def signals_disabled():
+    """
+    Disconnect the receivers in this module for the duration of a bulk load or
+    bulk delete (generate_bulk_data) - the caller rebuilds balances and the
+    inventory cache set-wise afterwards instead of once per row.
+    """
+    receivers = [
+        value for value in globals().values()
+        if callable(value) and getattr(value, '__module__', None) == __name__ and value is not signals_disabled
+    ]
+    disconnected = []
+    for model in apps.get_app_config('core').get_models():
+        for signal in (post_save, post_delete):
+            for func in receivers:
+                if signal.disconnect(func, sender=model):
+                    disconnected.append((signal, func, model))
+    try:
+        yield
+    finally:
+        for signal, func, model in disconnected:
+            signal.connect(func, sender=model)
@@ -9,7 +9,11 @@ from django.utils import timezone
 from .models import (
     StockIssueMaster, StockIssueDetail, ProductMaster, Web_User
 )
+from .stock_service import balance, balances_for
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 @login_required
 def stock_issue_list(request):
@@ -70,35 +74,10 @@ def add_stock_issue(request):
                         quantity_issued = float(item['quantity_issued'])
                         unit_rate = float(item.get('unit_rate', 0))
                         
-                        # Update inventory first
-                        try:
-                            inventory = InventoryMaster.objects.get(
-                                product=product,
-                                batch_no=item['batch_no']
-                            )
-                            
-                            # Check if sufficient stock available
-                            if inventory.current_stock < quantity_issued:
-                                raise ValueError(f"Insufficient stock for {product.product_name} - Batch {item['batch_no']}. Available: {inventory.current_stock}, Required: {quantity_issued}")
-                            
-                            # Decrease inventory stock
-                            inventory.current_stock = max(0, inventory.current_stock - quantity_issued)
-                            inventory.save()
-                            
-                            # Create inventory transaction
-                            InventoryTransaction.objects.create(
-                                inventory=inventory,
-                                transaction_type='adjustment',
-                                quantity=-quantity_issued,
-                                unit_rate=unit_rate,
-                                reference_type='stock_issue',
-                                reference_id=issue.issue_no or f'SI-{issue.issue_id}',
-                                remarks=f"Stock Issue: {issue.get_issue_type_display()} - {item.get('remarks', '')}",
-                                created_by=request.user
-                            )
-                            
-                        except InventoryMaster.DoesNotExist:
-                            raise ValueError(f"No inventory found for {product.product_name} - Batch {item['batch_no']}")
+                        # Check the batch stock (earlier lines of this issue are already saved)
+                        available = balance(product.productid, item['batch_no'])
+                        if available < quantity_issued:
+                            raise ValueError(f"Insufficient stock for {product.product_name} - Batch {item['batch_no']}. Available: {available}, Required: {quantity_issued}")
                         
                         # Create stock issue detail
                         detail = StockIssueDetail.objects.create(
@@ -112,12 +91,8 @@ def add_stock_issue(request):
                         )
                         total_value += detail.total_amount
                         
-                        print(f"✅ Stock Issue Created: Product {product.product_name}, Batch {item['batch_no']}, Qty Issued: {quantity_issued}")
-                        
-                        # Verify stock after issue
-                        from .utils import get_batch_stock_status
-                        new_stock, new_available = get_batch_stock_status(product.productid, item['batch_no'])
-                        print(f"📊 After Issue - New Stock: {new_stock}, Available: {new_available}")
+                        logger.debug('Stock issue %s: product %s batch %s, issued %s of %s',
+                                     issue.issue_no, product.productid, item['batch_no'], quantity_issued, available)
                 
                 # Update total value
                 issue.total_value = total_value
@@ -161,33 +136,7 @@ def delete_stock_issue(request, pk):
     if request.method == 'POST':
         try:
             with transaction.atomic():
-                # Reverse inventory changes
-                for detail in issue.details.all():
-                    try:
-                        inventory = InventoryMaster.objects.get(
-                            product=detail.product,
-                            batch_no=detail.batch_no
-                        )
-                        
-                        # Add back the issued quantity
-                        inventory.current_stock += detail.quantity_issued
-                        inventory.save()
-                        
-                        # Create reversal inventory transaction
-                        InventoryTransaction.objects.create(
-                            inventory=inventory,
-                            transaction_type='adjustment',
-                            quantity=detail.quantity_issued,
-                            unit_rate=detail.unit_rate,
-                            reference_type='stock_issue_reversal',
-                            reference_id=issue.issue_no,
-                            remarks=f"Stock Issue Reversal: {issue.get_issue_type_display()} - Deleted",
-                            created_by=request.user
-                        )
-                        
-                    except InventoryMaster.DoesNotExist:
-                        pass
-                
+                # Deleting the details puts the stock back (signals refresh the cache)
                 issue_no = issue.issue_no
                 issue.delete()
                 messages.success(request, f'Stock Issue {issue_no} deleted successfully!')
@@ -207,7 +156,6 @@ def get_product_batch_info(request):
         return JsonResponse({'error': 'Product ID required'}, status=400)
     
     try:
-        from .utils import get_batch_stock_status
         from .models import PurchaseMaster, SupplierChallanMaster, SaleRateMaster, ProductMaster
         
         product = ProductMaster.objects.get(productid=product_id)
@@ -281,14 +229,12 @@ def get_product_batch_info(request):
             
             return expiry_str
         
+        stock = balances_for([product.productid], level='batch')
         batch_list = []
         for batch in batches:
             batch_no = batch['product_batch_no']
             
-            # Use the same stock calculation function as sales form
-            current_stock, is_available = get_batch_stock_status(product_id, batch_no)
-            
-            print(f"🔍 Stock Issue API - Product {product_id}, Batch {batch_no}: Stock = {current_stock}, Available = {is_available}")
+            current_stock = stock.get((product.productid, batch_no), 0)
             
             # Only include batches with stock > 0
             if current_stock > 0:
@@ -1,16 +1,21 @@
+import logging
+
 from django.db.models import Sum, F
 from django.db import transaction
 from .models import (
-    PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
-    ProductMaster, SupplierChallanMaster
+    PurchaseMaster, ProductMaster, SupplierChallanMaster
 )
 from .date_utils import format_date_for_backend
+from .opening_balances import live_rows, opening_stock_rows
+from .stock_service import balances_for, movements, movements_for, stock_of
+
+logger = logging.getLogger(__name__)
 
 
 class StockManager:
     """
-    Centralized stock management system that handles all stock calculations
-    including purchases, sales, purchase returns, and sales returns.
+    Stock summaries and validation for views; the figures come from
+    core/stock_service.py.
     """
     
 
@@ -18,84 +23,29 @@ class StockManager:
     @staticmethod
     def get_stock_summary(product_id):
         """
-        Get comprehensive stock summary for a product
-        Prevents double counting when challans are pulled into invoices
+        Get comprehensive stock summary for a product (stock_service formula)
         """
         try:
-            from .models import CustomerChallanMaster
-            
-            # Get total purchased from invoices (excluding challan-sourced ones)
-            total_purchased_invoice = PurchaseMaster.objects.filter(
-                productid=product_id
-            ).exclude(
-                product_invoice_no__icontains='from challan'
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            # Get total purchased from challans that haven't been invoiced
-            from .models import Challan1
-            non_invoiced_challan_ids = Challan1.objects.filter(
-                is_invoiced=False
-            ).values_list('challan_id', flat=True)
-            
-            total_purchased_challan = SupplierChallanMaster.objects.filter(
-                product_id=product_id,
-                product_challan_id__in=non_invoiced_challan_ids
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            # Get challan-sourced invoice purchases (already counted in challans)
-            challan_sourced_invoice = PurchaseMaster.objects.filter(
-                productid=product_id,
-                product_invoice_no__icontains='from challan'
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            total_purchased = total_purchased_invoice + total_purchased_challan + challan_sourced_invoice
-            
-            # Get total sold from sales invoices
-            total_sold = SalesMaster.objects.filter(
-                productid=product_id
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            # Get total sold from customer challans
-            total_challan_sold = CustomerChallanMaster.objects.filter(
-                product_id=product_id
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            total_sold_combined = total_sold + total_challan_sold
-            
-            # Get total purchase returns (reduces stock)
-            total_purchase_returns = ReturnPurchaseMaster.objects.filter(
-                returnproductid=product_id
-            ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-            
-            # Get total sales returns (increases stock)
-            total_sales_returns = ReturnSalesMaster.objects.filter(
-                return_productid=product_id
-            ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-            
-            # Calculate current stock
-            # Stock = Purchased - Sold - Challan Sold - Purchase Returns + Sales Returns
-            total_stock = total_purchased - total_sold_combined - total_purchase_returns + total_sales_returns
-            
-            # Get batch-wise breakdown
-            batches = StockManager._get_batch_breakdown(product_id)
-            
+            moved = movements(product_id)
             return {
                 'product_id': product_id,
-                'total_purchased': total_purchased,
-                'total_sold': total_sold,
-                'total_purchase_returns': total_purchase_returns,
-                'total_sales_returns': total_sales_returns,
-                'total_stock': total_stock,
-                'batches': batches
+                'total_purchased': moved['purchased'] + moved['supplier_challan'],
+                'total_sold': moved['sold'],
+                'total_purchase_returns': moved['purchase_returns'],
+                'total_sales_returns': moved['sales_returns'],
+                'total_stock_issues': moved['stock_issued'],
+                'total_stock': stock_of(moved),
+                'batches': StockManager._get_batch_breakdown(product_id)
             }
-        except Exception as e:
-            print(f"Error in get_stock_summary: {[str(e)]}")
+        except Exception:
+            logger.exception('Error in get_stock_summary for product %s', product_id)
             return {
                 'product_id': product_id,
                 'total_purchased': 0,
                 'total_sold': 0,
                 'total_purchase_returns': 0,
                 'total_sales_returns': 0,
+                'total_stock_issues': 0,
                 'total_stock': 0,
                 'batches': []
             }
@@ -107,68 +57,29 @@ class StockManager:
         """
         return expiry_date
     
+    @staticmethod
+    def _batch_info(moved):
+        return {
+            'batch_stock': stock_of(moved),
+            'purchased': moved['purchased'] + moved['supplier_challan'],
+            'sold': moved['sold'],
+            'purchase_returns': moved['purchase_returns'],
+            'sales_returns': moved['sales_returns'],
+            'stock_issues': moved['stock_issued']
+        }
+    
     @staticmethod
     def _get_batch_breakdown(product_id):
         """
         Get stock breakdown by batch + expiry date combination
-        Fixed to track stock separately for each batch + expiry combination
         """
         batches = []
         
         try:
-            from .models import CustomerChallanMaster
-            
-            # Get all unique batch + expiry combinations from purchases
-            purchase_combinations = PurchaseMaster.objects.filter(
-                productid=product_id
-            ).values('product_batch_no', 'product_expiry').distinct()
-            
-            # Get combinations from supplier challans
-            challan_combinations = SupplierChallanMaster.objects.filter(
-                product_id=product_id
-            ).values('product_batch_no', 'product_expiry').distinct()
-            
-            # Get combinations from sales invoices
-            sales_combinations = SalesMaster.objects.filter(
-                productid=product_id
-            ).values('product_batch_no', 'product_expiry').distinct()
-            
-            # Get combinations from customer challans
-            customer_challan_combinations = CustomerChallanMaster.objects.filter(
-                product_id=product_id
-            ).values('product_batch_no', 'product_expiry').distinct()
-            
-            pr_combinations = ReturnPurchaseMaster.objects.filter(
-                returnproductid=product_id
-            ).values('returnproduct_batch_no', 'returnproduct_expiry').distinct()
-            
-            sr_combinations = ReturnSalesMaster.objects.filter(
-                return_productid=product_id
-            ).values('return_product_batch_no', 'return_product_expiry').distinct()
-            
-            # Combine all unique batch + expiry combinations
-            all_combinations = set()
-            
-            for combo in purchase_combinations:
-                all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-            
-            for combo in challan_combinations:
-                all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-            
-            for combo in sales_combinations:
-                all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-            
-            for combo in customer_challan_combinations:
-                all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-            
-            for combo in pr_combinations:
-                all_combinations.add((combo['returnproduct_batch_no'], combo['returnproduct_expiry']))
-            
-            for combo in sr_combinations:
-                all_combinations.add((combo['return_product_batch_no'], combo['return_product_expiry']))
-            
-            for batch_no, expiry_date in all_combinations:
-                batch_stock_info = StockManager._get_batch_stock_with_expiry(product_id, batch_no, expiry_date)
+            for (_, batch_no, expiry_date), moved in sorted(
+                movements_for([product_id], level='expiry').items(), key=lambda item: (item[0][1], str(item[0][2]))
+            ):
+                batch_stock_info = StockManager._batch_info(moved)
                 
                 # Include all batches with any activity (purchases, sales, or returns)
                 if (batch_stock_info['batch_stock'] != 0 or 
@@ -185,10 +96,10 @@ class StockManager:
                         'sold': batch_stock_info['sold'],
                         'purchase_returns': batch_stock_info['purchase_returns'],
                         'sales_returns': batch_stock_info['sales_returns'],
-                        'stock_issues': batch_stock_info.get('stock_issues', 0)
+                        'stock_issues': batch_stock_info['stock_issues']
                     })
-        except Exception as e:
-            print(f"Error in _get_batch_breakdown: {e}")
+        except Exception:
+            logger.exception('Error in _get_batch_breakdown for product %s', product_id)
         
         return batches
     
@@ -196,308 +107,15 @@ class StockManager:
     def _get_batch_stock(product_id, batch_no):
         """
         Get stock information for a specific batch (all expiry dates combined)
-        Prevents double counting when challans are pulled into invoices
         """
-        from .models import CustomerChallanMaster
-        
-        # Get batch purchased from invoices (excluding challan-sourced ones)
-        purchased_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).exclude(
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get batch purchased from non-invoiced challans only
-        from .models import Challan1
-        non_invoiced_challan_ids = Challan1.objects.filter(
-            is_invoiced=False
-        ).values_list('challan_id', flat=True)
-        
-        purchased_challan = SupplierChallanMaster.objects.filter(
-            product_id=product_id,
-            product_batch_no=batch_no,
-            product_challan_id__in=non_invoiced_challan_ids
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get challan-sourced invoice purchases
-        challan_sourced_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no,
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        purchased = purchased_invoice + purchased_challan + challan_sourced_invoice
-        
-        # Get batch sold quantity from sales invoices
-        sold = SalesMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        # Get batch sold quantity from customer challans
-        challan_sold = CustomerChallanMaster.objects.filter(
-            product_id=product_id,
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        total_sold = sold + challan_sold
-        
-        # Get batch purchase returns (reduces stock)
-        purchase_returns = ReturnPurchaseMaster.objects.filter(
-            returnproductid=product_id,
-            returnproduct_batch_no=batch_no
-        ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-        
-        # Get batch sales returns (increases stock)
-        sales_returns = ReturnSalesMaster.objects.filter(
-            return_productid=product_id,
-            return_product_batch_no=batch_no
-        ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-        
-        # Calculate batch stock
-        batch_stock = purchased - total_sold - purchase_returns + sales_returns
-        
-        return {
-            'batch_stock': batch_stock,
-            'purchased': purchased,
-            'sold': sold,
-            'purchase_returns': purchase_returns,
-            'sales_returns': sales_returns
-        }
+        return StockManager._batch_info(movements(product_id, batch_no))
     
     @staticmethod
     def _get_batch_stock_with_expiry(product_id, batch_no, expiry_date):
         """
         Get stock information for a specific batch + expiry date combination
-        Prevents double counting when challans are pulled into invoices
         """
-        try:
-            from .models import CustomerChallanMaster
-            
-            # Skip expiry date filtering to avoid MM-YYYY format issues
-            # Calculate stock for batch only (all expiry dates combined)
-            
-            # Get batch purchased from invoices (excluding challan-sourced ones)
-            purchased_invoice = PurchaseMaster.objects.filter(
-                productid=product_id,
-                product_batch_no=batch_no
-            ).exclude(
-                product_invoice_no__icontains='from challan'
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            # Get batch purchased from non-invoiced challans only
-            from .models import Challan1
-            non_invoiced_challan_ids = Challan1.objects.filter(
-                is_invoiced=False
-            ).values_list('challan_id', flat=True)
-            
-            purchased_challan = SupplierChallanMaster.objects.filter(
-                product_id=product_id,
-                product_batch_no=batch_no,
-                product_challan_id__in=non_invoiced_challan_ids
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            # Get challan-sourced invoice purchases
-            challan_sourced_invoice = PurchaseMaster.objects.filter(
-                productid=product_id,
-                product_batch_no=batch_no,
-                product_invoice_no__icontains='from challan'
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            purchased = purchased_invoice + purchased_challan + challan_sourced_invoice
-            
-            # Get batch sold quantity from sales invoices
-            sold = SalesMaster.objects.filter(
-                productid=product_id,
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            # Get batch sold quantity from customer challans
-            challan_sold = CustomerChallanMaster.objects.filter(
-                product_id=product_id,
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            total_sold = sold + challan_sold
-            
-            # Get batch purchase returns (reduces stock)
-            purchase_returns = ReturnPurchaseMaster.objects.filter(
-                returnproductid=product_id,
-                returnproduct_batch_no=batch_no
-            ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-            
-            # Get batch sales returns (increases stock)
-            sales_returns = ReturnSalesMaster.objects.filter(
-                return_productid=product_id,
-                return_product_batch_no=batch_no
-            ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-            
-            # Calculate batch stock
-            batch_stock = purchased - total_sold - purchase_returns + sales_returns
-            
-            return {
-                'batch_stock': batch_stock,
-                'purchased': purchased,
-                'sold': sold,
-                'purchase_returns': purchase_returns,
-                'sales_returns': sales_returns
-            }
-        except Exception as e:
-            # Silently handle MM-YYYY format validation errors
-            if "invalid date format" in str(e).lower():
-                return {
-                    'batch_stock': 0,
-                    'purchased': 0,
-                    'sold': 0,
-                    'purchase_returns': 0,
-                    'sales_returns': 0
-                }
-            return {
-                'batch_stock': 0,
-                'purchased': 0,
-                'sold': 0,
-                'purchase_returns': 0,
-                'sales_returns': 0
-            }
-    
-    @staticmethod
-    def process_purchase_return(return_item):
-        """
-        Process a purchase return - this decreases stock
-        Enhanced with better error handling and validation
-        """
-        try:
-            product_id = return_item.returnproductid.productid
-            batch_no = return_item.returnproduct_batch_no
-            return_quantity = return_item.returnproduct_quantity
-            product_name = return_item.returnproductid.product_name
-            
-            # Get current batch stock before return (excluding this return)
-            batch_info = StockManager._get_batch_stock_excluding_return(product_id, batch_no, return_item.returnpurchaseid)
-            current_stock = batch_info['batch_stock']
-            
-            # Enhanced validation with detailed feedback
-            if current_stock < return_quantity:
-                return {
-                    'success': False,
-                    'message': f"Insufficient stock for return. Product: {product_name}, Batch: {batch_no}. Available: {current_stock}, Requested: {return_quantity}",
-                    'error_type': 'insufficient_stock',
-                    'available_stock': current_stock,
-                    'requested_quantity': return_quantity,
-                    'product_name': product_name,
-                    'batch_no': batch_no
-                }
-            
-            # Check if return quantity is reasonable (not negative or zero)
-            if return_quantity <= 0:
-                return {
-                    'success': False,
-                    'message': f"Invalid return quantity: {return_quantity}. Quantity must be positive.",
-                    'error_type': 'invalid_quantity',
-                    'product_name': product_name,
-                    'batch_no': batch_no
-                }
-            
-            # Calculate new stock after return
-            new_stock = current_stock - return_quantity
-            
-            # Log the transaction for audit trail
-            print(f"PURCHASE RETURN PROCESSED:")
-            print(f"  Product: {product_name} (ID: {product_id})")
-            print(f"  Batch: {batch_no}")
-            print(f"  Return Quantity: {return_quantity}")
-            print(f"  Stock Before: {current_stock}")
-            print(f"  Stock After: {new_stock}")
-            
-            return {
-                'success': True,
-                'message': f"Purchase return processed successfully. {product_name} (Batch: {batch_no}) stock reduced from {current_stock} to {new_stock} units.",
-                'transaction_type': 'purchase_return',
-                'product_name': product_name,
-                'batch_no': batch_no,
-                'previous_stock': current_stock,
-                'new_stock': new_stock,
-                'return_quantity': return_quantity,
-                'stock_impact': -return_quantity
-            }
-        except Exception as e:
-            error_msg = f"Error processing purchase return: {str(e)}"
-            print(f"PURCHASE RETURN ERROR: {error_msg}")
-            return {
-                'success': False,
-                'message': error_msg,
-                'error_type': 'system_error',
-                'error': str(e)
-            }
-    
-    @staticmethod
-    def process_sales_return(return_item):
-        """
-        Process a sales return - this increases stock
-        Enhanced with better error handling and validation
-        """
-        try:
-            product_id = return_item.return_productid.productid
-            batch_no = return_item.return_product_batch_no
-            return_quantity = return_item.return_sale_quantity
-            product_name = return_item.return_productid.product_name
-            
-            # Get current batch stock before return (excluding this return)
-            batch_info = StockManager._get_batch_stock_excluding_sales_return(product_id, batch_no, return_item.return_sales_id)
-            current_stock = batch_info['batch_stock']
-            
-            # Enhanced validation
-            if return_quantity <= 0:
-                return {
-                    'success': False,
-                    'message': f"Invalid return quantity: {return_quantity}. Quantity must be positive.",
-                    'error_type': 'invalid_quantity',
-                    'product_name': product_name,
-                    'batch_no': batch_no
-                }
-            
-            # Check if the batch exists (has purchase records)
-            if not StockManager._batch_exists(product_id, batch_no):
-                return {
-                    'success': False,
-                    'message': f"Batch {batch_no} not found for product {product_name}. Cannot process return.",
-                    'error_type': 'batch_not_found',
-                    'product_name': product_name,
-                    'batch_no': batch_no
-                }
-            
-            # Calculate new stock after return
-            new_stock = current_stock + return_quantity
-            
-            # Log the transaction for audit trail
-            print(f"SALES RETURN PROCESSED:")
-            print(f"  Product: {product_name} (ID: {product_id})")
-            print(f"  Batch: {batch_no}")
-            print(f"  Return Quantity: {return_quantity}")
-            print(f"  Stock Before: {current_stock}")
-            print(f"  Stock After: {new_stock}")
-            
-            return {
-                'success': True,
-                'message': f"Sales return processed successfully. {product_name} (Batch: {batch_no}) stock increased from {current_stock} to {new_stock} units.",
-                'transaction_type': 'sales_return',
-                'product_name': product_name,
-                'batch_no': batch_no,
-                'previous_stock': current_stock,
-                'new_stock': new_stock,
-                'return_quantity': return_quantity,
-                'stock_impact': +return_quantity
-            }
-        except Exception as e:
-            error_msg = f"Error processing sales return: {str(e)}"
-            print(f"SALES RETURN ERROR: {error_msg}")
-            return {
-                'success': False,
-                'message': error_msg,
-                'error_type': 'system_error',
-                'error': str(e)
-            }
+        return StockManager._batch_info(movements(product_id, batch_no, expiry_date))
     
     @staticmethod
     def validate_sale_quantity(product_id, batch_no, sale_quantity):
@@ -528,23 +146,37 @@ class StockManager:
             }
     
     @staticmethod
-    def get_low_stock_products(threshold=10):
-        """
-        Get products with stock below threshold
-        """
-        low_stock_products = []
-        
-        products = ProductMaster.objects.all()
-        for product in products:
-            stock_summary = StockManager.get_stock_summary(product.productid)
-            if 0 < stock_summary['total_stock'] <= threshold:
-                low_stock_products.append({
-                    'product': product,
-                    'current_stock': stock_summary['total_stock'],
-                    'batches': stock_summary['batches']
-                })
-        
-        return low_stock_products
+    def get_low_stock_products(threshold=None):
+        """
+        Get products in stock but at or below their reorder level.
+        Reads ProductInventoryCache (indexed on stock_status, total_stock);
+        pass threshold to use one fixed level for every product instead.
+        """
+        from django.db.models import Prefetch
+        from .models import ProductInventoryCache, BatchInventoryCache
+        
+        if threshold is None:
+            caches = ProductInventoryCache.objects.filter(stock_status='low_stock')
+        else:
+            caches = ProductInventoryCache.objects.filter(total_stock__gt=0, total_stock__lte=threshold)
+        
+        caches = caches.select_related('product').prefetch_related(
+            Prefetch(
+                'product__batch_caches',
+                queryset=BatchInventoryCache.objects.filter(current_stock__gt=0),
+                to_attr='active_batches'
+            )
+        ).order_by('total_stock')
+        
+        return [{
+            'product': cache.product,
+            'current_stock': cache.total_stock,
+            'batches': [{
+                'batch_no': batch.batch_no,
+                'expiry': batch.expiry_date,
+                'stock': batch.current_stock
+            } for batch in cache.product.active_batches]
+        } for cache in caches]
     
     @staticmethod
     def get_out_of_stock_products():
@@ -553,14 +185,14 @@ class StockManager:
         """
         out_of_stock_products = []
         
-        products = ProductMaster.objects.all()
-        for product in products:
-            stock_summary = StockManager.get_stock_summary(product.productid)
-            if stock_summary['total_stock'] <= 0:
+        balances = balances_for(level='product')
+        for product in ProductMaster.objects.all():
+            current_stock = balances.get(product.productid, 0)
+            if current_stock <= 0:
                 out_of_stock_products.append({
                     'product': product,
-                    'current_stock': stock_summary['total_stock'],
-                    'batches': stock_summary['batches']
+                    'current_stock': current_stock,
+                    'batches': StockManager._get_batch_breakdown(product.productid)
                 })
         
         return out_of_stock_products
@@ -573,17 +205,12 @@ class StockManager:
         total_value = 0
         total_products = 0
         
-        products = ProductMaster.objects.all()
-        for product in products:
-            stock_summary = StockManager.get_stock_summary(product.productid)
-            if stock_summary['total_stock'] > 0:
-                # Get average MRP for value calculation
-                avg_mrp = PurchaseMaster.objects.filter(
-                    productid=product.productid
-                ).aggregate(avg_mrp=Sum('product_MRP'))['avg_mrp'] or 0
-                
-                product_value = stock_summary['total_stock'] * avg_mrp
-                total_value += product_value
+        mrp_totals = dict(PurchaseMaster.objects.order_by().values_list('productid').annotate(
+            avg_mrp=Sum('product_MRP')
+        ))
+        for product_id, current_stock in balances_for(level='product').items():
+            if current_stock > 0:
+                total_value += current_stock * (mrp_totals.get(product_id) or 0)
                 total_products += 1
         
         return {
@@ -591,162 +218,36 @@ class StockManager:
             'total_products_in_stock': total_products
         }
     
-    @staticmethod
-    def _get_batch_stock_excluding_return(product_id, batch_no, return_id):
-        """
-        Get batch stock excluding a specific purchase return (for validation)
-        Prevents double counting when challans are pulled into invoices
-        """
-        # Get batch purchased from invoices (excluding challan-sourced ones)
-        purchased_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).exclude(
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get batch purchased from non-invoiced challans only
-        from .models import Challan1
-        non_invoiced_challan_ids = Challan1.objects.filter(
-            is_invoiced=False
-        ).values_list('challan_id', flat=True)
-        
-        purchased_challan = SupplierChallanMaster.objects.filter(
-            product_id=product_id,
-            product_batch_no=batch_no,
-            product_challan_id__in=non_invoiced_challan_ids
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get challan-sourced invoice purchases
-        challan_sourced_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no,
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        purchased = purchased_invoice + purchased_challan + challan_sourced_invoice
-        
-        # Get batch sold quantity
-        sold = SalesMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        # Get batch purchase returns excluding the current one
-        purchase_returns = ReturnPurchaseMaster.objects.filter(
-            returnproductid=product_id,
-            returnproduct_batch_no=batch_no
-        ).exclude(
-            returnpurchaseid=return_id
-        ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-        
-        # Get batch sales returns
-        sales_returns = ReturnSalesMaster.objects.filter(
-            return_productid=product_id,
-            return_product_batch_no=batch_no
-        ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-        
-        # Calculate batch stock
-        batch_stock = purchased - sold - purchase_returns + sales_returns
-        
-        return {
-            'batch_stock': batch_stock,
-            'purchased': purchased,
-            'sold': sold,
-            'purchase_returns': purchase_returns,
-            'sales_returns': sales_returns
-        }
-    
-    @staticmethod
-    def _get_batch_stock_excluding_sales_return(product_id, batch_no, return_id):
-        """
-        Get batch stock excluding a specific sales return (for validation)
-        Prevents double counting when challans are pulled into invoices
-        """
-        # Get batch purchased from invoices (excluding challan-sourced ones)
-        purchased_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).exclude(
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get batch purchased from non-invoiced challans only
-        from .models import Challan1
-        non_invoiced_challan_ids = Challan1.objects.filter(
-            is_invoiced=False
-        ).values_list('challan_id', flat=True)
-        
-        purchased_challan = SupplierChallanMaster.objects.filter(
-            product_id=product_id,
-            product_batch_no=batch_no,
-            product_challan_id__in=non_invoiced_challan_ids
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get challan-sourced invoice purchases
-        challan_sourced_invoice = PurchaseMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no,
-            product_invoice_no__icontains='from challan'
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        purchased = purchased_invoice + purchased_challan + challan_sourced_invoice
-        
-        # Get batch sold quantity
-        sold = SalesMaster.objects.filter(
-            productid=product_id,
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        # Get batch purchase returns
-        purchase_returns = ReturnPurchaseMaster.objects.filter(
-            returnproductid=product_id,
-            returnproduct_batch_no=batch_no
-        ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-        
-        # Get batch sales returns excluding the current one
-        sales_returns = ReturnSalesMaster.objects.filter(
-            return_productid=product_id,
-            return_product_batch_no=batch_no
-        ).exclude(
-            return_sales_id=return_id
-        ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-        
-        # Calculate batch stock
-        batch_stock = purchased - sold - purchase_returns + sales_returns
-        
-        return {
-            'batch_stock': batch_stock,
-            'purchased': purchased,
-            'sold': sold,
-            'purchase_returns': purchase_returns,
-            'sales_returns': sales_returns
-        }
-    
     @staticmethod
     def _batch_exists(product_id, batch_no):
         """
         Check if a batch exists for a product
         Checks both invoices and non-invoiced challans
         """
-        invoice_exists = PurchaseMaster.objects.filter(
+        invoice_exists = live_rows(PurchaseMaster).filter(
             productid=product_id,
             product_batch_no=batch_no
         ).exists()
         
         # Check non-invoiced challans only to avoid double counting
         from .models import Challan1
-        non_invoiced_challan_ids = Challan1.objects.filter(
+        non_invoiced_challan_ids = live_rows(Challan1).filter(
             is_invoiced=False
         ).values_list('challan_id', flat=True)
         
-        challan_exists = SupplierChallanMaster.objects.filter(
+        challan_exists = live_rows(SupplierChallanMaster).filter(
             product_id=product_id,
             product_batch_no=batch_no,
             product_challan_id__in=non_invoiced_challan_ids
         ).exists()
         
-        return invoice_exists or challan_exists
+        opening_exists = opening_stock_rows().filter(
+            product_id=product_id,
+            batch_no=batch_no,
+            purchased__gt=0
+        ).exists()
+        
+        return invoice_exists or challan_exists or opening_exists
     
     @staticmethod
     def validate_stock_transaction(product_id, batch_no, transaction_type, quantity):
@@ -822,5 +323,5 @@ class StockManager:
         
         This method is kept for backward compatibility but does nothing.
         """
-        print(f"⚠️ DEPRECATED: update_stock_on_customer_challan called for {product.product_name}. Stock is now managed through InventoryMaster.")
+        logger.warning('DEPRECATED: update_stock_on_customer_challan called for %s', product.product_name)
         return True  # Return True to maintain compatibility
\ No newline at end of file
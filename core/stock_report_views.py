@@ -1,6 +1,7 @@
 from django.shortcuts import render
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Q
+from django.db.models import Q
 from django.http import JsonResponse, HttpResponse
 from django.core.paginator import Paginator
 from datetime import datetime, timedelta
@@ -17,28 +18,17 @@ from openpyxl.utils import get_column_letter
 
 from .models import ProductMaster
 from .stock_manager import StockManager
+from .stock_statement import ArchivedPeriodError, compute_stock_statement, get_statement_row
 
 
-@login_required
-def stock_statement_report(request):
-    """
-    Comprehensive stock statement report showing opening, received, sold, and balance
-    """
-    # Get filter parameters
+def _get_filtered_products(request):
+    """Products matching the stock statement search/category/company filters"""
     search_query = request.GET.get('search', '').strip()
     category_filter = request.GET.get('category', '')
     company_filter = request.GET.get('company', '')
-    stock_status = request.GET.get('stock_status', '')  # all, in_stock, low_stock, out_of_stock
-    date_from = request.GET.get('date_from', '')
-    date_to = request.GET.get('date_to', '')
     
-    # Base query
     products_query = ProductMaster.objects.all().order_by('product_name')
     
-    # Check if filters applied
-    has_filters = any([search_query, category_filter, company_filter, stock_status and stock_status != 'all', date_from, date_to])
-    
-    # Apply filters
     if search_query:
         products_query = products_query.filter(
             Q(product_name__icontains=search_query) |
@@ -53,6 +43,102 @@ def stock_statement_report(request):
     if company_filter:
         products_query = products_query.filter(product_company__icontains=company_filter)
     
+    return products_query
+
+
+def _get_stock_status(balance_stock):
+    """(status, label, css class) for a balance"""
+    if balance_stock <= 0:
+        return 'out_of_stock', 'Out of Stock', 'danger'
+    elif balance_stock < 10:
+        return 'low_stock', 'Low Stock', 'warning'
+    return 'in_stock', 'In Stock', 'success'
+
+
+def _build_stock_rows(products, statement, stock_status=''):
+    """
+    Turn engine output into report rows and totals.
+    Received = inward movement in the period, Sold = outward movement in the period.
+    """
+    stock_data = []
+    totals = {'opening': 0, 'received': 0, 'sold': 0, 'balance': 0, 'value': 0}
+    
+    for product in products:
+        row = get_statement_row(statement, product.productid)
+        status, status_label, status_class = _get_stock_status(row['closing'])
+        
+        # Apply stock status filter
+        if stock_status and stock_status != 'all' and stock_status != status:
+            continue
+        
+        stock_value = row['closing'] * row['avg_mrp']
+        stock_data.append({
+            'product': product,
+            'opening_stock': row['opening'],
+            'received_stock': row['inward'],
+            'sold_stock': row['outward'],
+            'balance_stock': row['closing'],
+            'avg_mrp': row['avg_mrp'],
+            'stock_value': stock_value,
+            'status': status,
+            'status_label': status_label,
+            'status_class': status_class,
+            'batches': []  # Batch details are loaded on demand
+        })
+        
+        totals['opening'] += row['opening']
+        totals['received'] += row['inward']
+        totals['sold'] += row['outward']
+        totals['balance'] += row['closing']
+        totals['value'] += stock_value
+    
+    return stock_data, totals
+
+
+def _get_export_stock_data(request):
+    """
+    Stock rows for the exports - all products matching the filters.
+    The engine computes the whole set in one query per movement source.
+    """
+    products = _get_filtered_products(request).only(
+        'productid', 'product_name', 'product_company', 'product_packing'
+    )
+    try:
+        statement = compute_stock_statement(
+            products,
+            date_from=request.GET.get('date_from') or None,
+            date_to=request.GET.get('date_to') or None
+        )
+    except ValueError:
+        statement = compute_stock_statement(products)
+    return _build_stock_rows(products.iterator(chunk_size=2000), statement, request.GET.get('stock_status', ''))
+
+
+@login_required
+def stock_statement_report(request):
+    """
+    Comprehensive stock statement report showing opening, received, sold, and balance
+    """
+    # Handle export requests
+    export_type = request.GET.get('export')
+    if export_type == 'pdf':
+        return export_stock_statement_pdf(request)
+    elif export_type == 'excel':
+        return export_stock_statement_excel(request)
+    
+    # Get filter parameters
+    search_query = request.GET.get('search', '').strip()
+    category_filter = request.GET.get('category', '')
+    company_filter = request.GET.get('company', '')
+    stock_status = request.GET.get('stock_status', '')  # all, in_stock, low_stock, out_of_stock
+    date_from = request.GET.get('date_from', '')
+    date_to = request.GET.get('date_to', '')
+    
+    # Check if filters applied
+    has_filters = any([search_query, category_filter, company_filter, stock_status and stock_status != 'all', date_from, date_to])
+    
+    products_query = _get_filtered_products(request)
+    
     # Limit to 100 products if no filters
     if not has_filters:
         products_query = products_query[:100]
@@ -66,137 +152,20 @@ def stock_statement_report(request):
     page_number = request.GET.get('page')
     products_page = paginator.get_page(page_number)
     
-    # OPTIMIZED: Bulk fetch all data in 4 queries instead of N+1
-    from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster
-    
-    product_ids = [p.productid for p in products_page]
-    purchases = PurchaseMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('product_quantity'), avg_mrp=Sum('product_MRP')/Sum('product_quantity'))
-    sales = SalesMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('sale_quantity'))
-    purchase_returns = ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid').annotate(qty=Sum('returnproduct_quantity'))
-    sales_returns = ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid').annotate(qty=Sum('return_sale_quantity'))
-    
-    purchase_dict = {p['productid']: {'qty': p['qty'] or 0, 'mrp': p['avg_mrp'] or 0} for p in purchases}
-    sales_dict = {s['productid']: s['qty'] or 0 for s in sales}
-    pr_dict = {pr['returnproductid']: pr['qty'] or 0 for pr in purchase_returns}
-    sr_dict = {sr['return_productid']: sr['qty'] or 0 for sr in sales_returns}
-    
-    stock_data = []
-    total_opening = 0
-    total_received = 0
-    total_sold = 0
-    total_balance = 0
-    total_value = 0
-    
-    for product in products_page:
-        try:
-            # OPTIMIZED: Use pre-fetched data
-            pid = product.productid
-            
-            # Calculate opening stock (stock before start date)
-            if date_from:
-                try:
-                    from datetime import datetime
-                    start_date = datetime.strptime(date_from, '%Y-%m-%d')
-                    
-                    # Get transactions before start date
-                    from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster
-                    
-                    prev_purchases = PurchaseMaster.objects.filter(
-                        productid=pid,
-                        purchase_entry_date__lt=start_date
-                    ).aggregate(qty=Sum('product_quantity'))['qty'] or 0
-                    
-                    prev_sales = SalesMaster.objects.filter(
-                        productid=pid,
-                        sale_entry_date__lt=start_date
-                    ).aggregate(qty=Sum('sale_quantity'))['qty'] or 0
-                    
-                    prev_pr = ReturnPurchaseMaster.objects.filter(
-                        returnproductid=pid,
-                        returnpurchase_entry_date__lt=start_date
-                    ).aggregate(qty=Sum('returnproduct_quantity'))['qty'] or 0
-                    
-                    prev_sr = ReturnSalesMaster.objects.filter(
-                        return_productid=pid,
-                        return_entry_date__lt=start_date
-                    ).aggregate(qty=Sum('return_sale_quantity'))['qty'] or 0
-                    
-                    opening_stock = (prev_purchases + prev_sr) - (prev_sales + prev_pr)
-                except:
-                    opening_stock = 0
-            else:
-                opening_stock = 0
-            
-            received_stock = purchase_dict.get(pid, {}).get('qty', 0) + sr_dict.get(pid, 0)
-            sold_stock = sales_dict.get(pid, 0) + pr_dict.get(pid, 0)
-            balance_stock = opening_stock + received_stock - sold_stock
-            avg_mrp = purchase_dict.get(pid, {}).get('mrp', 0)
-            stock_value = balance_stock * avg_mrp
-            
-            # Determine stock status
-            if balance_stock <= 0:
-                status = 'out_of_stock'
-                status_label = 'Out of Stock'
-                status_class = 'danger'
-            elif balance_stock < 10:
-                status = 'low_stock'
-                status_label = 'Low Stock'
-                status_class = 'warning'
-            else:
-                status = 'in_stock'
-                status_label = 'In Stock'
-                status_class = 'success'
-            
-            # Apply stock status filter
-            if stock_status and stock_status != 'all' and stock_status != status:
-                continue
-            
-            stock_item = {
-                'product': product,
-                'opening_stock': opening_stock,
-                'received_stock': received_stock,
-                'sold_stock': sold_stock,
-                'balance_stock': balance_stock,
-                'avg_mrp': avg_mrp,
-                'stock_value': stock_value,
-                'status': status,
-                'status_label': status_label,
-                'status_class': status_class,
-                'batches': []  # OPTIMIZED: Skip batch details for performance
-            }
-            
-            stock_data.append(stock_item)
-            
-            # Add to totals
-            total_opening += opening_stock
-            total_received += received_stock
-            total_sold += sold_stock
-            total_balance += balance_stock
-            total_value += stock_value
-            
-        except Exception as e:
-            print(f"Error processing stock for {product.product_name}: {e}")
-            # Add error entry
-            stock_data.append({
-                'product': product,
-                'opening_stock': 0,
-                'received_stock': 0,
-                'sold_stock': 0,
-                'balance_stock': 0,
-                'avg_mrp': 0,
-                'stock_value': 0,
-                'status': 'error',
-                'status_label': 'Error',
-                'status_class': 'secondary',
-                'batches': []
-            })
+    # One grouped query per movement source for the whole page (opening included)
+    try:
+        statement = compute_stock_statement(
+            [p.productid for p in products_page],
+            date_from=date_from or None,
+            date_to=date_to or None
+        )
+    except ArchivedPeriodError as error:
+        messages.warning(request, f'{error} - showing the full history instead')
+        statement = compute_stock_statement([p.productid for p in products_page])
+    except ValueError:
+        statement = compute_stock_statement([p.productid for p in products_page])
     
-    # Handle export requests
-    export_type = request.GET.get('export')
-    if export_type == 'pdf':
-        return export_stock_statement_pdf(request)
-    elif export_type == 'excel':
-        return export_stock_statement_excel(request)
+    stock_data, totals = _build_stock_rows(products_page, statement, stock_status)
     
     context = {
         'stock_data': stock_data,
@@ -209,13 +178,7 @@ def stock_statement_report(request):
         'date_to': date_to,
         'categories': [cat for cat in categories if cat],
         'companies': [comp for comp in companies if comp],
-        'totals': {
-            'opening': total_opening,
-            'received': total_received,
-            'sold': total_sold,
-            'balance': total_balance,
-            'value': total_value
-        },
+        'totals': totals,
         'title': 'Stock Statement Report'
     }
     
@@ -225,107 +188,7 @@ def stock_statement_report(request):
 @login_required
 def export_stock_statement_pdf(request):
     """Export stock statement to PDF"""
-    # Get filter parameters (same as main view)
-    search_query = request.GET.get('search', '').strip()
-    category_filter = request.GET.get('category', '')
-    company_filter = request.GET.get('company', '')
-    stock_status = request.GET.get('stock_status', '')
-    date_from = request.GET.get('date_from', '')
-    date_to = request.GET.get('date_to', '')
-    page_number = request.GET.get('page', '1')
-    
-    # Base query
-    products_query = ProductMaster.objects.all().order_by('product_name')
-    
-    # Check if any filter is applied
-    has_filters = any([search_query, category_filter, company_filter, stock_status and stock_status != 'all', date_from, date_to])
-    
-    # Apply filters
-    if search_query:
-        products_query = products_query.filter(
-            Q(product_name__icontains=search_query) |
-            Q(product_company__icontains=search_query) |
-            Q(product_salt__icontains=search_query) |
-            Q(product_barcode__icontains=search_query)
-        )
-    
-    if category_filter:
-        products_query = products_query.filter(product_category__icontains=category_filter)
-    
-    if company_filter:
-        products_query = products_query.filter(product_company__icontains=company_filter)
-    
-    # If no filters applied, use pagination (only current page)
-    if not has_filters:
-        paginator = Paginator(products_query, 25)
-        try:
-            products_query = paginator.page(page_number)
-        except:
-            products_query = paginator.page(1)
-    
-    # Process stock data
-    stock_data = []
-    totals = {'opening': 0, 'received': 0, 'sold': 0, 'balance': 0, 'value': 0}
-    
-    # OPTIMIZED: Bulk queries for PDF export
-    products_list = products_query.object_list if hasattr(products_query, 'object_list') else products_query
-    product_ids = [p.productid for p in products_list]
-    
-    from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster
-    purchases = PurchaseMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('product_quantity'), avg_mrp=Sum('product_MRP')/Sum('product_quantity'))
-    sales = SalesMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('sale_quantity'))
-    purchase_returns = ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid').annotate(qty=Sum('returnproduct_quantity'))
-    sales_returns = ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid').annotate(qty=Sum('return_sale_quantity'))
-    
-    purchase_dict = {p['productid']: {'qty': p['qty'] or 0, 'mrp': p['avg_mrp'] or 0} for p in purchases}
-    sales_dict = {s['productid']: s['qty'] or 0 for s in sales}
-    pr_dict = {pr['returnproductid']: pr['qty'] or 0 for pr in purchase_returns}
-    sr_dict = {sr['return_productid']: sr['qty'] or 0 for sr in sales_returns}
-    
-    for product in products_list:
-        try:
-            pid = product.productid
-            opening_stock = 0
-            received_stock = purchase_dict.get(pid, {}).get('qty', 0) + sr_dict.get(pid, 0)
-            sold_stock = sales_dict.get(pid, 0) + pr_dict.get(pid, 0)
-            balance_stock = received_stock - sold_stock
-            avg_mrp = purchase_dict.get(pid, {}).get('mrp', 0)
-            stock_value = balance_stock * avg_mrp
-            
-            if balance_stock <= 0:
-                status_label = 'Out of Stock'
-            elif balance_stock < 10:
-                status_label = 'Low Stock'
-            else:
-                status_label = 'In Stock'
-            
-            # Apply stock status filter
-            if stock_status and stock_status != 'all':
-                if balance_stock <= 0 and stock_status != 'out_of_stock':
-                    continue
-                elif balance_stock > 0 and balance_stock < 10 and stock_status != 'low_stock':
-                    continue
-                elif balance_stock >= 10 and stock_status != 'in_stock':
-                    continue
-            
-            stock_data.append({
-                'product': product,
-                'opening_stock': opening_stock,
-                'received_stock': received_stock,
-                'sold_stock': sold_stock,
-                'balance_stock': balance_stock,
-                'avg_mrp': avg_mrp,
-                'stock_value': stock_value,
-                'status_label': status_label
-            })
-            
-            totals['opening'] += opening_stock
-            totals['received'] += received_stock
-            totals['sold'] += sold_stock
-            totals['balance'] += balance_stock
-            totals['value'] += stock_value
-        except:
-            continue
+    stock_data, totals = _get_export_stock_data(request)
     
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="stock_statement_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf"'
@@ -429,99 +292,9 @@ def export_stock_statement_pdf(request):
 
 def export_stock_statement_excel(request, stock_data=None):
     """Export stock statement to Excel"""
-    # If stock_data not provided, fetch with filters
     if stock_data is None:
-        search_query = request.GET.get('search', '').strip()
-        category_filter = request.GET.get('category', '')
-        company_filter = request.GET.get('company', '')
-        stock_status = request.GET.get('stock_status', '')
-        page_number = request.GET.get('page', '1')
-        
-        products_query = ProductMaster.objects.all().order_by('product_name')
-        
-        # Check if any filter is applied
-        has_filters = any([search_query, category_filter, company_filter, stock_status and stock_status != 'all'])
-        
-        if search_query:
-            products_query = products_query.filter(
-                Q(product_name__icontains=search_query) |
-                Q(product_company__icontains=search_query) |
-                Q(product_salt__icontains=search_query) |
-                Q(product_barcode__icontains=search_query)
-            )
-        
-        if category_filter:
-            products_query = products_query.filter(product_category__icontains=category_filter)
-        
-        if company_filter:
-            products_query = products_query.filter(product_company__icontains=company_filter)
-        
-        # If no filters applied, use pagination (only current page)
-        if not has_filters:
-            paginator = Paginator(products_query, 25)
-            try:
-                products_query = paginator.page(page_number)
-            except:
-                products_query = paginator.page(1)
-        
-        # OPTIMIZED: Bulk queries for Excel export
-        products_list = products_query.object_list if hasattr(products_query, 'object_list') else products_query
-        product_ids = [p.productid for p in products_list]
-        
-        from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster
-        purchases = PurchaseMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('product_quantity'), avg_mrp=Sum('product_MRP')/Sum('product_quantity'))
-        sales = SalesMaster.objects.filter(productid__in=product_ids).values('productid').annotate(qty=Sum('sale_quantity'))
-        purchase_returns = ReturnPurchaseMaster.objects.filter(returnproductid__in=product_ids).values('returnproductid').annotate(qty=Sum('returnproduct_quantity'))
-        sales_returns = ReturnSalesMaster.objects.filter(return_productid__in=product_ids).values('return_productid').annotate(qty=Sum('return_sale_quantity'))
-        
-        purchase_dict = {p['productid']: {'qty': p['qty'] or 0, 'mrp': p['avg_mrp'] or 0} for p in purchases}
-        sales_dict = {s['productid']: s['qty'] or 0 for s in sales}
-        pr_dict = {pr['returnproductid']: pr['qty'] or 0 for pr in purchase_returns}
-        sr_dict = {sr['return_productid']: sr['qty'] or 0 for sr in sales_returns}
-        
-        stock_data = []
-        for product in products_list:
-            try:
-                pid = product.productid
-                opening_stock = 0
-                received_stock = purchase_dict.get(pid, {}).get('qty', 0) + sr_dict.get(pid, 0)
-                sold_stock = sales_dict.get(pid, 0) + pr_dict.get(pid, 0)
-                balance_stock = received_stock - sold_stock
-                avg_mrp = purchase_dict.get(pid, {}).get('mrp', 0)
-                stock_value = balance_stock * avg_mrp
-                
-                if balance_stock <= 0:
-                    status_label = 'Out of Stock'
-                elif balance_stock < 10:
-                    status_label = 'Low Stock'
-                else:
-                    status_label = 'In Stock'
-                
-                # Apply stock status filter
-                if stock_status and stock_status != 'all':
-                    if balance_stock <= 0 and stock_status != 'out_of_stock':
-                        continue
-                    elif balance_stock > 0 and balance_stock < 10 and stock_status != 'low_stock':
-                        continue
-                    elif balance_stock >= 10 and stock_status != 'in_stock':
-                        continue
-                
-                stock_data.append({
-                    'product': product,
-                    'opening_stock': opening_stock,
-                    'received_stock': received_stock,
-                    'sold_stock': sold_stock,
-                    'balance_stock': balance_stock,
-                    'avg_mrp': avg_mrp,
-                    'stock_value': stock_value,
-                    'status_label': status_label
-                })
-            except:
-                continue
-    
-    # Original Excel export code
-
-    """Export stock statement to Excel"""
+        stock_data, totals = _get_export_stock_data(request)
+    
     response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     filename = f'stock_statement_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
@@ -625,29 +398,26 @@ def export_stock_statement_excel(request, stock_data=None):
     
     current_row += 1
     
-    # Add data
+    # Add data (column widths are tracked while writing instead of re-scanning the sheet)
+    max_lengths = [len(header) for header in headers]
     for item in stock_data:
-        worksheet.cell(row=current_row, column=1, value=item['product'].product_name)
-        worksheet.cell(row=current_row, column=2, value=item['product'].product_packing)
-        worksheet.cell(row=current_row, column=3, value=item['opening_stock'])
-        worksheet.cell(row=current_row, column=4, value=item['received_stock'])
-        worksheet.cell(row=current_row, column=5, value=item['sold_stock'])
-        worksheet.cell(row=current_row, column=6, value=item['balance_stock'])
-        worksheet.cell(row=current_row, column=7, value=item['stock_value'])
+        values = [
+            item['product'].product_name,
+            item['product'].product_packing,
+            item['opening_stock'],
+            item['received_stock'],
+            item['sold_stock'],
+            item['balance_stock'],
+            item['stock_value'],
+        ]
+        for col, value in enumerate(values, 1):
+            worksheet.cell(row=current_row, column=col, value=value)
+            max_lengths[col - 1] = max(max_lengths[col - 1], len(str(value)))
         current_row += 1
     
     # Auto-adjust column widths
-    for column in worksheet.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        worksheet.column_dimensions[column_letter].width = adjusted_width
+    for col_idx, max_length in enumerate(max_lengths, 1):
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = min(max_length + 2, 50)
     
     workbook.save(response)
     return response
@@ -658,10 +428,8 @@ def stock_statement_batch_detail(request, product_id):
     """Get detailed batch information for a product"""
     try:
         product = ProductMaster.objects.get(productid=product_id)
-        stock_summary = StockManager.get_stock_summary(product_id)
-        
         batch_details = []
-        for batch in stock_summary['batches']:
+        for batch in StockManager._get_batch_breakdown(product_id):
             # Get additional batch information
             from .models import PurchaseMaster, SaleRateMaster
             
@@ -690,6 +458,7 @@ def stock_statement_batch_detail(request, product_id):
                 'sold': batch['sold'],
                 'purchase_returns': batch['purchase_returns'],
                 'sales_returns': batch['sales_returns'],
+                'stock_issues': batch['stock_issues'],
                 'mrp': purchase.product_MRP if purchase else 0,
                 'rate_A': rate_A,
                 'rate_B': rate_B,
@@ -0,0 +1,222 @@
+"""
+Stock Service
+The one stock formula, for a single batch, many products at once or a past date:
+
+    stock = purchases + supplier challans + sales returns
+            - sales - customer challans - stock issues - purchase returns
+
+Each source counts its rows dated from the first open financial year plus
+what closed years carried forward in OpeningStock (see opening_balances).
+Balances are not clamped: a negative figure means the documents disagree.
+
+Balances are kept per product, batch or batch + expiry (the level). Purchase
+returns record an expiry date instead of the MM-YYYY expiry of the other
+tables, so they are matched on the batch: at the expiry level a purchase
+return comes off every expiry of its batch, as it does in BatchInventoryCache.
+
+movements_for() and balances_for() read every source with one GROUP BY query
+for any number of products; movements() and balance() run one filtered
+aggregate per source for a single product or batch. The check_stock_service
+command checks that both paths agree.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import models
+from django.db.models import Q, Sum
+
+from .models import (
+    PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
+    SupplierChallanMaster, CustomerChallanMaster, StockIssueDetail
+)
+from .opening_balances import (
+    OPENING_SOURCES, live_rows, opening_quantities, opening_start, opening_stock_rows, row_dated,
+)
+
+
+# (model, product field, batch field, expiry field, quantity field, entry date field, OpeningStock column, direction)
+# direction +1 = stock comes IN, -1 = stock goes OUT
+STOCK_SOURCES = [
+    (PurchaseMaster, 'productid', 'product_batch_no', 'product_expiry',
+     'product_quantity', 'purchase_entry_date', 'purchased', 1),
+    (SupplierChallanMaster, 'product_id', 'product_batch_no', 'product_expiry',
+     'product_quantity', 'challan_entry_date', 'supplier_challan', 1),
+    (ReturnSalesMaster, 'return_productid', 'return_product_batch_no', 'return_product_expiry',
+     'return_sale_quantity', 'return_sale_entry_date', 'sales_returns', 1),
+    (SalesMaster, 'productid', 'product_batch_no', 'product_expiry',
+     'sale_quantity', 'sale_entry_date', 'sold', -1),
+    (CustomerChallanMaster, 'product_id', 'product_batch_no', 'product_expiry',
+     'sale_quantity', 'sales_entry_date', 'customer_challan', -1),
+    (StockIssueDetail, 'product_id', 'batch_no', 'expiry_date',
+     'quantity_issued', 'issue__issue_date', 'stock_issued', -1),
+    (ReturnPurchaseMaster, 'returnproductid', 'returnproduct_batch_no', None,
+     'returnproduct_quantity', 'returnpurchase_entry_date', 'purchase_returns', -1),
+]
+
+DIRECTIONS = {source[6]: source[7] for source in STOCK_SOURCES}
+LEVELS = ('product', 'batch', 'expiry')
+
+
+def date_bound(model, date_field, value):
+    """Convert a date to the type of the (possibly related) date column"""
+    field = model._meta.get_field(date_field.split('__')[0])
+    if field.is_relation:
+        field = field.related_model._meta.get_field(date_field.split('__')[1])
+    if isinstance(field, models.DateTimeField):
+        return datetime.combine(value, time.min)
+    return value
+
+
+def entered(model, date_field, lookup, value):
+    """Q on the entry date of a stock source, e.g. entered(SalesMaster, 'sale_entry_date', 'lt', day)"""
+    return Q(**{f'{date_field}__{lookup}': date_bound(model, date_field, value)})
+
+
+def _product_filter(products):
+    """products as a subquery or id list: a ProductMaster queryset, ids, or None for all"""
+    if products is None:
+        return None
+    if hasattr(products, 'values'):
+        return products.order_by().values('productid')
+    return list(products)
+
+
+def _group_fields(level, product_field, batch_field, expiry_field):
+    fields = [product_field]
+    if level != 'product':
+        fields.append(batch_field)
+    if level == 'expiry' and expiry_field:
+        fields.append(expiry_field)
+    return fields
+
+
+def _group_key(level, values):
+    return values[0] if level == 'product' else tuple(values)
+
+
+def _empty_movements():
+    return dict.fromkeys(OPENING_SOURCES, 0)
+
+
+def stock_of(movements):
+    """Balance of a {column: quantity} movements dict"""
+    return sum(DIRECTIONS[column] * quantity for column, quantity in movements.items())
+
+
+def movements_for(products=None, level='batch', as_of=None):
+    """
+    Quantities moved per source for many products, one grouped query per source.
+
+    Args:
+        products: ProductMaster queryset, iterable of product ids, or None for all
+        level: 'product', 'batch' or 'expiry'
+        as_of: last day counted (by entry date); None for everything
+
+    Returns:
+        {key: {source column: quantity}}, keyed by product_id,
+        (product_id, batch_no) or (product_id, batch_no, expiry)
+    """
+    if level not in LEVELS:
+        raise ValueError(f'level must be one of {LEVELS}')
+    product_filter = _product_filter(products)
+
+    # A date before the first open year still reads those years' rows (until archived)
+    start = opening_start()
+    if start is not None and as_of is not None and as_of < start:
+        start = None
+
+    grouped = defaultdict(_empty_movements)
+    batch_returns = defaultdict(float)  # purchase returns at the expiry level, per batch
+    for model, product_field, batch_field, expiry_field, quantity_field, date_field, column, _ in STOCK_SOURCES:
+        annotations = {'total': Sum(quantity_field)}
+        if start and as_of is not None:
+            # The snapshot holds the rows dated before start (ROW_DATES) whatever their
+            # entry date: the ones entered after as_of are read back and taken out
+            next_day = as_of + timedelta(days=1)
+            live = row_dated(model, 'gte', start)
+            queryset = model.objects.filter(
+                (live & entered(model, date_field, 'lt', next_day))
+                | (row_dated(model, 'lt', start) & entered(model, date_field, 'gte', next_day))
+            )
+            annotations = {
+                'total': Sum(quantity_field, filter=live),
+                'late': Sum(quantity_field, filter=row_dated(model, 'lt', start)),
+            }
+        elif as_of is not None:
+            queryset = model.objects.filter(entered(model, date_field, 'lt', as_of + timedelta(days=1)))
+        else:
+            queryset = live_rows(model, start) if start else model.objects.all()
+        if product_filter is not None:
+            queryset = queryset.filter(**{f'{product_field}__in': product_filter})
+        fields = _group_fields(level, product_field, batch_field, expiry_field)
+        # order_by() clears Meta.ordering so the GROUP BY stays on the key fields
+        for row in queryset.order_by().values_list(*fields).annotate(**annotations):
+            key, totals = row[:len(fields)], row[len(fields):]
+            quantity = (totals[0] or 0) - sum(late or 0 for late in totals[1:])
+            if level == 'expiry' and not expiry_field:
+                batch_returns[tuple(key[:2])] += quantity
+            else:
+                grouped[_group_key(level, key)][column] += quantity
+
+    if start is not None:
+        rows = opening_stock_rows()
+        if product_filter is not None:
+            rows = rows.filter(product_id__in=product_filter)
+        fields = _group_fields(level, 'product_id', 'batch_no', 'expiry_date')
+        rows = rows.order_by().values_list(*fields).annotate(**{
+            f'{column}_total': Sum(column) for column in OPENING_SOURCES
+        })
+        for row in rows:
+            key = _group_key(level, row[:len(fields)])
+            for column, quantity in zip(OPENING_SOURCES, row[len(fields):]):
+                if level == 'expiry' and column == 'purchase_returns':
+                    batch_returns[key[:2]] += quantity or 0
+                elif quantity:
+                    grouped[key][column] += quantity
+
+    if batch_returns:
+        expiries = defaultdict(list)
+        for key in grouped:
+            expiries[key[:2]].append(key)
+        for batch, quantity in batch_returns.items():
+            for key in expiries.get(batch) or [batch + (None,)]:
+                grouped[key]['purchase_returns'] += quantity
+
+    return dict(grouped)
+
+
+def balances_for(products=None, level='batch'):
+    """{key: stock} for many products - see movements_for"""
+    return {key: stock_of(moved) for key, moved in movements_for(products, level).items()}
+
+
+def balances_as_of(as_of, products=None, level='product'):
+    """{key: stock} on the evening of as_of (entry dates) - see movements_for"""
+    return {key: stock_of(moved) for key, moved in movements_for(products, level, as_of).items()}
+
+
+def movements(product_id, batch_no=None, expiry_date=None):
+    """{source column: quantity} of one product, batch or batch + expiry, one aggregate per source"""
+    start = opening_start()
+    totals = _empty_movements()
+    for model, product_field, batch_field, expiry_field, quantity_field, _, column, _ in STOCK_SOURCES:
+        filters = {product_field: product_id}
+        if batch_no is not None:
+            filters[batch_field] = batch_no
+        if expiry_date is not None and expiry_field:
+            filters[expiry_field] = expiry_date
+        queryset = live_rows(model, start) if start else model.objects.all()
+        totals[column] += queryset.filter(**filters).aggregate(total=Sum(quantity_field))['total'] or 0
+
+    if start is not None:
+        opening = opening_quantities(product_id, batch_no, expiry_date)
+        if expiry_date is not None:
+            opening['purchase_returns'] = opening_quantities(product_id, batch_no)['purchase_returns']
+        for column, quantity in opening.items():
+            totals[column] += quantity
+    return totals
+
+
+def balance(product_id, batch_no=None, expiry_date=None):
+    """Stock of one product, batch or batch + expiry"""
+    return stock_of(movements(product_id, batch_no, expiry_date))
@@ -0,0 +1,194 @@
+"""
+Stock Statement Engine
+Computes opening, inward, outward and closing quantities for many products at once.
+
+Every movement source is read with ONE grouped query that uses conditional
+aggregation (Sum(..., filter=Q(...))) so the opening balance and the period
+movement come out of the same scan. Date bounds are pushed into SQL, so the
+cost is one query per source no matter how many products are requested.
+
+Once a financial year is closed, periods reaching into the open years read
+only the rows dated from then on (opening_balances.live_rows) and take the
+closed years from the OpeningStock snapshot as opening stock. A period that
+starts inside a closed year also reads the closed rows from its first day and
+takes them back out of the snapshot, so those months keep their inward and
+outward; once the year is archived such a period is rejected. The snapshot
+splits rows on their document date (opening_balances.ROW_DATES) and the
+period on the entry date, so a backdated row the snapshot holds but entered
+after date_from is also taken back out and counted when it was entered.
+"""
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+
+from django.db.models import Sum, Q, F
+
+from .models import PurchaseMaster
+from .opening_balances import archived_until, opening_start, opening_stock_rows, row_dated
+from .stock_service import STOCK_SOURCES, entered
+
+
+# (model, product field, quantity field, date field, direction) - the sources of
+# the stock formula in core/stock_service.py
+STOCK_MOVEMENT_SOURCES = [
+    (model, product_field, quantity_field, date_field, direction)
+    for model, product_field, _, _, quantity_field, date_field, _, direction in STOCK_SOURCES
+]
+
+# OpeningStock columns by direction
+OPENING_INWARD = tuple(column for *_, column, direction in STOCK_SOURCES if direction > 0)
+OPENING_OUTWARD = tuple(column for *_, column, direction in STOCK_SOURCES if direction < 0)
+
+
+class ArchivedPeriodError(ValueError):
+    """The period needs stock movements that were moved to the archive"""
+
+
+def _to_date(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _sum(expression, condition):
+    """Sum over the rows matching condition (all rows for an empty Q)"""
+    return Sum(expression, filter=condition) if condition else Sum(expression)
+
+
+def _empty_row():
+    return {'opening': 0, 'inward': 0, 'outward': 0, 'closing': 0, 'avg_mrp': 0}
+
+
+def _add_opening_stock(statement, product_filter, mrp_totals):
+    """Fold the closed years' snapshot into the opening column"""
+    rows = opening_stock_rows()
+    if product_filter is not None:
+        rows = rows.filter(product_id__in=product_filter)
+    aggregates = {f'{column}_total': Sum(column) for column in OPENING_INWARD + OPENING_OUTWARD}
+    aggregates['mrp_value'] = Sum(F('mrp') * F('purchased'), filter=Q(mrp__isnull=False))
+    aggregates['mrp_qty'] = Sum('purchased', filter=Q(mrp__isnull=False))
+    for row in rows.order_by().values('product_id').annotate(**aggregates):
+        entry = statement[row['product_id']]
+        entry['opening'] += (sum(row[f'{column}_total'] or 0 for column in OPENING_INWARD)
+                             - sum(row[f'{column}_total'] or 0 for column in OPENING_OUTWARD))
+        mrp_totals[row['product_id']][0] += row['mrp_value'] or 0
+        mrp_totals[row['product_id']][1] += row['mrp_qty'] or 0
+
+
+def compute_stock_statement(products=None, date_from=None, date_to=None):
+    """
+    Stock statement for a set of products.
+
+    Args:
+        products: ProductMaster queryset (used as a SQL subquery), an iterable
+                  of product ids, or None for the full catalogue
+        date_from: first day of the period (date or 'YYYY-MM-DD'); movements
+                   before it are folded into the opening balance
+        date_to: last day of the period (inclusive); later movements are ignored
+
+    Returns:
+        dict {product_id: {'opening', 'inward', 'outward', 'closing', 'avg_mrp'}}
+
+    Raises:
+        ArchivedPeriodError: the period needs rows of an archived year
+    """
+    start = _to_date(date_from)
+    end = _to_date(date_to)
+    end_exclusive = end + timedelta(days=1) if end else None
+
+    if products is not None and hasattr(products, 'values'):
+        product_filter = products.order_by().values('productid')
+    elif products is not None:
+        product_filter = list(products)
+    else:
+        product_filter = None
+
+    statement = defaultdict(_empty_row)
+    mrp_totals = defaultdict(lambda: [0, 0])  # product -> [MRP x quantity, quantity]
+
+    # Periods ending in a closed year still read those years' rows; later ones
+    # take the snapshot as opening stock and read the rows dated (ROW_DATES, as
+    # the snapshot) from its date, or from date_from when that falls in a closed
+    # year (reopened: those rows move from the snapshot back into the period)
+    closed_until = opening_start()
+    reopened = False
+    if closed_until is not None and (end is None or end >= closed_until):
+        _add_opening_stock(statement, product_filter, mrp_totals)
+        reopened = start is not None and start < closed_until
+        rows_from = start if reopened else closed_until
+    else:
+        rows_from = None
+
+    archived = archived_until()
+    if archived is not None and (rows_from is None or rows_from < archived):
+        raise ArchivedPeriodError(f'Stock movements before {archived:%d-%m-%Y} are archived')
+
+    for model, product_field, qty_field, date_field, direction in STOCK_MOVEMENT_SOURCES:
+        period = Q()
+        if start:
+            period &= entered(model, date_field, 'gte', start)
+        if end_exclusive:
+            period &= entered(model, date_field, 'lt', end_exclusive)
+
+        live = row_dated(model, 'gte', rows_from) if rows_from else Q()
+        rows_filter = live
+        if end_exclusive and not reopened:
+            rows_filter &= entered(model, date_field, 'lt', end_exclusive)
+        # Rows the snapshot holds but entered from date_from on (or after date_to
+        # when there is no date_from) leave the opening
+        late_from = start or end_exclusive
+        if rows_from and late_from:
+            rows_filter |= row_dated(model, 'lt', rows_from) & entered(model, date_field, 'gte', late_from)
+        queryset = model.objects.filter(rows_filter)
+        if product_filter is not None:
+            queryset = queryset.filter(**{f'{product_field}__in': product_filter})
+
+        aggregates = {'during': _sum(qty_field, period)}
+        if start:
+            aggregates['before'] = _sum(qty_field, live & entered(model, date_field, 'lt', start))
+        if reopened:
+            aggregates['reopened'] = _sum(qty_field, live & row_dated(model, 'lt', closed_until))
+        if rows_from and late_from:
+            aggregates['late'] = _sum(qty_field, row_dated(model, 'lt', rows_from))
+
+        if model is PurchaseMaster:
+            # Quantity-weighted MRP for valuing the closing stock; the snapshot
+            # already carries the MRP of the closed years' purchases
+            mrp_filter = row_dated(model, 'gte', closed_until) if rows_from else Q()
+            if end_exclusive:
+                mrp_filter &= entered(model, date_field, 'lt', end_exclusive)
+            aggregates['mrp_value'] = _sum(F('product_MRP') * F('product_quantity'), mrp_filter)
+            aggregates['mrp_qty'] = _sum('product_quantity', mrp_filter)
+
+        # order_by() clears Meta.ordering so the GROUP BY stays on the product only
+        rows = queryset.order_by().values(product_field).annotate(**aggregates)
+
+        for row in rows:
+            entry = statement[row[product_field]]
+            before = row.get('before') or 0
+            during = row.get('during') or 0
+            taken_back = (row.get('reopened') or 0) + (row.get('late') or 0)
+            entry['opening'] += direction * (before - taken_back)
+            if direction > 0:
+                entry['inward'] += during
+            else:
+                entry['outward'] += during
+            if model is PurchaseMaster:
+                mrp_totals[row[product_field]][0] += row['mrp_value'] or 0
+                mrp_totals[row[product_field]][1] += row['mrp_qty'] or 0
+
+    for product_id, entry in statement.items():
+        entry['closing'] = entry['opening'] + entry['inward'] - entry['outward']
+        mrp_value, mrp_qty = mrp_totals[product_id]
+        if mrp_qty:
+            entry['avg_mrp'] = mrp_value / mrp_qty
+
+    return statement
+
+
+def get_statement_row(statement, product_id):
+    """Row for one product, zeros when the product had no movement"""
+    return statement.get(product_id) or _empty_row()
@@ -1,25 +1,27 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
 from django.db import transaction
 from datetime import datetime
-from django.db import models
+import json
+import logging
 from decimal import Decimal, ROUND_HALF_UP
-from .models import (
-    InvoiceMaster, InvoicePaid, SalesInvoiceMaster, SalesInvoicePaid,
-    SupplierMaster, CustomerMaster
+from .models import InvoiceMaster, SalesInvoiceMaster
+from .open_items import open_purchase_invoices, open_sales_invoices, purchase_invoice_item, sales_invoice_item
+from .payment_posting import (
+    post_purchase_payments, post_sales_receipts, settle_supplier_payment, settle_customer_receipt
 )
 
+logger = logging.getLogger(__name__)
+
 @login_required
 def add_unified_payment(request):
     """Unified view for adding payments, receipts, and contra entries"""
     
     if request.method == 'POST':
         try:
-            print("=== UNIFIED PAYMENT FORM SUBMISSION ===")
-            print(f"All POST data: {dict(request.POST)}")
-            
             # Get form data
             transaction_type = request.POST.get('transaction_type')
             payment_date = request.POST.get('payment_date')
@@ -29,13 +31,8 @@ def add_unified_payment(request):
             entity_id = request.POST.get('entity_id')
             invoice_no = request.POST.get('invoice_no')
             
-            print(f"Extracted form data:")
-            print(f"   Transaction type: '{transaction_type}'")
-            print(f"   Payment amount: '{payment_amount}'")
-            print(f"   Payment mode: '{payment_mode}'")
-            print(f"   Entity ID: '{entity_id}'")
-            print(f"   Invoice no: '{invoice_no}'")
-            print(f"   Payment date: '{payment_date}'")
+            logger.debug('Unified payment: type %s, amount %s, mode %s, entity %s, invoice %s, date %s',
+                         transaction_type, payment_amount, payment_mode, entity_id, invoice_no, payment_date)
             
             # Validate required fields
             missing_fields = []
@@ -49,24 +46,20 @@ def add_unified_payment(request):
                 missing_fields.append('payment_mode')
                 
             if missing_fields:
-                print(f"Missing required fields: {missing_fields}")
                 messages.error(request, f'Missing required fields: {", ".join(missing_fields)}')
                 return redirect('add_unified_payment')
             
             # Validate transaction type
             if transaction_type not in ['payment', 'receipt', 'contra']:
-                print(f"Invalid transaction type: '{transaction_type}'")
                 messages.error(request, 'Invalid transaction type.')
                 return redirect('add_unified_payment')
             
             # For payment and receipt, entity and invoice are required
             if transaction_type in ['payment', 'receipt']:
                 if not entity_id:
-                    print(f"Missing entity_id for {transaction_type}")
                     messages.error(request, 'Please select an invoice first (missing entity).')
                     return redirect('add_unified_payment')
                 if not invoice_no:
-                    print(f"Missing invoice_no for {transaction_type}")
                     messages.error(request, 'Please select an invoice first (missing invoice number).')
                     return redirect('add_unified_payment')
             
@@ -74,90 +67,61 @@ def add_unified_payment(request):
             try:
                 payment_amount = Decimal(str(payment_amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                 if payment_amount <= 0:
-                    print(f"Invalid payment amount: {payment_amount}")
                     messages.error(request, 'Payment amount must be greater than 0.')
                     return redirect('add_unified_payment')
             except (ValueError, TypeError):
-                print(f"Cannot convert payment amount to decimal: '{payment_amount}'")
                 messages.error(request, 'Invalid payment amount.')
                 return redirect('add_unified_payment')
             
             # Parse date
             try:
                 payment_date = datetime.strptime(payment_date, '%Y-%m-%d').date()
-                print(f"Parsed payment date: {payment_date}")
             except ValueError:
-                print(f"Invalid date format: '{payment_date}'")
                 messages.error(request, 'Invalid date format.')
                 return redirect('add_unified_payment')
             
             # Handle bank name for bank transfer
             bank_name = request.POST.get('bank_name', '').strip()
-            print(f"Bank name from form: '{bank_name}'")
             if payment_mode == 'bank':
                 if bank_name:
                     payment_mode = f'bank - {bank_name}'
-                    print(f"Updated payment mode: '{payment_mode}'")
                 else:
-                    print(f"Bank transfer selected but no bank name provided")
                     messages.error(request, 'Bank name is required for bank transfer.')
                     return redirect('add_unified_payment')
             
             with transaction.atomic():
                 if transaction_type == 'payment':
                     # Handle supplier payment
-                    print(f"Processing supplier payment for invoice: {invoice_no}")
                     try:
                         invoice = InvoiceMaster.objects.get(invoice_no=invoice_no)
-                        print(f"Found invoice: {invoice} (Total: Rs.{invoice.invoice_total}, Paid: Rs.{invoice.invoice_paid})")
                         
                         # Calculate balance with proper decimal precision
                         invoice_total = Decimal(str(invoice.invoice_total)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                         invoice_paid = Decimal(str(invoice.invoice_paid)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                         balance = invoice_total - invoice_paid
                         
-                        print(f"Invoice balance: Rs.{balance}")
-                        
                         # Handle small balance scenarios (≤ 10 paisa)
                         if balance <= Decimal('0.10') and balance > 0:
                             if payment_amount >= balance:
                                 # Auto-adjust payment to exact balance for small amounts
                                 payment_amount = balance
-                                print(f"Auto-adjusted payment to exact balance: Rs.{payment_amount}")
                                 messages.info(request, f'Payment adjusted to exact balance of Rs.{balance}')
                         elif payment_amount > balance:
-                            print(f"Payment amount Rs.{payment_amount} exceeds balance Rs.{balance}")
                             messages.error(request, f'Payment amount cannot exceed balance of Rs.{balance}')
                             return redirect('add_unified_payment')
                         
                         # Create payment record
-                        print(f"Creating payment record...")
-                        payment_record = InvoicePaid.objects.create(
-                            ip_invoiceid=invoice,
+                        # Paid amount, balance and payment status move in one UPDATE
+                        payment_record, = post_purchase_payments(
+                            [(invoice.invoiceid, payment_amount)],
                             payment_date=payment_date,
-                            payment_amount=payment_amount,
                             payment_mode=payment_mode,
                             payment_ref_no=reference_no
                         )
-                        print(f"Payment record created with ID: {payment_record.payment_id}")
-                        
-                        # Update invoice paid amount
-                        old_paid = invoice.invoice_paid
-                        invoice.invoice_paid = float(invoice_paid + payment_amount)
-                        
-                        # Update payment status
-                        new_balance = invoice_total - Decimal(str(invoice.invoice_paid))
-                        if new_balance <= Decimal('0.01'):
-                            invoice.payment_status = 'paid'
-                            print(f"Invoice marked as fully paid")
-                        elif invoice.invoice_paid > 0:
-                            invoice.payment_status = 'partial'
-                            print(f"Invoice marked as partially paid")
-                        else:
-                            invoice.payment_status = 'pending'
                         
-                        invoice.save()
-                        print(f"Invoice updated: Rs.{old_paid} -> Rs.{invoice.invoice_paid}, New balance: Rs.{new_balance}")
+                        new_balance = invoice_total - (invoice_paid + payment_amount)
+                        logger.info('Payment %s added: invoice %s, amount %s, new balance %s',
+                                    payment_record.payment_id, invoice_no, payment_amount, new_balance)
                         
                         if new_balance <= Decimal('0.01'):
                             messages.success(request, f'Payment of Rs.{payment_amount} added successfully! Invoice is now fully paid.')
@@ -165,61 +129,45 @@ def add_unified_payment(request):
                             messages.success(request, f'Payment of Rs.{payment_amount} added successfully! Remaining balance: Rs.{new_balance}')
                         
                     except InvoiceMaster.DoesNotExist:
-                        print(f"Invoice not found with invoice_no: '{invoice_no}'")
-                        # List available invoices for debugging
-                        available_invoices = InvoiceMaster.objects.all()[:5]
-                        print(f"Available invoices: {[inv.invoice_no for inv in available_invoices]}")
+                        logger.warning('Payment for unknown invoice %r', invoice_no)
                         messages.error(request, f'Invoice {invoice_no} not found.')
                         return redirect('add_unified_payment')
                     except Exception as e:
-                        print(f"Error creating payment: {str(e)}")
+                        logger.exception('Error creating payment for invoice %s', invoice_no)
                         messages.error(request, f'Error creating payment: {str(e)}')
                         return redirect('add_unified_payment')
                 
                 elif transaction_type == 'receipt':
                     # Handle customer receipt
-                    print(f"Processing customer receipt for invoice: {invoice_no}")
                     try:
                         invoice = SalesInvoiceMaster.objects.get(sales_invoice_no=invoice_no)
-                        print(f"Found sales invoice: {invoice} (Total: Rs.{invoice.sales_invoice_total}, Paid: Rs.{invoice.sales_invoice_paid})")
                         
                         # Calculate balance with proper decimal precision
                         invoice_total = Decimal(str(invoice.sales_invoice_total)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                         invoice_paid = Decimal(str(invoice.sales_invoice_paid)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                         balance = invoice_total - invoice_paid
                         
-                        print(f"Sales invoice balance: Rs.{balance}")
-                        
                         # Handle small balance scenarios (≤ 10 paisa)
                         if balance <= Decimal('0.10') and balance > 0:
                             if payment_amount >= balance:
                                 # Auto-adjust payment to exact balance for small amounts
                                 payment_amount = balance
-                                print(f"Auto-adjusted receipt to exact balance: Rs.{payment_amount}")
                                 messages.info(request, f'Receipt adjusted to exact balance of Rs.{balance}')
                         elif payment_amount > balance:
-                            print(f"Receipt amount Rs.{payment_amount} exceeds balance Rs.{balance}")
                             messages.error(request, f'Receipt amount cannot exceed balance of Rs.{balance}')
                             return redirect('add_unified_payment')
                         
                         # Create receipt record
-                        print(f"Creating receipt record...")
-                        receipt_record = SalesInvoicePaid.objects.create(
-                            sales_ip_invoice_no=invoice,
-                            sales_payment_date=payment_date,
-                            sales_payment_amount=payment_amount,
-                            sales_payment_mode=payment_mode,
-                            sales_payment_ref_no=reference_no
+                        receipt_record, = post_sales_receipts(
+                            [(invoice.sales_invoice_no, payment_amount)],
+                            payment_date=payment_date,
+                            payment_mode=payment_mode,
+                            payment_ref_no=reference_no
                         )
-                        print(f"Receipt record created with ID: {receipt_record.sales_payment_id}")
-                        
-                        # Update invoice paid amount
-                        old_paid = invoice.sales_invoice_paid
-                        invoice.sales_invoice_paid = float(invoice_paid + payment_amount)
-                        invoice.save()
                         
-                        new_balance = invoice_total - Decimal(str(invoice.sales_invoice_paid))
-                        print(f"Sales invoice updated: Rs.{old_paid} -> Rs.{invoice.sales_invoice_paid}, New balance: Rs.{new_balance}")
+                        new_balance = invoice_total - (invoice_paid + payment_amount)
+                        logger.info('Receipt %s added: sales invoice %s, amount %s, new balance %s',
+                                    receipt_record.sales_payment_id, invoice_no, payment_amount, new_balance)
                         
                         if new_balance <= Decimal('0.01'):
                             messages.success(request, f'Receipt of Rs.{payment_amount} added successfully! Invoice is now fully paid.')
@@ -227,32 +175,24 @@ def add_unified_payment(request):
                             messages.success(request, f'Receipt of Rs.{payment_amount} added successfully! Remaining balance: Rs.{new_balance}')
                         
                     except SalesInvoiceMaster.DoesNotExist:
-                        print(f"Sales invoice not found with sales_invoice_no: '{invoice_no}'")
-                        # List available sales invoices for debugging
-                        available_invoices = SalesInvoiceMaster.objects.all()[:5]
-                        print(f"Available sales invoices: {[inv.sales_invoice_no for inv in available_invoices]}")
+                        logger.warning('Receipt for unknown sales invoice %r', invoice_no)
                         messages.error(request, f'Sales invoice {invoice_no} not found.')
                         return redirect('add_unified_payment')
                     except Exception as e:
-                        print(f"Error creating receipt: {str(e)}")
+                        logger.exception('Error creating receipt for sales invoice %s', invoice_no)
                         messages.error(request, f'Error creating receipt: {str(e)}')
                         return redirect('add_unified_payment')
                 
                 elif transaction_type == 'contra':
                     # Handle contra entry (direct cash/bank transfer)
-                    print(f"Processing contra entry of Rs.{payment_amount}")
                     # For now, just show success message
                     # You can extend this to create contra entries in a separate table
-                    print(f"Contra entry processed successfully")
                     messages.success(request, f'Contra entry of Rs.{payment_amount:.2f} recorded successfully!')
                 
-                print(f"Transaction completed successfully")
                 return redirect('add_unified_payment')
                 
         except Exception as e:
-            print(f"Unexpected error: {str(e)}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
+            logger.exception('Error processing unified payment')
             messages.error(request, f'Error processing transaction: {str(e)}')
             return redirect('add_unified_payment')
     
@@ -270,25 +210,9 @@ def search_supplier_invoices(request):
     if len(query) < 2:
         return JsonResponse([])
     
-    # Search unpaid supplier invoices
-    invoices = InvoiceMaster.objects.filter(
-        supplierid__supplier_name__icontains=query,
-        invoice_paid__lt=models.F('invoice_total')
-    ).select_related('supplierid').order_by('-invoice_date')[:20]
-    
-    results = []
-    for invoice in invoices:
-        balance = invoice.invoice_total - invoice.invoice_paid
-        if balance > 0:
-            results.append({
-                'supplier_id': invoice.supplierid.supplierid,
-                'supplier_name': invoice.supplierid.supplier_name,
-                'invoice_no': invoice.invoice_no,
-                'invoice_date': invoice.invoice_date.strftime('%d-%m-%Y'),
-                'total_amount': float(invoice.invoice_total),
-                'paid_amount': float(invoice.invoice_paid),
-                'balance_amount': float(balance)
-            })
+    # Open invoices only - one query on the open-items index
+    invoices = open_purchase_invoices(search=query)[:20]
+    results = [purchase_invoice_item(invoice) for invoice in invoices]
     
     return JsonResponse(results, safe=False)
 
@@ -300,25 +224,77 @@ def search_customer_invoices(request):
     if len(query) < 2:
         return JsonResponse([])
     
-    # Search unpaid customer invoices
-    invoices = SalesInvoiceMaster.objects.filter(
-        models.Q(customerid__customer_name__icontains=query) |
-        models.Q(customerid__customer_mobile__icontains=query),
-        sales_invoice_paid__lt=models.F('sales_invoice_total')
-    ).select_related('customerid').order_by('-sales_invoice_date')[:20]
+    # Open invoices only - one query on the open-items index
+    invoices = open_sales_invoices(search=query)[:20]
+    results = [sales_invoice_item(invoice) for invoice in invoices]
+    
+    return JsonResponse(results, safe=False)
+
+@login_required
+def bulk_allocate_payment(request):
+    """
+    Settle one lump-sum payment (supplier) or receipt (customer) across the
+    party's open invoices - FIFO by invoice date, or by the explicit split in
+    `allocations` ({"invoice": amount, ...}).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    
+    transaction_type = request.POST.get('transaction_type')
+    party_id = request.POST.get('party_id')
+    payment_mode = request.POST.get('payment_mode', '').strip()
+    reference_no = request.POST.get('reference_no', '').strip()
+    bank_name = request.POST.get('bank_name', '').strip()
+    
+    if transaction_type not in ('payment', 'receipt') or not party_id or not payment_mode:
+        return JsonResponse({'success': False, 'error': 'Transaction type, party and payment mode are required'})
+    
+    try:
+        amount = float(request.POST.get('amount', ''))
+        if amount <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Amount must be greater than 0'})
+    
+    try:
+        payment_date = datetime.strptime(request.POST.get('payment_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid date format'})
+    
+    try:
+        splits = json.loads(request.POST.get('allocations') or '{}')
+        if not isinstance(splits, dict):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid allocations'}, status=400)
+    
+    if payment_mode == 'bank' and bank_name:
+        payment_mode = f'bank - {bank_name}'
+    
+    try:
+        if transaction_type == 'payment':
+            splits = {int(invoice_id): value for invoice_id, value in splits.items()}
+            allocations, unallocated = settle_supplier_payment(
+                party_id, amount, payment_date, payment_mode, reference_no, splits=splits
+            )
+        else:
+            allocations, unallocated = settle_customer_receipt(
+                party_id, amount, payment_date, payment_mode, reference_no, splits=splits
+            )
+    except ValidationError as e:
+        # ClosedYearError: the payment date is in a closed financial year
+        return JsonResponse({'success': False, 'error': ' '.join(e.messages)})
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
     
-    results = []
-    for invoice in invoices:
-        balance = invoice.sales_invoice_total - invoice.sales_invoice_paid
-        if balance > 0:
-            results.append({
-                'customer_id': invoice.customerid.customerid,
-                'customer_name': invoice.customerid.customer_name,
-                'invoice_no': invoice.sales_invoice_no,
-                'invoice_date': invoice.sales_invoice_date.strftime('%d-%m-%Y'),
-                'total_amount': float(invoice.sales_invoice_total),
-                'paid_amount': float(invoice.sales_invoice_paid),
-                'balance_amount': float(balance)
-            })
+    if not allocations:
+        return JsonResponse({'success': False, 'error': 'No outstanding invoices to allocate against'})
     
-    return JsonResponse(results, safe=False)
\ No newline at end of file
+    allocated = amount - unallocated
+    return JsonResponse({
+        'success': True,
+        'message': f'Rs.{allocated:.2f} allocated across {len(allocations)} invoice(s)',
+        'allocations': [{'invoice': invoice, 'amount': value} for invoice, value in allocations],
+        'allocated': round(allocated, 2),
+        'unallocated': unallocated
+    })
\ No newline at end of file
@@ -8,6 +8,10 @@ from .challan_views import (
 )
 from .combined_invoice_view import add_invoice_with_products, get_existing_batches, cleanup_duplicate_batches, get_supplier_challans, get_challan_products
 from .low_stock_views import low_stock_update, update_low_stock_item, bulk_update_low_stock, get_batch_suggestions
+from .reorder_views import reorder_suggestions
+from .expiry_report_views import expiry_return_list
+from .ageing_views import ageing_report, export_ageing_report
+from .unified_payment_view import bulk_allocate_payment
 from .bulk_upload_views import bulk_upload_products, download_product_template
 from core.bulk_upload_view import bulk_upload_invoices
 from .ledger_views import customer_ledger, supplier_ledger, ledger_selection, customer_ledger_print, supplier_ledger_print, export_supplier_ledger_pdf, export_supplier_ledger_excel, export_customer_ledger_pdf, export_customer_ledger_excel
@@ -25,7 +29,8 @@ from .inventory_export_views import (
     export_dateexpiry_inventory_pdf, export_dateexpiry_inventory_excel
 )
 from .financial_views import financial_report, export_financial_pdf, export_financial_excel
-from .backup_views import backup_list, create_backup, restore_backup, download_backup, delete_backup
+from .backup_views import backup_list, create_backup, restore_backup, download_backup, delete_backup, backup_job_status
+from .archive_views import archived_year_report
 from .return_receipt_views import print_purchase_return_receipt, print_sales_return_receipt
 from .cached_inventory_views import inventory_list_cached
 # ============================================
@@ -77,6 +82,8 @@ urlpatterns = [
     path('system/backups/restore/', restore_backup, name='restore_backup'),
     path('system/backups/download/<str:filename>/', download_backup, name='download_backup'),
     path('system/backups/delete/', delete_backup, name='delete_backup'),
+    path('system/backups/jobs/<str:job_id>/', backup_job_status, name='backup_job_status'),
+    path('archive/<int:fy_year>/', archived_year_report, name='archived_year_report'),
     path('download-backup-logout/<str:filename>/', views.download_backup_and_logout, name='download_backup_and_logout'),
     
     # Suppliers
@@ -195,6 +202,7 @@ urlpatterns = [
     # Reports
     path('reports/inventory/batch/', views.batch_inventory_report, name='batch_inventory_report'),
     path('reports/inventory/expiry/', views.dateexpiry_inventory_report, name='dateexpiry_inventory_report'),
+    path('reports/inventory/expiry/return-to-vendor/', expiry_return_list, name='expiry_return_list'),
     path('reports/stock-statement/', stock_statement_report, name='stock_statement_report'),
     path('reports/stock-statement/batch-details/<int:product_id>/', stock_statement_batch_detail, name='stock_statement_batch_detail'),
     path('reports/stock-statement/pdf/', export_stock_statement_pdf, name='export_stock_statement_pdf'),
@@ -213,6 +221,8 @@ urlpatterns = [
     
     # Customer Sales Reports
     path('reports/customer-sales/', customer_wise_sales_report, name='customer_wise_sales_report'),
+    path('reports/ageing/', ageing_report, name='ageing_report'),
+    path('reports/ageing/export/', export_ageing_report, name='export_ageing_report'),
     path('api/quick-customer-search/', quick_customer_search, name='quick_customer_search'),
     path('api/customer-sales-summary/<int:customer_id>/', customer_sales_summary, name='customer_sales_summary'),
     
@@ -264,6 +274,7 @@ urlpatterns = [
     
     # Low Stock Update
     path('inventory/low-stock-update/', low_stock_update, name='low_stock_update'),
+    path('inventory/reorder-suggestions/', reorder_suggestions, name='reorder_suggestions'),
     path('api/update-low-stock-item/', update_low_stock_item, name='update_low_stock_item'),
     path('api/bulk-update-low-stock/', bulk_update_low_stock, name='bulk_update_low_stock'),
     path('get-batch-suggestions/', get_batch_suggestions, name='get_batch_suggestions'),
@@ -291,6 +302,7 @@ urlpatterns = [
     # Unified Payment/Receipt Form
     path('finance/add/', views.add_unified_payment, name='add_unified_payment'),
     path('unified-payment/', views.add_unified_payment, name='unified_payment'),
+    path('api/bulk-allocate-payment/', bulk_allocate_payment, name='bulk_allocate_payment'),
     
     # Balance Check APIs
     path('api/check-invoice-balance/', check_invoice_balance, name='check_invoice_balance'),
@@ -1,11 +1,13 @@
-from django.db.models import Sum, F
 from django.utils import timezone
 from io import BytesIO
 from datetime import datetime, date
 import tempfile
 import os
+import logging
 
-from .models import PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster, ProductMaster
+from .models import PurchaseMaster, SalesMaster, ProductMaster
+
+logger = logging.getLogger(__name__)
 
 
 def parse_expiry_date(expiry_str):
@@ -71,160 +73,89 @@ def validate_expiry_format(expiry_str):
 
 def get_batch_stock_status(product_id, batch_no, expiry_date=None, exclude_sale_id=None):
     """
-    Calculate current stock for a specific product batch + expiry combination
+    Calculate current stock for a specific product batch (core/stock_service.py)
     Returns a tuple of (available_quantity, is_available)
-    Enhanced with better error handling and user feedback
-    Now includes stock issues in calculation - FIXED FOR UI UPDATE
     
     Args:
         product_id: Product ID
         batch_no: Batch number
-        expiry_date: Expiry date (optional)
+        expiry_date: Expiry date (optional, stock is counted for the whole batch)
         exclude_sale_id: Sale ID to exclude from calculation (for edit mode)
     """
     try:
         from django.db.models import Sum
+        from .opening_balances import live_rows
+        from .stock_service import movements, stock_of
         
-        # Get total stock for batch from invoices
-        batch_purchased_invoice = PurchaseMaster.objects.filter(
-            productid=product_id, 
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        # Get total stock for batch from challans
-        from .models import SupplierChallanMaster
-        batch_purchased_challan = SupplierChallanMaster.objects.filter(
-            product_id=product_id, 
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        batch_purchased = batch_purchased_invoice + batch_purchased_challan
-        
-        # Get sold quantity from sales invoices, excluding specific sale if provided (for edit mode)
-        sales_query = SalesMaster.objects.filter(
-            productid=product_id, 
-            product_batch_no=batch_no
-        )
+        moved = movements(product_id, batch_no)
+        current_stock = stock_of(moved)
         
+        # Edit mode: the sale being edited gives its quantity back
         if exclude_sale_id:
-            sales_query = sales_query.exclude(id=exclude_sale_id)
-        
-        batch_sold_invoices = sales_query.aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        # Get sold quantity from customer challans
-        from .models import CustomerChallanMaster
-        batch_sold_challans = CustomerChallanMaster.objects.filter(
-            product_id=product_id, 
-            product_batch_no=batch_no
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        batch_sold = batch_sold_invoices + batch_sold_challans
-        
-        purchase_returns = ReturnPurchaseMaster.objects.filter(
-            returnproductid=product_id,
-            returnproduct_batch_no=batch_no
-        ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-        
-        sales_returns = ReturnSalesMaster.objects.filter(
-            return_productid=product_id,
-            return_product_batch_no=batch_no
-        ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-        
-        # Get stock issues (reduces stock) - CRITICAL FOR UI UPDATE
-        from .models import StockIssueDetail
-        stock_issues = StockIssueDetail.objects.filter(
-            product=product_id,
-            batch_no=batch_no
-        ).aggregate(total=Sum('quantity_issued'))['total'] or 0
-        
-        # Calculate current stock including stock issues - UPDATED CALCULATION FOR UI FIX
-        current_stock = batch_purchased - batch_sold - purchase_returns + sales_returns - stock_issues
+            current_stock += live_rows(SalesMaster).filter(
+                id=exclude_sale_id,
+                productid=product_id,
+                product_batch_no=batch_no
+            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
         
-        # Debug logging for stock issue tracking - Enhanced for troubleshooting
-        print(f"[OK] Stock calculation for Product {product_id}, Batch {batch_no}:")
-        print(f"   [+] Purchased: {batch_purchased} (Invoice: {batch_purchased_invoice} + Challan: {batch_purchased_challan})")
-        print(f"   [-] Sold: {batch_sold} (Invoice: {batch_sold_invoices} + Challan: {batch_sold_challans})")
-        print(f"   [R] Returns: Purchase(-{purchase_returns}) + Sales(+{sales_returns}) = {sales_returns - purchase_returns}")
-        print(f"   [!] Stock Issues: -{stock_issues}")
-        print(f"   [=] Final Stock: {current_stock} (Available: {current_stock > 0})")
+        logger.debug(
+            'Stock calculation for product %s batch %s: purchased %s (invoice %s + challan %s), '
+            'sold %s (invoice %s + challan %s), purchase returns %s, sales returns %s, '
+            'stock issues %s, final stock %s',
+            product_id, batch_no, moved['purchased'] + moved['supplier_challan'], moved['purchased'],
+            moved['supplier_challan'], moved['sold'] + moved['customer_challan'], moved['sold'],
+            moved['customer_challan'], moved['purchase_returns'], moved['sales_returns'],
+            moved['stock_issued'], current_stock,
+        )
         
         return current_stock, float(current_stock) > 0
-    except Exception as e:
-        print(f"[ERROR] Error processing inventory for Product {product_id}, Batch {batch_no}: {e}")
+    except Exception:
+        logger.exception('Error processing inventory for product %s batch %s', product_id, batch_no)
         return 0, False
 
 
 def get_stock_status(product_id):
     """
-    Calculate current stock for a product using StockManager
-    Includes sales from both SalesMaster and CustomerChallanMaster
-    Now includes stock issues in calculation
+    Calculate current stock for a product (core/stock_service.py)
+    Includes sales from both SalesMaster and CustomerChallanMaster, and stock issues
     """
     try:
         from .stock_manager import StockManager
-        from .models import CustomerChallanMaster, StockIssueDetail
-        from django.db.models import Sum
-        
-        stock_summary = StockManager.get_stock_summary(product_id)
+        from .stock_service import movements, stock_of
         
-        # Get total sold from sales invoices
-        total_sold_invoices = SalesMaster.objects.filter(
-            productid=product_id
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
+        moved = movements(product_id)
         
-        # Get total sold from customer challans
-        total_sold_challans = CustomerChallanMaster.objects.filter(
-            product_id=product_id
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        total_sold_combined = total_sold_invoices + total_sold_challans
-        
-        # Get total stock issues (reduces stock)
-        total_stock_issues = StockIssueDetail.objects.filter(
-            product=product_id
-        ).aggregate(total=Sum('quantity_issued'))['total'] or 0
-        
-        # Recalculate current stock including stock issues
-        current_stock_with_issues = stock_summary['total_stock'] - total_stock_issues
+        # Rate and MRP of the first purchase of each batch
+        first_purchases = {}
+        for batch_no, rate, mrp in PurchaseMaster.objects.filter(productid=product_id).order_by(
+            'purchaseid'
+        ).values_list('product_batch_no', 'product_purchase_rate', 'product_MRP'):
+            first_purchases.setdefault(batch_no, (rate, mrp))
         
         # Convert to legacy format for backward compatibility
         expiry_stock = []
-        for batch in stock_summary['batches']:
-            # Get additional batch details
-            purchase = PurchaseMaster.objects.filter(
-                productid=product_id,
-                product_batch_no=batch['batch_no']
-            ).first()
-            
-            if purchase:
-                # Get stock issues for this batch
-                batch_stock_issues = StockIssueDetail.objects.filter(
-                    product=product_id,
-                    batch_no=batch['batch_no']
-                ).aggregate(total=Sum('quantity_issued'))['total'] or 0
-                
-                # Calculate batch stock including issues
-                batch_stock_with_issues = batch['stock'] - batch_stock_issues
-                
+        for batch in StockManager._get_batch_breakdown(product_id):
+            if batch['batch_no'] in first_purchases:
+                rate, mrp = first_purchases[batch['batch_no']]
                 expiry_stock.append({
                     'batch_no': batch['batch_no'],
                     'expiry': batch['expiry'],
-                    'quantity': batch_stock_with_issues,
-                    'purchase_rate': purchase.product_purchase_rate,
-                    'mrp': purchase.product_MRP
+                    'quantity': batch['stock'],
+                    'purchase_rate': rate,
+                    'mrp': mrp
                 })
         
         return {
-            'purchased': stock_summary['total_purchased'],
-            'sold': total_sold_combined,  # Now includes both invoices and challans
-            'purchase_returns': stock_summary['total_purchase_returns'],
-            'sales_returns': stock_summary['total_sales_returns'],
-            'stock_issues': total_stock_issues,  # Add stock issues to response
-            'current_stock': current_stock_with_issues,  # Updated stock including issues
+            'purchased': moved['purchased'] + moved['supplier_challan'],
+            'sold': moved['sold'] + moved['customer_challan'],
+            'purchase_returns': moved['purchase_returns'],
+            'sales_returns': moved['sales_returns'],
+            'stock_issues': moved['stock_issued'],
+            'current_stock': stock_of(moved),
             'expiry_stock': expiry_stock
         }
-    except Exception as e:
-        print(f"Error in get_stock_status: {e}")
+    except Exception:
+        logger.exception('Error in get_stock_status for product %s', product_id)
         return {
             'purchased': 0,
             'sold': 0,
@@ -363,77 +294,17 @@ def get_avg_mrp(product_id):
 def get_product_batches_info(product_id):
     """
     Get all batch information for a product with stock details including returns
-    Fixed to track stock separately by batch + expiry date combination
+    Stock is tracked separately by batch + expiry date combination (core/stock_service.py)
     """
-    from django.db.models import Sum
+    from .stock_service import movements_for, stock_of
     
     batches = []
     
-    # Get all unique batch + expiry combinations from purchases
-    purchase_combinations = PurchaseMaster.objects.filter(
-        productid=product_id
-    ).values('product_batch_no', 'product_expiry').distinct()
-    
-    # Also get combinations from sales, returns to ensure completeness
-    sales_combinations = SalesMaster.objects.filter(
-        productid=product_id
-    ).values('product_batch_no', 'product_expiry').distinct()
-    
-    pr_combinations = ReturnPurchaseMaster.objects.filter(
-        returnproductid=product_id
-    ).values('returnproduct_batch_no', 'returnproduct_expiry').distinct()
-    
-    sr_combinations = ReturnSalesMaster.objects.filter(
-        return_productid=product_id
-    ).values('return_product_batch_no', 'return_product_expiry').distinct()
-    
-    # Combine all unique batch + expiry combinations
-    all_combinations = set()
-    
-    for combo in purchase_combinations:
-        all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-    
-    for combo in sales_combinations:
-        all_combinations.add((combo['product_batch_no'], combo['product_expiry']))
-    
-    for combo in pr_combinations:
-        all_combinations.add((combo['returnproduct_batch_no'], combo['returnproduct_expiry']))
-    
-    for combo in sr_combinations:
-        all_combinations.add((combo['return_product_batch_no'], combo['return_product_expiry']))
-    
-    for batch_no, expiry_date in all_combinations:
-        # Calculate stock for this specific batch + expiry combination
-        batch_purchased = PurchaseMaster.objects.filter(
-            productid=product_id, 
-            product_batch_no=batch_no,
-            product_expiry=expiry_date
-        ).aggregate(total=Sum('product_quantity'))['total'] or 0
-        
-        batch_sold = SalesMaster.objects.filter(
-            productid=product_id, 
-            product_batch_no=batch_no,
-            product_expiry=expiry_date
-        ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-        
-        # Include returns in calculation for this specific batch + expiry
-        purchase_returns = ReturnPurchaseMaster.objects.filter(
-            returnproductid=product_id,
-            returnproduct_batch_no=batch_no,
-            returnproduct_expiry=expiry_date
-        ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-        
-        sales_returns = ReturnSalesMaster.objects.filter(
-            return_productid=product_id,
-            return_product_batch_no=batch_no,
-            return_product_expiry=expiry_date
-        ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-        
-        # Correct stock calculation: Purchased - Sold - Purchase Returns + Sales Returns
-        batch_stock = batch_purchased - batch_sold - purchase_returns + sales_returns
+    for (_, batch_no, expiry_date), moved in movements_for([product_id], level='expiry').items():
+        batch_stock = stock_of(moved)
         
         # Include all batches with any activity (for complete inventory tracking)
-        if batch_stock != 0 or batch_purchased > 0:
+        if batch_stock != 0 or moved['purchased'] > 0:
             # Normalize expiry date format
             normalized_expiry = normalize_expiry_date(expiry_date)
             batches.append({
@@ -450,12 +321,12 @@ def get_product_batches_info(product_id):
 def get_bulk_inventory_data(product_ids=None, search_query=None, limit=None):
     """
     Optimized function to get inventory data for multiple products at once
-    Reduces database queries significantly
+    Returns the products with current_stock, avg_mrp and stock_value set,
+    from one grouped query per stock source (core/stock_service.py)
     """
-    from django.db.models import Subquery, OuterRef, Value, Q, Avg
-    from django.db.models.functions import Coalesce
+    from django.db.models import Q, Avg
+    from .stock_service import balances_for
     
-    # Base queryset with select_related for better performance
     products_query = ProductMaster.objects.all().order_by('product_name')
     
     # Apply filters
@@ -472,51 +343,19 @@ def get_bulk_inventory_data(product_ids=None, search_query=None, limit=None):
     if limit:
         products_query = products_query[:limit]
     
-    # Annotate with stock calculations using optimized subqueries including returns
-    products_with_stock = products_query.annotate(
-        total_purchased=Coalesce(
-            Subquery(
-                PurchaseMaster.objects.filter(
-                    productid=OuterRef('productid')
-                ).aggregate(total=Sum('product_quantity'))['total']
-            ), Value(0)
-        ),
-        total_sold=Coalesce(
-            Subquery(
-                SalesMaster.objects.filter(
-                    productid=OuterRef('productid')
-                ).aggregate(total=Sum('sale_quantity'))['total']
-            ), Value(0)
-        ),
-        total_purchase_returns=Coalesce(
-            Subquery(
-                ReturnPurchaseMaster.objects.filter(
-                    returnproductid=OuterRef('productid')
-                ).aggregate(total=Sum('returnproduct_quantity'))['total']
-            ), Value(0)
-        ),
-        total_sales_returns=Coalesce(
-            Subquery(
-                ReturnSalesMaster.objects.filter(
-                    return_productid=OuterRef('productid')
-                ).aggregate(total=Sum('return_sale_quantity'))['total']
-            ), Value(0)
-        ),
-        avg_mrp=Coalesce(
-            Subquery(
-                PurchaseMaster.objects.filter(
-                    productid=OuterRef('productid')
-                ).aggregate(avg_mrp=Avg('product_MRP'))['avg_mrp']
-            ), Value(0.0)
-        )
-    ).annotate(
-        # Correct stock calculation: Purchased - Sold - Purchase Returns + Sales Returns
-        current_stock=F('total_purchased') - F('total_sold') - F('total_purchase_returns') + F('total_sales_returns')
-    ).annotate(
-        stock_value=F('current_stock') * F('avg_mrp')
-    )
+    products = list(products_query)
+    ids = [product.productid for product in products]
+    balances = balances_for(ids, level='product')
+    avg_mrps = dict(PurchaseMaster.objects.filter(productid__in=ids).order_by().values_list('productid').annotate(
+        avg_mrp=Avg('product_MRP')
+    ))
+    
+    for product in products:
+        product.current_stock = balances.get(product.productid, 0)
+        product.avg_mrp = avg_mrps.get(product.productid) or 0.0
+        product.stock_value = product.current_stock * product.avg_mrp
     
-    return products_with_stock
+    return products
 
 def normalize_expiry_date(expiry_input):
     """
@@ -561,7 +400,7 @@ def normalize_expiry_date(expiry_input):
             pass
         
     except Exception as e:
-        print(f"Error normalizing expiry date '{expiry_input}': {e}")
+        logger.warning('Error normalizing expiry date %r: %s', expiry_input, e)
     
     # Return as-is if format is not recognized
     return str(expiry_input).strip()
@@ -571,10 +410,10 @@ def get_inventory_batches_info(product_id):
     """
     Get all batch information for inventory display with stock details
     Simplified to avoid MM-YYYY date format issues
-    FIXED: Now properly includes stock issues in calculation for UI updates
+    Stock per batch comes from core/stock_service.py
     """
-    from django.db.models import Sum
-    from .models import SaleRateMaster, StockIssueDetail
+    from .models import SaleRateMaster
+    from .stock_service import balances_for
     
     batches = []
     
@@ -592,61 +431,11 @@ def get_inventory_batches_info(product_id):
         for b in challan_batches:
             all_batch_nos.add(b['product_batch_no'])
         
-        print(f"[INFO] Processing inventory for Product {product_id} - Found {len(all_batch_nos)} unique batches")
+        logger.debug('Processing inventory for product %s: %s unique batches', product_id, len(all_batch_nos))
+        balances = balances_for([product_id], level='batch')
         
         for batch_no in all_batch_nos:
-            # Calculate stock from invoices
-            batch_purchased_invoice = PurchaseMaster.objects.filter(
-                productid=product_id, 
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            # Calculate stock from challans
-            batch_purchased_challan = SupplierChallanMaster.objects.filter(
-                product_id=product_id, 
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('product_quantity'))['total'] or 0
-            
-            batch_purchased = batch_purchased_invoice + batch_purchased_challan
-            
-            # Calculate sold from sales invoices
-            batch_sold_invoices = SalesMaster.objects.filter(
-                productid=product_id, 
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            # Calculate sold from customer challans
-            from .models import CustomerChallanMaster
-            batch_sold_challans = CustomerChallanMaster.objects.filter(
-                product_id=product_id, 
-                product_batch_no=batch_no
-            ).aggregate(total=Sum('sale_quantity'))['total'] or 0
-            
-            batch_sold = batch_sold_invoices + batch_sold_challans
-            
-            # Include returns in calculation
-            purchase_returns = ReturnPurchaseMaster.objects.filter(
-                returnproductid=product_id,
-                returnproduct_batch_no=batch_no
-            ).aggregate(total=Sum('returnproduct_quantity'))['total'] or 0
-            
-            sales_returns = ReturnSalesMaster.objects.filter(
-                return_productid=product_id,
-                return_product_batch_no=batch_no
-            ).aggregate(total=Sum('return_sale_quantity'))['total'] or 0
-            
-            # CRITICAL FIX: Include stock issues in calculation (reduces stock)
-            batch_stock_issues = StockIssueDetail.objects.filter(
-                product=product_id,
-                batch_no=batch_no
-            ).aggregate(total=Sum('quantity_issued'))['total'] or 0
-            
-            # Calculate stock (includes customer challan sales and stock issues) - FIXED CALCULATION
-            batch_stock = batch_purchased - batch_sold - purchase_returns + sales_returns - batch_stock_issues
-            
-            # Enhanced logging for UI debugging
-            if batch_stock_issues > 0:
-                print(f"   [!] Batch {batch_no}: Stock Issues = {batch_stock_issues}, Final Stock = {batch_stock}")
+            batch_stock = balances.get((product_id, batch_no), 0)
             
             # Get MRP from first purchase or challan record
             first_purchase = PurchaseMaster.objects.filter(
@@ -681,17 +470,17 @@ def get_inventory_batches_info(product_id):
             except SaleRateMaster.DoesNotExist:
                 pass
             
-            # Include all batches - FIXED: Now shows correct stock after issues
+            # Include all batches
             batches.append({
                 'batch_no': batch_no,
                 'expiry': first_purchase.product_expiry if first_purchase else '',
-                'stock': batch_stock,  # This now includes stock issues deduction
+                'stock': batch_stock,
                 'mrp': first_purchase.product_MRP if first_purchase else 0,
                 'rates': batch_rates
             })
     
-    except Exception as e:
-        print(f"[ERROR] Error processing inventory for Product {product_id}: {str(e)}")
+    except Exception:
+        logger.exception('Error processing inventory for product %s', product_id)
     
     return batches
 
@@ -2,7 +2,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Count, F, Q, Func, Value, Avg, Case, When, FloatField, DecimalField
+from django.db.models import Sum, Count, F, Q, Func, Avg, Case, When, FloatField, DecimalField
 from core.year_filter_utils import apply_year_filter
 
 # Landing page view
@@ -17,7 +17,7 @@ def landing2_page(request):
 def landing3_page(request):
     """Display landing3 page"""
     return render(request, 'landing3.html', {'title': 'MedicVista - Future of Wellness'})
-from django.db.models.functions import TruncMonth, TruncYear, Coalesce
+from django.db.models.functions import TruncMonth, TruncYear
 from django.http import JsonResponse, HttpResponse
 from django.utils import timezone
 from django.core.paginator import Paginator
@@ -25,6 +25,7 @@ from django.urls import reverse
 from datetime import datetime, timedelta
 import json
 import csv
+import logging
 from django.db import transaction
 
 from .models import (
@@ -47,6 +48,12 @@ from .unified_payment_view import add_unified_payment, search_supplier_invoices,
 from .utils import get_stock_status, get_batch_stock_status, generate_invoice_pdf, generate_sales_invoice_pdf, get_avg_mrp, parse_expiry_date, generate_sales_invoice_number
 from .date_utils import parse_ddmmyyyy_date, format_date_for_display, format_date_for_backend, convert_legacy_dates
 from .low_stock_views import low_stock_update, update_low_stock_item, bulk_update_low_stock
+from .change_log import record_changes
+from .year_close import block_closed_years_bulk
+from .opening_balances import opening_batches
+from .return_posting import ReturnStockError, post_purchase_return, post_sales_return
+
+logger = logging.getLogger(__name__)
 
 # Authentication views
 def login_view(request):
@@ -88,13 +95,9 @@ def logout_view(request):
     return render(request, 'logout_confirm.html')
 
 def download_backup_and_logout(request, filename):
-    from django.http import FileResponse
-    import os
-    filepath = os.path.join('backups', filename)
-    if os.path.exists(filepath):
-        response = FileResponse(open(filepath, 'rb'), as_attachment=True)
-        response['Content-Type'] = 'application/x-sqlite3'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    from .backup_service import backup_response
+    response = backup_response(filename) if request.user.is_authenticated else None
+    if response is not None:
         logout(request)
         return response
     logout(request)
@@ -1600,30 +1603,15 @@ def add_invoice_payment(request, invoice_id):
                         'error': 'Invalid date format'
                     })
                 
-                # Create payment record
-                from .models import InvoicePaid
-                payment = InvoicePaid.objects.create(
-                    ip_invoiceid=invoice,
+                # Create payment record - paid amount and status move in one UPDATE
+                from .payment_posting import post_purchase_payments
+                post_purchase_payments(
+                    [(invoice.invoiceid, payment_amount)],
                     payment_date=parsed_date,
-                    payment_amount=payment_amount,
                     payment_mode=payment_mode,
                     payment_ref_no=payment_ref_no
                 )
                 
-                # Update invoice paid amount and payment status
-                invoice.invoice_paid += payment_amount
-                
-                # Update payment status based on balance
-                balance = invoice.invoice_total - invoice.invoice_paid
-                if balance <= 0.01:
-                    invoice.payment_status = 'paid'
-                elif invoice.invoice_paid > 0:
-                    invoice.payment_status = 'partial'
-                else:
-                    invoice.payment_status = 'pending'
-                
-                invoice.save()
-                
                 # Force refresh of invoice data to ensure all views show updated status
                 invoice.refresh_from_db()
                 
@@ -1637,9 +1625,7 @@ def add_invoice_payment(request, invoice_id):
                 })
                 
             except Exception as e:
-                import traceback
-                print(f"Payment error: {str(e)}")
-                print(traceback.format_exc())
+                logger.exception('Payment error')
                 return JsonResponse({
                     'success': False,
                     'error': f'Server error: {str(e)}'
@@ -1656,11 +1642,13 @@ def add_invoice_payment(request, invoice_id):
                 messages.error(request, "Payment amount cannot exceed the remaining balance.")
                 return redirect('add_invoice_payment', invoice_id=invoice_id)
             
-            payment.save()
-            
-            # Update invoice paid amount
-            invoice.invoice_paid += payment.payment_amount
-            invoice.save()
+            from .payment_posting import post_purchase_payments
+            post_purchase_payments(
+                [(invoice.invoiceid, payment.payment_amount)],
+                payment_date=payment.payment_date,
+                payment_mode=payment.payment_mode,
+                payment_ref_no=payment.payment_ref_no
+            )
             
             messages.success(request, f"Payment of {payment.payment_amount} added successfully!")
             return redirect('invoice_detail', pk=invoice_id)
@@ -1738,25 +1726,9 @@ def delete_invoice_payment(request, invoice_id, payment_id):
     payment = get_object_or_404(InvoicePaid, payment_id=payment_id, ip_invoiceid=invoice_id)
     
     if request.method == 'POST':
-        # Delete payment first
-        payment.delete()
-        
-        # Recalculate invoice_paid from remaining payments
-        from django.db.models import Sum
-        remaining_payments = InvoicePaid.objects.filter(ip_invoiceid=invoice)
-        total_paid = remaining_payments.aggregate(Sum('payment_amount'))['payment_amount__sum'] or 0
-        invoice.invoice_paid = total_paid
-        
-        # Update payment status based on balance
-        balance = invoice.invoice_total - invoice.invoice_paid
-        if balance <= 0.01:
-            invoice.payment_status = 'paid'
-        elif invoice.invoice_paid > 0:
-            invoice.payment_status = 'partial'
-        else:
-            invoice.payment_status = 'pending'
-        
-        invoice.save()
+        # Delete the payment and take it off the invoice in one transaction
+        from .payment_posting import reverse_purchase_payment
+        reverse_purchase_payment(payment)
         
         messages.success(request, "Payment deleted successfully!")
         return redirect('invoice_detail', pk=invoice_id)
@@ -2355,10 +2327,7 @@ def delete_sales_invoice(request, pk):
         # Store invoice number before deletion with proper handling
         invoice_no = str(invoice.sales_invoice_no) if invoice.sales_invoice_no else str(pk)
         
-        # Debug logging
-        print(f"Deleting invoice: {invoice_no}")
-        print(f"Invoice object: {invoice}")
-        print(f"Invoice PK: {pk}")
+        logger.debug('Deleting sales invoice %s', invoice_no)
         
         try:
             from .models import CustomerChallanMaster, CustomerChallanMaster2
@@ -2487,15 +2456,10 @@ def add_sales_invoice_with_products(request):
     
     if request.method == 'POST':
         try:
-            # Debug: Print POST data
-            print("POST Data:", request.POST)
-            
             invoice_form = SalesInvoiceForm(request.POST)
             
-            # Debug: Check form validity
-            print("Form is valid:", invoice_form.is_valid())
             if not invoice_form.is_valid():
-                print("Form errors:", invoice_form.errors)
+                logger.info('Sales invoice form errors: %s', invoice_form.errors.as_json())
                 messages.error(request, f"Form validation failed: {invoice_form.errors}")
                 
             if invoice_form.is_valid():
@@ -2518,44 +2482,38 @@ def add_sales_invoice_with_products(request):
                     if isinstance(invoice.sales_invoice_date, str):
                         invoice.sales_invoice_date = convert_date_format(invoice.sales_invoice_date)
                 
-                # Debug: Print invoice data before save
-                print(f"Saving invoice: {invoice.sales_invoice_no}, Date: {invoice.sales_invoice_date}, Customer: {invoice.customerid}")
-                
                 invoice.save()
-                print("Invoice saved successfully!")
+                logger.debug('Saved sales invoice %s, date %s, customer %s',
+                             invoice.sales_invoice_no, invoice.sales_invoice_date, invoice.customerid_id)
                 
                 # Extract customer rate type for rate_applied
                 customer_rate_type = invoice.customerid.customer_type  # 'TYPE-A', 'TYPE-B', or 'TYPE-C'
                 rate_letter = customer_rate_type.split('-')[1] if '-' in customer_rate_type else 'A'
-                print(f"Customer rate type: {customer_rate_type}, Rate letter: {rate_letter}")
                 
                 # Process products data
                 products_data = request.POST.get('products_data')
-                print(f"Products data received: {products_data}")
                 
                 sales_created_count = 0
                 
                 if products_data:
                     try:
                         products = json.loads(products_data)
-                        print(f"Parsed {len(products)} products")
+                        logger.debug('Sales invoice %s: %s product lines, customer rate %s',
+                                     invoice.sales_invoice_no, len(products), rate_letter)
                         
                         sales_to_create = []
                         
                         # Validate all products first
                         for i, product_data in enumerate(products):
-                            print(f"Processing product {i+1}: {product_data}")
-                            
                             if not product_data.get('productid'):
-                                print(f"Skipping product {i+1}: No product ID")
+                                logger.debug('Skipping product line %s: no product ID', i + 1)
                                 continue
                                 
                             try:
                                 product = ProductMaster.objects.get(productid=product_data['productid'])
-                                print(f"Found product: {product.product_name}")
                             except ProductMaster.DoesNotExist:
                                 error_msg = f"Product with ID {product_data['productid']} not found."
-                                print(error_msg)
+                                logger.info(error_msg)
                                 messages.error(request, error_msg)
                                 continue
                             
@@ -2569,21 +2527,20 @@ def add_sales_invoice_with_products(request):
                                 )
                                 
                                 sale_quantity = float(product_data['quantity'])
-                                print(f"Stock check - Available: {batch_quantity}, Required: {sale_quantity}")
                                 
                                 if not is_available:
                                     error_msg = f"Product {product.product_name} batch {product_data['batch_no']} is out of stock."
-                                    print(error_msg)
+                                    logger.info(error_msg)
                                     messages.error(request, error_msg)
                                     continue
                                 
                                 if batch_quantity < sale_quantity:
                                     error_msg = f"Insufficient stock for {product.product_name} batch {product_data['batch_no']}. Available: {batch_quantity}, Required: {sale_quantity}"
-                                    print(error_msg)
+                                    logger.info(error_msg)
                                     messages.error(request, error_msg)
                                     continue
                             else:
-                                print(f"✅ Skipping stock validation for challan product: {product.product_name}")
+                                # Stock was taken out by the challan
                                 sale_quantity = float(product_data['quantity'])
                             
                             # Calculate total amount
@@ -2601,8 +2558,6 @@ def add_sales_invoice_with_products(request):
                             
                             total_amount = discounted_amount * (1 + (igst / 100))
                             
-                            print(f"Calculated total: {total_amount}")
-                            
                             # Convert expiry date to MM-YYYY format for SalesMaster
                             expiry_date = product_data.get('expiry', '')
                             if expiry_date:
@@ -2649,17 +2604,16 @@ def add_sales_invoice_with_products(request):
                             )
                             
                             sales_to_create.append(sale_obj)
-                            print(f"Added sale object for {product.product_name}")
                         
                         # Bulk create all sales
                         if sales_to_create:
+                            block_closed_years_bulk(SalesMaster, sales_to_create)
                             SalesMaster.objects.bulk_create(sales_to_create)
+                            record_changes(SalesMaster, [sale.pk for sale in sales_to_create])
                             sales_created_count = len(sales_to_create)
-                            print(f"Successfully created {sales_created_count} sales records")
                             
                             # ✅ UPDATE INVENTORY CACHE AFTER SALES
                             from .inventory_cache import update_batch_cache, update_product_cache
-                            print("🔄 Updating inventory cache after sales...")
                             
                             # Track unique products for cache update
                             products_to_update = set()
@@ -2673,34 +2627,33 @@ def add_sales_invoice_with_products(request):
                                         sale_obj.product_expiry
                                     )
                                     products_to_update.add(sale_obj.productid.productid)
-                                    print(f"✅ Updated batch cache: {sale_obj.product_name} - Batch: {sale_obj.product_batch_no}")
-                                except Exception as cache_error:
-                                    print(f"⚠️ Cache update warning for {sale_obj.product_name}: {cache_error}")
+                                except Exception:
+                                    logger.exception('Batch cache update failed for %s batch %s',
+                                                     sale_obj.product_name, sale_obj.product_batch_no)
                             
                             # Update product-level cache for all affected products
                             for product_id in products_to_update:
                                 try:
                                     update_product_cache(product_id)
-                                    print(f"✅ Updated product cache: Product ID {product_id}")
-                                except Exception as cache_error:
-                                    print(f"⚠️ Product cache update warning for Product ID {product_id}: {cache_error}")
+                                except Exception:
+                                    logger.exception('Product cache update failed for product %s', product_id)
                             
-                            print(f"✅ Inventory cache updated for {len(products_to_update)} products")
+                            logger.debug('Sales invoice %s: %s lines, cache updated for %s products',
+                                         invoice.sales_invoice_no, sales_created_count, len(products_to_update))
                         else:
-                            print("No valid products to create sales records")
+                            logger.debug('Sales invoice %s: no valid product lines', invoice.sales_invoice_no)
                             
                     except json.JSONDecodeError as e:
                         error_msg = f"Invalid products data format: {str(e)}"
-                        print(error_msg)
+                        logger.warning(error_msg)
                         messages.error(request, error_msg)
                         return redirect('add_sales_invoice_with_products')
                     except Exception as e:
                         error_msg = f"Error processing products: {str(e)}"
-                        print(error_msg)
+                        logger.exception(error_msg)
                         messages.error(request, error_msg)
                         return redirect('add_sales_invoice_with_products')
                 else:
-                    print("No products data received - creating header-only invoice")
                     messages.info(request, "📄 Sales Invoice created without products. You can add products later by editing the invoice.")
                 
                 # Success message based on whether products were added
@@ -2709,8 +2662,6 @@ def add_sales_invoice_with_products(request):
                 else:
                     success_msg = f"Sales Invoice #{invoice.sales_invoice_no} created successfully (header only)!"
                 
-                print(success_msg)
-                
                 # Move challan entries to CustomerChallanMaster2 if pulled from challan
                 from .models import CustomerChallanMaster, CustomerChallanMaster2
                 moved_count = 0
@@ -2747,25 +2698,25 @@ def add_sales_invoice_with_products(request):
                                     )
                                     entry.delete()
                                     moved_count += 1
-                    except Exception as e:
-                        print(f"Error moving customer challan entry: {e}")
+                    except Exception:
+                        logger.exception('Error moving customer challan entries of sales invoice %s',
+                                         invoice.sales_invoice_no)
                 
                 if moved_count > 0:
-                    print(f"Moved {moved_count} customer challan entries to CustomerChallanMaster2")
+                    logger.debug('Moved %s customer challan entries to CustomerChallanMaster2', moved_count)
                 
                 messages.success(request, success_msg)
                 # Redirect to invoice detail page after creating invoice
                 return redirect('sales_invoice_detail', pk=invoice.sales_invoice_no)
             else:
                 # Form validation failed
-                print("Form validation failed")
                 for field, errors in invoice_form.errors.items():
                     for error in errors:
                         messages.error(request, f"{field}: {error}")
                         
         except Exception as e:
             error_msg = f"Unexpected error: {str(e)}"
-            print(error_msg)
+            logger.exception(error_msg)
             messages.error(request, error_msg)
             return redirect('add_sales_invoice_with_products')
     else:
@@ -2849,29 +2800,22 @@ def add_sales_payment(request, invoice_id):
                         'error': 'Invalid date format'
                     })
                 
-                # Create payment record
-                from .models import SalesInvoicePaid
-                payment = SalesInvoicePaid.objects.create(
-                    sales_ip_invoice_no=invoice,
-                    sales_payment_date=parsed_date,
-                    sales_payment_amount=payment_amount,
-                    sales_payment_mode=payment_mode,
-                    sales_payment_ref_no=payment_ref_no
+                # Create payment record and apply it to the invoice in one transaction
+                from .payment_posting import post_sales_receipts
+                post_sales_receipts(
+                    [(invoice.sales_invoice_no, payment_amount)],
+                    payment_date=parsed_date,
+                    payment_mode=payment_mode,
+                    payment_ref_no=payment_ref_no
                 )
                 
-                # Update invoice paid amount
-                invoice.sales_invoice_paid += payment_amount
-                invoice.save()
-                
                 return JsonResponse({
                     'success': True,
                     'message': f'Payment of ₹{payment_amount:.2f} added successfully!'
                 })
                 
             except Exception as e:
-                import traceback
-                print(f"Sales payment error: {str(e)}")
-                print(traceback.format_exc())
+                logger.exception('Sales payment error')
                 return JsonResponse({
                     'success': False,
                     'error': f'Server error: {str(e)}'
@@ -2887,9 +2831,13 @@ def add_sales_payment(request, invoice_id):
                 messages.error(request, "Payment amount cannot exceed the remaining balance.")
                 return redirect('add_sales_payment', invoice_id=invoice_id)
             
-            payment.save()
-            invoice.sales_invoice_paid += payment.sales_payment_amount
-            invoice.save()
+            from .payment_posting import post_sales_receipts
+            post_sales_receipts(
+                [(invoice.sales_invoice_no, payment.sales_payment_amount)],
+                payment_date=payment.sales_payment_date,
+                payment_mode=payment.sales_payment_mode,
+                payment_ref_no=payment.sales_payment_ref_no
+            )
             
             messages.success(request, f"Payment of {payment.sales_payment_amount} added successfully!")
             return redirect('sales_invoice_detail', pk=invoice_id)
@@ -2951,10 +2899,9 @@ def delete_sales_payment(request, invoice_id, payment_id):
     payment = get_object_or_404(SalesInvoicePaid, sales_payment_id=payment_id, sales_ip_invoice_no=invoice_id)
     
     if request.method == 'POST':
-        invoice.sales_invoice_paid -= payment.sales_payment_amount
-        invoice.save()
-        
-        payment.delete()
+        # Delete the payment and take it off the invoice in one transaction
+        from .payment_posting import reverse_sales_receipt
+        reverse_sales_receipt(payment)
         
         messages.success(request, "Payment deleted successfully!")
         return redirect('sales_invoice_detail', pk=invoice_id)
@@ -3031,6 +2978,7 @@ def add_purchase_return(request):
                     # Process products data
                     products_data = request.POST.get('products_data')
                     return_items_created = 0
+                    return_items = []
                     
                     if products_data:
                         try:
@@ -3074,9 +3022,7 @@ def add_purchase_return(request):
                                 gst_amount = subtotal * (cgst + sgst) / 100
                                 total_amount = subtotal + gst_amount
                                 
-                                # Create return item
-                                return_item = ReturnPurchaseMaster.objects.create(
-                                    returninvoiceid=return_invoice,
+                                return_items.append(ReturnPurchaseMaster(
                                     returnproduct_supplierid=return_invoice.returnsupplierid,
                                     returnproductid=product,
                                     returnproduct_batch_no=product_data.get('batch_no', ''),
@@ -3088,36 +3034,12 @@ def add_purchase_return(request):
                                     returnproduct_sgst=sgst,
                                     returntotal_amount=total_amount,
                                     return_reason=product_data.get('reason', '')
-                                )
-                                
-                                # STOCK UPDATE: Purchase return decreases stock
-                                # Enhanced stock processing with better error handling
-                                from .stock_manager import StockManager
-                                try:
-                                    stock_result = StockManager.process_purchase_return(return_item)
-                                    
-                                    if stock_result['success']:
-                                        print(f"✅ Stock updated successfully: {stock_result['message']}")
-                                        # Optional: Add success message for user feedback
-                                        # messages.success(request, f"Stock updated: {stock_result['message']}")
-                                    else:
-                                        print(f"❌ Stock processing failed: {stock_result['message']}")
-                                        
-                                        # Handle different error types with appropriate user feedback
-                                        if stock_result.get('error_type') == 'insufficient_stock':
-                                            messages.error(request, f"Stock Error: {stock_result['message']}")
-                                            # Could potentially prevent the return from being saved
-                                        elif stock_result.get('error_type') == 'invalid_quantity':
-                                            messages.error(request, f"Validation Error: {stock_result['message']}")
-                                        else:
-                                            messages.warning(request, f"Stock Warning: {stock_result['message']}")
-                                            
-                                except Exception as e:
-                                    error_msg = f"Stock processing system error: {str(e)}"
-                                    print(f"🔥 {error_msg}")
-                                    messages.error(request, error_msg)
-                                
-                                return_items_created += 1
+                                ))
+                            
+                            # STOCK UPDATE: Purchase return decreases stock - all lines are
+                            # checked against the locked batch stock and saved together
+                            created, _ = post_purchase_return(return_invoice, return_items, request.user)
+                            return_items_created = len(created)
                             
                             # Update return invoice total
                             total_items = ReturnPurchaseMaster.objects.filter(
@@ -3130,6 +3052,11 @@ def add_purchase_return(request):
                         except json.JSONDecodeError as e:
                             messages.error(request, f"Invalid products data format: {str(e)}")
                             return redirect('add_purchase_return')
+                        except ReturnStockError as e:
+                            transaction.set_rollback(True)
+                            for problem in e.problems:
+                                messages.error(request, f"Stock Error: {problem['message']}")
+                            return redirect('add_purchase_return')
                         except Exception as e:
                             messages.error(request, f"Error processing products: {str(e)}")
                             return redirect('add_purchase_return')
@@ -3290,11 +3217,9 @@ def update_purchase_return_api(request):
         return_invoice.returninvoice_date = data.get('return_date')
         return_invoice.return_charges = float(data.get('return_charges', 0))
         
-        # Clear existing return items
-        ReturnPurchaseMaster.objects.filter(returninvoiceid=return_invoice).delete()
-        
         # Add updated products
         total_items = 0
+        return_items = []
         products = data.get('products', [])
         
         for product_data in products:
@@ -3331,10 +3256,8 @@ def update_purchase_return_api(request):
             else:
                 expiry_formatted = datetime.now().date()
             
-            # Create return item
-            ReturnPurchaseMaster.objects.create(
-                returninvoiceid=return_invoice,
-                returnproduct_supplierid=return_invoice.returnsupplierid,
+            return_items.append(ReturnPurchaseMaster(
+                returnproduct_supplierid_id=return_invoice.returnsupplierid_id,
                 returnproductid=product,
                 returnproduct_batch_no=product_data.get('batch_no', ''),
                 returnproduct_expiry=expiry_formatted,
@@ -3345,19 +3268,29 @@ def update_purchase_return_api(request):
                 returnproduct_sgst=sgst,
                 returntotal_amount=item_total,
                 return_reason=product_data.get('reason', '')
-            )
+            ))
             
             total_items += item_total
         
-        # Update return invoice total
-        return_invoice.returninvoice_total = total_items + return_invoice.return_charges
-        return_invoice.save()
+        with transaction.atomic():
+            # Replace the return items; only the change in quantity per batch moves stock
+            post_purchase_return(return_invoice, return_items, request.user)
+            
+            # Update return invoice total
+            return_invoice.returninvoice_total = total_items + return_invoice.return_charges
+            return_invoice.save()
         
         return JsonResponse({
             'success': True,
             'message': f'Purchase Return #{return_invoice.returninvoiceid} updated successfully!'
         })
         
+    except ReturnStockError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'problems': e.problems
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -3607,6 +3540,7 @@ def add_sales_return(request):
                 # Process products data
                 products_data = request.POST.get('products_data')
                 return_items_created = 0
+                return_items = []
                 total_amount = 0
                 
                 if products_data:
@@ -3653,10 +3587,8 @@ def add_sales_return(request):
                             else:
                                 expiry_formatted = ''
                             
-                            # Create return item
-                            return_item = ReturnSalesMaster.objects.create(
-                                return_sales_invoice_no=return_invoice,
-                                return_customerid=return_invoice.return_sales_customerid,
+                            return_items.append(ReturnSalesMaster(
+                                return_customerid_id=return_invoice.return_sales_customerid_id,
                                 return_productid=product,
                                 return_product_name=product.product_name,
                                 return_product_company=product.product_company,
@@ -3672,36 +3604,14 @@ def add_sales_return(request):
                                 return_sale_sgst=sgst,
                                 return_sale_total_amount=item_total,
                                 return_reason=product_data.get('return_reason', '')
-                            )
-                            
-                            # STOCK UPDATE: Sales return increases stock
-                            # Enhanced stock processing with better error handling
-                            from .stock_manager import StockManager
-                            try:
-                                stock_result = StockManager.process_sales_return(return_item)
-                                
-                                if stock_result['success']:
-                                    print(f"✅ Stock updated successfully: {stock_result['message']}")
-                                    # Optional: Add success message for user feedback
-                                    # messages.success(request, f"Stock updated: {stock_result['message']}")
-                                else:
-                                    print(f"❌ Stock processing failed: {stock_result['message']}")
-                                    
-                                    # Handle different error types with appropriate user feedback
-                                    if stock_result.get('error_type') == 'batch_not_found':
-                                        messages.error(request, f"Batch Error: {stock_result['message']}")
-                                    elif stock_result.get('error_type') == 'invalid_quantity':
-                                        messages.error(request, f"Validation Error: {stock_result['message']}")
-                                    else:
-                                        messages.warning(request, f"Stock Warning: {stock_result['message']}")
-                                        
-                            except Exception as e:
-                                error_msg = f"Stock processing system error: {str(e)}"
-                                print(f"🔥 {error_msg}")
-                                messages.error(request, error_msg)
+                            ))
                             
                             total_amount += item_total
-                            return_items_created += 1
+                        
+                        # STOCK UPDATE: Sales return increases stock - all lines are
+                        # validated and saved together
+                        created, _ = post_sales_return(return_invoice, return_items, request.user)
+                        return_items_created = len(created)
                         
                         # Update return invoice total (products + additional charges + transport charges)
                         return_invoice.return_sales_invoice_total = total_amount + return_invoice.return_sales_charges + return_invoice.transport_charges
@@ -3710,6 +3620,11 @@ def add_sales_return(request):
                     except json.JSONDecodeError as e:
                         messages.error(request, f"Invalid products data format: {str(e)}")
                         return redirect('add_sales_return')
+                    except ReturnStockError as e:
+                        transaction.set_rollback(True)
+                        for problem in e.problems:
+                            messages.error(request, f"Stock Error: {problem['message']}")
+                        return redirect('add_sales_return')
                     except Exception as e:
                         messages.error(request, f"Error processing products: {str(e)}")
                         return redirect('add_sales_return')
@@ -4307,10 +4222,6 @@ def update_sales_return_api(request):
             return_invoice.return_sales_invoice_date = datetime.strptime(return_date, '%Y-%m-%d').date()
             return_invoice.return_sales_charges = return_charges
             
-            # Delete existing items in a separate step
-            existing_items = ReturnSalesMaster.objects.filter(return_sales_invoice_no=return_invoice)
-            existing_items.delete()
-            
             # Create new items
             total_amount = 0
             new_items = []
@@ -4332,7 +4243,6 @@ def update_sales_return_api(request):
                     item_total = round(after_discount + cgst_amount + sgst_amount, 2)
                     
                     new_item = ReturnSalesMaster(
-                        return_sales_invoice_no=return_invoice,
                         return_customerid_id=customer_id,
                         return_productid=product,
                         return_product_name=product.product_name,
@@ -4356,13 +4266,12 @@ def update_sales_return_api(request):
                     
                 except ProductMaster.DoesNotExist:
                     continue
-                except Exception as item_error:
-                    print(f"Error processing item: {item_error}")
+                except Exception:
+                    logger.exception('Error processing sales return item')
                     continue
             
-            # Bulk create all items at once
-            if new_items:
-                ReturnSalesMaster.objects.bulk_create(new_items)
+            # Replace the items in one go; only the change in quantity per batch moves stock
+            post_sales_return(return_invoice, new_items, request.user)
             
             # Update total and save (products + additional charges + transport charges)
             final_total = round(total_amount + return_charges + transport_charges, 2)
@@ -4375,6 +4284,12 @@ def update_sales_return_api(request):
                 'message': f'Sales return {return_id} updated successfully!'
             })
             
+    except ReturnStockError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'problems': e.problems
+        }, status=400)
     except ReturnSalesInvoiceMaster.DoesNotExist:
         return JsonResponse({
             'success': False,
@@ -4386,7 +4301,7 @@ def update_sales_return_api(request):
             'error': 'Invalid JSON data'
         }, status=400)
     except Exception as e:
-        print(f"Error in update_sales_return_api: {e}")
+        logger.exception('Error in update_sales_return_api')
         return JsonResponse({
             'success': False,
             'error': f'Database error: {str(e)}'
@@ -4555,8 +4470,8 @@ def add_payment(request):
                     # Update all related purchase invoice lists and details
                     # This ensures that wherever this invoice appears, the payment status is updated
                     
-                    # Log the payment for audit trail
-                    print(f"Payment added: Invoice #{invoice.invoice_no}, Amount: ₹{payment_amount}, New Balance: ₹{new_balance}")
+                    logger.info('Payment added: invoice %s, amount %s, new balance %s',
+                                invoice.invoice_no, payment_amount, new_balance)
                 
                 return JsonResponse({
                     'success': True,
@@ -4569,9 +4484,7 @@ def add_payment(request):
                 })
                     
             except Exception as e:
-                import traceback
-                print(f"Payment error: {str(e)}")
-                print(traceback.format_exc())
+                logger.exception('Payment error')
                 return JsonResponse({
                     'success': False,
                     'error': f'Server error: {str(e)}'
@@ -4614,31 +4527,9 @@ def search_supplier_invoices(request):
     results = []
     
     if len(query) >= 2:
-        # Search suppliers and their invoices
-        suppliers = SupplierMaster.objects.filter(
-            supplier_name__icontains=query
-        )[:10]
-        
-        for supplier in suppliers:
-            # Get unpaid or partially paid invoices for this supplier
-            invoices = InvoiceMaster.objects.filter(
-                supplierid=supplier,
-                invoice_paid__lt=F('invoice_total')
-            ).order_by('-invoice_date')[:5]
-            
-            for invoice in invoices:
-                balance = invoice.invoice_total - invoice.invoice_paid
-                if balance > 0:  # Only show invoices with outstanding balance
-                    results.append({
-                        'id': invoice.invoiceid,
-                        'text': f"{supplier.supplier_name} - Invoice #{invoice.invoice_no} (₹{balance:.2f} due)",
-                        'supplier_name': supplier.supplier_name,
-                        'invoice_no': invoice.invoice_no,
-                        'invoice_date': invoice.invoice_date.strftime('%d-%m-%Y'),
-                        'total_amount': float(invoice.invoice_total),
-                        'paid_amount': float(invoice.invoice_paid),
-                        'balance_amount': float(balance)
-                    })
+        # Open invoices only - one query on the open-items index
+        from .open_items import open_purchase_invoices, purchase_invoice_item
+        results = [purchase_invoice_item(invoice) for invoice in open_purchase_invoices(search=query)[:50]]
     
     return JsonResponse(results, safe=False)
 
@@ -4648,30 +4539,9 @@ def search_customer_invoices(request):
     results = []
     
     if len(query) >= 2:
-        # Search customers and their invoices
-        customers = CustomerMaster.objects.filter(
-            customer_name__icontains=query
-        )[:10]
-        
-        for customer in customers:
-            # Get unpaid or partially paid invoices for this customer
-            invoices = SalesInvoiceMaster.objects.filter(
-                customerid=customer,
-
-            ).order_by('-sales_invoice_date')[:5]
-            
-            for invoice in invoices:
-                balance = invoice.sales_invoice_total - invoice.sales_invoice_paid
-                if balance > 0:  # Only show invoices with outstanding balance
-                    results.append({
-                        'invoice_no': invoice.sales_invoice_no,
-                        'customer_id': customer.customerid,
-                        'customer_name': customer.customer_name,
-                        'invoice_date': invoice.sales_invoice_date.strftime('%d-%m-%Y'),
-                        'total_amount': float(invoice.sales_invoice_total),
-                        'paid_amount': float(invoice.sales_invoice_paid),
-                        'balance_amount': float(balance)
-                    })
+        # Open invoices only - one query on the open-items index
+        from .open_items import open_sales_invoices, sales_invoice_item
+        results = [sales_invoice_item(invoice) for invoice in open_sales_invoices(search=query)[:50]]
     
     return JsonResponse(results, safe=False)
 
@@ -5252,8 +5122,8 @@ def export_receipts_excel(request):
 
 @login_required
 def inventory_list(request):
-    from django.db.models import Avg, Case, When, FloatField, Sum
     from django.http import JsonResponse
+    from .stock_service import balances_for
 
     # Get search query and offset
     search_query = request.GET.get('search', '').strip()
@@ -5283,37 +5153,19 @@ def inventory_list(request):
     
     product_ids = [p.productid for p in products]
     
-    # Batch fetch all purchases with stock calculation
-    purchases = PurchaseMaster.objects.filter(
-        productid__in=product_ids
-    ).values(
-        'productid', 'product_batch_no', 'product_expiry', 'product_MRP'
-    ).annotate(
-        purchased=Sum('product_quantity', output_field=FloatField()),
-        sold=Coalesce(
-            Sum('productid__salesmaster__sale_quantity',
-                filter=Q(productid__salesmaster__product_batch_no=F('product_batch_no')),
-                output_field=FloatField()),
-            Value(0.0),
-            output_field=FloatField()
-        )
-    ).annotate(stock=F('purchased') - F('sold')).filter(stock__gt=0)
+    # Stock of every batch in one grouped query per source (core/stock_service.py)
+    balances = balances_for(product_ids, level='batch')
     
-    # Batch fetch all challans with stock calculation
-    challans = SupplierChallanMaster.objects.filter(
-        product_id__in=product_ids
-    ).values(
+    # Expiry and MRP of each batch from its first purchase, else its first challan
+    batch_details = {}
+    for row in SupplierChallanMaster.objects.filter(product_id__in=product_ids).order_by('-challan_id').values_list(
         'product_id', 'product_batch_no', 'product_expiry', 'product_mrp'
-    ).annotate(
-        purchased=Sum('product_quantity', output_field=FloatField()),
-        sold=Coalesce(
-            Sum('product_id__salesmaster__sale_quantity',
-                filter=Q(product_id__salesmaster__product_batch_no=F('product_batch_no')),
-                output_field=FloatField()),
-            Value(0.0),
-            output_field=FloatField()
-        )
-    ).annotate(stock=F('purchased') - F('sold')).filter(stock__gt=0)
+    ):
+        batch_details[row[:2]] = row[2:]
+    for row in PurchaseMaster.objects.filter(productid__in=product_ids).order_by('-purchaseid').values_list(
+        'productid', 'product_batch_no', 'product_expiry', 'product_MRP'
+    ):
+        batch_details[row[:2]] = row[2:]
     
     # Batch fetch all rates in one query
     all_rates = {}
@@ -5329,50 +5181,21 @@ def inventory_list(request):
     
     # Build product inventory map
     product_inventory = {}
-    
-    # Process purchases
-    for p in purchases:
-        pid = p['productid']
+    for (pid, batch_no), stock in sorted(balances.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        if stock <= 0:
+            continue
         if pid not in product_inventory:
             product_inventory[pid] = {'batches': [], 'total_stock': 0}
         
-        batch_key = (pid, p['product_batch_no'])
-        rates = all_rates.get(batch_key, {'rate_A': 0, 'rate_B': 0, 'rate_C': 0})
-        
+        expiry, mrp = batch_details.get((pid, batch_no), ('', 0))
         product_inventory[pid]['batches'].append({
-            'batch_no': p['product_batch_no'],
-            'expiry': p['product_expiry'] or '',
-            'mrp': float(p['product_MRP'] or 0),
-            'stock': float(p['stock']),
-            'rates': rates
+            'batch_no': batch_no,
+            'expiry': expiry or '',
+            'mrp': float(mrp or 0),
+            'stock': float(stock),
+            'rates': all_rates.get((pid, batch_no), {'rate_A': 0, 'rate_B': 0, 'rate_C': 0})
         })
-        product_inventory[pid]['total_stock'] += float(p['stock'])
-    
-    # Process challans
-    for c in challans:
-        pid = c['product_id']
-        if pid not in product_inventory:
-            product_inventory[pid] = {'batches': [], 'total_stock': 0}
-        
-        batch_key = (pid, c['product_batch_no'])
-        rates = all_rates.get(batch_key, {'rate_A': 0, 'rate_B': 0, 'rate_C': 0})
-        
-        # Check if batch exists
-        existing = next((b for b in product_inventory[pid]['batches'] 
-                        if b['batch_no'] == c['product_batch_no']), None)
-        
-        if existing:
-            existing['stock'] += float(c['stock'])
-            product_inventory[pid]['total_stock'] += float(c['stock'])
-        else:
-            product_inventory[pid]['batches'].append({
-                'batch_no': c['product_batch_no'],
-                'expiry': c['product_expiry'] or '',
-                'mrp': float(c['product_mrp'] or 0),
-                'stock': float(c['stock']),
-                'rates': rates
-            })
-            product_inventory[pid]['total_stock'] += float(c['stock'])
+        product_inventory[pid]['total_stock'] += float(stock)
     
     # Build final inventory data
     inventory_data = []
@@ -5493,12 +5316,18 @@ def batch_inventory_report(request):
 @login_required
 def dateexpiry_inventory_report(request):
     from .fast_inventory import FastInventory
+    from .expiry_report import get_bucket_summary, BUCKET_LABELS
     
     search_query = request.GET.get('search', '')
     expiry_from = request.GET.get('expiry_from', '')
     expiry_to = request.GET.get('expiry_to', '')
     
-    expiry_data, total_value = FastInventory.get_dateexpiry_inventory_data(search_query)
+    bucket = request.GET.get('bucket', '')
+    if bucket not in BUCKET_LABELS:
+        bucket = ''
+    
+    expiry_data, total_value = FastInventory.get_dateexpiry_inventory_data(search_query, bucket=bucket or None)
+    bucket_summary = get_bucket_summary(search=search_query)
     
     # Pagination - 50 entries per page
     paginator = Paginator(expiry_data, 50)
@@ -5517,6 +5346,8 @@ def dateexpiry_inventory_report(request):
         'search_query': search_query,
         'expiry_from': expiry_from,
         'expiry_to': expiry_to,
+        'bucket': bucket,
+        'bucket_summary': bucket_summary,
         'pharmacy': pharmacy,
         'title': 'Date-wise Inventory Report'
     }
@@ -6188,7 +6019,7 @@ def get_batch_details(request):
         })
         
     except Exception as e:
-        print(f"Error in get_batch_details: {e}")
+        logger.exception('Error in get_batch_details')
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -6257,9 +6088,8 @@ def get_customer_rate_info(request):
                 productid=product_id,
                 product_batch_no=batch_no
             )
-            print(f"Found batch-specific rates for {product_name} batch {batch_no}: A={batch_rate.rate_A}, B={batch_rate.rate_B}, C={batch_rate.rate_C}")
         except SaleRateMaster.DoesNotExist:
-            print(f"No batch-specific rates found for {product_name} batch {batch_no}")
+            pass
         
         # Get MRP as fallback
         purchase_record = PurchaseMaster.objects.filter(
@@ -6281,14 +6111,9 @@ def get_customer_rate_info(request):
             rate_B = mrp
             rate_C = mrp
         
-        # Log the rate matching process
-        print(f"Rate matching for customer type '{customer_type}':")
-        print(f"  Product: {product_name}")
-        print(f"  Batch: {batch_no}")
-        print(f"  MRP: ₹{mrp}")
-        print(f"  Rate A: ₹{rate_A}")
-        print(f"  Rate B: ₹{rate_B}")
-        print(f"  Rate C: ₹{rate_C}")
+        logger.debug('Rates for customer type %s, %s batch %s: MRP %s, A %s, B %s, C %s (%s)',
+                     customer_type, product_name, batch_no, mrp, rate_A, rate_B, rate_C,
+                     'batch' if batch_rate else 'MRP fallback')
         
         response_data = {
             'success': True,
@@ -6307,7 +6132,7 @@ def get_customer_rate_info(request):
         return JsonResponse(response_data)
         
     except Exception as e:
-        print(f"Error in get_customer_rate_info: {str(e)}")
+        logger.exception('Error in get_customer_rate_info')
         return JsonResponse({
             'success': False,
             'error': f'Server error: {str(e)}'
@@ -8761,6 +8586,20 @@ def get_product_batches(request):
                 'is_available': is_available
             })
         
+        # Batches whose purchases were archived
+        listed = {(batch['batch_no'], batch['expiry']) for batch in batch_list}
+        for opening in opening_batches(product_id).exclude(mrp__isnull=True):
+            if (opening.batch_no, opening.expiry_date) in listed:
+                continue
+            batch_quantity, is_available = get_batch_stock_status(product_id, opening.batch_no)
+            batch_list.append({
+                'batch_no': opening.batch_no,
+                'expiry': opening.expiry_date,
+                'stock': batch_quantity,
+                'mrp': float(opening.mrp or 0),
+                'is_available': is_available
+            })
+        
         return JsonResponse({
             'success': True,
             'batches': batch_list
@@ -8781,11 +8620,16 @@ def get_batch_details(request):
         return JsonResponse({'error': 'Missing parameters'}, status=400)
     
     try:
-        # Get batch details from purchase records
+        # Get batch details from purchase records, else from the archived batch
         purchase = PurchaseMaster.objects.filter(
             productid=product_id,
             product_batch_no=batch_no
         ).first()
+        if not purchase:
+            opening = opening_batches(product_id).filter(batch_no=batch_no, mrp__isnull=False).first()
+            if opening:
+                purchase = PurchaseMaster(productid_id=product_id, product_batch_no=batch_no,
+                                          product_expiry=opening.expiry_date, product_MRP=opening.mrp)
         
         if purchase:
             # Get available stock
@@ -8896,6 +8740,29 @@ def get_product_batch_selector(request):
                 'rates': rates
             }
         
+        # 3. Batches whose purchases / challans were archived
+        for opening in opening_batches(product_id).exclude(mrp__isnull=True):
+            batch_no = opening.batch_no
+            if batch_no in batch_dict:
+                continue
+            
+            batch_quantity, is_available = get_batch_stock_status(product_id, batch_no)
+            
+            try:
+                sale_rate = SaleRateMaster.objects.get(productid=product_id, product_batch_no=batch_no)
+                rates = {'rate_A': float(sale_rate.rate_A or 0), 'rate_B': float(sale_rate.rate_B or 0), 'rate_C': float(sale_rate.rate_C or 0)}
+            except SaleRateMaster.DoesNotExist:
+                rates = {'rate_A': 0, 'rate_B': 0, 'rate_C': 0}
+            
+            batch_dict[batch_no] = {
+                'batch_no': batch_no,
+                'expiry': opening.expiry_date or 'N/A',
+                'mrp': float(opening.mrp or 0),
+                'stock': batch_quantity,
+                'is_available': is_available,
+                'rates': rates
+            }
+        
         return JsonResponse({'success': True, 'batches': list(batch_dict.values())})
         
     except Exception as e:
@@ -9515,10 +9382,7 @@ def export_purchases_excel(request):
         return response
 
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Purchase Excel generation error: {str(e)}")
-        print(f"Error details: {error_details}")
+        logger.exception('Purchase Excel generation error')
         
         from django.http import JsonResponse
         return JsonResponse({
@@ -9954,10 +9818,7 @@ def export_financial_excel(request):
         return response
 
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Financial Excel generation error: {str(e)}")
-        print(f"Error details: {error_details}")
+        logger.exception('Financial Excel generation error')
         
         from django.http import JsonResponse
         return JsonResponse({
@@ -10237,7 +10098,7 @@ def export_sales_excel(request):
         if not end_date:
             end_date = today
 
-        print(f"Date range: {start_date} to {end_date}")  # Debug log
+        logger.debug('Sales Excel date range: %s to %s', start_date, end_date)
 
         # Get sales data
         sales_data = SalesMaster.objects.filter(
@@ -10413,10 +10274,7 @@ def export_sales_excel(request):
         return response
 
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Excel generation error: {str(e)}")
-        print(f"Error details: {error_details}")
+        logger.exception('Excel generation error')
         
         from django.http import JsonResponse
         return JsonResponse({
@@ -11360,36 +11218,28 @@ def get_suppliers_api(request):
 @login_required
 def get_suppliers_with_invoices(request):
     """Get suppliers with their pending invoices for payment form"""
-    from core.models import SupplierMaster, InvoiceMaster
-    from django.db import models
+    from core.models import SupplierMaster
+    from collections import defaultdict
+    from .open_items import open_purchase_invoices
     
     try:
-        suppliers = SupplierMaster.objects.all().order_by('supplier_name')
-        result = []
+        # All open invoices in one indexed query, grouped per supplier
+        pending = defaultdict(list)
+        for invoice in open_purchase_invoices().values('supplierid', 'invoiceid', 'invoice_no', 'invoice_balance'):
+            pending[invoice['supplierid']].append({
+                'invoice_id': invoice['invoiceid'],
+                'invoice_no': invoice['invoice_no'],
+                'balance_due': float(invoice['invoice_balance'])
+            })
         
-        for supplier in suppliers:
-            # Get pending invoices for this supplier
-            invoices = InvoiceMaster.objects.filter(
-                supplierid=supplier,
-                invoice_paid__lt=models.F('invoice_total')
-            ).values('invoiceid', 'invoice_no', 'invoice_total', 'invoice_paid')
-            
-            invoice_list = []
-            for invoice in invoices:
-                balance_due = invoice['invoice_total'] - invoice['invoice_paid']
-                if balance_due > 0:
-                    invoice_list.append({
-                        'invoice_id': invoice['invoiceid'],
-                        'invoice_no': invoice['invoice_no'],
-                        'balance_due': float(balance_due)
-                    })
-            
+        result = []
+        for supplier in SupplierMaster.objects.all().order_by('supplier_name'):
             result.append({
                 'supplierid': supplier.supplierid,
                 'supplier_name': supplier.supplier_name,
                 'supplier_mobile': supplier.supplier_mobile,
                 'supplier_address': supplier.supplier_address,
-                'invoices': invoice_list
+                'invoices': pending.get(supplier.supplierid, [])
             })
         
         return JsonResponse(result, safe=False)
@@ -11489,8 +11339,8 @@ def edit_payment(request, pk):
                 
                 invoice.save()
                 
-                # Log the update
-                print(f"Payment updated: Invoice #{invoice.invoice_no}, Amount change: ₹{difference}, New Balance: ₹{new_balance}")
+                logger.info('Payment updated: invoice %s, amount change %s, new balance %s',
+                            invoice.invoice_no, difference, new_balance)
             
             messages.success(request, f"Payment updated successfully! Invoice balance updated.")
             return redirect('payment_list')
@@ -11509,33 +11359,11 @@ def delete_payment(request, pk):
     payment = get_object_or_404(InvoicePaid, pk=pk)
     
     if request.method == 'POST':
-        with transaction.atomic():
-            # Store invoice and payment amount before deletion
-            invoice = payment.ip_invoiceid
-            payment_amount = payment.payment_amount
-            
-            # Delete payment first
-            payment.delete()
-            
-            # Recalculate invoice_paid from remaining payments
-            from django.db.models import Sum
-            remaining_payments = InvoicePaid.objects.filter(ip_invoiceid=invoice)
-            total_paid = remaining_payments.aggregate(Sum('payment_amount'))['payment_amount__sum'] or 0
-            invoice.invoice_paid = total_paid
-            
-            # Update payment status
-            new_balance = invoice.invoice_total - invoice.invoice_paid
-            if new_balance <= 0.01:
-                invoice.payment_status = 'paid'
-            elif invoice.invoice_paid > 0:
-                invoice.payment_status = 'partial'
-            else:
-                invoice.payment_status = 'pending'
-            
-            invoice.save()
-            
-            # Log the deletion
-            print(f"Payment deleted: Invoice #{invoice.invoice_no}, Amount: ₹{payment_amount}, New Balance: ₹{new_balance}")
+        # Delete the payment and take it off the invoice (paid, balance, status) in one transaction
+        from .payment_posting import reverse_purchase_payment
+        reverse_purchase_payment(payment)
+        
+        logger.info('Payment deleted: invoice id %s, amount %s', payment.ip_invoiceid_id, payment.payment_amount)
         
         messages.success(request, "Payment deleted successfully! Invoice balance updated.")
         return redirect('payment_list')
@@ -11552,40 +11380,9 @@ def search_supplier_invoices(request):
     results = []
     
     if len(query) >= 2:
-        # Search suppliers and their invoices
-        suppliers = SupplierMaster.objects.filter(
-            supplier_name__icontains=query
-        )[:10]
-        
-        for supplier in suppliers:
-            # Get unpaid or partially paid invoices for this supplier
-            invoices = InvoiceMaster.objects.filter(
-                supplierid=supplier,
-                invoice_paid__lt=F('invoice_total')
-            ).order_by('-invoice_date')[:5]
-            
-            for invoice in invoices:
-                balance = invoice.invoice_total - invoice.invoice_paid
-                if balance > 0:  # Only show invoices with outstanding balance
-                    # Determine payment status
-                    if invoice.invoice_paid == 0:
-                        status = 'Unpaid'
-                    elif balance <= 0.01:
-                        status = 'Paid'
-                    else:
-                        status = 'Partial'
-                    
-                    results.append({
-                        'id': invoice.invoiceid,
-                        'supplier_name': supplier.supplier_name,
-                        'invoice_no': invoice.invoice_no,
-                        'invoice_date': invoice.invoice_date.strftime('%d-%m-%Y'),
-                        'total_amount': float(invoice.invoice_total),
-                        'paid_amount': float(invoice.invoice_paid),
-                        'balance_amount': float(balance),
-                        'payment_status': status,
-                        'text': f"{supplier.supplier_name} - Invoice #{invoice.invoice_no} (₹{balance:.2f} due)"
-                    })
+        # Open invoices only - one query on the open-items index
+        from .open_items import open_purchase_invoices, purchase_invoice_item
+        results = [purchase_invoice_item(invoice) for invoice in open_purchase_invoices(search=query)[:50]]
     
     return JsonResponse(results, safe=False)
 
@@ -0,0 +1,354 @@
+"""
+Financial year close
+`manage.py close_year --year 2023` snapshots the closing stock per (product,
+batch, expiry) and the closing ledger totals per customer / supplier at
+31 March 2024 into OpeningStock / OpeningBalance rows for FY 2024-25.
+Each close adds the documents of the years it closes to the previous
+snapshot, so it only reads those years.
+
+From then on StockManager, the inventory cache, the ledgers and the stock
+statement read the snapshot plus the rows dated from 1 April 2024
+(opening_balances.live_rows), and closed years are read-only: documents,
+lines and payments dated in them cannot be added, changed or deleted.
+Nothing is deleted by closing - archive_years (core/archive_service.py)
+moves closed years out of the database.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Min, Sum, Subquery
+from django.db.models.signals import pre_save, pre_delete
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .change_log import record_changes
+from .models import (
+    PurchaseMaster, SalesMaster, ReturnPurchaseMaster, ReturnSalesMaster,
+    SupplierChallanMaster, CustomerChallanMaster, StockIssueDetail,
+    InvoiceMaster, InvoicePaid, SalesInvoiceMaster, SalesInvoicePaid,
+    ReturnInvoiceMaster, ReturnSalesInvoiceMaster, Challan1, CustomerChallan, StockIssueMaster,
+    FinancialYearClose, OpeningStock, OpeningBalance,
+)
+from .opening_balances import (
+    OPENING_SOURCES, OPENING_DETAILS, ROW_DATES, clear_year_state, opening_year, opening_start, opening_stock_rows,
+    year_state,
+)
+from .year_filter_utils import get_current_financial_year, get_financial_year_dates
+
+
+# OpeningStock column -> (model, product, batch, expiry, quantity)
+STOCK_SOURCES = {
+    'purchased': (PurchaseMaster, 'productid', 'product_batch_no', 'product_expiry', 'product_quantity'),
+    'supplier_challan': (SupplierChallanMaster, 'product_id', 'product_batch_no', 'product_expiry', 'product_quantity'),
+    'sales_returns': (ReturnSalesMaster, 'return_productid', 'return_product_batch_no', 'return_product_expiry',
+                      'return_sale_quantity'),
+    'sold': (SalesMaster, 'productid', 'product_batch_no', 'product_expiry', 'sale_quantity'),
+    'customer_challan': (CustomerChallanMaster, 'product_id', 'product_batch_no', 'product_expiry', 'sale_quantity'),
+    'purchase_returns': (ReturnPurchaseMaster, 'returnproductid', 'returnproduct_batch_no', 'returnproduct_expiry',
+                         'returnproduct_quantity'),
+    'stock_issued': (StockIssueDetail, 'product', 'batch_no', 'expiry_date', 'quantity_issued'),
+}
+
+# Header models: later changes to them (payments received, balances) are allowed
+# as long as their date stays out of the closed years
+HEADERS = {
+    InvoiceMaster, SalesInvoiceMaster, ReturnInvoiceMaster, ReturnSalesInvoiceMaster,
+    Challan1, CustomerChallan, StockIssueMaster,
+}
+
+
+class YearCloseError(Exception):
+    pass
+
+
+class ClosedYearError(ValidationError):
+    pass
+
+
+def year_label(fy_year):
+    return f'{fy_year}-{str(fy_year + 1)[-2:]}'
+
+
+def year_cutoff(fy_year):
+    """First day after financial year fy_year"""
+    return get_financial_year_dates(fy_year)[1] + timedelta(days=1)
+
+
+# ---------------------------------------------------------------------------
+# Read-only closed years
+# ---------------------------------------------------------------------------
+
+_unlocked = threading.local()
+
+
+@contextmanager
+def closed_years_unlocked():
+    """Let archive_years delete rows of closed years"""
+    _unlocked.active = True
+    try:
+        yield
+    finally:
+        _unlocked.active = False
+
+
+def is_closed_date(value):
+    if isinstance(value, str):
+        # Views may assign the posted 'YYYY-MM-DD' string before saving
+        value = parse_date(value[:10])
+    if not value:
+        return False
+    if isinstance(value, datetime):
+        value = value.date()
+    # Only years before the current one can be closed - no query for current documents
+    if value >= get_financial_year_dates(get_current_financial_year())[0]:
+        return False
+    start = opening_start()
+    return start is not None and value < start
+
+
+def _row_date(instance, path):
+    """
+    The ROW_DATES date of a row: through the related objects already loaded,
+    else one values query from the foreign key (no header is loaded for it)
+    """
+    value = instance
+    names = path.split('__')
+    for index, name in enumerate(names[:-1]):
+        field = value._meta.get_field(name)
+        if not field.is_cached(value):
+            key = getattr(value, field.attname)
+            if key is None:
+                return None
+            return field.related_model._base_manager.filter(
+                **{field.target_field.name: key}
+            ).values_list('__'.join(names[index + 1:]), flat=True).first()
+        value = getattr(value, name)
+        if value is None:
+            return None
+    return getattr(value, names[-1], None)
+
+
+def _guarded_path(model):
+    """ROW_DATES path the guards check for model, or None: untracked, unlocked or no year closed yet"""
+    path = ROW_DATES.get(model)
+    if path is None or getattr(_unlocked, 'active', False):
+        return None
+    # year_state is cached, so this costs no query until a year is closed
+    if year_state()['opening_year'] is None:
+        return None
+    return path
+
+
+def _closed_year_error(value):
+    return ClosedYearError(f'{value:%d-%m-%Y} falls in a closed financial year; closed years are read-only')
+
+
+def block_closed_years_save(sender, instance, raw=False, **kwargs):
+    """Rows dated in a closed year cannot be added or changed; headers may change but not move in or out"""
+    path = _guarded_path(sender)
+    if raw or path is None:
+        return
+    value = _row_date(instance, path)
+    if sender in HEADERS and not instance._state.adding:
+        stored = sender.objects.filter(pk=instance.pk).values_list(path, flat=True).first()
+        if stored == value or not (is_closed_date(value) or is_closed_date(stored)):
+            return
+    elif not is_closed_date(value):
+        return
+    raise _closed_year_error(value)
+
+
+def block_closed_years_delete(sender, instance, **kwargs):
+    path = _guarded_path(sender)
+    if path is None:
+        return
+    value = _row_date(instance, path)
+    if is_closed_date(value):
+        raise _closed_year_error(value)
+
+
+def block_closed_years_bulk(model, rows):
+    """
+    The pre_save guard for new rows written with bulk_create, which sends no
+    signals: raises ClosedYearError, for the whole batch, if any row is dated
+    in a closed year.
+    """
+    path = _guarded_path(model)
+    if path is None:
+        return
+    dates = {_row_date(row, path) for row in rows}
+    closed = sorted(value for value in dates if is_closed_date(value))
+    if closed:
+        raise _closed_year_error(closed[0])
+
+
+def connect_receivers():
+    """Connect the guards to each dated model (a receiver without a sender turns off fast deletes everywhere)"""
+    for model in ROW_DATES:
+        label = model._meta.label_lower
+        pre_save.connect(block_closed_years_save, sender=model, dispatch_uid=f'closed_years_save_{label}')
+        pre_delete.connect(block_closed_years_delete, sender=model, dispatch_uid=f'closed_years_delete_{label}')
+
+
+# ---------------------------------------------------------------------------
+# Snapshots
+# ---------------------------------------------------------------------------
+
+def blocking_items(cutoff):
+    """Reasons the years before `cutoff` cannot be closed yet"""
+    problems = []
+    pending = Challan1.objects.filter(challan_date__lt=cutoff, is_invoiced=False).count()
+    if pending:
+        problems.append(f'{pending} supplier challan(s) not invoiced')
+    pending = CustomerChallan.objects.filter(customer_challan_date__lt=cutoff, is_invoiced=False).count()
+    if pending:
+        problems.append(f'{pending} customer challan(s) not invoiced')
+    return problems
+
+
+def _closing_rows(model, start, cutoff):
+    """Rows of the years being closed: from the previous snapshot up to cutoff"""
+    rows = model.objects.filter(**{f'{ROW_DATES[model]}__lt': cutoff})
+    if start is not None:
+        rows = rows.filter(**{f'{ROW_DATES[model]}__gte': start})
+    return rows
+
+
+def _expiry_key(value):
+    """Purchase returns store expiry as a date; everything else as MM-YYYY"""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%m-%Y')
+    return value or ''
+
+
+def _batch_details(rows, product, batch, expiry, pk, columns):
+    """Details of the first row of every batch"""
+    first_ids = rows.order_by().values(product, batch, expiry).annotate(
+        first_id=Min(pk)
+    ).values_list('first_id', flat=True)
+    return {
+        (row[0], row[1], row[2]): row[3:]
+        for row in rows.model.objects.filter(**{f'{pk}__in': Subquery(first_ids)}).values_list(
+            product, batch, expiry, *columns
+        )
+    }
+
+
+def closing_stock(cutoff, fy_year):
+    """The current OpeningStock rows plus the rows dated from them up to cutoff, as new rows for fy_year"""
+    start = opening_start()
+    totals = defaultdict(lambda: dict.fromkeys(OPENING_SOURCES, 0))
+    details = {}
+    for row in opening_stock_rows().values('product_id', 'batch_no', 'expiry_date', *OPENING_SOURCES, *OPENING_DETAILS):
+        key = (row['product_id'], row['batch_no'], row['expiry_date'])
+        totals[key].update({source: row[source] for source in OPENING_SOURCES})
+        if row['mrp'] is not None:
+            details[key] = tuple(row[column] for column in OPENING_DETAILS)
+
+    for source, (model, product, batch, expiry, quantity) in STOCK_SOURCES.items():
+        rows = _closing_rows(model, start, cutoff).order_by().values_list(
+            product, batch, expiry
+        ).annotate(total=Sum(quantity))
+        for product_id, batch_no, expiry_value, total in rows:
+            totals[(product_id, batch_no, _expiry_key(expiry_value))][source] += total or 0
+
+    # Details: the earlier snapshot, else the first purchase, else the first supplier challan
+    for model, product, pk, columns in (
+        (PurchaseMaster, 'productid', 'purchaseid', ['product_MRP', 'product_purchase_rate', 'rate_a', 'rate_b', 'rate_c']),
+        (SupplierChallanMaster, 'product_id', 'challan_id', ['product_mrp', 'product_purchase_rate', 'rate_a', 'rate_b', 'rate_c']),
+    ):
+        rows = _closing_rows(model, start, cutoff)
+        for key, values in _batch_details(rows, product, 'product_batch_no', 'product_expiry', pk, columns).items():
+            details.setdefault(key, values)
+
+    rows = []
+    for (product_id, batch_no, expiry), values in totals.items():
+        values.update(zip(OPENING_DETAILS, details.get((product_id, batch_no, expiry), (None,) * len(OPENING_DETAILS))))
+        rows.append(OpeningStock(fy_year=fy_year, product_id=product_id, batch_no=batch_no,
+                                 expiry_date=expiry, **values))
+    return rows
+
+
+def _grouped_sum(queryset, party, amount):
+    return queryset.order_by().values_list(party).annotate(total=Sum(amount))
+
+
+def closing_balances(cutoff, fy_year):
+    """The current OpeningBalance rows plus the ledger entries dated from them up to cutoff, as new rows for fy_year"""
+    start = opening_start()
+    customers = defaultdict(lambda: [0.0, 0.0])  # id -> [debit, credit]
+    suppliers = defaultdict(lambda: [0.0, 0.0])
+    for row in OpeningBalance.objects.filter(fy_year=opening_year()):
+        target = customers[row.customer_id] if row.customer_id else suppliers[row.supplier_id]
+        target[0] += row.debit
+        target[1] += row.credit
+
+    # Customer ledger: sales (debit), receipts and sales returns (credit)
+    for party, total in _grouped_sum(_closing_rows(SalesMaster, start, cutoff),
+                                     'sales_invoice_no__customerid', 'sale_total_amount'):
+        customers[party][0] += total or 0
+    for party, total in _grouped_sum(_closing_rows(SalesInvoicePaid, start, cutoff),
+                                     'sales_ip_invoice_no__customerid', 'sales_payment_amount'):
+        customers[party][1] += total or 0
+    for party, total in _grouped_sum(_closing_rows(ReturnSalesInvoiceMaster, start, cutoff),
+                                     'return_sales_customerid', 'return_sales_invoice_total'):
+        customers[party][1] += total or 0
+
+    # Supplier ledger: purchases (credit), payments and purchase returns (debit)
+    for party, total in _grouped_sum(_closing_rows(InvoiceMaster, start, cutoff),
+                                     'supplierid', 'invoice_total'):
+        suppliers[party][1] += total or 0
+    for party, total in _grouped_sum(_closing_rows(InvoicePaid, start, cutoff),
+                                     'ip_invoiceid__supplierid', 'payment_amount'):
+        suppliers[party][0] += total or 0
+    for party, total in _grouped_sum(_closing_rows(ReturnInvoiceMaster, start, cutoff),
+                                     'returnsupplierid', 'returninvoice_total'):
+        suppliers[party][0] += total or 0
+
+    return [
+        OpeningBalance(fy_year=fy_year, customer_id=party, debit=debit, credit=credit)
+        for party, (debit, credit) in customers.items()
+    ] + [
+        OpeningBalance(fy_year=fy_year, supplier_id=party, debit=debit, credit=credit)
+        for party, (debit, credit) in suppliers.items()
+    ]
+
+
+def check_closable(fy_year):
+    """Raise YearCloseError unless fy_year can be closed now"""
+    if fy_year >= get_current_financial_year():
+        raise YearCloseError(f'FY {year_label(fy_year)} has not ended yet')
+    current = opening_year()
+    if current is not None and fy_year < current:
+        raise YearCloseError(f'Financial years up to {year_label(current - 1)} are already closed')
+
+
+def write_snapshot(fy_year):
+    """
+    Snapshot the closing figures of fy_year (and any open year before it) as
+    the opening of the next year. Call inside a transaction.
+    """
+    cutoff = year_cutoff(fy_year)
+    stock_rows = closing_stock(cutoff, fy_year + 1)
+    balance_rows = closing_balances(cutoff, fy_year + 1)
+    for model, rows in ((OpeningStock, stock_rows), (OpeningBalance, balance_rows)):
+        created = model.objects.bulk_create(rows, batch_size=1000)
+        record_changes(model, [row.pk for row in created])
+    close = FinancialYearClose.objects.create(fy_year=fy_year, closed_at=timezone.now())
+    record_changes(FinancialYearClose, [close.pk])
+    clear_year_state()
+    return {'stock_rows': len(stock_rows), 'balance_rows': len(balance_rows)}
+
+
+def close_year(fy_year):
+    """Close every financial year up to fy_year; returns the number of snapshot rows written"""
+    check_closable(fy_year)
+    problems = blocking_items(year_cutoff(fy_year))
+    if problems:
+        raise YearCloseError('Not ready to close: ' + '; '.join(problems))
+    with transaction.atomic():
+        return write_snapshot(fy_year)
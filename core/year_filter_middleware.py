@@ -1,13 +1,16 @@
-from core.year_filter_utils import get_current_financial_year
+from core.year_filter_utils import get_selected_year
 
 class YearFilterMiddleware:
+    """
+    Exposes the selected financial year as request.selected_year.
+    Nothing is written per request - the selection is only stored when the
+    user changes it (see year_filter_views.set_year_filter).
+    """
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Set default financial year if not set
-        if 'selected_year' not in request.session:
-            request.session['selected_year'] = get_current_financial_year()
+        request.selected_year = get_selected_year(request)
         
         response = self.get_response(request)
         return response
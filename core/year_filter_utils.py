@@ -1,5 +1,12 @@
 from datetime import datetime, date
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+# Cookie used when FY_SELECTION_STORE = 'cookie'
+FY_COOKIE_NAME = 'selected_year'
+FY_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
 def get_current_financial_year():
     """Get current financial year (April to March)"""
     today = date.today()
@@ -14,6 +21,46 @@ def get_financial_year_dates(fy_year):
     end_date = date(fy_year + 1, 3, 31)  # 31 March next year
     return start_date, end_date
 
+def get_selected_year(request):
+    """
+    Financial year chosen by the user, read from the store configured in
+    settings.FY_SELECTION_STORE (cookie / profile / session). Falls back to
+    the current financial year. The value is memoised on the request.
+    """
+    if hasattr(request, '_selected_year'):
+        return request._selected_year
+
+    store = getattr(settings, 'FY_SELECTION_STORE', 'cookie')
+    if store == 'profile':
+        user = getattr(request, 'user', None)
+        value = user.selected_financial_year if user is not None and user.is_authenticated else None
+    elif store == 'session':
+        value = request.session.get('selected_year')
+    else:
+        value = request.COOKIES.get(FY_COOKIE_NAME)
+
+    try:
+        year = int(value)
+    except (TypeError, ValueError):
+        year = get_current_financial_year()
+
+    request._selected_year = year
+    return year
+
+def set_selected_year(request, response, year):
+    """Persist the selected financial year in the configured store"""
+    store = getattr(settings, 'FY_SELECTION_STORE', 'cookie')
+    if store == 'profile' and request.user.is_authenticated:
+        from .change_log import record_changes
+        get_user_model().objects.filter(pk=request.user.pk).update(selected_financial_year=year)
+        record_changes(get_user_model(), [request.user.pk])
+    elif store == 'session':
+        request.session['selected_year'] = year
+    else:
+        response.set_cookie(FY_COOKIE_NAME, str(year), max_age=FY_COOKIE_MAX_AGE, samesite='Lax')
+    request._selected_year = year
+    return response
+
 def apply_year_filter(queryset, request, date_field):
     """
     Apply financial year filter (1 April to 31 March)
@@ -26,7 +73,10 @@ def apply_year_filter(queryset, request, date_field):
     Returns:
         Filtered queryset
     """
-    selected_year = request.session.get('selected_year', get_current_financial_year())
+    selected_year = get_selected_year(request)
+    if getattr(queryset, 'partition_field', None) == date_field:
+        # Partitioned table: bounds that match the yearly partitions exactly
+        return queryset.for_financial_year(selected_year)
     start_date, end_date = get_financial_year_dates(selected_year)
     
     filter_kwargs = {
@@ -1,14 +1,16 @@
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 
+from .year_filter_utils import set_selected_year
+
 @require_POST
 def set_year_filter(request):
     year = request.POST.get('year')
     if year:
         try:
             year = int(year)
-            request.session['selected_year'] = year
-            return JsonResponse({'success': True, 'year': year})
+            response = JsonResponse({'success': True, 'year': year})
+            return set_selected_year(request, response, year)
         except ValueError:
             return JsonResponse({'success': False, 'error': 'Invalid year'})
     return JsonResponse({'success': False, 'error': 'Year not provided'})
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,6 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryBudgetMiddleware',  # No-op unless QUERY_BUDGET_ENABLED
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -38,13 +40,44 @@ MIDDLEWARE = [
     'core.auth_middleware.LoginRequiredMiddleware',  # Authentication middleware
 ]
 
-# Session optimization for better performance with 600K records
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'  # Use DB only, no cache
-
-# SESSION_CACHE_ALIAS = 'default'
+# Session storage - SESSION_STORE env var:
+#   cached_db      (default) reads served from the 'sessions' cache, writes go to cache + DB
+#   cache          cache only (sessions are lost if the cache is flushed)
+#   signed_cookies no server-side storage at all
+#   db             DB only (previous behaviour)
+SESSION_STORE = os.getenv('SESSION_STORE', 'cached_db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_STORE]
+SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_AGE = 3600  # 1 hour
 SESSION_SAVE_EVERY_REQUEST = False
 
+# Where the selected financial year lives - FY_SELECTION_STORE env var:
+#   cookie  (default) plain cookie, no session read/write per request
+#   profile Web_User.selected_financial_year, follows the user across devices
+#   session previous behaviour
+FY_SELECTION_STORE = os.getenv('FY_SELECTION_STORE', 'cookie')
+
+# Per-request SQL instrumentation (core.middleware.QueryBudgetMiddleware):
+# Server-Timing header + one log line per request on 'core.query_budget'.
+# Budgets are keyed by URL name; anything over budget is logged as a warning.
+QUERY_BUDGET_ENABLED = os.getenv('QUERY_BUDGET_ENABLED', '1' if DEBUG else '0') == '1'
+QUERY_BUDGET_TOP_N = 5
+QUERY_BUDGET_DEFAULT = {'queries': 50, 'db_ms': 500, 'duplicates': 5}
+QUERY_BUDGETS = {
+    'product_search_suggestions': {'queries': 6, 'db_ms': 100},
+    'search_customer_invoices': {'queries': 5},
+    'search_supplier_invoices': {'queries': 5},
+    'get_customer_invoices_api': {'queries': 6},
+    'low_stock_update': {'queries': 12},
+    'ageing_report': {'queries': 10},
+    'bulk_allocate_payment': {'queries': 15},
+}
+
 # Admin pagination for large datasets
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 50000
 
@@ -78,15 +111,27 @@ WSGI_APPLICATION = 'pharmamgmt.wsgi.application'
 import os
 
 # PostgreSQL Configuration - Primary Database
+# Connection management - DB_CONNECTION_MODE env var:
+#   persistent (default) keep connections open for CONN_MAX_AGE seconds and
+#                        health-check them before reuse (CONN_HEALTH_CHECKS)
+#   pgbouncer            connect through PgBouncer in transaction pooling mode:
+#                        point DB_PORT at PgBouncer (usually 6432); server-side
+#                        cursors are disabled because they do not survive
+#                        transaction pooling
+#   per_request          close after every request (old behaviour, for comparison)
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'persistent')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'pharma_db',
-        'USER': 'postgres',
-        'PASSWORD': 'postgres',
-        'HOST': 'localhost',
-        'PORT': '5432',
-        'CONN_MAX_AGE': 600,
+        'NAME': os.getenv('DB_NAME', 'pharma_db'),
+        'USER': os.getenv('DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DB_CONNECTION_MODE == 'per_request' else int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': DB_CONNECTION_MODE != 'per_request',
+        'DISABLE_SERVER_SIDE_CURSORS': DB_CONNECTION_MODE == 'pgbouncer',
     }
 }
 
@@ -195,36 +240,108 @@ else:  # Development with enhanced local memory
         }
     }
 
+# Session cache: Redis when available, otherwise a file cache shared by all
+# worker processes on this host (SESSION_CACHE_BACKEND=locmem for a single
+# process dev server)
+if os.getenv('REDIS_URL'):
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'KEY_PREFIX': 'pharma_session',
+        'TIMEOUT': SESSION_COOKIE_AGE,
+    }
+elif os.getenv('SESSION_CACHE_BACKEND', 'file') == 'locmem':
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pharma-sessions',
+        'TIMEOUT': SESSION_COOKIE_AGE,
+    }
+else:
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SESSION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pharmamgmt_sessions')),
+        'TIMEOUT': SESSION_COOKIE_AGE,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
 # Login URL
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/login/'
 
+# Backups (core/backup_service.py)
+#   BACKUP_FORMAT   custom: one pg_dump -Fc file; directory: pg_dump -Fd with
+#                   BACKUP_JOBS parallel jobs (faster on large databases).
+#                   Non-PostgreSQL databases are always dumped as gzipped JSON Lines.
+#   Retention       the newest BACKUP_KEEP_LAST backups are always kept, older
+#                   ones are deleted after BACKUP_KEEP_DAYS days
+#   Incremental     CHANGE_LOG_ENABLED records every saved / deleted row so
+#                   `create_backup --incremental` can export just the changes
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(BASE_DIR, 'backups'))
+BACKUP_FORMAT = os.getenv('BACKUP_FORMAT', 'custom')
+BACKUP_JOBS = int(os.getenv('BACKUP_JOBS', '4'))
+BACKUP_COMPRESSION = int(os.getenv('BACKUP_COMPRESSION', '6'))
+BACKUP_KEEP_LAST = int(os.getenv('BACKUP_KEEP_LAST', '10'))
+BACKUP_KEEP_DAYS = int(os.getenv('BACKUP_KEEP_DAYS', '30'))
+CHANGE_LOG_ENABLED = os.getenv('CHANGE_LOG_ENABLED', '1') == '1'
+PG_BIN_DIR = os.getenv('PG_BIN_DIR', '')  # folder with pg_dump / pg_restore if not on PATH
+
+# Archived financial years (core/archive_service.py): one folder of gzipped
+# JSON Lines per archived year, read back by the archived-year report.
+# Not part of the database backups - copy it along with them.
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
 # Logging configuration
+# Records go through a queue to a background thread (core/log_handlers.py)
+# and are written as one JSON object per line. LOG_LEVEL sets the level of
+# the core.* loggers; debug output of single modules is switched on with
+# LOG_LEVELS, e.g. LOG_LEVELS="core.utils=DEBUG,core.signals=DEBUG".
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVELS = dict(
+    item.strip().split('=', 1) for item in os.getenv('LOG_LEVELS', '').split(',') if '=' in item
+)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'core.log_handlers.JsonFormatter',
+        },
+    },
     'handlers': {
         'file': {
             'level': 'WARNING',
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_DIR, 'django.log'),
+            'formatter': 'json',
         },
         'console': {
-            'level': 'INFO',
             'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+        'queue': {
+            '()': 'core.log_handlers.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
         },
     },
     'loggers': {
+        'core': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
         'core.middleware': {
-            'handlers': ['file', 'console'],
             'level': 'WARNING',
-            'propagate': True,
+        },
+        'core.query_budget': {
+            'level': 'INFO',
         },
         'django.db.backends': {
-            'handlers': ['file'],
+            'handlers': ['queue'],
             'level': 'ERROR',
-            'propagate': True,
+            'propagate': False,
         },
+        **{name: {'level': level.upper()} for name, level in LOG_LEVELS.items()},
     },
 }